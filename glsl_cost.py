@@ -0,0 +1,341 @@
+#!/bin/env python3
+
+"""
+"glsl_cost.py" estimates the cost of glsl functions without running them.
+For every function, it counts the arithmetic and logic operations (ALU operations),
+the calls to transcendental functions that run on special function units,
+the branches that are taken by control flow statements,
+and the largest number of variable components that are live at once,
+which estimates the number of registers a function needs.
+Counts are static: the content of a loop is counted once,
+and both sides of a branch are counted.
+
+Counts are made using builtin_costs, a table of the approximate number of
+ALU operations and transcendental operations needed by each operator and
+built-in function, per component. They can be combined into a single number
+using get_weighted_cost(), which is used by glsl_strength.py and glsl_simplify.py
+to choose between equivalent expressions.
+
+The command line interface for this script prints a report of the costs of
+every function within a file, either as text or as json.
+You can select a file using the `-f` argument.
+You can select the format of the report using the `--format` argument.
+
+For basic usage on a single file, call like so:
+  python3 ./glsl_cost.py -f file.glsl.c
+
+If you want to compare the cost of a file before and after other scripts have run, call like so:
+  python3 ./glsl_derivative.py -f file.glsl.c | python3 ./glsl_cost.py
+  python3 ./glsl_derivative.py -f file.glsl.c | python3 ./glsl_strength.py | python3 ./glsl_cost.py
+"""
+
+
+import collections
+import copy
+import json
+import sys
+
+import pypeg2 as peg
+import pypeg2glsl as glsl
+import glsl_dce
+import glsl_index
+import glsl_include
+
+def assert_type(variable, types):
+    if len(types) == 1 and not isinstance(variable, types[0]):
+        raise AssertionError(f'expected {types[0]} but got {type(variable)} (value: {variable})')
+    if not any([isinstance(variable, type_) for type_ in types]):
+        raise AssertionError(f'expected any of {types} but got {type(variable)} (value: {variable})')
+
+'''
+"builtin_costs" estimates the number of ALU operations and transcendental operations
+needed by each operator and built-in function, per component of its first operand.
+Transcendental operations, such as `exp2`, `log2`, `sin`, `cos`, reciprocals and square roots,
+run on special function units at a fraction of the rate of ALU operations.
+Functions that are not supported in hardware are built from several operations,
+such as `pow(x, y)` as `exp2(y * log2(x))` or `x / y` as `x * (1.0 / y)`.
+Negation and abs() are free, since they are applied as modifiers on operands.
+The numbers are approximate, and only serve to compare equivalent code.
+'''
+builtin_costs = {
+    # operators
+    '+': (1, 0), '-': (1, 0), '*': (1, 0), '/': (1, 1), '%': (5, 0),
+    '<': (1, 0), '>': (1, 0), '<=': (1, 0), '>=': (1, 0), '==': (1, 0), '!=': (1, 0),
+    '&&': (1, 0), '||': (1, 0), '^^': (1, 0), '!': (1, 0), '~': (1, 0),
+    '&': (1, 0), '|': (1, 0), '^': (1, 0), '<<': (1, 0), '>>': (1, 0),
+    '++': (1, 0), '--': (1, 0),
+    '?': (1, 0),
+    # common functions
+    'abs': (0, 0), 'sign': (1, 0), 'floor': (1, 0), 'ceil': (1, 0), 'trunc': (1, 0),
+    'round': (1, 0), 'roundEven': (1, 0), 'fract': (1, 0), 'mod': (3, 1),
+    'min': (1, 0), 'max': (1, 0), 'clamp': (2, 0), 'mix': (2, 0), 'step': (1, 0), 'smoothstep': (7, 1),
+    # exponential functions
+    'exp2': (0, 1), 'log2': (0, 1), 'exp': (1, 1), 'log': (1, 1), 'pow': (1, 2),
+    'sqrt': (0, 1), 'inversesqrt': (0, 1),
+    # trigonometric functions
+    'radians': (1, 0), 'degrees': (1, 0), 'sin': (1, 1), 'cos': (1, 1), 'tan': (2, 3),
+    'asin': (12, 1), 'acos': (12, 1), 'atan': (12, 1),
+    'sinh': (4, 2), 'cosh': (4, 2), 'tanh': (4, 2), 'asinh': (4, 2), 'acosh': (4, 2), 'atanh': (4, 2),
+    # geometric functions
+    'dot': (2, 0), 'length': (2, 0), 'distance': (3, 0), 'normalize': (3, 0), 'cross': (2, 0),
+    'reflect': (5, 0), 'refract': (9, 0), 'faceforward': (3, 0),
+}
+
+'''
+"builtin_fixed_costs" estimates the number of ALU operations and transcendental operations
+that are needed by built-in functions regardless of the number of components,
+such as the square root that is taken by length()
+'''
+builtin_fixed_costs = {
+    'length': (0, 1), 'distance': (0, 1), 'normalize': (0, 1), 'refract': (2, 1),
+}
+
+'''
+"transcendental_weight" is the number of ALU operations that could be run
+in the time taken by a transcendental operation, as used by get_weighted_cost()
+'''
+transcendental_weight = 4
+
+def get_component_count(type_):
+    '''
+    "get_component_count" returns the number of components within a value of a given type,
+    or 1 if the type is unknown or not built in
+    '''
+    if type_ in glsl.vector_types:
+        return int(type_[-1])
+    elif type_ in glsl.matrix_types:
+        size = type_.split('mat')[-1]
+        return int(size[0]) * int(size[-1])
+    return 1
+
+def get_operation_counts(operation, components, fixed=False):
+    '''
+    "get_operation_counts" returns the counts for an operator or built-in function
+    applied to values with the given number of components,
+    or its fixed counts, as described by builtin_fixed_costs
+    '''
+    if fixed:
+        alu, transcendental = builtin_fixed_costs.get(operation, (0, 0))
+    else:
+        alu, transcendental = builtin_costs.get(operation, (1, 0))
+    return collections.Counter(alu=alu * components, transcendental=transcendental * components)
+
+def get_memoized_scope(scope):
+    '''
+    "get_memoized_scope" returns a copy of a scope whose deduce_type() 
+    stores the type of every expression it visits, 
+    including those it visits while deducing the types of larger expressions,
+    so that deducing the type of every node of a parse tree takes linear time.
+    The scope should only be used while the parse tree is unchanged.
+    '''
+    result = copy.copy(scope)
+    types = {}
+    deduce_type = scope.deduce_type.__func__
+    def get_type(expression):
+        # the expression is stored to keep its id from being reused
+        if id(expression) not in types:
+            types[id(expression)] = (deduce_type(result, expression), expression)
+        return types[id(expression)][0]
+    result.deduce_type = get_type
+    return result
+
+def get_counts(element, scope):
+    '''
+    "get_counts" returns a collections.Counter containing the number of
+    `alu` operations, `transcendental` operations, and `branches`
+    that are needed to evaluate an element that is found within `scope`,
+    as described by builtin_costs.
+    Calls to functions that are not built in are only counted for their arguments.
+    '''
+    scope = get_memoized_scope(scope)
+
+    def get_components(expression):
+        return get_component_count(scope.deduce_type(expression))
+
+    def visit(element):
+        if isinstance(element, list):
+            return sum([visit(subelement) for subelement in element], collections.Counter())
+        elif isinstance(element, glsl.BinaryExpression):
+            counts = visit(element.operand1) + visit(element.operand2)
+            types = [scope.deduce_type(element.operand1), scope.deduce_type(element.operand2)]
+            a, b = [get_component_count(type_) for type_ in types]
+            if element.operator == '*' and a > 1 and b > 1 and any([type_ in glsl.matrix_types for type_ in types]):
+                # matrix products take a dot product for every component of their result
+                return counts + get_operation_counts('*', get_components(element) * int(max(a, b) ** 0.5))
+            return counts + get_operation_counts(element.operator, max(a, b))
+        elif isinstance(element, glsl.AssignmentExpression):
+            operator = element.operator[:-1]
+            counts = visit([element.operand1, element.operand2])
+            return counts + get_operation_counts(operator, get_components(element.operand1)) if operator else counts
+        elif isinstance(element, glsl.PreIncrementExpression) and element.operator in '+-':
+            return visit(element.operand1)
+        elif isinstance(element, glsl.UnaryExpression):
+            return visit(element.operand1) + get_operation_counts(element.operator, get_components(element.operand1))
+        elif isinstance(element, glsl.TernaryExpression):
+            return (visit([element.operand1, element.operand2, element.operand3]) +
+                get_operation_counts('?', get_components(element.operand2)))
+        elif isinstance(element, glsl.InvocationExpression):
+            counts = visit(element.arguments)
+            if element.reference not in builtin_costs or len(element.arguments) < 1:
+                return counts
+            return (counts + get_operation_counts(element.reference, 1, fixed=True) +
+                get_operation_counts(element.reference, get_components(element.arguments[0])))
+        elif isinstance(element, glsl.GlslElement):
+            counts = sum([visit(getattr(element, attribute))
+                          for attribute in glsl.element_attributes
+                          if hasattr(element, attribute) and not attribute.startswith('comment')],
+                         collections.Counter())
+            if type(element) in glsl.code_block_element_types:
+                counts['branches'] += 1
+            return counts
+        return collections.Counter()
+
+    return visit(element)
+
+def get_weighted_cost(counts):
+    '''
+    "get_weighted_cost" returns a single number for the counts returned by get_counts(),
+    where transcendental operations are weighted by transcendental_weight
+    '''
+    return counts['alu'] + transcendental_weight * counts['transcendental']
+
+def get_cost(element, scope):
+    '''
+    "get_cost" returns the estimated cost of evaluating an element
+    that is found within `scope`, for use in choosing between equivalent expressions
+    '''
+    return get_weighted_cost(get_counts(element, scope))
+
+def get_register_count(function, scope):
+    '''
+    "get_register_count" returns the largest number of components of local variables
+    and parameters that are live at once within a function, as found by glsl_dce.py,
+    which estimates the number of registers that the function needs
+    '''
+    # types are deduced quietly, since problems have already been reported by whatever produced the function
+    subscope = scope.get_subscope(function).get_quiet_scope()
+    declared = glsl_dce.get_declared_variables(function.content)
+    local = {*declared, *[parameter.name for parameter in function.parameters]}
+    live_sets = []
+    liveness = glsl_dce.Liveness(subscope, {*subscope.variables, *declared}, local, live_sets)
+    glsl_dce.get_live_code_block(function.content, set(), set(), liveness)
+    return max([0, *[
+        sum([get_component_count(subscope.variables.get(variable)) for variable in live & local])
+        for live in live_sets
+    ]])
+
+def get_function_cost(function, scope):
+    '''
+    "get_function_cost" returns a dictionary describing the estimated cost of a function,
+    containing the counts returned by get_counts(),
+    the number of `registers` returned by get_register_count(),
+    and the `weighted` cost returned by get_weighted_cost()
+    '''
+    assert_type(function, [glsl.FunctionDeclaration])
+    counts = get_counts(function.content, scope.get_subscope(function).get_quiet_scope())
+    return {
+        'alu': counts['alu'],
+        'transcendental': counts['transcendental'],
+        'branches': counts['branches'],
+        'registers': get_register_count(function, scope),
+        'weighted': get_weighted_cost(counts),
+    }
+
+def get_function_signature(function):
+    '''
+    "get_function_signature" returns text that identifies a function among its overloads
+    '''
+    parameter_types = [parameter.type if isinstance(parameter.type, str) else
+                       peg.compose(parameter.type, type(parameter.type))
+                       for parameter in function.parameters]
+    return f'{function.name}({", ".join(parameter_types)})'
+
+def get_function_costs(code, scope):
+    '''
+    "get_function_costs" returns a list containing the signature
+    and the cost returned by get_function_cost() for every function within `code`
+    '''
+    return [
+        (get_function_signature(element), get_function_cost(element, scope))
+        for element in code
+        if isinstance(element, glsl.FunctionDeclaration)
+    ]
+
+def get_report(function_costs, format='text'):
+    '''
+    "get_report" returns text that lists the costs returned by get_function_costs(),
+    either as a `text` table or as `json`
+    '''
+    if format == 'json':
+        return json.dumps([{'function': signature, **cost} for signature, cost in function_costs], indent=1)
+    columns = ['alu', 'transcendental', 'branches', 'registers', 'weighted']
+    width = max([len('function'), *[len(signature) for signature, cost in function_costs]])
+    lines = [f'{"function":<{width}}' + ''.join([f'  {column:>14}' for column in columns])]
+    for signature, cost in function_costs:
+        lines.append(f'{signature:<{width}}' + ''.join([f'  {cost[column]:>14}' for column in columns]))
+    return '\n'.join(lines)
+
+def convert_text(input_text, diagnostics=None, base_scope=None, format='text'):
+    '''
+    "convert_text" is a pure function that returns a report of the costs
+    of every function within a string containing glsl code
+    '''
+    input_glsl = peg.parse(input_text, glsl.code)
+    scope = glsl.LexicalScope(input_glsl, diagnostics, base_scope)
+    return get_report(get_function_costs(input_glsl, scope), format)
+
+def convert_file(input_filename=False, format='text',
+        diagnostics_format='text', diagnostics_limit=None, index_filename=None,
+        include_paths=None, include_cache=None):
+    '''
+    "convert_file" prints a report of the costs of every function within a file containing glsl code
+    '''
+    input_text = ''
+    if input_filename:
+        with open(input_filename, 'r+') as input_file:
+            input_text = input_file.read()
+    else:
+        for line in sys.stdin:
+            input_text += line
+
+    diagnostics = glsl.Diagnostics(diagnostics_limit)
+    base_scope = glsl_index.ProjectIndex.load(index_filename).get_scope() if index_filename else None
+    include_resolver = glsl_include.IncludeResolver(include_paths, include_cache)
+    base_scope = include_resolver.get_scope(input_text, input_filename, base_scope)
+    include_resolver.save()
+    output_text = convert_text(input_text, diagnostics, base_scope, format)
+    diagnostics.report(diagnostics_format)
+    print(output_text)
+
+if __name__ == '__main__':
+    import argparse
+
+    assert sys.version_info[0] >= 3, "Script must be run with Python 3 or higher"
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--filename', dest='filename',
+        help='read input from FILE', metavar='FILE')
+    parser.add_argument('--format', dest='format', choices=['text', 'json'], default='text',
+        help='specify whether to print the report as a text table or as json')
+    parser.add_argument('--diagnostics', dest='diagnostics_format', choices=['text', 'json', 'none'], default='text',
+        help='specify whether to report diagnostics to stderr as text, as json, or not at all',
+    )
+    parser.add_argument('--diagnostics-limit', dest='diagnostics_limit', type=int, default=100,
+        help='maximum number of diagnostics to record', metavar='N',
+    )
+    parser.add_argument('--index', dest='index_filename',
+        help='seed type information from an index built by glsl_index.py', metavar='FILE')
+    parser.add_argument('-I', '--include-path', dest='include_paths', action='append',
+        help='search DIRECTORY for headers named by #include directives', metavar='DIRECTORY')
+    parser.add_argument('--include-cache', dest='include_cache',
+        help='store parsed header declarations in FILE between runs', metavar='FILE')
+    args = parser.parse_args()
+    convert_file(
+        args.filename,
+        format=args.format,
+        diagnostics_format=args.diagnostics_format,
+        diagnostics_limit=args.diagnostics_limit,
+        index_filename=args.index_filename,
+        include_paths=args.include_paths,
+        include_cache=args.include_cache,
+    )
@@ -0,0 +1,537 @@
+#!/bin/env python3
+
+"""
+"glsl_cse.py" performs common subexpression elimination on glsl code.
+Expressions that are repeated within a function are found using
+pypeg2glsl.get_structure_key(), then evaluated once and stored
+within a new local variable that is used in their place.
+It mostly exists to be used in combination with glsl_derivative.py,
+whose output is full of repeated expressions,
+but it can be used on any glsl code.
+
+Only expressions that are free of side effects are considered,
+and a repeated expression is only replaced while none of the variables
+it reads are assigned, so the value it stores is always the same.
+Expressions are not moved across or out of control flow.
+
+The command line interface for this script is meant to resemble sed.
+You can select a file using the `-f` argument.
+By default, the script will print out the results of a "dry run".
+You can modify the file in-place using the `-i` flag.
+You can print a diff between input and output using the `-v` flag.
+
+For basic usage on a single file, call like so:
+  python3 ./glsl_cse.py -f file.glsl.c
+
+If you want to replace all files in a directory, call like so:
+ find . -name *.glsl.c \
+     -exec echo {} \; -exec python3 ./glsl_cse.py -if {} \;
+"""
+
+
+import copy
+import difflib
+import itertools
+import sys
+
+import pypeg2 as peg
+import pypeg2glsl as glsl
+import glsl_index
+import glsl_include
+
+# attempt to import colorama, for colored diff output
+try:
+    from colorama import Fore, Back, Style, init
+    init()
+except ImportError:  # fallback so that the imported classes always exist
+    class ColorFallback():
+        __getattr__ = lambda self, name: ''
+    Fore = Back = Style = ColorFallback()
+
+def assert_type(variable, types):
+    if len(types) == 1 and not isinstance(variable, types[0]):
+        raise AssertionError(f'expected {types[0]} but got {type(variable)} (value: {variable})')
+    if not any([isinstance(variable, type_) for type_ in types]):
+        raise AssertionError(f'expected any of {types} but got {type(variable)} (value: {variable})')
+
+'''
+"name_prefix" is prepended to the names of variables that store common subexpressions
+'''
+name_prefix = 'cse'
+
+def is_pure(element, scope):
+    '''
+    "is_pure" returns whether an expression can be evaluated
+    any number of times without changing the state of the program.
+    Calls to functions other than built-in functions and constructors are assumed
+    to have side effects, since they may assign to `out` parameters.
+    '''
+    if isinstance(element, str):
+        return True
+    elif isinstance(element, list):
+        return all([is_pure(subelement, scope) for subelement in element])
+    elif isinstance(element, glsl.AssignmentExpression):
+        return False
+    elif isinstance(element, glsl.PostIncrementExpression):
+        return False
+    elif isinstance(element, glsl.PreIncrementExpression) and element.operator in ['++', '--']:
+        return False
+    elif isinstance(element, glsl.InvocationExpression):
+        return ((element.reference in glsl.built_in_function_signatures or
+                 element.reference in glsl.built_in_types or
+                 element.reference in scope.attributes) and
+                is_pure(element.arguments, scope))
+    elif isinstance(element, glsl.GlslElement):
+        return all([
+            is_pure(getattr(element, attribute), scope)
+            for attribute in glsl.element_attributes
+            if hasattr(element, attribute)
+        ])
+    return True
+
+def is_trivial(element):
+    '''
+    "is_trivial" returns whether an expression is so cheap to evaluate
+    that there is nothing to gain from storing it in a variable,
+    such as a variable reference, literal, attribute access, negation,
+    or constructor whose arguments are all literals
+    '''
+    if isinstance(element, str):
+        return True
+    elif isinstance(element, glsl.ParensExpression):
+        return is_trivial(element.content)
+    elif isinstance(element, glsl.AttributeExpression):
+        return is_trivial(element.reference)
+    elif isinstance(element, glsl.PreIncrementExpression):
+        return is_trivial(element.operand1)
+    elif isinstance(element, glsl.InvocationExpression):
+        return (element.reference in glsl.built_in_types and
+                all([isinstance(argument, str) for argument in element.arguments]))
+    return False
+
+def get_size(element):
+    '''
+    "get_size" returns the number of elements within a parse tree
+    '''
+    if isinstance(element, list):
+        return sum([get_size(subelement) for subelement in element])
+    elif isinstance(element, glsl.GlslElement):
+        return 1 + get_size([
+            getattr(element, attribute)
+            for attribute in glsl.element_attributes
+            if hasattr(element, attribute)
+        ])
+    return 1
+
+def get_subexpressions(element, is_chained=False):
+    '''
+    "get_subexpressions" yields every subexpression within an expression
+    that could be replaced by a variable without changing its meaning.
+    Binary expressions are parsed so that operators of equal precedence nest to the right,
+    so `a-b-c` is parsed as `a-(b-c)` even though it means `(a-b)-c`.
+    The right operand of a binary expression is therefore not a subexpression
+    if it has the same precedence as its parent, and is said to be "chained".
+    '''
+    if isinstance(element, glsl.ParensExpression):
+        yield from get_subexpressions(element.content)
+    elif isinstance(element, glsl.BinaryExpression):
+        if not is_chained:
+            yield element
+        yield from get_subexpressions(element.operand1)
+        yield from get_subexpressions(element.operand2, type(element.operand2) is type(element))
+    elif isinstance(element, glsl.InvocationExpression):
+        yield element
+        for argument in element.arguments:
+            yield from get_subexpressions(argument)
+    elif isinstance(element, glsl.AttributeExpression):
+        yield from get_subexpressions(element.reference)
+        for attribute in element.attributes:
+            if isinstance(attribute, glsl.BracketedExpression):
+                yield from get_subexpressions(attribute.content)
+    elif isinstance(element, glsl.TernaryExpression):
+        yield element
+        yield from get_subexpressions(element.operand1)
+        yield from get_subexpressions(element.operand2)
+        yield from get_subexpressions(element.operand3)
+    elif isinstance(element, glsl.PreIncrementExpression):
+        yield from get_subexpressions(element.operand1)
+
+def get_replaced(element, key, name, is_chained=False):
+    '''
+    "get_replaced" returns a copy of an expression where every subexpression
+    whose structure key matches `key` is replaced with `name`,
+    as found by get_subexpressions()
+    '''
+    if isinstance(element, glsl.ParensExpression):
+        if glsl.get_structure_key(element.content) == key:
+            return name
+        return glsl.ParensExpression(get_replaced(element.content, key, name))
+    elif not isinstance(element, glsl.GlslElement):
+        return element
+    elif not is_chained and glsl.get_structure_key(element) == key:
+        return name
+    result = copy.copy(element)
+    if isinstance(element, glsl.BinaryExpression):
+        result.operand1 = get_replaced(element.operand1, key, name)
+        result.operand2 = get_replaced(element.operand2, key, name, type(element.operand2) is type(element))
+    elif isinstance(element, glsl.InvocationExpression):
+        result.arguments = [get_replaced(argument, key, name) for argument in element.arguments]
+    elif isinstance(element, glsl.AttributeExpression):
+        result.reference = get_replaced(element.reference, key, name)
+        result.attributes = [
+            glsl.BracketedExpression(get_replaced(attribute.content, key, name))
+            if isinstance(attribute, glsl.BracketedExpression) else attribute
+            for attribute in element.attributes
+        ]
+    elif isinstance(element, glsl.TernaryExpression):
+        result.operand1 = get_replaced(element.operand1, key, name)
+        result.operand2 = get_replaced(element.operand2, key, name)
+        result.operand3 = get_replaced(element.operand3, key, name)
+    elif isinstance(element, glsl.PreIncrementExpression):
+        result.operand1 = get_replaced(element.operand1, key, name)
+    return result
+
+def get_evaluated_expressions(statement):
+    '''
+    "get_evaluated_expressions" returns a list of attributes for expressions
+    that a statement evaluates before it assigns to anything,
+    as tuples of the element that owns the attribute and the name of the attribute.
+    '''
+    if isinstance(statement, glsl.VariableDeclaration):
+        content = statement.content if isinstance(statement.content, list) else [statement.content]
+        return [(variable, 'operand2') for variable in content
+                if isinstance(variable, glsl.AssignmentExpression)]
+    elif isinstance(statement, glsl.AssignmentExpression):
+        return [(statement, 'operand2')]
+    elif isinstance(statement, glsl.ReturnStatement) and statement.value is not None:
+        return [(statement, 'value')]
+    elif isinstance(statement, glsl.IfStatement):
+        return [(statement, 'condition')]
+    return []
+
+def get_assigned_variables(element, scope):
+    '''
+    "get_assigned_variables" returns the set of variables that may be assigned by a statement
+    '''
+    def get_root(reference):
+        while isinstance(reference, glsl.AttributeExpression):
+            reference = reference.reference
+        return {reference} if isinstance(reference, str) else set()
+    if isinstance(element, list):
+        return set().union(*[get_assigned_variables(subelement, scope) for subelement in element])
+    elif isinstance(element, glsl.VariableDeclaration):
+        return {*element.get_names(), *get_assigned_variables(element.content, scope)}
+    elif isinstance(element, glsl.AssignmentExpression):
+        return {*get_root(element.operand1), *get_assigned_variables(element.operand2, scope)}
+    elif (isinstance(element, glsl.PostIncrementExpression) or
+          isinstance(element, glsl.PreIncrementExpression) and element.operator in ['++', '--']):
+        return get_root(element.operand1)
+    elif isinstance(element, glsl.InvocationExpression) and not is_pure(element, scope):
+        return {
+            *glsl.get_variable_references(element.arguments, scope.variables),
+            *get_assigned_variables(element.arguments, scope)
+        }
+    elif isinstance(element, glsl.GlslElement):
+        return get_assigned_variables([
+                getattr(element, attribute)
+                for attribute in glsl.element_attributes
+                if hasattr(element, attribute)
+            ], scope)
+    return set()
+
+def get_renamed(element, names):
+    '''
+    "get_renamed" returns a copy of a parse tree where variables are renamed 
+    according to the dictionary `names`
+    '''
+    if isinstance(element, str):
+        return names.get(element, element)
+    elif isinstance(element, list):
+        return [get_renamed(subelement, names) for subelement in element]
+    elif isinstance(element, glsl.AttributeExpression):
+        result = copy.copy(element)
+        result.reference = get_renamed(element.reference, names)
+        result.attributes = [
+            get_renamed(attribute, names) if isinstance(attribute, glsl.BracketedExpression) else attribute
+            for attribute in element.attributes
+        ]
+        return result
+    elif isinstance(element, glsl.GlslElement):
+        result = copy.copy(element)
+        for attribute in glsl.element_attributes:
+            if hasattr(element, attribute):
+                setattr(result, attribute, get_renamed(getattr(element, attribute), names))
+        return result
+    return element
+
+def get_eliminated_code_block(statements, scope, names=None, budget=None):
+    '''
+    "get_eliminated_code_block" returns a copy of a list of statements
+    where repeated subexpressions are stored in new variables.
+    Nested code blocks are handled separately,
+    and nothing is moved into or out of them.
+    Larger subexpressions are considered first,
+    so a subexpression is only stored separately if it is still repeated afterwards.
+    The names of new variables are appended to `names`, if provided.
+    Every new variable is counted against `budget`, if provided, see pypeg2glsl.Budget,
+    and the statements found so far are returned once it is exhausted.
+    '''
+    names = names if names is not None else []
+    statements = [get_eliminated(statement, scope, names, budget) for statement in statements]
+    rejected = set()
+    while True:
+        if budget is not None and not budget.spend():
+            return statements
+        # find where each candidate subexpression is first evaluated,
+        # and the statement after which its variables may change
+        candidates = {}
+        for i, statement in enumerate(statements):
+            assigned = get_assigned_variables(statement, scope)
+            for owner, attribute in get_evaluated_expressions(statement):
+                for subexpression in get_subexpressions(getattr(owner, attribute)):
+                    key = glsl.get_structure_key(subexpression)
+                    if key in rejected or is_trivial(subexpression):
+                        continue
+                    if (key in candidates and 
+                        candidates[key]['end'] is not None and 
+                        candidates[key]['count'] < 2):
+                        # the variables it reads have changed since it was last repeated,
+                        # so start looking for repetitions again from here
+                        del candidates[key]
+                    if key not in candidates:
+                        if not is_pure(subexpression, scope):
+                            rejected.add(key)
+                            continue
+                        candidates[key] = {
+                            'expression': subexpression,
+                            'reads': glsl.get_variable_references(subexpression, scope.variables),
+                            'start': i, 'end': None, 'count': 0,
+                        }
+                    candidate = candidates[key]
+                    if candidate['end'] is None:
+                        candidate['count'] += 1
+            for candidate in candidates.values():
+                if candidate['end'] is None and candidate['reads'] & assigned:
+                    candidate['end'] = i
+        repeated = [
+            (key, candidate) for key, candidate in candidates.items()
+            if candidate['count'] > 1
+        ]
+        if len(repeated) < 1:
+            return statements
+        key, candidate = max(repeated,
+            key = lambda item: (get_size(item[1]['expression']), -item[1]['start']))
+        type_ = scope.deduce_type(candidate['expression'])
+        if not isinstance(type_, str):
+            rejected.add(key)
+            continue
+        i = 0
+        while f'{name_prefix}{i}' in scope.variables or f'{name_prefix}{i}' in scope.functions:
+            i += 1
+        name = f'{name_prefix}{i}'
+        names.append(name)
+        scope.variables[name] = type_
+        start = candidate['start']
+        end = candidate['end'] if candidate['end'] is not None else len(statements)-1
+        for statement in statements[start:end+1]:
+            for owner, attribute in get_evaluated_expressions(statement):
+                setattr(owner, attribute, get_replaced(getattr(owner, attribute), key, name))
+        statements.insert(start,
+            glsl.VariableDeclaration(type_, [
+                glsl.AssignmentExpression(name, '=', copy.deepcopy(candidate['expression']))
+            ])
+        )
+
+def get_eliminated_function_declaration(in_element, scope, budget=None):
+    budget = budget.get_started() if budget is not None else None
+    if budget is not None and not budget.fits(get_size(in_element)):
+        budget.report(scope.diagnostics, in_element)
+        return copy.deepcopy(in_element)
+    out_element = copy.deepcopy(in_element)
+    local_scope = scope.get_subscope(in_element)
+    names = []
+    out_element.content = get_eliminated_code_block(out_element.content, local_scope, names, budget)
+    if budget is not None:
+        budget.report(scope.diagnostics, in_element)
+    # number new variables in the order they are declared
+    declared = [
+        name for name in get_declared_variables(out_element.content) 
+        if name in names
+    ]
+    available = (
+        f'{name_prefix}{i}' for i in itertools.count()
+        if f'{name_prefix}{i}' in names
+        or f'{name_prefix}{i}' not in local_scope.variables 
+        and f'{name_prefix}{i}' not in local_scope.functions
+    )
+    out_element.content = get_renamed(out_element.content, {
+        name: next(available) for name in declared
+    })
+    return out_element
+
+def get_declared_variables(element):
+    '''
+    "get_declared_variables" yields the names of variables declared within a parse tree,
+    in the order they are declared
+    '''
+    if isinstance(element, list):
+        for subelement in element:
+            yield from get_declared_variables(subelement)
+    elif isinstance(element, glsl.VariableDeclaration):
+        yield from element.get_names()
+    elif type(element) in glsl.code_block_element_types:
+        for attribute in ['content', 'else_']:
+            if hasattr(element, attribute):
+                yield from get_declared_variables(getattr(element, attribute))
+
+def get_eliminated(element, scope, names=None, budget=None):
+    '''
+    "get_eliminated" is a pure function that returns a copy of a glsl parse tree
+    where repeated subexpressions within functions are evaluated only once.
+    If a pypeg2glsl.Budget is provided as `budget`, its limits apply to each function separately.
+    A function that exhausts it keeps the variables that were introduced so far, 
+    and this is reported in the diagnostics of `scope`.
+    '''
+    assert_type(element, [str, list, glsl.GlslElement])
+    if isinstance(element, glsl.FunctionDeclaration):
+        return get_eliminated_function_declaration(element, scope, budget)
+    elif isinstance(element, list):
+        return [get_eliminated(subelement, scope, names, budget) for subelement in element]
+    elif type(element) in glsl.code_block_element_types:
+        # statements nested within control flow form a code block of their own
+        out_element = copy.copy(element)
+        for attribute in ['content', 'else_']:
+            if isinstance(getattr(element, attribute, None), list):
+                setattr(out_element, attribute, get_eliminated_code_block(getattr(element, attribute), scope, names, budget))
+            elif hasattr(element, attribute):
+                setattr(out_element, attribute, get_eliminated(getattr(element, attribute), scope, names, budget))
+        return out_element
+    return element
+
+def convert_glsl(input_glsl, diagnostics=None, base_scope=None, budget=None):
+    '''
+    "convert_glsl" is a pure function that performs
+    a transformation on a parse tree of glsl as represented by pypeg2glsl,
+    then returns a transformed parse tree as output.
+    Problems found along the way are recorded in `diagnostics`, if provided.
+    Declarations outside input_glsl can be provided using `base_scope`.
+    If a pypeg2glsl.Budget is provided as `budget`, it limits the work done on each function.
+    '''
+    output_glsl = get_eliminated(input_glsl, glsl.LexicalScope(input_glsl, diagnostics, base_scope), budget=budget)
+    glsl.warn_of_invalid_grammar_elements(output_glsl)
+    return output_glsl
+
+def convert_text(input_text, diagnostics=None, base_scope=None, budget=None):
+    '''
+    "convert_text" is a pure function that performs
+    a transformation on a string containing glsl code,
+    then returns transformed output.
+    It may run convert_glsl behind the scenes,
+    and may also perform additional string based transformations,
+    such as appending utility functions
+    or performing simple string substitutions
+    '''
+    input_glsl = peg.parse(input_text, glsl.code)
+    output_glsl = convert_glsl(input_glsl, diagnostics, base_scope, budget)
+    output_text = peg.compose(output_glsl, glsl.code, autoblank = False)
+    return output_text
+
+def convert_file(input_filename=False, in_place=False, verbose=False,
+        diagnostics_format='text', diagnostics_limit=None, index_filename=None,
+        include_paths=None, include_cache=None, budget=None):
+    '''
+    "convert_file" performs a transformation on a file containing glsl code
+    It may either print out transformed contents or replace the file,
+    depending on the value of `in_place`
+    '''
+
+    def colorize_diff(diff):
+        '''
+        "colorize_diff" colorizes text output from the difflib library
+        for display in the command line
+        All credit goes to:
+        https://chezsoi.org/lucas/blog/colored-diff-output-with-python.html
+        '''
+        for line in diff:
+            if line.startswith('+'):
+                yield Fore.GREEN + line + Fore.RESET
+            elif line.startswith('-'):
+                yield Fore.RED + line + Fore.RESET
+            elif line.startswith('^'):
+                yield Fore.BLUE + line + Fore.RESET
+            else:
+                yield line
+
+    input_text = ''
+    if input_filename:
+        with open(input_filename, 'r+') as input_file:
+            input_text = input_file.read()
+    else:
+        for line in sys.stdin:
+            input_text += line
+
+    diagnostics = glsl.Diagnostics(diagnostics_limit)
+    base_scope = glsl_index.ProjectIndex.load(index_filename).get_scope() if index_filename else None
+    include_resolver = glsl_include.IncludeResolver(include_paths, include_cache)
+    base_scope = include_resolver.get_scope(input_text, input_filename, base_scope)
+    include_resolver.save()
+    output_text = convert_text(input_text, diagnostics, base_scope, budget)
+    diagnostics.report(diagnostics_format)
+
+    if verbose:
+        diff = difflib.ndiff(
+            input_text.splitlines(keepends=True),
+            output_text.splitlines(keepends=True)
+        )
+        for line in colorize_diff(diff):
+            print(line)
+
+    if in_place:
+        with open(input_filename, 'w') as output_file:
+            output_file.write(output_text)
+            output_file.truncate()
+    else:
+        print(output_text)
+
+if __name__ == '__main__':
+    import argparse
+
+    assert sys.version_info[0] >= 3, "Script must be run with Python 3 or higher"
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--filename', dest='filename',
+        help='read input from FILE', metavar='FILE')
+    parser.add_argument('-i', '--in-place', dest='in_place',
+        help='edit the file in-place', action='store_true')
+    parser.add_argument('-v', '--verbose', dest='verbose',
+        help='show debug information', action='store_true')
+    parser.add_argument('--iteration-limit', dest='iteration_limit', type=int, default=200000,
+        help='stop introducing variables to a function after N variables', metavar='N')
+    parser.add_argument('--node-limit', dest='node_limit', type=int, default=20000,
+        help='leave functions with more than N elements in their parse tree as they are', metavar='N')
+    parser.add_argument('--time-limit', dest='time_limit', type=float, default=30.0,
+        help='stop introducing variables to a function after SECONDS', metavar='SECONDS')
+    parser.add_argument('--diagnostics', dest='diagnostics_format', choices=['text', 'json', 'none'], default='text',
+        help='specify whether to report diagnostics to stderr as text, as json, or not at all',
+    )
+    parser.add_argument('--diagnostics-limit', dest='diagnostics_limit', type=int, default=100,
+        help='maximum number of diagnostics to record', metavar='N',
+    )
+    parser.add_argument('--index', dest='index_filename',
+        help='seed type information from an index built by glsl_index.py', metavar='FILE')
+    parser.add_argument('-I', '--include-path', dest='include_paths', action='append',
+        help='search DIRECTORY for headers named by #include directives', metavar='DIRECTORY')
+    parser.add_argument('--include-cache', dest='include_cache',
+        help='store parsed header declarations in FILE between runs', metavar='FILE')
+    args = parser.parse_args()
+    convert_file(
+        args.filename,
+        in_place=args.in_place,
+        verbose=args.verbose,
+        diagnostics_format=args.diagnostics_format,
+        diagnostics_limit=args.diagnostics_limit,
+        index_filename=args.index_filename,
+        include_paths=args.include_paths,
+        include_cache=args.include_cache,
+        budget=glsl.Budget(args.iteration_limit, args.node_limit, args.time_limit),
+    )
@@ -0,0 +1,435 @@
+#!/bin/env python3
+
+"""
+"glsl_dce.py" performs dead code elimination on glsl code.
+Variables are found to be "live" at a point within a function
+if their value at that point may later be read.
+Assignments to variables that are not live are removed,
+as are declarations of variables that are no longer used at all.
+It mostly exists to be used in combination with glsl_derivative.py,
+whose output often contains variables that are only needed
+to find the value of the original function,
+but it can be used on any glsl code.
+It is also run by glsl_derivative.py, and by glsl_simplify.py if `--dce` is set.
+
+Only assignments that are free of side effects are removed.
+Assignments to `out` or `inout` parameters and to variables declared
+outside the function are always kept, since they may be read once the function returns.
+Assignments to variables that are declared more than once within a function,
+or that share their name with a function that is called within it, are also kept,
+since it is not clear which declaration or function a reference refers to.
+Liveness is found by name, so a variable that is declared within a nested code block
+does not affect the liveness of variables with the same name outside it.
+
+The command line interface for this script is meant to resemble sed.
+You can select a file using the `-f` argument.
+By default, the script will print out the results of a "dry run".
+You can modify the file in-place using the `-i` flag.
+You can print a diff between input and output using the `-v` flag.
+
+For basic usage on a single file, call like so:
+  python3 ./glsl_dce.py -f file.glsl.c
+
+If you want to replace all files in a directory, call like so:
+ find . -name *.glsl.c \
+     -exec echo {} \; -exec python3 ./glsl_dce.py -if {} \;
+"""
+
+
+import collections
+import copy
+import difflib
+import re
+import sys
+
+import pypeg2 as peg
+import pypeg2glsl as glsl
+import glsl_cse
+import glsl_index
+import glsl_include
+
+# attempt to import colorama, for colored diff output
+try:
+    from colorama import Fore, Back, Style, init
+    init()
+except ImportError:  # fallback so that the imported classes always exist
+    class ColorFallback():
+        __getattr__ = lambda self, name: ''
+    Fore = Back = Style = ColorFallback()
+
+def assert_type(variable, types):
+    if len(types) == 1 and not isinstance(variable, types[0]):
+        raise AssertionError(f'expected {types[0]} but got {type(variable)} (value: {variable})')
+    if not any([isinstance(variable, type_) for type_ in types]):
+        raise AssertionError(f'expected any of {types} but got {type(variable)} (value: {variable})')
+
+jump_statement = re.compile('continue|break')
+
+class Liveness:
+    """
+    A "Liveness" stores what is known about a function while its dead code is eliminated:
+    `scope` is the LexicalScope of the function,
+    `names` are the names of all variables that can be referenced within the function,
+    and `local` are the names of variables whose values are lost once the function returns.
+    If `live_sets` is a list, the set of variables that are live before each statement
+    is appended to it, as used by glsl_cost.py to estimate register pressure.
+    """
+    def __init__(self, scope, names, local, live_sets=None):
+        self.scope = scope
+        self.names = names
+        self.local = local
+        self.live_sets = live_sets
+
+    def get_reads(self, element):
+        return glsl.get_variable_references(element, self.names)
+
+    def is_removable(self, variable, expression, live):
+        return (variable in self.local and
+                variable not in live and
+                glsl_cse.is_pure(expression, self.scope))
+
+def get_root(reference):
+    while isinstance(reference, glsl.AttributeExpression):
+        reference = reference.reference
+    return reference if isinstance(reference, str) else None
+
+def get_declaration_counts(element):
+    '''
+    "get_declaration_counts" returns a Counter of the number of times 
+    each variable is declared within a parse tree, including loop declarations
+    '''
+    if isinstance(element, list):
+        return sum([get_declaration_counts(subelement) for subelement in element], collections.Counter())
+    elif isinstance(element, glsl.VariableDeclaration):
+        return collections.Counter(element.get_names())
+    elif isinstance(element, glsl.ForStatement):
+        return get_declaration_counts([element.declaration, element.content])
+    elif type(element) in glsl.code_block_element_types:
+        return get_declaration_counts([element.content, getattr(element, 'else_', [])])
+    return collections.Counter()
+
+def get_declared_variables(element):
+    '''
+    "get_declared_variables" returns the set of variables
+    declared anywhere within a parse tree, including loop declarations
+    '''
+    return set(get_declaration_counts(element))
+
+def get_invoked_functions(element):
+    '''
+    "get_invoked_functions" returns the set of names of functions that are called within a parse tree
+    '''
+    if isinstance(element, list):
+        return set().union(*[get_invoked_functions(subelement) for subelement in element])
+    elif isinstance(element, glsl.InvocationExpression):
+        return {element.reference, *get_invoked_functions(element.arguments)}
+    elif isinstance(element, glsl.GlslElement):
+        return get_invoked_functions([
+            getattr(element, attribute)
+            for attribute in glsl.element_attributes
+            if hasattr(element, attribute)
+        ])
+    return set()
+
+def get_live_statement(statement, live, loop_live, liveness):
+    '''
+    "get_live_statement" returns a tuple containing
+    a list of statements that are equivalent to `statement` with dead code removed,
+    and the set of variables that are live before it,
+    given the set of variables `live` after it
+    and the set of variables `loop_live` that are live
+    when leaving the innermost loop that contains it
+    '''
+    if isinstance(statement, list):
+        return get_live_code_block(statement, live, loop_live, liveness)
+    elif isinstance(statement, str):
+        if jump_statement.match(statement):
+            return [statement], loop_live
+        return [statement], live
+    elif isinstance(statement, glsl.ReturnStatement):
+        return [statement], liveness.get_reads(statement.value)
+    elif isinstance(statement, glsl.AssignmentExpression):
+        variable = get_root(statement.operand1)
+        if liveness.is_removable(variable, statement.operand2, live):
+            return [], live
+        if statement.operator == '=' and isinstance(statement.operand1, str):
+            return [statement], (live - {variable}) | liveness.get_reads(statement.operand2)
+        # assignments to attributes, indices, or in place read the variable they write to
+        return [statement], live | liveness.get_reads([statement.operand1, statement.operand2])
+    elif isinstance(statement, glsl.VariableDeclaration):
+        content = statement.content if isinstance(statement.content, list) else [statement.content]
+        result = []
+        for variable in reversed(content):
+            if not isinstance(variable, glsl.AssignmentExpression):
+                result.insert(0, variable)
+                live = live - {variable}
+            elif liveness.is_removable(variable.operand1, variable.operand2, live):
+                # the declaration is kept for now,
+                # it is removed later if the variable is not referenced at all
+                result.insert(0, variable.operand1)
+            else:
+                result.insert(0, variable)
+                live = (live - {variable.operand1}) | liveness.get_reads(variable.operand2)
+        out_statement = copy.copy(statement)
+        out_statement.content = result
+        return [out_statement], live
+    elif isinstance(statement, glsl.IfStatement):
+        out_statement = copy.copy(statement)
+        out_statement.content, content_live = get_live_nested_code_block(statement.content, live, loop_live, liveness)
+        out_statement.else_, else_live = get_live_nested_code_block(statement.else_, live, loop_live, liveness)
+        return [out_statement], content_live | else_live | liveness.get_reads(statement.condition)
+    elif type(statement) in glsl.code_block_element_types:
+        # the body of a loop may run any number of times,
+        # so variables are live at its start if they are live after any iteration
+        out_statement = copy.copy(statement)
+        operation = getattr(statement, 'operation', None)
+        declaration = getattr(statement, 'declaration', None)
+        head_live = live | liveness.get_reads([statement.condition, operation])
+        while True:
+            content, content_live = get_live_nested_code_block(statement.content, head_live, head_live, liveness)
+            updated_live = head_live | content_live
+            if updated_live == head_live:
+                break
+            head_live = updated_live
+        out_statement.content = content
+        if declaration is not None:
+            head_live = (head_live - set(declaration.get_names())) | liveness.get_reads(declaration)
+        return [out_statement], head_live
+    else:
+        # expressions that are evaluated for their side effects, such as function calls
+        return [statement], live | liveness.get_reads(statement)
+
+def get_live_code_block(statements, live, loop_live, liveness):
+    '''
+    "get_live_code_block" behaves like get_live_statement() for a list of statements
+    '''
+    result = []
+    for statement in reversed(statements):
+        live_statements, live = get_live_statement(statement, live, loop_live, liveness)
+        result = [*live_statements, *result]
+        if liveness.live_sets is not None:
+            liveness.live_sets.append(live)
+    return result, live
+
+def get_live_nested_code_block(statement, live, loop_live, liveness):
+    '''
+    "get_live_nested_code_block" behaves like get_live_statement()
+    for the content of a control flow statement.
+    Variables declared within the content are local to it,
+    so they do not affect the liveness of variables of the same name outside it.
+    '''
+    if isinstance(statement, list) or isinstance(statement, glsl.GlslElement):
+        statements, content_live = get_live_statement(statement, live, loop_live, liveness)
+    else:
+        statements, content_live = [statement], live
+    content_live = content_live | (live & get_declared_variables(statement))
+    if isinstance(statement, list):
+        return statements, content_live
+    elif len(statements) == 1:
+        return statements[0], content_live
+    return statements, content_live
+
+def get_without_unused_declarations(element, liveness):
+    '''
+    "get_without_unused_declarations" returns a copy of a list of statements
+    where local variables that are never referenced are no longer declared
+    '''
+    def get_references(statement):
+        if isinstance(statement, list):
+            return set().union(*[get_references(substatement) for substatement in statement])
+        elif isinstance(statement, glsl.VariableDeclaration):
+            content = statement.content if isinstance(statement.content, list) else [statement.content]
+            return liveness.get_reads([
+                variable for variable in content 
+                if isinstance(variable, glsl.AssignmentExpression)
+            ])
+        elif isinstance(statement, glsl.GlslElement):
+            return get_references([
+                getattr(statement, attribute) 
+                for attribute in glsl.element_attributes 
+                if hasattr(statement, attribute)
+            ])
+        return liveness.get_reads(statement)
+    references = get_references(element)
+    def get_filtered(statement):
+        if isinstance(statement, list):
+            result = []
+            for substatement in statement:
+                filtered = get_filtered(substatement)
+                if filtered is not None:
+                    result.append(filtered)
+            return result
+        elif isinstance(statement, glsl.VariableDeclaration):
+            content = statement.content if isinstance(statement.content, list) else [statement.content]
+            content = [
+                variable for variable in content
+                if isinstance(variable, glsl.AssignmentExpression) or variable in references
+            ]
+            if len(content) < 1:
+                return None
+            out_statement = copy.copy(statement)
+            out_statement.content = content
+            return out_statement
+        elif type(statement) in glsl.code_block_element_types:
+            out_statement = copy.copy(statement)
+            for attribute in ['content', 'else_']:
+                if isinstance(getattr(statement, attribute, None), (list, glsl.GlslElement)):
+                    filtered = get_filtered(getattr(statement, attribute))
+                    setattr(out_statement, attribute, filtered if filtered is not None else [])
+            return out_statement
+        return statement
+    return get_filtered(element)
+
+def get_eliminated_function_declaration(in_element, scope):
+    out_element = copy.copy(in_element)
+    local_scope = scope.get_subscope(in_element)
+    counts = get_declaration_counts(in_element.content)
+    declared = set(counts)
+    parameters = {
+        parameter.name for parameter in in_element.parameters
+        if 'out' not in parameter.qualifiers and 'inout' not in parameter.qualifiers
+    }
+    ambiguous = {
+        *[name for name, count in counts.items() if count > 1],
+        *get_invoked_functions(in_element.content),
+    }
+    liveness = Liveness(
+        local_scope,
+        {*local_scope.variables, *declared},
+        {*declared, *parameters} - ambiguous
+    )
+    content, _ = get_live_code_block(in_element.content, set(), set(), liveness)
+    out_element.content = get_without_unused_declarations(content, liveness)
+    return out_element
+
+def get_eliminated(element, scope):
+    '''
+    "get_eliminated" is a pure function that returns a copy of a glsl parse tree
+    where assignments and declarations whose values are never read within functions are removed
+    '''
+    assert_type(element, [str, list, glsl.GlslElement])
+    if isinstance(element, glsl.FunctionDeclaration):
+        return get_eliminated_function_declaration(element, scope)
+    elif isinstance(element, list):
+        return [get_eliminated(subelement, scope) for subelement in element]
+    return element
+
+def convert_glsl(input_glsl, diagnostics=None, base_scope=None):
+    '''
+    "convert_glsl" is a pure function that performs
+    a transformation on a parse tree of glsl as represented by pypeg2glsl,
+    then returns a transformed parse tree as output.
+    Problems found along the way are recorded in `diagnostics`, if provided.
+    Declarations outside input_glsl can be provided using `base_scope`.
+    '''
+    output_glsl = get_eliminated(input_glsl, glsl.LexicalScope(input_glsl, diagnostics, base_scope))
+    glsl.warn_of_invalid_grammar_elements(output_glsl)
+    return output_glsl
+
+def convert_text(input_text, diagnostics=None, base_scope=None):
+    '''
+    "convert_text" is a pure function that performs
+    a transformation on a string containing glsl code,
+    then returns transformed output.
+    It may run convert_glsl behind the scenes,
+    and may also perform additional string based transformations,
+    such as appending utility functions
+    or performing simple string substitutions
+    '''
+    input_glsl = peg.parse(input_text, glsl.code)
+    output_glsl = convert_glsl(input_glsl, diagnostics, base_scope)
+    output_text = peg.compose(output_glsl, glsl.code, autoblank = False)
+    return output_text
+
+def convert_file(input_filename=False, in_place=False, verbose=False,
+        diagnostics_format='text', diagnostics_limit=None, index_filename=None,
+        include_paths=None, include_cache=None):
+    '''
+    "convert_file" performs a transformation on a file containing glsl code
+    It may either print out transformed contents or replace the file,
+    depending on the value of `in_place`
+    '''
+
+    def colorize_diff(diff):
+        '''
+        "colorize_diff" colorizes text output from the difflib library
+        for display in the command line
+        All credit goes to:
+        https://chezsoi.org/lucas/blog/colored-diff-output-with-python.html
+        '''
+        for line in diff:
+            if line.startswith('+'):
+                yield Fore.GREEN + line + Fore.RESET
+            elif line.startswith('-'):
+                yield Fore.RED + line + Fore.RESET
+            elif line.startswith('^'):
+                yield Fore.BLUE + line + Fore.RESET
+            else:
+                yield line
+
+    input_text = ''
+    if input_filename:
+        with open(input_filename, 'r+') as input_file:
+            input_text = input_file.read()
+    else:
+        for line in sys.stdin:
+            input_text += line
+
+    diagnostics = glsl.Diagnostics(diagnostics_limit)
+    base_scope = glsl_index.ProjectIndex.load(index_filename).get_scope() if index_filename else None
+    include_resolver = glsl_include.IncludeResolver(include_paths, include_cache)
+    base_scope = include_resolver.get_scope(input_text, input_filename, base_scope)
+    include_resolver.save()
+    output_text = convert_text(input_text, diagnostics, base_scope)
+    diagnostics.report(diagnostics_format)
+
+    if verbose:
+        diff = difflib.ndiff(
+            input_text.splitlines(keepends=True),
+            output_text.splitlines(keepends=True)
+        )
+        for line in colorize_diff(diff):
+            print(line)
+
+    if in_place:
+        with open(input_filename, 'w') as output_file:
+            output_file.write(output_text)
+            output_file.truncate()
+    else:
+        print(output_text)
+
+if __name__ == '__main__':
+    import argparse
+
+    assert sys.version_info[0] >= 3, "Script must be run with Python 3 or higher"
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--filename', dest='filename',
+        help='read input from FILE', metavar='FILE')
+    parser.add_argument('-i', '--in-place', dest='in_place',
+        help='edit the file in-place', action='store_true')
+    parser.add_argument('-v', '--verbose', dest='verbose',
+        help='show debug information', action='store_true')
+    parser.add_argument('--diagnostics', dest='diagnostics_format', choices=['text', 'json', 'none'], default='text',
+        help='specify whether to report diagnostics to stderr as text, as json, or not at all',
+    )
+    parser.add_argument('--diagnostics-limit', dest='diagnostics_limit', type=int, default=100,
+        help='maximum number of diagnostics to record', metavar='N',
+    )
+    parser.add_argument('--index', dest='index_filename',
+        help='seed type information from an index built by glsl_index.py', metavar='FILE')
+    parser.add_argument('-I', '--include-path', dest='include_paths', action='append',
+        help='search DIRECTORY for headers named by #include directives', metavar='DIRECTORY')
+    parser.add_argument('--include-cache', dest='include_cache',
+        help='store parsed header declarations in FILE between runs', metavar='FILE')
+    args = parser.parse_args()
+    convert_file(
+        args.filename,
+        in_place=args.in_place,
+        verbose=args.verbose,
+        diagnostics_format=args.diagnostics_format,
+        diagnostics_limit=args.diagnostics_limit,
+        index_filename=args.index_filename,
+        include_paths=args.include_paths,
+        include_cache=args.include_cache,
+    )
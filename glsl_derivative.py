@@ -14,8 +14,15 @@ If you want to replace all files in a directory, call like so:
 """
 
 
+import collections
+import itertools
+import json
+import multiprocessing
+import os
 import traceback
+import types
 import difflib
+import weakref
 import copy
 import sys
 import re
@@ -23,6 +30,13 @@ import re
 import pypeg2 as peg
 import pypeg2glsl as glsl
 import glsl_simplify
+import glsl_cse
+import glsl_dce
+import glsl_index
+import glsl_include
+import glsl_inline
+import glsl_rewrite
+import glsl_unroll
 
 # attempt to import colorama, for colored diff output
 try:
@@ -65,10 +79,46 @@ def maybe_wrap(
         else glsl.ParensExpression(expression)
     )
 
+def get_grouped(f):
+    '''
+    "get_grouped" returns a copy of a parse tree where chains of binary operations
+    that subtract or divide nest to the left, as they are evaluated, 
+    see glsl_rewrite.get_evaluation_grouped().
+    The grammar parses chains such as `a - b + c` as `a - (b + c)`, 
+    which would otherwise be differentiated as they are parsed.
+    Other chains are left as they are parsed, since they have the same value either way.
+    '''
+    if (isinstance(f, glsl.BinaryExpression) and 
+        any([operator in ['-', '/'] for BinaryExpressionTemp, operator in glsl.Template.get_chain(f)[1::2]])):
+        return glsl_rewrite.get_evaluation_grouped(f)
+    return glsl_rewrite.get_mapped(f, get_grouped)
+
 def compose_many(*expressions):
     return [peg.compose(expression, type(expression)) 
             for expression in expressions]
 
+# DERIVATIVE TEMPLATES
+'''
+Derivatives are expressed as templates wherever possible. 
+Templates are parsed once when this module is loaded, 
+and instantiated by substituting parse trees for their placeholders,
+so derivatives can be built without composing and parsing text.
+'''
+ddx_max_template  = glsl.Template('$u > $v ? $dudx : $dvdx', glsl.TernaryExpression)
+ddx_min_template  = glsl.Template('$u < $v ? $dudx : $dvdx', glsl.TernaryExpression)
+ddx_abs_template  = glsl.Template('$u > 0.0f ? $dudx : -$dudx', glsl.TernaryExpression)
+ddx_sqrt_template = glsl.Template('$dudx / (2.0f * $f)', glsl.MultiplicativeExpression)
+ddx_pow_template  = glsl.Template('$v*pow($u,$v-1.0f)*$dudx  +  log($u)*pow($u,$v)*$dvdx', glsl.AdditiveExpression)
+ddx_cos_template  = glsl.Template('-sin($u)*$dudx', glsl.MultiplicativeExpression)
+ddx_tan_template  = glsl.Template('$dudx/pow(cos($u), 2.0f)', glsl.MultiplicativeExpression)
+ddx_asin_template = glsl.Template('$dudx/sqrt(1.0f-$u*$u)', glsl.MultiplicativeExpression)
+ddx_acos_template = glsl.Template('-$dudx/sqrt(1.0f-$u*$u)', glsl.MultiplicativeExpression)
+ddx_atan_template = glsl.Template('$dudx/(1.0f+$u*$u)', glsl.MultiplicativeExpression)
+ddx_dot_template  = glsl.Template('dot($u, $dvdx) + dot($dudx, $v)', glsl.AdditiveExpression)
+ddx_length_template = glsl.Template('dot(normalize($u), $dudx)', glsl.InvocationExpression)
+ddx_product_template  = glsl.Template('$v*$dudx + $u*$dvdx', glsl.AdditiveExpression)
+ddx_quotient_template = glsl.Template('($v*$dudx - $u*$dvdx)/($v*$v)', glsl.MultiplicativeExpression)
+
 # DERIVATIVES FOR BUILT IN FUNCTIONS
 def get_ddx_max(f, x, scope):
     f_args = f.arguments
@@ -76,7 +126,7 @@ def get_ddx_max(f, x, scope):
         glsl.AdditiveExpression,
         *glsl.unary_expression_or_less
     ]
-    u, dudx, v, dvdx = compose_many(
+    u, dudx, v, dvdx = (
         maybe_wrap(f_args[0], additive_expression_or_less),
         maybe_wrap(get_ddx(f_args[0], x, scope), glsl.binary_expression_or_less),
         maybe_wrap(f_args[1], additive_expression_or_less),
@@ -85,9 +135,7 @@ def get_ddx_max(f, x, scope):
     u_type = scope.deduce_type(f_args[0])
     v_type = scope.deduce_type(f_args[1])
     if (u_type == 'float' and v_type == 'float'):
-        return peg.parse(f''' 
-            {u} > {v} ? {dudx} : {dvdx}
-        ''', glsl.TernaryExpression)
+        return ddx_max_template.instantiate(u=u, v=v, dudx=dudx, dvdx=dvdx)
     else:
         throw_not_implemented_error(f, 'calls to component-wise max()')
 
@@ -97,7 +145,7 @@ def get_ddx_min(f, x, scope):
         glsl.AdditiveExpression,
         *glsl.unary_expression_or_less
     ]
-    u, dudx, v, dvdx = compose_many(
+    u, dudx, v, dvdx = (
         maybe_wrap(f_args[0], additive_expression_or_less),
         maybe_wrap(get_ddx(f_args[0], x, scope), glsl.binary_expression_or_less),
         maybe_wrap(f_args[1], additive_expression_or_less),
@@ -106,9 +154,7 @@ def get_ddx_min(f, x, scope):
     u_type = scope.deduce_type(f_args[0])
     v_type = scope.deduce_type(f_args[1])
     if (u_type == 'float' and v_type == 'float'):
-        return peg.parse(f''' 
-            {u} < {v} ? {dudx} : {dvdx}
-        ''', glsl.TernaryExpression)
+        return ddx_min_template.instantiate(u=u, v=v, dudx=dudx, dvdx=dvdx)
     else:
         throw_not_implemented_error(f, 'calls to component-wise min()')
     
@@ -117,78 +163,71 @@ def get_ddx_abs(f, x, scope):
         glsl.AdditiveExpression,
         *glsl.unary_expression_or_less
     ]
-    u, dudx = compose_many(
+    # the derivative is negated, so it must not be a binary expression
+    u, dudx = (
         maybe_wrap(f.arguments[0], additive_expression_or_less),
-        maybe_wrap(get_ddx(f.arguments[0], x, scope), glsl.binary_expression_or_less)
+        maybe_wrap(get_ddx(f.arguments[0], x, scope))
     )
     u_type = scope.deduce_type(f.arguments[0])
     if (u_type == 'float'):
-        return peg.parse(f''' 
-            {u} > 0.0f ? {dudx} : -{dudx}
-        ''', glsl.TernaryExpression)
+        return ddx_abs_template.instantiate(u=u, dudx=dudx)
     else:
         throw_not_implemented_error(f, 'calls to component-wise abs()')
 
 def get_ddx_sqrt(f, x, scope):
-    u, dudx = compose_many(
-        maybe_wrap(f.arguments[0]),
-        maybe_wrap(get_ddx(f.arguments[0], x, scope)),
-    )
-    return peg.parse(f'{dudx} / (2.0f * {u})', glsl.MultiplicativeExpression)
+    dudx = maybe_wrap(get_ddx(f.arguments[0], x, scope))
+    return ddx_sqrt_template.instantiate(f=f, dudx=dudx)
 
 def get_ddx_log(f, x, scope):
-    u, dudx = compose_many(
-        f.arguments[0],
-        maybe_wrap(get_ddx(f.arguments[0], x, scope))
-    )
+    dudx = maybe_wrap(get_ddx(f.arguments[0], x, scope))
     return glsl.MultiplicativeExpression(
-        dudx, '/', copy.deepcopy(f.arguments[0])
+        dudx, '/', maybe_wrap(copy.deepcopy(f.arguments[0]))
     )
 
 def get_ddx_pow(f, x, scope):
-    u, dudx, v, dvdx = compose_many(
+    u, dudx, v, dvdx = (
         f.arguments[0],
         maybe_wrap(get_ddx(f.arguments[0], x, scope)),
         maybe_wrap(f.arguments[1]),
         maybe_wrap(get_ddx(f.arguments[1], x, scope))
     )
-    return peg.parse(f'{v}*pow({u},{v}-1.0f)*{dudx}  +  log({u})*pow({u},{v})*{dvdx}', glsl.AdditiveExpression)
+    return ddx_pow_template.instantiate(u=u, v=v, dudx=dudx, dvdx=dvdx)
 
 def get_ddx_cos(f, x, scope):
-    u, dudx = compose_many(
+    u, dudx = (
         f.arguments[0],
         maybe_wrap(get_ddx(f.arguments[0], x, scope))
     )
-    return peg.parse(f'-sin({u})*{dudx}', glsl.MultiplicativeExpression)
+    return ddx_cos_template.instantiate(u=u, dudx=dudx)
 
 def get_ddx_tan(f, x, scope):
-    u, dudx = compose_many(
+    u, dudx = (
         f.arguments[0],
         maybe_wrap(get_ddx(f.arguments[0], x, scope))
     )
-    return peg.parse(f'pow(sec({u}), 2.0f)*{dudx}', glsl.MultiplicativeExpression)
+    return ddx_tan_template.instantiate(u=u, dudx=dudx)
 
 def get_ddx_asin(f, x, scope):
-    u, dudx = compose_many(
+    u, dudx = (
         f.arguments[0],
         maybe_wrap(get_ddx(f.arguments[0], x, scope))
     )
-    return peg.parse(f'{dudx}/sqrt(1.0f-{u}*{u})', glsl.MultiplicativeExpression)
+    return ddx_asin_template.instantiate(u=u, dudx=dudx)
 
 def get_ddx_acos(f, x, scope):
-    u, dudx = compose_many(
+    u, dudx = (
         f.arguments[0],
         maybe_wrap(get_ddx(f.arguments[0], x, scope))
     )
-    return peg.parse(f'-{dudx}/sqrt(1.0f-{u}*{u})', glsl.MultiplicativeExpression)
+    return ddx_acos_template.instantiate(u=u, dudx=dudx)
 
 
 def get_ddx_atan(f, x, scope):
-    u, dudx = compose_many(
+    u, dudx = (
         f.arguments[0],
         maybe_wrap(get_ddx(f.arguments[0], x, scope))
     )
-    return peg.parse(f'{dudx}/(1.0f+{u}*{u})', glsl.MultiplicativeExpression)
+    return ddx_atan_template.instantiate(u=u, dudx=dudx)
 
 
 def get_ddx_dot(f, x, scope):
@@ -244,15 +283,24 @@ def get_ddx_dot(f, x, scope):
     create non-component-wise behavior, 
     since it would amount to turning a float back into a vector.
     '''
-    u, dudx, v, dvdx = compose_many(
+    u, dudx, v, dvdx = (
         maybe_wrap( f.arguments[0] ),
         maybe_wrap( get_ddx(f.arguments[0], x, scope) ),
         maybe_wrap( f.arguments[1] ),
         maybe_wrap( get_ddx(f.arguments[1], x, scope) ),
     )
-    return peg.parse(
-        f' dot({u}, {dvdx}) + dot({dudx}, {v}) ', 
-        glsl.AdditiveExpression
+    return ddx_dot_template.instantiate(u=u, v=v, dudx=dudx, dvdx=dvdx)
+
+def get_ddx_length(f, x, scope):
+    if len(f.arguments) != 1:
+        throw_compiler_error(f, 'length must have one parameter')
+    u, dudx = f.arguments[0], get_ddx(f.arguments[0], x, scope)
+    # the length of a vector changes by the component of its derivative along its direction,
+    # whereas the gradient of a length is found component-wise, as described for get_ddx_dot()
+    if scope.deduce_type(u) in glsl.float_vector_types and scope.deduce_type(x) == 'float':
+        return ddx_length_template.instantiate(u=u, dudx=dudx)
+    return glsl.MultiplicativeExpression(
+        glsl.InvocationExpression('normalize', f.arguments), '*', maybe_wrap(dudx)
     )
 
 def get_ddx_invocation_expression(f, x, scope):
@@ -269,11 +317,11 @@ def get_ddx_invocation_expression(f, x, scope):
         'min' : get_ddx_min,
         'max' : get_ddx_max,
         'dot' : get_ddx_dot,
+        'length': get_ddx_length,
         'normalize': lambda f,x,scope: throw_not_implemented_error(f, 'non-component-wise functions'),
         'cross': lambda f,x,scope: throw_not_implemented_error(f, 'non-component-wise functions'),
     }
     dfdu_name_map = {
-        'length': 'normalize',
         'sin': 'cos',
         'exp': 'exp',
     }
@@ -286,6 +334,12 @@ def get_ddx_invocation_expression(f, x, scope):
         return glsl.InvocationExpression(
             f.reference, ['0.0f' for argument in f.arguments]
         )
+    # supported constructor (built-in, of variables that do not depend on x),
+    # such as `float(i + 1)` where a loop variable was replaced by glsl_unroll.py
+    elif (f.reference in glsl.built_in_types and 
+          not any([variable == x or variable not in scope.variables or is_active(variable, x, scope) 
+                   for variable in glsl.get_variable_references(f.arguments, get_identifiers(f.arguments))])):
+        return glsl.get_0_for_type(get_ddx_type(scope.deduce_type(f), scope.deduce_type(x)))
     # non-supported constructor (built-in)
     elif f.reference in glsl.built_in_types:
         throw_not_implemented_error(f, 'constructors')
@@ -324,10 +378,14 @@ def get_ddx_attribute_expression(f, x, scope):
     f_type = scope.deduce_type(f)
     x_type = scope.deduce_type(x)
 
+    # variable reference that does not depend on x
+    if isinstance(f.reference, str) and f.reference in scope.variables and not is_active(f.reference, x, scope):
+        return glsl.get_0_for_type(get_ddx_type(f_type, x_type, f))
+
     # variable reference
     type_ = scope.deduce_type(f.reference)
     if f.reference == x:
-        dfdx = glsl.get_1_for_type(scope.deduce_type(f))
+        dfdx = glsl.get_1_for_type(type_)
     elif isinstance(f.reference, str):
         dfdx = f'dd{x}_{f.reference}'
     else:
@@ -354,9 +412,8 @@ def get_ddx_attribute_expression(f, x, scope):
                         N = int(vecN[-1])
                         i = int(attribute.content)
                         vecN_params = ['0.0f' for i in range(N)]
-                        vecN_params[i] = peg.compose(glsl.AttributeExpression(dfdx, [attribute]), glsl.AttributeExpression)
-                        vecN_params = ','.join(vecN_params)
-                        updated_dfdx = peg.parse(f'{vecN}({vecN_params})', glsl.InvocationExpression)
+                        vecN_params[i] = glsl.AttributeExpression(dfdx, [attribute])
+                        updated_dfdx = glsl.InvocationExpression(vecN, vecN_params)
                     else:
                         throw_not_implemented_error(f, 'component access for non-float derivatives')
                 else:
@@ -386,9 +443,8 @@ def get_ddx_attribute_expression(f, x, scope):
                         's':0,'t':1,'u':2,'v':3,
                       }[attribute]
                     vecN_params = ['0.0f' for i in range(N)]
-                    vecN_params[i] = peg.compose(glsl.AttributeExpression(dfdx, [attribute]), glsl.AttributeExpression)
-                    vecN_params = ','.join(vecN_params)
-                    updated_dfdx = peg.parse(f'{vecN}({vecN_params})', glsl.InvocationExpression)
+                    vecN_params[i] = glsl.AttributeExpression(dfdx, [attribute])
+                    updated_dfdx = glsl.InvocationExpression(vecN, vecN_params)
                 else:
                     throw_not_implemented_error(f, 'component access for non-float derivatives')
             # attribute access
@@ -408,7 +464,7 @@ def get_ddx_multiplicative_expression(f, x, scope):
     # multiplication in glsl is always element wise, 
     # so we don't have to worry about managing types
 
-    u, dudx, v, dvdx = compose_many(
+    u, dudx, v, dvdx = (
         maybe_wrap(f.operand1), 
         maybe_wrap(get_ddx(f.operand1, x, scope)), 
         maybe_wrap(f.operand2), 
@@ -416,9 +472,9 @@ def get_ddx_multiplicative_expression(f, x, scope):
     )
 
     if f.operator == '*':
-        dfdx = peg.parse(f'{v}*{dudx} + {u}*{dvdx}', glsl.AdditiveExpression)
+        dfdx = ddx_product_template.instantiate(u=u, v=v, dudx=dudx, dvdx=dvdx)
     elif f.operator == '/':
-        dfdx = peg.parse(f'({v}*{dudx} - {u}*{dvdx})/({v}*{v})', glsl.MultiplicativeExpression)
+        dfdx = ddx_quotient_template.instantiate(u=u, v=v, dudx=dudx, dvdx=dvdx)
     else:
         throw_compiler_error(f, f'multiplicative expressions cannot have an operator of "{f.operator}"')
 
@@ -465,10 +521,22 @@ def get_ddx_primary_expression(k, x, scope):
     elif k == x:
         k_type = scope.deduce_type(k)
         return glsl.get_1_for_type(k_type)
+    # variable, not x, that does not depend on x
+    elif k in scope.variables and not is_active(k, x, scope):
+        return glsl.get_0_for_type(get_ddx_type(scope.deduce_type(k), scope.deduce_type(x)))
     # variable, not x
     else:
         return f'dd{x}_{k}'
 
+def get_ddx_pre_increment_expression(f, x, scope):
+    if f.operator == '-':
+        return glsl.PreIncrementExpression(
+            maybe_wrap(get_ddx(f.operand1, x, scope), glsl.postfix_expression_or_less), '-')
+    elif f.operator == '+':
+        return get_ddx(f.operand1, x, scope)
+    else:
+        throw_not_implemented_error(f, f'"{f.operator}" operators')
+
 def get_ddx_ternary_expression(f, x, scope):
     return glsl.TernaryExpression(
         f.operand1,
@@ -514,7 +582,7 @@ def get_ddx_assignment_expression(f, x, scope):
         throw_compiler_error(f, f'tried to set value to a {deduced_rhs_type} but needed a {deduced_lhs_type}')
     return glsl.AssignmentExpression(
         f'dd{x}_{f.operand1}',
-        '=',
+        f.operator,
         get_ddx(f.operand2, x, scope),
     )
 
@@ -532,18 +600,194 @@ def get_ddx_if_statement(f, x, scope):
         get_ddx(f.else_, x, scope) 
     )
 
+def get_expanded_assignment(f):
+    '''
+    "get_expanded_assignment" returns an assignment that multiplies or divides in place,
+    such as `a *= b`, as an equivalent assignment that does not, such as `a = a * b`,
+    or the assignment itself otherwise
+    '''
+    if f.operator not in ['*=', '/=']:
+        return f
+    return glsl.AssignmentExpression(f.operand1, '=', 
+        glsl.MultiplicativeExpression(copy.deepcopy(f.operand1), f.operator[0], maybe_wrap(f.operand2)))
+
+def get_ddx_statements(f, x, scope):
+    '''
+    "get_ddx_statements" returns a list containing a copy of 
+    a variable declaration or assignment, `f`, together with 
+    the statement that assigns its derivative, if it is active, 
+    in the order they must be executed
+    '''
+    active_statement = get_active_statement(f, x, scope)
+    if active_statement is None:
+        return [copy.deepcopy(f)]
+    elif isinstance(f, glsl.AssignmentExpression):
+        expanded = get_expanded_assignment(f)
+        if get_assigned_variable(expanded) in glsl.get_variable_references(expanded.operand2, scope.variables):
+            # the derivative of an assignment such as `a = a * b` reads the value of `a` before it is assigned
+            return [get_ddx(expanded, x, scope), copy.deepcopy(f)]
+        return [copy.deepcopy(f), get_ddx(expanded, x, scope)]
+    else:
+        return [copy.deepcopy(f), get_ddx(active_statement, x, scope)]
+
 def get_ddx_code_block(f, x, scope):
     dfdx = []
 
     for statement in f:
         if (isinstance(statement, glsl.VariableDeclaration) or 
             isinstance(statement, glsl.AssignmentExpression)):
-            dfdx.append( copy.deepcopy(statement) )
-            dfdx.append( get_ddx(statement, x, scope))
+            dfdx.extend( get_ddx_statements(statement, x, scope) )
         else:
             dfdx.append( get_ddx(statement, x, scope) )
 
     return dfdx
+
+def get_assigned_variable(f):
+    '''
+    "get_assigned_variable" returns the name of the variable 
+    that is written to by an assignment or declaration, 
+    or None if the name cannot be determined
+    '''
+    if isinstance(f, glsl.AssignmentExpression):
+        return get_assigned_variable(f.operand1)
+    elif isinstance(f, glsl.AttributeExpression):
+        return get_assigned_variable(f.reference)
+    elif isinstance(f, str):
+        return f
+    return None
+
+def get_assignments(f, names):
+    '''
+    "get_assignments" returns a list of (variable, references) tuples 
+    for every assignment that occurs within a glsl parse tree,
+    where "references" is the set of `names` that are read 
+    to find the value that is assigned to "variable".
+    Assignments to attributes or indices, and in place assignments (e.g. "+="),
+    are treated as also reading the variable that they write to.
+    '''
+    if isinstance(f, list):
+        return [assignment for element in f for assignment in get_assignments(element, names)]
+    elif isinstance(f, glsl.AssignmentExpression):
+        references = glsl.get_variable_references(f.operand2, names)
+        if f.operator != '=' or not isinstance(f.operand1, str):
+            references = references | glsl.get_variable_references(f.operand1, names)
+        return [(get_assigned_variable(f), references), *get_assignments(f.operand2, names)]
+    elif isinstance(f, glsl.GlslElement):
+        return get_assignments([
+            getattr(f, attribute) 
+            for attribute in glsl.element_attributes 
+            if hasattr(f, attribute)
+        ], names)
+    return []
+
+def get_identifiers(f):
+    '''
+    "get_identifiers" returns the set of all text within a parse tree 
+    that could be the name of a variable, see get_tokens()
+    '''
+    return {
+        token for token in get_tokens(f) 
+        if glsl.token.fullmatch(token) and not glsl.bool_literal.fullmatch(token)
+    }
+
+def get_active_variables(f, x, scope):
+    '''
+    "get_active_variables" performs an activity analysis on a glsl function.
+    It returns the set of variables within the function 
+    whose values depend on the parameter `x`, 
+    by following assignments until no more variables are found to depend on it.
+    Derivatives of all other variables are known to be zero, 
+    so no code needs to be generated for them.
+    Only dependencies through data are considered, 
+    since the derivative of a value does not depend on which branch produced it.
+    '''
+    # variables declared within else blocks may be absent from the scope
+    targets = [variable for variable, _ in get_assignments(f.content, set())]
+    names = {*scope.variables, *targets}
+    assignments = get_assignments(f.content, {*names, *get_identifiers(f.content)})
+    # names that are not declared, such as misspelled variables, are treated as depending on x,
+    # so that they are reported where their derivatives are needed, rather than assumed to be constant
+    active = {x, *[name for _, references in assignments for name in references if name not in names]}
+    updated = True
+    while updated:
+        updated = False
+        for variable, references in assignments:
+            if variable not in active and not references.isdisjoint(active):
+                active.add(variable)
+                updated = True
+    return active
+
+'''
+"derivative_activities" maps each LexicalScope of a function 
+to a dictionary of variables that were found by get_active_variables(), 
+keyed by the variable of differentiation.
+Scopes that have not been analyzed treat all variables as active.
+"derivative_activity_statistics" counts active and inactive variables across all functions.
+'''
+derivative_activities = weakref.WeakKeyDictionary()
+derivative_activity_statistics = collections.Counter()
+
+def set_active_variables(f, x, scope):
+    active = get_active_variables(f, x, scope)
+    derivative_activities.setdefault(scope, {})[x] = active
+    local_variables = {
+        *glsl.LexicalScope.get_local_variable_type_lookups(f.parameters),
+        *glsl.LexicalScope.get_local_variable_type_lookups(f.content),
+    }
+    derivative_activity_statistics['active'] += len(local_variables & active)
+    derivative_activity_statistics['inactive'] += len(local_variables - active)
+
+def is_active(variable, x, scope):
+    active = derivative_activities.get(scope, {}).get(x)
+    return active is None or variable in active
+
+def is_derived(variable, x, scope):
+    '''
+    "is_derived" returns whether code must be generated 
+    to find the derivative of a variable with respect to x.
+    This is not the case if the variable does not depend on x, 
+    or if the derivative is already stored in a variable of the function, 
+    as happens when differentiating the output of get_ddx_function() again
+    with respect to the same parameter.
+    '''
+    return is_active(variable, x, scope) and f'dd{x}_{variable}' not in scope.variables
+
+def get_active_statement(f, x, scope):
+    '''
+    "get_active_statement" returns a declaration or assignment 
+    restricted to those variables whose derivatives must be found, see is_derived(),
+    or None if there are no such variables
+    '''
+    if isinstance(f, glsl.AssignmentExpression):
+        return f if is_derived(get_assigned_variable(f), x, scope) else None
+    variables = f.content if isinstance(f.content, list) else [f.content]
+    content = [
+        variable for variable in variables 
+        if is_derived(get_assigned_variable(variable), x, scope)
+    ]
+    if len(content) < 1:
+        return None
+    elif len(content) == len(variables):
+        return f
+    return glsl.VariableDeclaration(f.type, content, f.qualifiers)
+
+'''
+"derivative_caches" maps each LexicalScope to a dictionary of derivatives 
+that have already been found within that scope, keyed by 
+the structure of the differentiated element and the variable of differentiation.
+Every function is differentiated within its own subscope, 
+so each distinct subexpression is differentiated at most once per function.
+A derivative is copied wherever it is reused, so that no element appears 
+more than once within the output, though the first place it is used 
+shares it with the cache, so derivatives must still not be modified in place.
+"derivative_structure_ids" holds the tables of pypeg2glsl.get_structure_id() for each LexicalScope,
+so the structure of each element is only traversed once however deeply it is nested.
+"derivative_cache_statistics" counts hits and misses across all caches.
+'''
+derivative_caches = weakref.WeakKeyDictionary()
+derivative_structure_ids = weakref.WeakKeyDictionary()
+derivative_cache_statistics = collections.Counter()
+
 def get_ddx(f, x, scope):
     assert_type(f, [str, list, glsl.GlslElement])
 
@@ -551,7 +795,22 @@ def get_ddx(f, x, scope):
     "get_ddx" is a pure function that 
     transforms an glsl grammar element matching pypeg2glsl.ternary_expression_or_less
     into a glsl parse tree representing the derivative with respect to a given variable. 
+    Derivatives of expressions are memoized within the scope they are found.
     '''
+    if isinstance(f, list):
+        return get_ddx_uncached(f, x, scope)
+    cache = derivative_caches.setdefault(scope, {})
+    structure_ids, element_ids = derivative_structure_ids.setdefault(scope, ({}, {}))
+    key = (glsl.get_structure_id(f, structure_ids, element_ids), x)
+    if key in cache:
+        derivative_cache_statistics['hits'] += 1
+        return copy.deepcopy(cache[key])
+    derivative_cache_statistics['misses'] += 1
+    dfdx = get_ddx_uncached(f, x, scope)
+    cache[key] = dfdx
+    return dfdx
+
+def get_ddx_uncached(f, x, scope):
     derivative_map = {
         (str,  get_ddx_primary_expression),
         (list, get_ddx_code_block),
@@ -559,7 +818,7 @@ def get_ddx(f, x, scope):
         (glsl.InvocationExpression, get_ddx_invocation_expression),
         (glsl.AttributeExpression, get_ddx_attribute_expression),
         # (glsl.PostIncrementExpression,   ),
-        # (glsl.PreIncrementExpression,    ),
+        (glsl.PreIncrementExpression,    get_ddx_pre_increment_expression),
 
         (glsl.MultiplicativeExpression,  get_ddx_multiplicative_expression),
         (glsl.AdditiveExpression,        get_ddx_additive_expression),
@@ -651,13 +910,16 @@ def get_ddx_function(f, x, scope):
             )
             return dfdx
 
-        # create parameters expressing derivatives of other parameters besides x
+        set_active_variables(f, x, local_scope)
+
+        # create parameters expressing derivatives of other parameters besides x,
+        # where they are later assigned values that depend on x
         dfdx.parameters = []
         for param in f.parameters:
             if 'out' in param.qualifiers:
                 throw_not_implemented_error('output reference parameters')
             dfdx.parameters.append(copy.deepcopy(param))
-            if param.name != x:
+            if param.name != x and is_active(param.name, x, local_scope):
                 dfdx.content.append(
                     glsl.VariableDeclaration(
                         copy.deepcopy(param.type),
@@ -678,41 +940,725 @@ def get_ddx_function(f, x, scope):
         return dfdx
 
     except (NotImplementedError, ValueError) as error:
-        return f'/*\n Derivative "{dfdx.name}" not available: \n{error} \n*/'
+        return f'/*\n Derivative "{dfdx.name}" not available: \n{error} \n*/\n'
+    except Exception as error:
+        return f'/*\n Derivative "{dfdx.name}" not available: \n{traceback.format_exc()} \n*/\n'
+
+def get_dual_type(f_type, dfdx_type):
+    '''
+    "get_dual_type" returns the type used to return 
+    both a value and its derivative from a function.
+    A vec2 is used if both are floats, otherwise a data structure is used,
+    whose declaration is returned by get_dual_structure_declaration()
+    '''
+    if f_type == 'float' and dfdx_type == 'float':
+        return 'vec2'
+    else:
+        return f'dual_{f_type}_{dfdx_type}'
+
+def get_dual_structure_declaration(f_type, dfdx_type):
+    '''
+    "get_dual_structure_declaration" returns the declaration of the data structure
+    named by get_dual_type(), which stores a value of `f_type` and its derivative of `dfdx_type`.
+    The types are passed in rather than read from the name, since they may contain underscores.
+    '''
+    dual_type = get_dual_type(f_type, dfdx_type)
+    return peg.parse(
+        f'struct {dual_type} {{ {f_type} value; {dfdx_type} derivative; }};', 
+        glsl.StructureDeclaration
+    )
+
+def get_dual(f, x, scope, dual_type):
+    '''
+    "get_dual" behaves like get_ddx() for a list of statements,
+    except statements that return a value instead return 
+    an instance of `dual_type` storing both the value and its derivative
+    '''
+    if isinstance(f, list):
+        dual = []
+        for statement in f:
+            if (isinstance(statement, glsl.VariableDeclaration) or 
+                isinstance(statement, glsl.AssignmentExpression)):
+                dual.extend( get_ddx_statements(statement, x, scope) )
+            else:
+                dual.append( get_dual(statement, x, scope, dual_type) )
+        return dual
+    elif isinstance(f, glsl.IfStatement):
+        return glsl.IfStatement(
+            f.condition, 
+            get_dual(f.content, x, scope, dual_type), 
+            get_dual(f.else_, x, scope, dual_type) 
+        )
+    elif isinstance(f, glsl.ReturnStatement):
+        dfdx = get_ddx_return_statement(f, x, scope)
+        return glsl.ReturnStatement(
+            glsl.InvocationExpression(dual_type, [copy.deepcopy(f.value), dfdx.value])
+        )
+    else:
+        return get_ddx(f, x, scope)
+
+def get_dual_function(f, x, scope):
+    ''' 
+    "get_dual_function" is a pure function that finds analytic derivatives 
+    using forward mode differentiation, like get_ddx_function(), 
+    except the function it returns, "dual_dd{x}_{name}", 
+    returns the value of the original function alongside its derivative.
+    Values that are needed to find the derivative are then found only once,
+    rather than once when calling the function and again when calling its derivative.
+    If both the value and derivative are floats, they are returned within a vec2,
+    otherwise they are returned within a data structure with the attributes 
+    "value" and "derivative", see get_dual_type().
+    '''
+    try:
+        local_scope = scope.get_subscope(f)
+        x_type = local_scope.variables[x]
+
+        dual = glsl.FunctionDeclaration(
+            name  = f'dual_dd{x}_{f.name}',
+        )
+        dual.type = get_dual_type(f.type, get_ddx_type(f.type, x_type, f.name))
+
+        set_active_variables(f, x, local_scope)
+
+        # create parameters expressing derivatives of other parameters besides x,
+        # where they are later assigned values that depend on x
+        dual.parameters = []
+        for param in f.parameters:
+            if 'out' in param.qualifiers:
+                throw_not_implemented_error('output reference parameters')
+            dual.parameters.append(copy.deepcopy(param))
+            if param.name != x and is_active(param.name, x, local_scope):
+                dual.content.append(
+                    glsl.VariableDeclaration(
+                        copy.deepcopy(param.type),
+                        get_ddx(glsl.AssignmentExpression(
+                            param.name,
+                            '=',
+                            glsl.get_0_for_type(param.type)
+                        ), x, local_scope)
+                    )
+                )
+
+        # convert the content of the function
+        dual.content = [
+            *dual.content,
+            *get_dual(f.content, x, local_scope, dual.type)
+        ]
+
+        return dual
+
+    except (NotImplementedError, ValueError) as error:
+        return f'/*\n Dual "{dual.name}" not available: \n{error} \n*/\n'
+    except Exception as error:
+        return f'/*\n Dual "{dual.name}" not available: \n{traceback.format_exc()} \n*/\n'
+
+def get_local_partial(f, x, scope, variables):
+    '''
+    "get_local_partial" returns a glsl parse tree representing 
+    the partial derivative of an expression with respect to a variable,
+    treating all other `variables` as independent of it.
+    '''
+    x_type = variables[x]
+    zeros = {
+        f'dd{x}_{name}': glsl.get_0_for_type(get_ddx_type(type_, x_type))
+        for name, type_ in variables.items()
+        if name != x
+    }
+    def get_substituted(element):
+        if isinstance(element, str):
+            return zeros.get(element, element)
+        elif isinstance(element, list):
+            return [get_substituted(subelement) for subelement in element]
+        elif isinstance(element, glsl.GlslElement):
+            result = copy.copy(element)
+            for attribute in glsl.element_attributes:
+                if hasattr(element, attribute):
+                    setattr(result, attribute, get_substituted(getattr(element, attribute)))
+            return result
+        return element
+    return get_substituted(get_ddx(f, x, scope))
+
+def get_gradient_function(f, scope):
+    ''' 
+    "get_gradient_function" is a pure function that finds analytic gradients 
+    using reverse mode differentiation.
+    Given a glsl parse tree representing a glsl function that returns a float,
+    and an instance of pypeg2glsl.LexicalScope,
+    it returns a glsl parse tree representing a single function 
+    that returns the same value and stores the derivative with respect to 
+    each floating point parameter in an `out` parameter, "dd{x}_{name}".
+    The body of the original function is run once, 
+    then the "adjoint" of each variable, the derivative of the return value 
+    with respect to that variable, is accumulated while walking its statements in reverse.
+    Partial derivatives of each statement are found using the same rules as get_ddx().
+    Only straight line code is supported, and since values are not stored 
+    while walking in reverse, a variable cannot be reassigned after it is read.
+    '''
+    try:
+        local_scope = scope.get_subscope(f)
+
+        dfdX = glsl.FunctionDeclaration(
+            name  = f'gradient_{f.name}',
+        )
+        if f.type != 'float':
+            throw_not_implemented_error(f.name, 'gradients of functions that do not return a float')
+        dfdX.type = f.type
+
+        variables = {
+            name: type_
+            for name, type_ in {
+                **glsl.LexicalScope.get_local_variable_type_lookups(f.parameters),
+                **glsl.LexicalScope.get_local_variable_type_lookups(f.content),
+            }.items()
+            if type_ == 'float' or type_ in glsl.float_vector_types
+        }
+        def get_adjoint_name(name):
+            return f'adjoint_{name}'
+
+        # find the statements that assign to variables, and the variables they read
+        assignments = []
+        return_statement = None
+        for statement in f.content:
+            if return_statement is not None:
+                throw_not_implemented_error(return_statement, 'statements after a return within gradients')
+            if isinstance(statement, str):
+                continue
+            elif isinstance(statement, glsl.VariableDeclaration):
+                for variable in statement.content:
+                    if isinstance(variable, glsl.AssignmentExpression):
+                        assignments.append(variable)
+            elif isinstance(statement, glsl.AssignmentExpression):
+                if statement.operator not in ['=', '+=', '-=']:
+                    throw_not_implemented_error(statement, f'assignments using "{statement.operator}"')
+                if not isinstance(statement.operand1, str):
+                    throw_not_implemented_error(statement, 'assignments to attributes or indices')
+                assignments.append(statement)
+            elif isinstance(statement, glsl.ReturnStatement):
+                return_statement = statement
+            else:
+                throw_not_implemented_error(statement, 'control flow within gradients')
+        if return_statement is None:
+            throw_compiler_error(f.name, 'function does not return a value')
+
+        for i, assignment in enumerate(assignments):
+            reads = glsl.get_variable_references(assignment.operand2, variables)
+            writes = {later.operand1 for later in assignments[i:]}
+            if reads & writes:
+                throw_not_implemented_error(assignment, 'reassignment of variables after they are read within gradients')
+
+        # run the original function
+        dfdX.parameters = [copy.deepcopy(parameter) for parameter in f.parameters]
+        for parameter in f.parameters:
+            if 'out' in parameter.qualifiers:
+                throw_not_implemented_error('output reference parameters')
+        dfdX.content = [
+            copy.deepcopy(statement) 
+            for statement in f.content 
+            if not isinstance(statement, glsl.ReturnStatement)
+        ]
+
+        # declare adjoints
+        for name, type_ in variables.items():
+            dfdX.content.append(
+                glsl.VariableDeclaration(
+                    get_ddx_type('float', type_), 
+                    [glsl.AssignmentExpression(get_adjoint_name(name), '=', glsl.get_0_for_type(get_ddx_type('float', type_)))]
+                )
+            )
+
+        # accumulate adjoints in reverse
+        def get_accumulation(adjoint, adjoint_type, operator, expression):
+            for x in sorted(glsl.get_variable_references(expression, variables)):
+                dudx = get_local_partial(expression, x, local_scope, variables)
+                x_type = variables[x]
+                if adjoint_type in glsl.float_vector_types and x_type == 'float':
+                    increment = glsl.InvocationExpression('dot', [adjoint, dudx])
+                else:
+                    increment = glsl.MultiplicativeExpression(adjoint, '*', maybe_wrap(dudx))
+                dfdX.content.append(glsl.AssignmentExpression(get_adjoint_name(x), operator, increment))
+
+        get_accumulation('1.0f', 'float', '+=', return_statement.value)
+        for i, assignment in reversed(list(enumerate(assignments))):
+            u = assignment.operand1
+            if u not in variables:
+                continue
+            get_accumulation(
+                get_adjoint_name(u), 
+                variables[u], 
+                '-=' if assignment.operator == '-=' else '+=', 
+                assignment.operand2
+            )
+            if (assignment.operator == '=' and 
+                any([earlier.operand1 == u for earlier in assignments[:i]])):
+                dfdX.content.append(glsl.AssignmentExpression(
+                    get_adjoint_name(u), '=', glsl.get_0_for_type(get_ddx_type('float', variables[u]))
+                ))
+
+        # store adjoints of parameters
+        for parameter in f.parameters:
+            if parameter.name in variables:
+                dfdX.parameters.append(
+                    glsl.ParameterDeclaration(
+                        get_ddx_type('float', parameter.type), 
+                        f'dd{parameter.name}_{f.name}', 
+                        ['out']
+                    )
+                )
+                dfdX.content.append(glsl.AssignmentExpression(
+                    f'dd{parameter.name}_{f.name}', '=', get_adjoint_name(parameter.name)
+                ))
+
+        dfdX.content.append(copy.deepcopy(return_statement))
+        return dfdX
+
+    except (NotImplementedError, ValueError) as error:
+        return f'/*\n Gradient "{dfdX.name}" not available: \n{error} \n*/\n'
     except Exception as error:
-        return f'/*\n Derivative "{dfdx.name}" not available: \n{traceback.format_exc()} \n*/'
+        return f'/*\n Gradient "{dfdX.name}" not available: \n{traceback.format_exc()} \n*/\n'
+
+'''
+"persistent_cache_version" is stored with a persistent derivative cache,
+caches written with a different version are ignored
+'''
+persistent_cache_version = 1
+
+def get_tool_filenames(module=sys.modules[__name__]):
+    '''
+    "get_tool_filenames" returns a sorted list of the source files of a module
+    and every module within the same directory that it imports, directly or indirectly,
+    such as pypeg2glsl.py, glsl_simplify.py, and glsl_unroll.py for this module
+    '''
+    directory = os.path.dirname(os.path.abspath(module.__file__))
+    filenames = set()
+    unvisited = [module]
+    while len(unvisited) > 0:
+        module = unvisited.pop()
+        filename = os.path.abspath(module.__file__)
+        if filename in filenames:
+            continue
+        filenames.add(filename)
+        unvisited.extend([
+            value for value in vars(module).values()
+            if isinstance(value, types.ModuleType) and 
+               getattr(value, '__file__', None) and
+               os.path.dirname(os.path.abspath(value.__file__)) == directory
+        ])
+    return sorted(filenames)
+
+def get_tool_version():
+    '''
+    "get_tool_version" returns a hash of the source code of every module 
+    that affects the output of get_converted_function(), see get_tool_filenames(),
+    so that cached output is not reused once the tools that produced it have changed
+    '''
+    global tool_version
+    if tool_version is None:
+        text = ''
+        for filename in get_tool_filenames():
+            with open(filename, 'r') as file:
+                text += file.read()
+        tool_version = glsl_index.get_content_hash(text)
+    return tool_version
+tool_version = None
+
+def get_tokens(element):
+    '''
+    "get_tokens" returns the set of all text within a parse tree, 
+    including the names of variables, functions, and types
+    '''
+    if isinstance(element, str):
+        return {element}
+    elif isinstance(element, list):
+        return set().union(*[get_tokens(subelement) for subelement in element])
+    elif isinstance(element, glsl.GlslElement):
+        return get_tokens([
+            getattr(element, attribute) 
+            for attribute in [*glsl.element_attributes, 'attributes']
+            if hasattr(element, attribute)
+        ])
+    return set()
+
+def get_text(element):
+    '''
+    "get_text" returns the glsl text for a parse tree
+    '''
+    return element if isinstance(element, str) else peg.compose(element, type(element))
+
+def get_dependency_signature(declaration, scope):
+    '''
+    "get_dependency_signature" returns a hash of the types of every 
+    function, global variable, and data structure that a function declaration refers to,
+    including the attributes of any data structures that those types refer to,
+    and the values of every global `const` variable that it refers to,
+    including those that the values of other `const` variables refer to
+    '''
+    tokens = get_tokens(declaration)
+    local = {*[parameter.name for parameter in declaration.parameters], 
+             *glsl.LexicalScope.get_local_variable_type_lookups(declaration.content)}
+    functions = {name: scope.functions[name] for name in sorted(tokens) if name in scope.functions}
+    variables = {name: scope.variables[name] for name in sorted(tokens) 
+                 if name in scope.variables and name not in local}
+    constants = {}
+    unvisited = [name for name in tokens if name not in local]
+    while len(unvisited) > 0:
+        name = unvisited.pop()
+        if name in scope.constants and name not in constants:
+            constants[name] = get_text(scope.constants[name])
+            unvisited.extend(get_tokens(scope.constants[name]))
+    structures = {}
+    unvisited = [*tokens, *functions.values(), *variables.values()]
+    while len(unvisited) > 0:
+        for name in get_tokens(unvisited.pop()):
+            if name in scope.attributes and name not in structures:
+                structures[name] = scope.attributes[name]
+                unvisited.extend(structures[name].values())
+    return glsl_index.get_content_hash(json.dumps({
+            'functions': {name: glsl_index.get_type_str(type_) for name, type_ in functions.items()},
+            'variables': {name: glsl_index.get_type_str(type_) for name, type_ in variables.items()},
+            'constants': constants,
+            'attributes': {
+                structure: {name: glsl_index.get_type_str(type_) for name, type_ in attribute_types.items()}
+                for structure, attribute_types in structures.items()
+            },
+        }, sort_keys=True))
+
+def get_diagnostic_record(diagnostic):
+    '''
+    "get_diagnostic_record" returns a json serializable dictionary 
+    that describes a pypeg2glsl.Diagnostic, see get_diagnostic()
+    '''
+    return {
+        'kind': diagnostic.kind,
+        'element_type': type(diagnostic.element).__name__,
+        'element': get_text(diagnostic.element),
+        'operand_type': type(diagnostic.operand).__name__,
+        'operand': get_text(diagnostic.operand) if diagnostic.operand is not None else None,
+        'description': diagnostic.description,
+        'types': [None if type_ is None else glsl_index.get_type_str(type_) for type_ in diagnostic.types],
+    }
+
+def get_diagnostic(record):
+    '''
+    "get_diagnostic" is the inverse of get_diagnostic_record()
+    '''
+    def get_element(text, type_name):
+        Element = getattr(glsl, type_name, None)
+        if text is None or not isinstance(Element, type) or not issubclass(Element, glsl.GlslElement):
+            return text
+        try:
+            return peg.parse(text, Element)
+        except (SyntaxError, ValueError):
+            return text
+    return glsl.Diagnostic(
+        record['kind'], 
+        get_element(record['element'], record['element_type']), 
+        record['description'], 
+        [None if type_str is None else glsl_index.get_type(type_str) for type_str in record['types']],
+        get_element(record['operand'], record['operand_type']),
+    )
+
+class PersistentDerivativeCache:
+    """
+    A "PersistentDerivativeCache" stores the output of get_converted_function() on disk,
+    along with any diagnostics that were found while producing it, 
+    so that functions which have not changed are not converted again on subsequent runs.
+    Output is keyed by a hash of the function declaration, the parameter, the mode, 
+    the types of everything that the function refers to and the values of `const` variables, 
+    see get_dependency_signature(), 
+    and the version of the tools that produced it, see get_tool_version().
+    At most `limit` entries are kept, 
+    those that were least recently used are evicted first.
+    """
+
+    def __init__(self, filename=None, limit=10000):
+        self.filename = filename
+        self.limit = limit
+        self.run = 0
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        if filename and os.path.exists(filename):
+            with open(filename, 'r') as file:
+                stored = json.load(file)
+            if stored.get('version') == persistent_cache_version:
+                self.run = stored['run']
+                self.entries = stored['entries']
+        self.run += 1
+
+    def get_key(self, declaration, x, mode, scope):
+        return glsl_index.get_content_hash(json.dumps([
+            glsl_index.get_content_hash(peg.compose(declaration, glsl.FunctionDeclaration)),
+            x, 
+            mode, 
+            get_dependency_signature(declaration, scope), 
+            get_tool_version(),
+        ]))
+
+    def get(self, key):
+        '''
+        "get" returns a tuple containing the output and diagnostics that are stored for a key,
+        or None if nothing is stored
+        '''
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry['used'] = self.run
+        output = (peg.parse(entry['output'], glsl.FunctionDeclaration) 
+                  if entry['kind'] == 'function' else entry['output'])
+        diagnostics = glsl.Diagnostics()
+        diagnostics.records = [get_diagnostic(record) for record in entry['diagnostics']]
+        diagnostics.dropped_count = entry['dropped_count']
+        return output, diagnostics
+
+    def set(self, key, output, diagnostics):
+        is_function = isinstance(output, glsl.FunctionDeclaration)
+        self.entries[key] = {
+            'kind': 'function' if is_function else 'comment',
+            'output': peg.compose(output, glsl.FunctionDeclaration) if is_function else output,
+            'diagnostics': [get_diagnostic_record(record) for record in diagnostics.records],
+            'dropped_count': diagnostics.dropped_count,
+            'used': self.run,
+        }
+
+    def save(self):
+        if not self.filename:
+            return
+        if self.limit is not None and len(self.entries) > self.limit:
+            kept = sorted(self.entries, key=lambda key: (-self.entries[key]['used'], key))[:self.limit]
+            self.entries = {key: self.entries[key] for key in sorted(kept)}
+        with open(self.filename, 'w') as file:
+            json.dump({
+                'version': persistent_cache_version, 
+                'run': self.run, 
+                'entries': self.entries
+            }, file, indent=1, sort_keys=True)
+
+def get_converted_function(declaration, x, scope, mode='derivative', intermediates=None, budget=None):
+    '''
+    "get_converted_function" returns the simplified output of convert_glsl()
+    for a single function declaration and parameter, see convert_glsl().
+    `x` is ignored if `mode` is "gradient".
+    In "derivative" mode, `x` may also be a tuple of parameters,
+    to find a higher order derivative with respect to each parameter in turn, 
+    see get_higher_order_function().
+    If a pypeg2glsl.Budget is provided as `budget`, it limits the work done 
+    to simplify the output and eliminate common subexpressions, 
+    which is shared between both steps.
+    Loops with constant bounds are unrolled by glsl_unroll.py beforehand, 
+    since loops cannot be differentiated otherwise.
+    '''
+    if isinstance(x, tuple):
+        return get_higher_order_function(declaration, x, scope, 
+            intermediates if intermediates is not None else {}, budget)
+    declaration = get_grouped(glsl_unroll.get_unrolled(declaration, scope))
+    if mode == 'gradient':
+        ddx_declaration = get_gradient_function(declaration, scope)
+    elif mode == 'dual':
+        ddx_declaration = get_dual_function(declaration, x, scope)
+    else:
+        ddx_declaration = get_ddx_function(declaration, x, scope)
+    budget = budget.get_started() if budget is not None else None
+    return glsl_cse.get_eliminated(glsl_simplify.get_simplified(ddx_declaration, scope, budget=budget, dce=True), scope, budget=budget)
 
-def convert_glsl(input_glsl, input_handling='omit'):
+def get_higher_order_function(declaration, xs, scope, intermediates, budget=None):
+    '''
+    "get_higher_order_function" returns the simplified derivative of a function 
+    with respect to each parameter within `xs` in turn, 
+    so that ('x','y') returns the function "ddy_ddx_{name}".
+    The derivative is found by differentiating the simplified parse tree 
+    of the derivative for all but the last parameter, 
+    so variables that store intermediate results in lower order derivatives, 
+    such as those introduced by glsl_cse.py, are reused rather than expanded.
+    Lower order derivatives are stored in `intermediates`, keyed by their parameters,
+    so they can be shared between all derivatives of the same declaration.
+    '''
+    if len(xs) < 2:
+        return get_converted_function(declaration, xs[0], scope, budget=budget)
+    lower_xs = xs[:-1]
+    if lower_xs not in intermediates:
+        intermediates[lower_xs] = get_higher_order_function(declaration, lower_xs, scope, intermediates, budget)
+    lower = intermediates[lower_xs]
+    if not isinstance(lower, glsl.FunctionDeclaration):
+        lower_name = declaration.name
+        for x in lower_xs:
+            lower_name = f'dd{x}_{lower_name}'
+        return f'/*\n Derivative "dd{xs[-1]}_{lower_name}" not available: \nderivative "{lower_name}" is not available \n*/\n'
+    return get_converted_function(lower, xs[-1], scope, budget=budget)
+
+'''
+"worker_declaration_types" and "worker_constants" store the declarations 
+and the values of `const` variables of the input to convert_glsl() 
+within each process of a pool, see set_worker_declarations()
+'''
+worker_declaration_types = None
+worker_constants = None
+worker_diagnostics_limit = None
+
+def set_worker_declarations(declarations, constants, diagnostics_limit):
+    global worker_declaration_types, worker_constants, worker_diagnostics_limit
+    worker_declaration_types = glsl_index.get_declaration_types(declarations)
+    worker_constants = {
+        name: peg.parse(value_text, glsl.ternary_expression_or_less)
+        for name, value_text in constants.items()
+    }
+    worker_diagnostics_limit = diagnostics_limit
+    worker_intermediates.clear()
+
+'''
+"worker_intermediates" stores the lower order derivatives found by get_higher_order_function()
+within each process of a pool, keyed by the text of their declaration, see get_higher_order_function().
+It is cleared whenever a pool is started by convert_glsl(), and only the 
+"worker_intermediates_limit" declarations that were most recently converted are kept,
+so that it does not grow with the size of the input.
+'''
+worker_intermediates = collections.OrderedDict()
+worker_intermediates_limit = 16
+
+def get_converted_function_in_worker(declaration_text, x, mode, budget=None):
+    '''
+    "get_converted_function_in_worker" behaves like get_converted_function()
+    within a process of a pool, where the declaration is provided as text.
+    It also returns the diagnostics and statistics that were found along the way,
+    so they can be merged by the process that started the pool.
+    '''
+    diagnostics = glsl.Diagnostics(worker_diagnostics_limit)
+    scope = glsl.LexicalScope(diagnostics=diagnostics)
+    variables, functions, attributes = worker_declaration_types
+    scope.variables, scope.functions, scope.attributes = dict(variables), dict(functions), dict(attributes)
+    scope.constants = dict(worker_constants)
+    declaration = peg.parse(declaration_text, glsl.FunctionDeclaration)
+    derivative_cache_statistics.clear()
+    derivative_activity_statistics.clear()
+    intermediates = worker_intermediates.setdefault(declaration_text, {})
+    worker_intermediates.move_to_end(declaration_text)
+    while len(worker_intermediates) > worker_intermediates_limit:
+        worker_intermediates.popitem(last=False)
+    output = get_converted_function(declaration, x, scope, mode, intermediates, budget)
+    return output, diagnostics, derivative_cache_statistics.copy(), derivative_activity_statistics.copy()
+
+def convert_glsl(input_glsl, input_handling='omit', diagnostics=None, base_scope=None, mode='derivative', jobs=1, cache=None, orders=(1,), budget=None, inline=False):
     ''' 
     "convert_glsl" is a pure function that performs 
     a transformation on a parse tree of glsl as represented by glsl,
     then returns a transformed parse tree as output. 
+    Problems found along the way are recorded in `diagnostics`, if provided.
+    Declarations outside input_glsl can be provided using `base_scope`.
+    `mode` is either "derivative", to output a derivative function for every parameter, 
+    "gradient", to output a single function for every input function 
+    that finds derivatives for all parameters at once,
+    or "dual", to output a function for every parameter 
+    that returns both the value of the input function and its derivative.
+    If `jobs` is greater than 1, functions are converted by a pool of that many processes,
+    and output is identical to what would be returned otherwise.
+    If a PersistentDerivativeCache is provided as `cache`, 
+    output is read from it where available, and stored within it otherwise.
+    In "derivative" mode, a function is output for every order within `orders`,
+    and for every unique combination of parameters of that order.
+    Mixed partial derivatives are symmetric, so only one order of differentiation is output,
+    e.g. "ddy_ddx_{name}" is output but "ddx_ddy_{name}" is not.
+    If a pypeg2glsl.Budget is provided as `budget`, it limits the work done on each output function,
+    see get_converted_function(). Output that exhausted it is not stored in `cache`,
+    so that it may be improved on by a later run with a larger budget.
+    If `inline` is true, calls to small functions within input_glsl are inlined by glsl_inline.py 
+    before functions are converted, so that calls to functions without derivatives can be differentiated.
+    Input that is output by `input_handling` is left as it is.
     '''
 
+    def get_parameters(declaration):
+        if mode == 'gradient':
+            return [None]
+        elif mode == 'dual':
+            return [parameter.name for parameter in declaration.parameters]
+        return [
+            xs[0] if len(xs) == 1 else xs
+            for order in orders
+            for xs in itertools.combinations_with_replacement(
+                [parameter.name for parameter in declaration.parameters], order)
+        ]
+
+    # every function and parameter is converted independently
+    tasks = []
+    converted_glsl = (
+        glsl_inline.get_inlined(input_glsl, glsl.LexicalScope(input_glsl, diagnostics, base_scope)) 
+        if inline else input_glsl)
+    for declaration in converted_glsl:
+        if isinstance(declaration, glsl.FunctionDeclaration):
+            tasks.extend([(declaration, x) for x in get_parameters(declaration)])
+
+    # output that is already known is read from the cache
+    results = [None for task in tasks]
+    keys = [None for task in tasks]
+    if cache is not None:
+        scope = glsl.LexicalScope(input_glsl, None, base_scope)
+        for i, (declaration, x) in enumerate(tasks):
+            keys[i] = cache.get_key(declaration, x, mode, scope)
+            results[i] = cache.get(keys[i])
+    pending = [i for i, result in enumerate(results) if result is None]
+
+    diagnostics_limit = diagnostics.limit if diagnostics is not None else None
+    if jobs > 1 and len(pending) > 1:
+        scope = glsl.LexicalScope(input_glsl, None, base_scope)
+        declarations = glsl_index.get_scope_declarations(scope)
+        constants = {name: get_text(value) for name, value in scope.constants.items()}
+        with multiprocessing.Pool(jobs, set_worker_declarations, (declarations, constants, diagnostics_limit)) as pool:
+            worker_results = pool.starmap(get_converted_function_in_worker, [
+                (peg.compose(tasks[i][0], glsl.FunctionDeclaration), tasks[i][1], mode, budget)
+                for i in pending
+            ], chunksize=1)
+        for i, (output, task_diagnostics, cache_statistics, activity_statistics) in zip(pending, worker_results):
+            derivative_cache_statistics.update(cache_statistics)
+            derivative_activity_statistics.update(activity_statistics)
+            results[i] = (output, task_diagnostics)
+    else:
+        intermediates = {}
+        for i in pending:
+            declaration, x = tasks[i]
+            task_diagnostics = glsl.Diagnostics(diagnostics_limit)
+            output = get_converted_function(declaration, x, 
+                glsl.LexicalScope(input_glsl, task_diagnostics, base_scope), mode, 
+                intermediates.setdefault(id(declaration), {}), budget)
+            results[i] = (output, task_diagnostics)
+
+    outputs = []
+    for i, (output, task_diagnostics) in enumerate(results):
+        if (cache is not None and i in pending and 
+            all([record.kind != 'budget-exhausted' for record in task_diagnostics.records])):
+            cache.set(keys[i], output, task_diagnostics)
+        if diagnostics is not None:
+            diagnostics.extend(task_diagnostics)
+        outputs.append(output)
+
+    # merge output in the order of input
+    outputs = iter(outputs)
+    output_glsl0 = {}
     output_glsl1 = []
     output_glsl2 = []
     for declaration in input_glsl:
         if isinstance(declaration, glsl.FunctionDeclaration):
             if input_handling != 'omit':
                 output_glsl1.append(copy.deepcopy(declaration))
-            for parameter in declaration.parameters:
-                x = parameter.name
-                scope = glsl.LexicalScope(input_glsl)
-                ddx_declaration = get_ddx_function(declaration, x, scope)
+            parameters = get_parameters(declaration)
+            parameter_types = {parameter.name: parameter.type for parameter in declaration.parameters}
+            for x, ddx_declaration in zip(parameters, itertools.islice(outputs, len(parameters))):
+                if (mode == 'dual' and 
+                    isinstance(ddx_declaration, glsl.FunctionDeclaration) and 
+                    ddx_declaration.type not in glsl.built_in_types):
+                    output_glsl0[ddx_declaration.type] = get_dual_structure_declaration(
+                        declaration.type, get_ddx_type(declaration.type, parameter_types[x], declaration.name))
                 if input_handling == 'prepend':
-                    # output_glsl2.append(ddx_declaration)
-                    output_glsl2.append(glsl_simplify.get_simplified(ddx_declaration, scope))
+                    output_glsl2.append(ddx_declaration)
                 else:
-                    # output_glsl1.append(ddx_declaration)
-                    output_glsl1.append(glsl_simplify.get_simplified(ddx_declaration, scope))
+                    output_glsl1.append(ddx_declaration)
         else:
             output_glsl1.append(copy.deepcopy(declaration))
 
-    output_glsl = [*output_glsl1, *output_glsl2]
+    output_glsl = [*output_glsl0.values(), *output_glsl1, *output_glsl2]
     glsl.warn_of_invalid_grammar_elements(output_glsl)
     return output_glsl
 
-def convert_text(input_text, input_handling='omit'):
+def convert_text(input_text, input_handling='omit', diagnostics=None, base_scope=None, mode='derivative', jobs=1, cache=None, orders=(1,), budget=None, inline=False):
     ''' 
     "convert_text" is a pure function that performs 
     a transformation on a string containing glsl code,
@@ -722,11 +1668,14 @@ def convert_text(input_text, input_handling='omit'):
     such as string substitutions or regex replacements
     '''
     input_glsl = peg.parse(input_text, glsl.code)
-    output_glsl = convert_glsl(input_glsl, input_handling = input_handling)
+    output_glsl = convert_glsl(input_glsl, input_handling = input_handling, diagnostics = diagnostics, base_scope = base_scope, mode = mode, jobs = jobs, cache = cache, orders = orders, budget = budget, inline = inline)
     output_text = peg.compose(output_glsl, glsl.code, autoblank = False) 
     return output_text
 
-def convert_file(input_filename=False, in_place=False, verbose=False, input_handling='omit'):
+def convert_file(input_filename=False, in_place=False, verbose=False, input_handling='omit', 
+        diagnostics_format='text', diagnostics_limit=None, index_filename=None,
+        include_paths=None, include_cache=None, mode='derivative', jobs=1,
+        derivative_cache=None, derivative_cache_limit=10000, orders=(1,), budget=None, inline=False):
     ''' 
     "convert_file" performs a transformation on a file containing glsl code
     It may either print out transformed contents or replace the file, 
@@ -757,9 +1706,24 @@ def convert_file(input_filename=False, in_place=False, verbose=False, input_hand
         for line in sys.stdin:
             input_text += line
 
-    output_text = convert_text(input_text, input_handling=input_handling)
+    diagnostics = glsl.Diagnostics(diagnostics_limit)
+    base_scope = glsl_index.ProjectIndex.load(index_filename).get_scope() if index_filename else None
+    include_resolver = glsl_include.IncludeResolver(include_paths, include_cache)
+    base_scope = include_resolver.get_scope(input_text, input_filename, base_scope)
+    include_resolver.save()
+    cache = PersistentDerivativeCache(derivative_cache, derivative_cache_limit) if derivative_cache else None
+    output_text = convert_text(input_text, input_handling=input_handling, diagnostics=diagnostics, base_scope=base_scope, mode=mode, jobs=jobs, cache=cache, orders=orders, budget=budget, inline=inline)
+    if cache is not None:
+        cache.save()
+    diagnostics.report(diagnostics_format)
 
     if verbose:
+        print(f'derivative cache: {derivative_cache_statistics["hits"]} hits, '
+              f'{derivative_cache_statistics["misses"]} misses', file=sys.stderr)
+        print(f'activity analysis: {derivative_activity_statistics["active"]} active, '
+              f'{derivative_activity_statistics["inactive"]} inactive variables', file=sys.stderr)
+        if cache is not None:
+            print(f'persistent derivative cache: {cache.hits} hits, {cache.misses} misses', file=sys.stderr)
         diff = difflib.ndiff(
             input_text.splitlines(keepends=True), 
             output_text.splitlines(keepends=True)
@@ -787,13 +1751,68 @@ if __name__ == '__main__':
     parser.add_argument('--input-handling', dest='input_handling', choices=['embed', 'prepend', 'omit'],
         help='specify whether to embed, prepend, or omit input functions in output', 
     )
+    parser.add_argument('--mode', dest='mode', choices=['derivative', 'gradient', 'dual'], default='derivative',
+        help='specify whether to output a derivative function for every parameter, '
+             'a single reverse mode gradient function for every input function, '
+             'or a function for every parameter that returns both a value and its derivative', 
+    )
+    parser.add_argument('--order', dest='order', type=int, default=1,
+        help='in derivative mode, output derivatives of order N', metavar='N',
+    )
+    parser.add_argument('--hessian', dest='hessian', action='store_true',
+        help='in derivative mode, output all first and second order derivatives',
+    )
+    parser.add_argument('--inline', dest='inline', action='store_true',
+        help='inline calls to small functions before converting functions, see glsl_inline.py',
+    )
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+        help='convert functions using a pool of N processes', metavar='N',
+    )
     parser.add_argument('-v', '--verbose', dest='verbose', 
         help='show debug information', action='store_true')
+    parser.add_argument('--diagnostics', dest='diagnostics_format', choices=['text', 'json', 'none'], default='text',
+        help='specify whether to report diagnostics to stderr as text, as json, or not at all', 
+    )
+    parser.add_argument('--diagnostics-limit', dest='diagnostics_limit', type=int, default=100,
+        help='maximum number of diagnostics to record', metavar='N',
+    )
+    parser.add_argument('--index', dest='index_filename', 
+        help='seed type information from an index built by glsl_index.py', metavar='FILE')
+    parser.add_argument('-I', '--include-path', dest='include_paths', action='append',
+        help='search DIRECTORY for headers named by #include directives', metavar='DIRECTORY')
+    parser.add_argument('--include-cache', dest='include_cache',
+        help='store parsed header declarations in FILE between runs', metavar='FILE')
+    parser.add_argument('--derivative-cache', dest='derivative_cache',
+        help='store converted functions in FILE, so unchanged functions are not converted again', metavar='FILE')
+    parser.add_argument('--derivative-cache-limit', dest='derivative_cache_limit', type=int, default=10000,
+        help='maximum number of converted functions to store, the least recently used are removed first', metavar='N')
+    parser.add_argument('--iteration-limit', dest='iteration_limit', type=int, default=200000,
+        help='stop optimizing an output function after N rewrites', metavar='N')
+    parser.add_argument('--node-limit', dest='node_limit', type=int, default=20000,
+        help='leave output functions with more than N elements in their parse tree unoptimized', metavar='N')
+    parser.add_argument('--time-limit', dest='time_limit', type=float, default=30.0,
+        help='stop optimizing an output function after SECONDS', metavar='SECONDS')
 
     args = parser.parse_args()
+    if args.order < 1:
+        parser.error('--order must be at least 1')
+    if args.mode != 'derivative' and (args.order != 1 or args.hessian):
+        parser.error('--order and --hessian are only available in derivative mode')
     convert_file(
         args.filename, 
         in_place=args.in_place, 
         verbose=args.verbose, 
+        diagnostics_format=args.diagnostics_format, 
+        diagnostics_limit=args.diagnostics_limit, 
+        index_filename=args.index_filename, 
+        include_paths=args.include_paths, 
+        include_cache=args.include_cache, 
         input_handling=args.input_handling,
+        mode=args.mode,
+        jobs=args.jobs,
+        derivative_cache=args.derivative_cache,
+        derivative_cache_limit=args.derivative_cache_limit,
+        orders=(1, 2) if args.hessian else (args.order,),
+        budget=glsl.Budget(args.iteration_limit, args.node_limit, args.time_limit),
+        inline=args.inline,
     )
@@ -0,0 +1,439 @@
+#!/bin/env python3
+
+"""
+"glsl_egraph.py" optimizes small glsl expressions using equality saturation.
+Rules such as those within glsl_rewrite.py replace an expression with another,
+so the order in which they are applied decides which forms are ever reached,
+and a rule that would lead to a cheaper form later is never applied
+if it makes the expression more expensive at first.
+Instead, an "e-graph" stores every form that rules find for an expression at once,
+by grouping expressions that are known to be equal into "e-classes"
+whose members share subexpressions with one another.
+Rules are applied to every e-class without removing anything,
+until no rule finds anything new or a budget runs out,
+and the form that glsl_cost.py estimates to be cheapest is then extracted.
+
+Rules are declared as pairs of glsl patterns, in the same way as glsl_rewrite.py.
+They include commutativity and associativity of `+` and `*`,
+distributivity, and a few identities and strength reductions.
+Only sums, products, negations, and calls to built-in functions of floats and float vectors
+are rearranged, for which these rules hold, at least for real numbers.
+Other subexpressions are treated as opaque values.
+Like floating point arithmetic that is relaxed by a glsl compiler,
+results may be rounded differently.
+
+The number of forms within an e-graph can grow exponentially,
+so only expressions below a size threshold are optimized,
+and optimization stops early once an e-graph holds too many e-nodes,
+or once a time limit has passed.
+
+This script is a library, it is used by glsl_simplify.py if `--egraph` is set.
+"""
+
+
+import copy
+import time
+
+import pypeg2glsl as glsl
+import glsl_cost
+import glsl_cse
+import glsl_rewrite
+
+def assert_type(variable, types):
+    if len(types) == 1 and not isinstance(variable, types[0]):
+        raise AssertionError(f'expected {types[0]} but got {type(variable)} (value: {variable})')
+    if not any([isinstance(variable, type_) for type_ in types]):
+        raise AssertionError(f'expected any of {types} but got {type(variable)} (value: {variable})')
+
+'''
+"egraph_types" lists the types of expressions that can be stored within an e-graph,
+since their operations are componentwise and can be reordered
+'''
+egraph_types = ['float', *glsl.float_vector_types]
+
+'''
+"egraph_operators" lists the binary operators that can be stored within an e-graph
+'''
+egraph_operators = {
+    '+': glsl.AdditiveExpression,
+    '-': glsl.AdditiveExpression,
+    '*': glsl.MultiplicativeExpression,
+    '/': glsl.MultiplicativeExpression,
+}
+
+default_max_size = 48
+default_node_limit = 2000
+default_iteration_limit = 8
+default_time_limit = 1.0
+
+def get_operator(element):
+    '''
+    "get_operator" returns the operator of an e-node for an element,
+    or None if the element can only be stored as an opaque value.
+    Operators are tuples whose first item is `binary`, `negate`, or `call`.
+    '''
+    if isinstance(element, glsl.BinaryExpression) and element.operator in egraph_operators:
+        return ('binary', element.operator)
+    elif isinstance(element, glsl.PreIncrementExpression) and element.operator == '-':
+        return ('negate', '-')
+    elif (isinstance(element, glsl.InvocationExpression) and
+          (element.reference in glsl.built_in_function_signatures or element.reference in egraph_types)):
+        return ('call', element.reference)
+    return None
+
+def get_operands(element):
+    if isinstance(element, glsl.BinaryExpression):
+        return [element.operand1, element.operand2]
+    elif isinstance(element, glsl.UnaryExpression):
+        return [element.operand1]
+    return list(element.arguments)
+
+def get_unwrapped(element):
+    while isinstance(element, glsl.ParensExpression):
+        element = element.content
+    return element
+
+def get_node_type(operator, operand_types):
+    '''
+    "get_node_type" returns the type of an e-node given the types of its operands,
+    or None if the e-node would not be valid glsl,
+    or its type is not among egraph_types
+    '''
+    kind, name = operator
+    if None in operand_types:
+        return None
+    if kind == 'leaf':
+        return None
+    elif kind == 'negate':
+        type_ = operand_types[0]
+    elif kind == 'binary':
+        sizes = set([type_ for type_ in operand_types if type_ != 'float'])
+        type_ = sizes.pop() if len(sizes) == 1 else 'float' if len(sizes) == 0 else None
+    elif name in egraph_types:
+        type_ = name
+    else:
+        type_ = glsl.get_built_in_function_type(name, tuple(operand_types))
+    return type_ if type_ in egraph_types else None
+
+class EGraph:
+    """
+    An "EGraph" stores expressions that are known to be equal within shared e-classes.
+    An e-node is a tuple containing an operator, as returned by get_operator(),
+    and a tuple of the ids of the e-classes of its operands.
+    Opaque values are stored as e-nodes with a `leaf` operator that contains their equivalence key,
+    as returned by glsl_rewrite.get_equivalence_key().
+    E-classes are merged using a union find structure,
+    and `hashcons` maps every e-node to the id of the e-class that contains it,
+    so that an e-node is never stored twice.
+    """
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.parents = []
+        self.nodes = {}
+        self.types = {}
+        self.hashcons = {}
+        self.leaves = {}
+
+    def find(self, id_):
+        while self.parents[id_] != id_:
+            self.parents[id_] = self.parents[self.parents[id_]]
+            id_ = self.parents[id_]
+        return id_
+
+    def get_canonical_node(self, node):
+        operator, children = node
+        return (operator, tuple([self.find(child) for child in children]))
+
+    def get_node_count(self):
+        return len(self.hashcons)
+
+    def add_node(self, node, type_):
+        '''
+        "add_node" returns the id of the e-class that contains an e-node,
+        adding a new e-class if the e-node is not yet stored
+        '''
+        node = self.get_canonical_node(node)
+        if node in self.hashcons:
+            return self.find(self.hashcons[node])
+        id_ = len(self.parents)
+        self.parents.append(id_)
+        self.nodes[id_] = [node]
+        self.types[id_] = type_
+        self.hashcons[node] = id_
+        return id_
+
+    def add(self, element):
+        '''
+        "add" returns the id of the e-class that contains an element,
+        adding e-nodes for the element and its subexpressions where needed
+        '''
+        element = get_unwrapped(element)
+        operator = get_operator(element)
+        type_ = self.scope.deduce_type(element)
+        if operator is not None and type_ in egraph_types:
+            children = [self.add(operand) for operand in get_operands(element)]
+            if get_node_type(operator, [self.types[child] for child in children]) == type_:
+                return self.add_node((operator, tuple(children)), type_)
+        key = glsl_rewrite.get_equivalence_key(element)
+        self.leaves.setdefault(key, element)
+        return self.add_node((('leaf', key), ()), type_)
+
+    def union(self, a, b):
+        '''
+        "union" merges the e-classes of two ids, and returns whether they were separate
+        '''
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return False
+        if len(self.nodes[a]) < len(self.nodes[b]):
+            a, b = b, a
+        self.parents[b] = a
+        self.nodes[a].extend(self.nodes.pop(b))
+        self.types.pop(b)
+        return True
+
+    def rebuild(self):
+        '''
+        "rebuild" restores the invariants of the e-graph after e-classes are merged:
+        e-nodes whose operands are now in the same e-classes are themselves merged,
+        until no further e-classes need to be merged
+        '''
+        while True:
+            hashcons = {}
+            merges = []
+            for id_ in list(self.nodes):
+                for node in self.nodes[id_]:
+                    node = self.get_canonical_node(node)
+                    if node in hashcons and self.find(hashcons[node]) != self.find(id_):
+                        merges.append((hashcons[node], id_))
+                    hashcons[node] = id_
+            for a, b in merges:
+                self.union(a, b)
+            if len(merges) < 1:
+                break
+        self.hashcons = hashcons
+        for id_ in self.nodes:
+            self.nodes[id_] = list(dict.fromkeys([self.get_canonical_node(node) for node in self.nodes[id_]]))
+
+    def match(self, pattern, id_, bindings):
+        '''
+        "match" returns a list of bindings, one for every way that a pattern
+        returned by get_pattern() matches an e-class,
+        where bindings map placeholder names to the ids of e-classes
+        '''
+        kind, value = pattern[0]
+        if kind == 'placeholder':
+            if value in bindings:
+                return [bindings] if self.find(bindings[value]) == self.find(id_) else []
+            return [{**bindings, value: id_}]
+        result = []
+        for operator, children in self.nodes[self.find(id_)]:
+            if operator != pattern[0] or len(children) != len(pattern[1]):
+                continue
+            matches = [bindings]
+            for subpattern, child in zip(pattern[1], children):
+                matches = [match for partial in matches for match in self.match(subpattern, child, partial)]
+            result.extend(matches)
+        return result
+
+    def instantiate(self, pattern, bindings):
+        '''
+        "instantiate" returns the id of the e-class that contains a pattern
+        where placeholders are substituted with the e-classes they are bound to,
+        or None if the result would not be valid glsl
+        '''
+        kind, value = pattern[0]
+        if kind == 'placeholder':
+            return bindings[value]
+        elif kind == 'leaf':
+            self.leaves.setdefault(value, pattern[2])
+            return self.add_node((pattern[0], ()), self.scope.deduce_type(pattern[2]))
+        children = [self.instantiate(subpattern, bindings) for subpattern in pattern[1]]
+        if None in children:
+            return None
+        type_ = get_node_type(pattern[0], [self.types[self.find(child)] for child in children])
+        return self.add_node((pattern[0], tuple(children)), type_) if type_ is not None else None
+
+    def get_node_cost(self, node, costs):
+        '''
+        "get_node_cost" returns the weighted cost of an e-node as estimated by glsl_cost.py,
+        along with its size, given the costs of the e-classes of its operands
+        '''
+        (kind, name), children = node
+        cost, size = 0, 1
+        if kind == 'binary':
+            components = max([glsl_cost.get_component_count(self.types[self.find(child)]) for child in children])
+            cost = glsl_cost.get_weighted_cost(glsl_cost.get_operation_counts(name, components))
+        elif kind == 'call' and name in glsl_cost.builtin_costs:
+            components = glsl_cost.get_component_count(self.types[self.find(children[0])])
+            cost = glsl_cost.get_weighted_cost(
+                glsl_cost.get_operation_counts(name, components) +
+                glsl_cost.get_operation_counts(name, 1, fixed=True))
+        for child in children:
+            child_cost, child_size = costs[self.find(child)]
+            cost, size = cost + child_cost, size + child_size
+        return cost, size
+
+    def extract(self, id_):
+        '''
+        "extract" returns the cheapest element within an e-class,
+        as estimated by glsl_cost.py, where ties go to the smallest element
+        '''
+        costs = {}
+        best = {}
+        changed = True
+        while changed:
+            changed = False
+            for class_id, nodes in self.nodes.items():
+                for node in nodes:
+                    if not all([self.find(child) in costs for child in node[1]]):
+                        continue
+                    cost = self.get_node_cost(node, costs)
+                    if class_id not in costs or cost < costs[class_id]:
+                        costs[class_id] = cost
+                        best[class_id] = node
+                        changed = True
+
+        def get_element(id_):
+            (kind, name), children = best[self.find(id_)]
+            operands = [get_element(child) for child in children]
+            if kind == 'leaf':
+                return copy.deepcopy(self.leaves[name])
+            elif kind == 'negate':
+                result = glsl.PreIncrementExpression(None, '-')
+                result.operand1 = glsl_rewrite.get_wrapped(operands[0], result, 'operand1')
+                return result
+            elif kind == 'binary':
+                return glsl_rewrite.get_binary_expression(egraph_operators[name], operands[0], name, operands[1])
+            return glsl.InvocationExpression(name, operands)
+        return get_element(id_)
+
+class EGraphRule:
+    """
+    An "EGraphRule" states that expressions matching a pattern
+    are equal to a replacement, where both are written as glsl text
+    in which placeholders such as `$a` stand for subexpressions, as in glsl_rewrite.py
+    """
+
+    def __init__(self, pattern, replacement):
+        self.text = f'{pattern} = {replacement}'
+        self.pattern = EGraphRule.get_pattern(glsl.Template(pattern, glsl.ternary_expression_or_less).tree)
+        self.replacement = EGraphRule.get_pattern(glsl.Template(replacement, glsl.ternary_expression_or_less).tree)
+
+    @staticmethod
+    def get_pattern(element):
+        '''
+        "get_pattern" returns a pattern for a parse tree,
+        as a tuple containing the operator of an e-node and a tuple of patterns for its operands,
+        where placeholders are represented by a `placeholder` operator,
+        and literals by a `leaf` operator, along with the literal itself
+        '''
+        element = get_unwrapped(glsl_rewrite.get_evaluation_grouped(element))
+        name = glsl_rewrite.RewriteRule.get_placeholder(element)
+        if name is not None:
+            return (('placeholder', name), ())
+        operator = get_operator(element)
+        if operator is None:
+            return (('leaf', glsl_rewrite.get_equivalence_key(element)), (), element)
+        return (operator, tuple([EGraphRule.get_pattern(operand) for operand in get_operands(element)]))
+
+'''
+"egraph_rules" lists the rules that are applied by get_saturated()
+'''
+egraph_rules = [
+    # commutativity and associativity
+    EGraphRule('$a + $b', '$b + $a'),
+    EGraphRule('$a * $b', '$b * $a'),
+    EGraphRule('$a + $b + $c', '$a + ($b + $c)'),
+    EGraphRule('$a + ($b + $c)', '$a + $b + $c'),
+    EGraphRule('$a * $b * $c', '$a * ($b * $c)'),
+    EGraphRule('$a * ($b * $c)', '$a * $b * $c'),
+    # subtraction and negation
+    EGraphRule('$a - $b', '$a + -$b'),
+    EGraphRule('$a + -$b', '$a - $b'),
+    EGraphRule('-(-$a)', '$a'),
+    EGraphRule('-$a * $b', '-($a * $b)'),
+    EGraphRule('-($a * $b)', '-$a * $b'),
+    # distributivity
+    EGraphRule('$a * ($b + $c)', '$a * $b + $a * $c'),
+    EGraphRule('$a * $b + $a * $c', '$a * ($b + $c)'),
+    EGraphRule('$a * ($b - $c)', '$a * $b - $a * $c'),
+    EGraphRule('$a * $b - $a * $c', '$a * ($b - $c)'),
+    EGraphRule('$a / $c + $b / $c', '($a + $b) / $c'),
+    EGraphRule('$a / $c - $b / $c', '($a - $b) / $c'),
+    # division
+    EGraphRule('$a * ($b / $c)', '$a * $b / $c'),
+    EGraphRule('$a * $b / $c', '$a * ($b / $c)'),
+    EGraphRule('$a / $b / $c', '$a / ($b * $c)'),
+    EGraphRule('$a / $b * $c', '$a * $c / $b'),
+    # identities
+    EGraphRule('$a * 1.0f', '$a'),
+    EGraphRule('$a / 1.0f', '$a'),
+    EGraphRule('$a + 0.0f', '$a'),
+    EGraphRule('$a + $a', '2.0f * $a'),
+    # strength reductions
+    EGraphRule('pow($a, 2.0f)', '$a * $a'),
+    EGraphRule('1.0f / sqrt($a)', 'inversesqrt($a)'),
+    EGraphRule('$b / sqrt($a)', '$b * inversesqrt($a)'),
+    EGraphRule('exp(log($a))', '$a'),
+    EGraphRule('exp($a) * exp($b)', 'exp($a + $b)'),
+]
+
+def get_saturated(egraph, rules, deadline, node_limit=default_node_limit, iteration_limit=default_iteration_limit):
+    '''
+    "get_saturated" applies rules to every e-class of an e-graph,
+    until none find anything new, or until the e-graph holds more than `node_limit` e-nodes,
+    `iteration_limit` rounds of rules have been applied, or time.monotonic() passes `deadline`.
+    It returns whether the e-graph was saturated before any limit was reached.
+    '''
+    for iteration in range(iteration_limit):
+        matches = []
+        for rule in rules:
+            for id_ in list(egraph.nodes):
+                matches.extend([(rule, id_, bindings) for bindings in egraph.match(rule.pattern, id_, {})])
+                if time.monotonic() > deadline:
+                    return False
+        changed = False
+        for rule, id_, bindings in matches:
+            result = egraph.instantiate(rule.replacement, bindings)
+            if result is not None:
+                changed = egraph.union(id_, result) or changed
+            if egraph.get_node_count() > node_limit:
+                egraph.rebuild()
+                return False
+        egraph.rebuild()
+        if not changed:
+            return True
+    return False
+
+def get_optimized(element, scope, max_size=default_max_size, node_limit=default_node_limit,
+        iteration_limit=default_iteration_limit, time_limit=default_time_limit):
+    '''
+    "get_optimized" is a pure function that returns a copy of an element
+    grouped by glsl_rewrite.get_evaluation_grouped(), where every expression
+    that glsl_egraph.py can rearrange, and whose size as found by glsl_cse.get_size()
+    is at most `max_size`, is replaced with the cheapest equivalent expression that is found
+    by get_saturated(), if it is cheaper than the original.
+    Expressions are left as they are once `time_limit` seconds have passed.
+    '''
+    quiet_scope = scope.get_quiet_scope()
+    deadline = time.monotonic() + time_limit
+
+    def visit(element):
+        if time.monotonic() > deadline:
+            return element
+        if (get_operator(element) is not None and
+            quiet_scope.deduce_type(element) in egraph_types and
+            glsl_cse.get_size(element) <= max_size and
+            glsl_cse.is_pure(element, quiet_scope)):
+            egraph = EGraph(quiet_scope)
+            id_ = egraph.add(element)
+            get_saturated(egraph, egraph_rules, deadline, node_limit, iteration_limit)
+            result = egraph.extract(id_)
+            if glsl_cost.get_cost(result, quiet_scope) < glsl_cost.get_cost(element, quiet_scope):
+                return result
+            return element
+        return glsl_rewrite.get_mapped(element, visit)
+
+    return visit(element)
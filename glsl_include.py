@@ -0,0 +1,241 @@
+#!/bin/env python3
+
+"""
+"glsl_include.py" resolves `#include` directives within glsl code,
+so that scripts can make use of type information declared within included headers.
+pypeg2glsl ignores preprocessor directives while parsing,
+so includes are found by scanning the text of each file.
+
+Each header is parsed at most once per run,
+and the LexicalScope built from its declarations is shared by reference
+across every translation unit that includes it.
+If a cache file is provided, the declarations of each header are also stored
+alongside a hash of its content, so that unchanged headers are not parsed again
+on subsequent runs.
+
+Headers are visited at most once per translation unit,
+which mirrors the behavior of include guards and `#pragma once`.
+Headers that share the same include guard macro are treated as the same header.
+A cycle of includes is an error unless the headers involved are guarded.
+
+The command line interface for this script prints the headers
+that a file includes, in the order they are visited:
+  python3 ./glsl_include.py -f shaders/foo.glsl.c -I shaders/include
+"""
+
+
+import collections
+import json
+import os
+import re
+import sys
+import warnings
+
+import pypeg2 as peg
+import pypeg2glsl as glsl
+import glsl_index
+
+include_regex = re.compile(r'^\s*\#\s*include\s*["<]([^">]+)[">]', re.MULTILINE)
+include_guard_regex = re.compile(
+    r'''
+    \A (\s | //[^\n]*\n | /\*((?!\*/).)*\*/ )*
+    \#\s*ifndef \s+ (\w+) \s*
+    \s*\#\s*define \s+ \3 \b
+    ''',
+    re.DOTALL | re.VERBOSE
+)
+pragma_once_regex = re.compile(r'^\s*\#\s*pragma\s+once\b', re.MULTILINE)
+
+'''
+"cache_version" is stored with the cache,
+caches written with a different version are ignored
+'''
+cache_version = 1
+
+def get_include_names(text):
+    '''
+    "get_include_names" returns the names of headers included within glsl text,
+    in the order they are included
+    '''
+    return include_regex.findall(text)
+
+def get_include_guard(text):
+    '''
+    "get_include_guard" returns the name of the include guard macro
+    within glsl text, or None if the text is not guarded.
+    `#pragma once` is treated as a guard that is unique to the file.
+    '''
+    match = include_guard_regex.match(text)
+    if match:
+        return match.group(3)
+    elif pragma_once_regex.search(text):
+        return ''
+    else:
+        return None
+
+class Header:
+    """
+    A "Header" stores what is known about an included file:
+    its path, the hash of its content, the names of headers it includes,
+    its include guard, and a LexicalScope containing its declarations.
+    `code` is the parse tree of the header,
+    or None if its declarations were read from a cache.
+    """
+    def __init__(self, path, content_hash, includes, guard, scope, code=None):
+        self.path = path
+        self.hash = content_hash
+        self.includes = includes
+        self.guard = guard
+        self.scope = scope
+        self.code = code
+
+class IncludeResolver:
+    """
+    An "IncludeResolver" finds the headers included by glsl code
+    and builds a LexicalScope from their declarations.
+    Headers are searched for relative to the including file,
+    then within each of `search_paths`, in order.
+    Parsed headers are kept for the lifetime of the resolver,
+    and optionally persisted to `cache_filename`.
+    """
+
+    def __init__(self, search_paths=None, cache_filename=None):
+        self.search_paths = search_paths or []
+        self.cache_filename = cache_filename
+        self.headers = {}
+        self.cache = {}
+        if cache_filename and os.path.exists(cache_filename):
+            with open(cache_filename, 'r') as file:
+                stored = json.load(file)
+            if stored.get('version') == cache_version:
+                self.cache = stored['headers']
+
+    def resolve(self, name, including_directory):
+        '''
+        "resolve" returns the path to the header with the given name,
+        or None if it cannot be found
+        '''
+        for directory in [including_directory, *self.search_paths]:
+            path = os.path.normpath(os.path.join(directory, name))
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def get_header(self, path):
+        '''
+        "get_header" returns the Header for a path,
+        parsing it only if it has not been seen before during this run,
+        and its content does not match what is stored in the cache
+        '''
+        if path in self.headers:
+            return self.headers[path]
+        with open(path, 'r') as file:
+            text = file.read()
+        content_hash = glsl_index.get_content_hash(text)
+        record = self.cache.get(path)
+        scope = glsl.LexicalScope()
+        code = None
+        if record is not None and record['hash'] == content_hash:
+            scope.variables, scope.functions, scope.attributes = glsl_index.get_declaration_types(record)
+        else:
+            code = peg.parse(text, glsl.code)
+            scope = glsl.LexicalScope(code)
+            self.cache[path] = {
+                'hash': content_hash,
+                **glsl_index.get_file_declarations(code),
+            }
+        header = Header(
+            path, content_hash,
+            get_include_names(text), get_include_guard(text),
+            scope, code
+        )
+        self.headers[path] = header
+        return header
+
+    def get_headers(self, text, filename=None):
+        '''
+        "get_headers" returns a list of Headers that are included by glsl text,
+        directly or indirectly, in the order they are visited.
+        It raises a ValueError if an unguarded cycle of includes is found.
+        '''
+        result = []
+        visited = set()
+        guards = set()
+        def visit(names, directory, stack):
+            for name in names:
+                path = self.resolve(name, directory)
+                if path is None:
+                    warnings.warn(f'could not find header "{name}" included by "{stack[-1]}"')
+                    continue
+                if path in stack:
+                    header = self.get_header(path)
+                    if header.guard is None:
+                        chain = ' -> '.join([*stack, path])
+                        raise ValueError(f'include cycle, code cannot compile, cannot continue safely: \n\t{chain}')
+                    continue
+                if path in visited:
+                    continue
+                header = self.get_header(path)
+                if header.guard and header.guard in guards:
+                    continue
+                visited.add(path)
+                guards.add(header.guard)
+                visit(header.includes, os.path.dirname(path), [*stack, path])
+                result.append(header)
+        origin = os.path.normpath(filename) if filename else '<stdin>'
+        directory = os.path.dirname(filename) if filename else os.getcwd()
+        visit(get_include_names(text), directory, [origin])
+        return result
+
+    def get_scope(self, text, filename=None, base_scope=None, diagnostics=None):
+        '''
+        "get_scope" returns a LexicalScope containing declarations
+        from all headers included by glsl text, for use as the `base_scope`
+        of the LexicalScope for that text.
+        The lookups of each header are chained rather than copied,
+        so headers are shared by reference between translation units.
+        If nothing is included, `base_scope` is returned as is.
+        '''
+        headers = self.get_headers(text, filename)
+        if len(headers) < 1:
+            return base_scope
+        scopes = [header.scope for header in reversed(headers)]
+        if base_scope is not None:
+            scopes.append(base_scope)
+        scope = glsl.LexicalScope(diagnostics=diagnostics)
+        scope.variables  = collections.ChainMap(*[header_scope.variables  for header_scope in scopes])
+        scope.functions  = collections.ChainMap(*[header_scope.functions  for header_scope in scopes])
+        scope.attributes = collections.ChainMap(*[header_scope.attributes for header_scope in scopes])
+        return scope
+
+    def save(self):
+        if self.cache_filename:
+            with open(self.cache_filename, 'w') as file:
+                json.dump({'version': cache_version, 'headers': self.cache}, file, indent=1, sort_keys=True)
+
+if __name__ == '__main__':
+    import argparse
+
+    assert sys.version_info[0] >= 3, "Script must be run with Python 3 or higher"
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--filename', dest='filename',
+        help='read input from FILE', metavar='FILE')
+    parser.add_argument('-I', '--include-path', dest='include_paths', action='append',
+        help='search DIRECTORY for included headers, may be repeated', metavar='DIRECTORY')
+    parser.add_argument('--include-cache', dest='include_cache',
+        help='store parsed header declarations in FILE between runs', metavar='FILE')
+    args = parser.parse_args()
+
+    input_text = ''
+    if args.filename:
+        with open(args.filename, 'r') as input_file:
+            input_text = input_file.read()
+    else:
+        for line in sys.stdin:
+            input_text += line
+
+    resolver = IncludeResolver(args.include_paths, args.include_cache)
+    for header in resolver.get_headers(input_text, args.filename):
+        print(header.path)
+    resolver.save()
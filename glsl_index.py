@@ -0,0 +1,261 @@
+#!/bin/env python3
+
+"""
+"glsl_index.py" builds a project wide index of declarations
+found within a directory tree of glsl files.
+The index stores the return types of functions,
+the attribute types of data structures,
+and the types of global variables for every file.
+It is stored on disk and updated incrementally:
+a file is only parsed again if both its modification time and its content have changed.
+
+Other scripts can seed their pypeg2glsl.LexicalScope from the index
+using the `--index` argument, so that type information is available
+for declarations that live in other files.
+
+For basic usage on a directory, call like so:
+  python3 ./glsl_index.py -d shaders/ -o shaders/.glsl_index.json
+
+The index can then be used by other scripts like so:
+  python3 ./glsl_js.py -f shaders/foo.glsl.c --index shaders/.glsl_index.json
+"""
+
+
+import hashlib
+import json
+import os
+import sys
+import warnings
+
+import pypeg2 as peg
+import pypeg2glsl as glsl
+
+'''
+"index_version" is stored with the index,
+indexes written with a different version are rebuilt from scratch
+'''
+index_version = 1
+
+default_extensions = [
+    '.glsl', '.glsl.c', '.vert', '.frag', '.geom', '.comp', '.tesc', '.tese',
+]
+
+def get_type_str(type_):
+    '''
+    "get_type_str" returns a text representation of a type
+    as returned by pypeg2glsl.LexicalScope, for storage within the index
+    '''
+    return type_ if isinstance(type_, str) else peg.compose(type_, type(type_))
+
+def get_type(type_str):
+    '''
+    "get_type" returns a type from its text representation within the index,
+    in the form that would be returned by pypeg2glsl.LexicalScope
+    '''
+    return (peg.parse(type_str, glsl.AttributeExpression)
+            if '[' in type_str or '.' in type_str
+            else type_str)
+
+def get_content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def get_file_declarations(code):
+    '''
+    "get_file_declarations" returns a json serializable dictionary
+    describing the declarations within a parse tree of glsl
+    '''
+    return {
+        'functions': {
+            name: get_type_str(type_)
+            for name, type_ in glsl.LexicalScope.get_function_type_lookups(code).items()
+        },
+        'attributes': {
+            structure: {
+                name: get_type_str(type_)
+                for name, type_ in attribute_types.items()
+            }
+            for structure, attribute_types in glsl.LexicalScope.get_attribute_type_lookups(code).items()
+        },
+        'variables': {
+            name: get_type_str(type_)
+            for name, type_ in glsl.LexicalScope.get_global_variable_type_lookups(code).items()
+        },
+    }
+
+def get_scope_declarations(scope):
+    '''
+    "get_scope_declarations" returns a json serializable dictionary 
+    describing the declarations within a pypeg2glsl.LexicalScope, 
+    in the same form as get_file_declarations()
+    '''
+    return {
+        'functions': {
+            name: get_type_str(type_)
+            for name, type_ in scope.functions.items()
+        },
+        'attributes': {
+            structure: {
+                name: get_type_str(type_)
+                for name, type_ in attribute_types.items()
+            }
+            for structure, attribute_types in scope.attributes.items()
+        },
+        'variables': {
+            name: get_type_str(type_)
+            for name, type_ in scope.variables.items()
+        },
+    }
+
+def get_declaration_types(declarations):
+    '''
+    "get_declaration_types" is the inverse of get_file_declarations(),
+    it returns dictionaries mapping variables, functions, and data structure attributes 
+    to types in the form that would be returned by pypeg2glsl.LexicalScope
+    '''
+    variables = {
+        name: get_type(type_str)
+        for name, type_str in declarations['variables'].items()
+    }
+    functions = {
+        name: get_type(type_str)
+        for name, type_str in declarations['functions'].items()
+    }
+    attributes = {
+        structure: {
+            name: get_type(type_str)
+            for name, type_str in attribute_types.items()
+        }
+        for structure, attribute_types in declarations['attributes'].items()
+    }
+    return variables, functions, attributes
+
+def get_filenames(root, extensions=default_extensions):
+    '''
+    "get_filenames" returns a sorted list of all files beneath `root`
+    whose names end with any of the given extensions
+    '''
+    result = []
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            if any([filename.endswith(extension) for extension in extensions]):
+                result.append(os.path.join(directory, filename))
+    return result
+
+class ProjectIndex:
+    """
+    A "ProjectIndex" stores the declarations found within each file
+    of a directory tree, along with the modification time and content hash
+    that were observed when the file was last parsed.
+    Declarations from all files are merged into single dictionaries,
+    so that lookups can be made in constant time regardless of file count.
+    Where names collide, files that sort later take precedence.
+    """
+
+    def __init__(self, files=None):
+        self.files = files or {}
+        self.variables  = {}
+        self.functions  = {}
+        self.attributes = {}
+        self.merge()
+
+    def merge(self):
+        self.variables  = {}
+        self.functions  = {}
+        self.attributes = {}
+        for filename in sorted(self.files):
+            variables, functions, attributes = get_declaration_types(self.files[filename])
+            self.variables.update(variables)
+            self.functions.update(functions)
+            self.attributes.update(attributes)
+
+    def update(self, root, extensions=default_extensions):
+        '''
+        "update" brings the index up to date with files beneath `root`,
+        parsing only those files whose content has changed,
+        and returns a list of the filenames that were parsed
+        '''
+        updated = []
+        filenames = get_filenames(root, extensions)
+        for filename in filenames:
+            mtime = os.path.getmtime(filename)
+            record = self.files.get(filename)
+            if record is not None and record['mtime'] == mtime:
+                continue
+            with open(filename, 'r') as file:
+                text = file.read()
+            content_hash = get_content_hash(text)
+            if record is not None and record['hash'] == content_hash:
+                record['mtime'] = mtime
+                continue
+            try:
+                code = peg.parse(text, glsl.code)
+            except (SyntaxError, ValueError) as error:
+                warnings.warn(f'could not index "{filename}": {error}')
+                continue
+            self.files[filename] = {
+                'mtime': mtime,
+                'hash': content_hash,
+                **get_file_declarations(code),
+            }
+            updated.append(filename)
+        for filename in list(self.files):
+            if filename not in filenames and filename.startswith(os.path.join(root, '')):
+                del self.files[filename]
+        self.merge()
+        return updated
+
+    def get_scope(self, diagnostics=None):
+        '''
+        "get_scope" returns a pypeg2glsl.LexicalScope
+        containing all declarations within the index,
+        for use as the `base_scope` of another LexicalScope
+        '''
+        scope = glsl.LexicalScope(diagnostics=diagnostics)
+        scope.variables  = self.variables
+        scope.functions  = self.functions
+        scope.attributes = self.attributes
+        return scope
+
+    def save(self, filename):
+        with open(filename, 'w') as file:
+            json.dump({'version': index_version, 'files': self.files}, file, indent=1, sort_keys=True)
+
+    @staticmethod
+    def load(filename):
+        '''
+        "load" returns the ProjectIndex stored at `filename`,
+        or an empty ProjectIndex if none exists or it was written by another version
+        '''
+        if not os.path.exists(filename):
+            return ProjectIndex()
+        with open(filename, 'r') as file:
+            stored = json.load(file)
+        if stored.get('version') != index_version:
+            return ProjectIndex()
+        return ProjectIndex(stored['files'])
+
+if __name__ == '__main__':
+    import argparse
+
+    assert sys.version_info[0] >= 3, "Script must be run with Python 3 or higher"
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--directory', dest='directory', default='.',
+        help='index glsl files beneath DIRECTORY', metavar='DIRECTORY')
+    parser.add_argument('-o', '--output', dest='output', default='.glsl_index.json',
+        help='read and write the index at FILE', metavar='FILE')
+    parser.add_argument('-e', '--extension', dest='extensions', action='append',
+        help='index files ending with EXTENSION, may be repeated', metavar='EXTENSION')
+    parser.add_argument('-v', '--verbose', dest='verbose',
+        help='show debug information', action='store_true')
+    args = parser.parse_args()
+
+    index = ProjectIndex.load(args.output)
+    updated = index.update(args.directory, args.extensions or default_extensions)
+    index.save(args.output)
+    if args.verbose:
+        for filename in updated:
+            print(f'indexed {filename}')
+        print(f'{len(index.files)} files, {len(index.functions)} functions, '
+              f'{len(index.attributes)} data structures, {len(index.variables)} global variables')
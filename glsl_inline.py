@@ -0,0 +1,591 @@
+#!/bin/env python3
+
+"""
+"glsl_inline.py" replaces calls to small functions with the code of the function,
+such as `sq(a.x)` with `a.x * a.x` where `float sq(float x) { return x * x; }`.
+Some drivers do not inline functions on their own,
+and glsl_simplify.py and glsl_cse.py cannot see across calls to functions,
+so inlining allows more expressions to be folded and shared.
+It is also used by glsl_derivative.py if the `--inline` flag is set,
+which cannot otherwise differentiate calls to user defined functions with many parameters.
+
+A function is only inlined if:
+* it is declared exactly once within the same code, so that its content is known,
+* it does not call itself, whether directly or through other functions,
+* it contains at most `size_limit` elements in its parse tree, see glsl_cse.get_size(),
+  once calls within it have been inlined,
+* none of its parameters are `out` or `inout`,
+* and it returns a value from a single `return` statement at its end.
+A function whose content is a single `return` statement is inlined as an expression,
+where its parameters are replaced by the arguments to the call,
+so long as it does not assign to anything or call functions that may assign to their arguments.
+Otherwise, the statements before its `return` are inserted before the statement that calls it,
+so long as they only assign to variables that are declared within the function,
+call only built in functions, and the call is always evaluated by the statement,
+i.e. it is not found within `?:`, `&&`, or `||`.
+Parameters are passed by value: a parameter is declared as a new variable
+if it is assigned within the function or if its argument is not trivial to evaluate,
+unless the function is inlined as an expression that references the parameter at most once,
+and a call is not inlined where such a variable cannot be declared before it.
+Variables that are declared within the function are renamed, such as `t` to `sq_t`,
+so that they do not conflict with variables of the function that calls it,
+and a function is not inlined where it would reference a global variable
+that is hidden by a variable of the same name within the function that calls it.
+Arguments and return values whose types do not match those that are declared are converted explicitly,
+such as `float(2)` where an `int` is passed as a `float` parameter.
+Functions that are inlined are kept, since they may still be called elsewhere.
+
+The command line interface for this script is meant to resemble sed.
+You can select a file using the `-f` argument.
+By default, the script will print out the results of a "dry run".
+You can modify the file in-place using the `-i` flag.
+You can print a diff between input and output using the `-v` flag.
+
+For basic usage on a single file, call like so:
+  python3 ./glsl_inline.py -f file.glsl.c
+
+If you want to replace all files in a directory, call like so:
+ find . -name *.glsl.c \
+     -exec echo {} \; -exec python3 ./glsl_inline.py -if {} \;
+"""
+
+
+import collections
+import copy
+import difflib
+import itertools
+import sys
+
+import pypeg2 as peg
+import pypeg2glsl as glsl
+import glsl_cse
+import glsl_dce
+import glsl_index
+import glsl_include
+import glsl_rewrite
+import glsl_simplify
+
+# attempt to import colorama, for colored diff output
+try:
+    from colorama import Fore, Back, Style, init
+    init()
+except ImportError:  # fallback so that the imported classes always exist
+    class ColorFallback():
+        __getattr__ = lambda self, name: ''
+    Fore = Back = Style = ColorFallback()
+
+def assert_type(variable, types):
+    if len(types) == 1 and not isinstance(variable, types[0]):
+        raise AssertionError(f'expected {types[0]} but got {type(variable)} (value: {variable})')
+    if not any([isinstance(variable, type_) for type_ in types]):
+        raise AssertionError(f'expected any of {types} but got {type(variable)} (value: {variable})')
+
+'''
+"default_size_limit" is the largest number of elements within a function that is inlined by default
+'''
+default_size_limit = 64
+
+class Inlining:
+    """
+    An "Inlining" stores what is known about code while functions are inlined within it:
+    `scope` is the LexicalScope of the code,
+    `declarations` maps the names of functions that can be inlined to their declarations,
+    see get_function_declarations(),
+    `size_limit` is the largest number of elements within a function that is inlined,
+    and `callees` maps the names of functions to the Callee that is used to inline them,
+    or to None if they cannot be inlined or are still being inlined themselves.
+    """
+    def __init__(self, scope, declarations, size_limit=default_size_limit):
+        self.scope = scope
+        self.declarations = declarations
+        self.size_limit = size_limit
+        self.callees = {}
+
+class Callee:
+    """
+    A "Callee" stores what is known about a function that can be inlined:
+    `declaration` is the declaration of the function once calls within it are inlined,
+    `statements` are the statements before its `return` statement,
+    `value` is the value that it returns, converted to its return type,
+    `declared` are the names of variables declared within it, including its parameters,
+    `assigned` are the names of variables that are assigned within it,
+    `free` are the names of global variables that it references,
+    `types` maps the names of variables within it to their types,
+    and `is_expression` is whether it can be inlined as an expression.
+    """
+    def __init__(self, declaration, statements, value, declared, assigned, free, types, is_expression):
+        self.declaration = declaration
+        self.statements = statements
+        self.value = value
+        self.declared = declared
+        self.assigned = assigned
+        self.free = free
+        self.types = types
+        self.is_expression = is_expression
+
+def get_function_declarations(code):
+    '''
+    "get_function_declarations" returns a dictionary that maps the names of functions
+    that are declared exactly once within `code` to their declarations.
+    Overloaded functions are left out, since the declaration that is called
+    would otherwise have to be found from the types of the arguments.
+    '''
+    declarations = [element for element in code if isinstance(element, glsl.FunctionDeclaration)]
+    counts = collections.Counter([declaration.name for declaration in declarations])
+    return {declaration.name: declaration for declaration in declarations if counts[declaration.name] == 1}
+
+def get_return_statements(element):
+    '''
+    "get_return_statements" returns a list of the return statements within a code block
+    '''
+    if isinstance(element, list):
+        return [statement for subelement in element for statement in get_return_statements(subelement)]
+    elif isinstance(element, glsl.ReturnStatement):
+        return [element]
+    elif type(element) in glsl.code_block_element_types:
+        return [
+            statement
+            for attribute in ['content', 'else_'] if hasattr(element, attribute)
+            for statement in get_return_statements(getattr(element, attribute))
+        ]
+    return []
+
+def has_assignment(element):
+    '''
+    "has_assignment" returns whether a parse tree assigns to anything,
+    including by incrementing or decrementing it
+    '''
+    if isinstance(element, list):
+        return any([has_assignment(subelement) for subelement in element])
+    elif (isinstance(element, (glsl.AssignmentExpression, glsl.PostIncrementExpression)) or
+          isinstance(element, glsl.PreIncrementExpression) and element.operator in ['++', '--']):
+        return True
+    elif isinstance(element, glsl.GlslElement):
+        return has_assignment([
+            getattr(element, attribute)
+            for attribute in glsl.element_attributes
+            if hasattr(element, attribute)
+        ])
+    return False
+
+def is_built_in(reference, scope):
+    '''
+    "is_built_in" returns whether a function is a built in function or a constructor,
+    which cannot change anything besides its return value
+    '''
+    return (reference in glsl.built_in_function_signatures or
+            reference in glsl.built_in_types or
+            reference in scope.attributes)
+
+def is_safe_to_call(reference, inlining):
+    '''
+    "is_safe_to_call" returns whether a function is known not to assign to its arguments,
+    so that a call to it can be moved into the function that calls the function that contains it
+    '''
+    if is_built_in(reference, inlining.scope):
+        return True
+    declaration = inlining.declarations.get(reference)
+    return declaration is not None and all([
+        'out' not in parameter.qualifiers and 'inout' not in parameter.qualifiers
+        for parameter in declaration.parameters
+    ])
+
+def get_wrapped(operand, parent, attribute):
+    '''
+    "get_wrapped" returns an operand wrapped in parentheses
+    wherever it would otherwise be ambiguous as the given attribute of `parent`,
+    see glsl_rewrite.get_wrapped()
+    '''
+    # the grammar nests chains of operators with equal precedence to the right,
+    # so the left operand of a binary expression cannot have the same precedence as it does
+    if (isinstance(parent, glsl.BinaryExpression) and attribute == 'operand1' and
+        glsl.Template.get_precedence(operand) == glsl.Template.get_precedence(parent)):
+        return glsl.ParensExpression(operand)
+    return glsl_rewrite.get_wrapped(operand, parent, attribute)
+
+def get_substituted(element, values, parent=None, attribute=None):
+    '''
+    "get_substituted" returns a copy of a parse tree where variables are replaced
+    according to the dictionary `values`, which may map them to other names or to expressions.
+    Expressions are wrapped in parentheses wherever they would otherwise be ambiguous.
+    '''
+    if isinstance(element, str):
+        return get_wrapped(copy.deepcopy(values[element]), parent, attribute) if element in values else element
+    elif isinstance(element, list):
+        return [get_substituted(subelement, values, parent, attribute) for subelement in element]
+    elif isinstance(element, glsl.InvocationExpression):
+        result = copy.copy(element)
+        result.arguments = get_substituted(element.arguments, values, result, 'arguments')
+        return result
+    elif isinstance(element, glsl.AttributeExpression):
+        result = copy.copy(element)
+        result.reference = get_substituted(element.reference, values, result, 'reference')
+        result.attributes = [
+            get_substituted(subelement, values, result, 'attributes')
+            if isinstance(subelement, glsl.BracketedExpression) else subelement
+            for subelement in element.attributes
+        ]
+        return result
+    elif isinstance(element, glsl.GlslElement):
+        result = copy.copy(element)
+        for subattribute in glsl.element_attributes:
+            if hasattr(element, subattribute):
+                setattr(result, subattribute, get_substituted(getattr(element, subattribute), values, result, subattribute))
+        return result
+    return element
+
+def get_reference_counts(element, names):
+    '''
+    "get_reference_counts" returns a Counter of the number of times that 
+    each variable within `names` is referenced by a parse tree,
+    i.e. the number of times it would be replaced by get_substituted()
+    '''
+    if isinstance(element, str):
+        return collections.Counter([element] if element in names else [])
+    elif isinstance(element, list):
+        return sum([get_reference_counts(subelement, names) for subelement in element], collections.Counter())
+    elif isinstance(element, glsl.InvocationExpression):
+        return get_reference_counts(element.arguments, names)
+    elif isinstance(element, glsl.AttributeExpression):
+        return get_reference_counts([element.reference, *[
+            subelement for subelement in element.attributes 
+            if isinstance(subelement, glsl.BracketedExpression)]], names)
+    elif isinstance(element, glsl.GlslElement):
+        return get_reference_counts([
+            getattr(element, attribute) for attribute in glsl.element_attributes 
+            if hasattr(element, attribute)], names)
+    return collections.Counter()
+
+def get_converted(expression, type_, scope):
+    '''
+    "get_converted" returns an expression that is explicitly converted to `type_`,
+    if its type is known to differ, or the expression itself otherwise
+    '''
+    expression_type = scope.deduce_type(expression)
+    if expression_type is None or expression_type == type_ or type_ not in glsl.built_in_types:
+        return expression
+    return glsl.InvocationExpression(type_, [expression])
+
+def get_callee(name, inlining):
+    '''
+    "get_callee" returns a Callee for the function named `name`,
+    or None if the function cannot be inlined, as described at the top of this file
+    '''
+    if name in inlining.callees:
+        return inlining.callees[name]
+    if name not in inlining.declarations or name not in inlining.scope.functions:
+        return None
+    # the function is marked while it is inlined, so that calls to it within it are left alone
+    inlining.callees[name] = None
+    declaration = get_inlined_function_declaration(inlining.declarations[name], inlining)
+    local_scope = inlining.scope.get_subscope(declaration).get_quiet_scope()
+    content = [statement for statement in declaration.content if not isinstance(statement, str)]
+    if (declaration.type == 'void' or
+        glsl_cse.get_size(declaration.content) > inlining.size_limit or
+        any(['out' in parameter.qualifiers or 'inout' in parameter.qualifiers
+             for parameter in declaration.parameters]) or
+        len(get_return_statements(declaration.content)) != 1 or
+        len(content) < 1 or not isinstance(content[-1], glsl.ReturnStatement) or
+        content[-1].value is None):
+        return None
+    statements = declaration.content[:declaration.content.index(content[-1])]
+    value = get_converted(content[-1].value, declaration.type, local_scope)
+    declared = {
+        *[parameter.name for parameter in declaration.parameters],
+        *glsl_dce.get_declared_variables(declaration.content)
+    }
+    assigned = glsl_cse.get_assigned_variables(declaration.content, local_scope)
+    free = glsl.get_variable_references(declaration.content, local_scope.variables) - declared
+    invoked = glsl_dce.get_invoked_functions(declaration.content)
+    if name in invoked:
+        return None
+    if len(content) == 1:
+        is_expression = (not has_assignment(value) and
+            all([is_safe_to_call(reference, inlining) for reference in invoked]))
+    else:
+        is_expression = False
+        if (not assigned <= declared or
+            not all([is_built_in(reference, inlining.scope) for reference in invoked])):
+            return None
+    if len(content) == 1 and not is_expression:
+        return None
+    inlining.callees[name] = Callee(declaration, statements, value, declared, assigned, free, local_scope.variables, is_expression)
+    return inlining.callees[name]
+
+def get_name(name, names):
+    '''
+    "get_name" returns a variable name based on `name` that is not within `names`,
+    and adds it to `names`
+    '''
+    result = next(
+        candidate for candidate in
+            (name if i < 1 else f'{name}_{i}' for i in itertools.count())
+        if candidate not in names)
+    names.add(result)
+    return result
+
+def get_inlined_invocation(invocation, callee, scope, names, local, hoisted):
+    '''
+    "get_inlined_invocation" returns an expression that replaces a call to a Callee,
+    or None if it cannot be inlined where it is called.
+    `names` is the set of names that are already in use within the function that calls it,
+    `local` is the set of names that are declared within it,
+    to which the names of inlined variables are added,
+    and statements that must run before the expression are appended to `hoisted`,
+    or `hoisted` is None if no statements can be inserted before the expression.
+    '''
+    if (callee is None or
+        len(invocation.arguments) != len(callee.declaration.parameters) or
+        callee.free & local or
+        not glsl_cse.is_pure(invocation.arguments, scope) or
+        not callee.is_expression and hoisted is None):
+        return None
+    parameters = callee.declaration.parameters
+    arguments = [get_converted(argument, parameter.type, scope)
+                 for parameter, argument in zip(parameters, invocation.arguments)]
+    # arguments that are not trivial are only evaluated once, 
+    # so they are substituted into an expression only where its parameter is referenced at most once
+    counts = get_reference_counts(callee.value, {parameter.name for parameter in parameters})
+    is_substituted = [
+        parameter.name not in callee.assigned and 
+        (glsl_cse.is_trivial(argument) or callee.is_expression and counts[parameter.name] <= 1)
+        for parameter, argument in zip(parameters, arguments)]
+    if hoisted is None and not all(is_substituted):
+        return None
+    values = {}
+    renamed = {}
+    declarations = []
+    for parameter, argument, is_substituted_ in zip(parameters, arguments, is_substituted):
+        if is_substituted_:
+            values[parameter.name] = argument
+        else:
+            values[parameter.name] = renamed[parameter.name] = get_name(f'{callee.declaration.name}_{parameter.name}', names)
+            declarations.append(glsl.VariableDeclaration(parameter.type,
+                [glsl.AssignmentExpression(values[parameter.name], '=', argument)]))
+    for variable in sorted(callee.declared - set(values)):
+        values[variable] = renamed[variable] = get_name(f'{callee.declaration.name}_{variable}', names)
+    for variable, name in renamed.items():
+        local.add(name)
+        scope.variables[name] = callee.types[variable]
+    if hoisted is not None:
+        hoisted.extend([*declarations, *get_substituted(copy.deepcopy(callee.statements), values)])
+    return get_substituted(copy.deepcopy(callee.value), values)
+
+def get_inlined_expression(element, inlining, scope, names, local, hoisted, parent=None, attribute=None):
+    '''
+    "get_inlined_expression" returns a copy of an expression where calls to functions are inlined where possible,
+    see get_inlined_invocation() for a description of parameters
+    '''
+    if isinstance(element, list):
+        return [get_inlined_expression(subelement, inlining, scope, names, local, hoisted, parent, attribute)
+                for subelement in element]
+    elif isinstance(element, glsl.InvocationExpression):
+        result = copy.copy(element)
+        result.arguments = get_inlined_expression(element.arguments, inlining, scope, names, local, hoisted, result, 'arguments')
+        inlined = get_inlined_invocation(result, get_callee(element.reference, inlining), scope, names, local, hoisted)
+        return result if inlined is None else get_wrapped(inlined, parent, attribute)
+    elif isinstance(element, glsl.GlslElement):
+        result = copy.copy(element)
+        for subattribute in glsl.element_attributes:
+            if hasattr(element, subattribute):
+                # operands that are only evaluated under some condition cannot be preceded by statements
+                is_conditional = (
+                    isinstance(element, glsl.TernaryExpression) and subattribute in ['operand2', 'operand3'] or
+                    isinstance(element, (glsl.LogicalAndExpression, glsl.LogicalOrExpression)) and subattribute == 'operand2')
+                setattr(result, subattribute, get_inlined_expression(getattr(element, subattribute),
+                    inlining, scope, names, local, None if is_conditional else hoisted, result, subattribute))
+        return result
+    return element
+
+def get_inlined_statement(statement, inlining, scope, names, local):
+    '''
+    "get_inlined_statement" returns a list of statements that are equivalent to `statement`,
+    where calls to functions within it are inlined where possible.
+    see get_inlined_invocation() for a description of parameters
+    '''
+    hoisted = []
+    if isinstance(statement, str):
+        return [statement]
+    elif type(statement) in glsl.code_block_element_types:
+        result = copy.copy(statement)
+        for attribute in ['declaration', 'condition', 'operation']:
+            if hasattr(statement, attribute):
+                # the condition of an if statement is evaluated once, before anything else within it
+                setattr(result, attribute, get_inlined_expression(getattr(statement, attribute),
+                    inlining, scope, names, local, hoisted if isinstance(statement, glsl.IfStatement) else None))
+        for attribute in ['content', 'else_']:
+            content = getattr(statement, attribute, None)
+            if isinstance(content, list):
+                setattr(result, attribute, get_inlined_code_block(content, inlining, scope, names, local))
+            elif isinstance(content, glsl.GlslElement):
+                inlined = get_inlined_statement(content, inlining, scope, names, local)
+                setattr(result, attribute, inlined[0] if len(inlined) == 1 else inlined)
+        return [*hoisted, result]
+    elif isinstance(statement, glsl.VariableDeclaration):
+        # statements cannot be inserted between the names of a declaration,
+        # since their values may refer to names that precede them
+        result = get_inlined_expression(statement, inlining, scope, names, local,
+            hoisted if len(list(statement.get_names())) == 1 else None)
+        return [*hoisted, result]
+    result = get_inlined_expression(statement, inlining, scope, names, local, hoisted)
+    return [*hoisted, result]
+
+def get_inlined_code_block(statements, inlining, scope, names, local):
+    '''
+    "get_inlined_code_block" behaves like get_inlined_statement() for a list of statements
+    '''
+    return [
+        inlined
+        for statement in statements
+        for inlined in get_inlined_statement(statement, inlining, scope, names, local)
+    ]
+
+def get_inlined_function_declaration(in_element, inlining):
+    out_element = copy.copy(in_element)
+    local_scope = inlining.scope.get_subscope(in_element).get_quiet_scope()
+    declared = glsl_dce.get_declared_variables(in_element.content)
+    local = {*[parameter.name for parameter in in_element.parameters], *declared}
+    names = {*local_scope.variables, *local_scope.functions, *declared}
+    out_element.content = get_inlined_code_block(in_element.content, inlining, local_scope, names, local)
+    return out_element
+
+def get_inlined(element, scope, size_limit=default_size_limit, inlining=None):
+    '''
+    "get_inlined" is a pure function that returns a copy of a glsl parse tree
+    where calls to functions that contain at most `size_limit` elements are inlined,
+    as described at the top of this file.
+    Only functions that are declared within `element` can be inlined.
+    '''
+    assert_type(element, [str, list, glsl.GlslElement])
+    if inlining is None:
+        inlining = Inlining(scope,
+            get_function_declarations(element if isinstance(element, list) else [element]), size_limit)
+    if isinstance(element, glsl.FunctionDeclaration):
+        return get_inlined_function_declaration(element, inlining)
+    elif isinstance(element, list):
+        return [get_inlined(subelement, scope, size_limit, inlining) for subelement in element]
+    return element
+
+def convert_glsl(input_glsl, diagnostics=None, base_scope=None, size_limit=default_size_limit):
+    '''
+    "convert_glsl" is a pure function that performs
+    a transformation on a parse tree of glsl as represented by pypeg2glsl,
+    then returns a transformed parse tree as output.
+    Problems found along the way are recorded in `diagnostics`, if provided.
+    Declarations outside input_glsl can be provided using `base_scope`.
+    Functions are inlined if they contain at most `size_limit` elements.
+    '''
+    output_glsl = get_inlined(input_glsl, glsl.LexicalScope(input_glsl, diagnostics, base_scope), size_limit)
+    glsl.warn_of_invalid_grammar_elements(output_glsl)
+    return output_glsl
+
+def convert_text(input_text, diagnostics=None, base_scope=None, size_limit=default_size_limit):
+    '''
+    "convert_text" is a pure function that performs
+    a transformation on a string containing glsl code,
+    then returns transformed output.
+    It may run convert_glsl behind the scenes,
+    and may also perform additional string based transformations,
+    such as appending utility functions
+    or performing simple string substitutions
+    '''
+    input_glsl = peg.parse(input_text, glsl.code)
+    output_glsl = convert_glsl(input_glsl, diagnostics, base_scope, size_limit)
+    output_text = peg.compose(output_glsl, glsl.code, autoblank = False)
+    return output_text
+
+def convert_file(input_filename=False, in_place=False, verbose=False,
+        diagnostics_format='text', diagnostics_limit=None, index_filename=None,
+        include_paths=None, include_cache=None, size_limit=default_size_limit):
+    '''
+    "convert_file" performs a transformation on a file containing glsl code
+    It may either print out transformed contents or replace the file,
+    depending on the value of `in_place`
+    '''
+
+    def colorize_diff(diff):
+        '''
+        "colorize_diff" colorizes text output from the difflib library
+        for display in the command line
+        All credit goes to:
+        https://chezsoi.org/lucas/blog/colored-diff-output-with-python.html
+        '''
+        for line in diff:
+            if line.startswith('+'):
+                yield Fore.GREEN + line + Fore.RESET
+            elif line.startswith('-'):
+                yield Fore.RED + line + Fore.RESET
+            elif line.startswith('^'):
+                yield Fore.BLUE + line + Fore.RESET
+            else:
+                yield line
+
+    input_text = ''
+    if input_filename:
+        with open(input_filename, 'r+') as input_file:
+            input_text = input_file.read()
+    else:
+        for line in sys.stdin:
+            input_text += line
+
+    diagnostics = glsl.Diagnostics(diagnostics_limit)
+    base_scope = glsl_index.ProjectIndex.load(index_filename).get_scope() if index_filename else None
+    include_resolver = glsl_include.IncludeResolver(include_paths, include_cache)
+    base_scope = include_resolver.get_scope(input_text, input_filename, base_scope)
+    include_resolver.save()
+    output_text = convert_text(input_text, diagnostics, base_scope, size_limit)
+    diagnostics.report(diagnostics_format)
+
+    if verbose:
+        diff = difflib.ndiff(
+            input_text.splitlines(keepends=True),
+            output_text.splitlines(keepends=True)
+        )
+        for line in colorize_diff(diff):
+            print(line)
+
+    if in_place:
+        with open(input_filename, 'w') as output_file:
+            output_file.write(output_text)
+            output_file.truncate()
+    else:
+        print(output_text)
+
+if __name__ == '__main__':
+    import argparse
+
+    assert sys.version_info[0] >= 3, "Script must be run with Python 3 or higher"
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--filename', dest='filename',
+        help='read input from FILE', metavar='FILE')
+    parser.add_argument('-i', '--in-place', dest='in_place',
+        help='edit the file in-place', action='store_true')
+    parser.add_argument('-v', '--verbose', dest='verbose',
+        help='show debug information', action='store_true')
+    parser.add_argument('--size-limit', dest='size_limit', type=int, default=default_size_limit,
+        help='only inline functions with at most N elements in their parse tree', metavar='N')
+    parser.add_argument('--diagnostics', dest='diagnostics_format', choices=['text', 'json', 'none'], default='text',
+        help='specify whether to report diagnostics to stderr as text, as json, or not at all',
+    )
+    parser.add_argument('--diagnostics-limit', dest='diagnostics_limit', type=int, default=100,
+        help='maximum number of diagnostics to record', metavar='N',
+    )
+    parser.add_argument('--index', dest='index_filename',
+        help='seed type information from an index built by glsl_index.py', metavar='FILE')
+    parser.add_argument('-I', '--include-path', dest='include_paths', action='append',
+        help='search DIRECTORY for headers named by #include directives', metavar='DIRECTORY')
+    parser.add_argument('--include-cache', dest='include_cache',
+        help='store parsed header declarations in FILE between runs', metavar='FILE')
+    args = parser.parse_args()
+    convert_file(
+        args.filename,
+        in_place=args.in_place,
+        verbose=args.verbose,
+        diagnostics_format=args.diagnostics_format,
+        diagnostics_limit=args.diagnostics_limit,
+        index_filename=args.index_filename,
+        include_paths=args.include_paths,
+        include_cache=args.include_cache,
+        size_limit=args.size_limit,
+    )
@@ -6,6 +6,8 @@ import sys
 import pypeg2 as peg
 import pypeg2glsl as glsl
 import pypeg2js as js
+import glsl_index
+import glsl_include
 
 # attempt to import colorama, for colored diff output
 try:
@@ -240,7 +242,9 @@ def get_js_function_declaration(glsl_function, scope):
 
 
 glsl_js_getter_map = [
-    (str,        lambda glsl_element, scope: glsl_element),
+    # #include directives are resolved by glsl_include.py, other directives are kept as they are
+    (str,        lambda glsl_element, scope: 
+        f'//{glsl_element}' if glsl_include.include_regex.match(glsl_element) else glsl_element),
     (int,        lambda glsl_element, scope: glsl_element),
     (type(None), lambda glsl_element, scope: glsl_element),
 
@@ -301,7 +305,9 @@ If you want to replace all files in a directory, call like so:
      -exec echo {} \; -exec python3 ./glsl2js.py -if {} \;
 """
 
-def convert_file(input_filename=False, in_place=False, verbose=False):
+def convert_file(input_filename=False, in_place=False, verbose=False, 
+        diagnostics_format='text', diagnostics_limit=None, index_filename=None,
+        include_paths=None, include_cache=None):
     def colorize_diff(diff):
         '''
         "colorize_diff" colorizes text output from the difflib library
@@ -327,10 +333,16 @@ def convert_file(input_filename=False, in_place=False, verbose=False):
         for line in sys.stdin:
             input_text += line
 
+    diagnostics = glsl.Diagnostics(diagnostics_limit)
     glsl_code = peg.parse(input_text, glsl.code)
-    js_code = get_js(glsl_code, glsl.LexicalScope(glsl_code))
+    base_scope = glsl_index.ProjectIndex.load(index_filename).get_scope() if index_filename else None
+    include_resolver = glsl_include.IncludeResolver(include_paths, include_cache)
+    base_scope = include_resolver.get_scope(input_text, input_filename, base_scope)
+    include_resolver.save()
+    js_code = get_js(glsl_code, glsl.LexicalScope(glsl_code, diagnostics, base_scope))
     js.warn_of_invalid_grammar_elements(js_code)
     output_text = peg.compose(js_code, js.code, autoblank = False)
+    diagnostics.report(diagnostics_format)
 
     if verbose:
         diff = difflib.ndiff(
@@ -359,9 +371,26 @@ if __name__ == '__main__':
         help='edit the file in-place', action='store_true')
     parser.add_argument('-v', '--verbose', dest='verbose', 
         help='show debug information', action='store_true')
+    parser.add_argument('--diagnostics', dest='diagnostics_format', choices=['text', 'json', 'none'], default='text',
+        help='specify whether to report diagnostics to stderr as text, as json, or not at all', 
+    )
+    parser.add_argument('--diagnostics-limit', dest='diagnostics_limit', type=int, default=100,
+        help='maximum number of diagnostics to record', metavar='N',
+    )
+    parser.add_argument('--index', dest='index_filename', 
+        help='seed type information from an index built by glsl_index.py', metavar='FILE')
+    parser.add_argument('-I', '--include-path', dest='include_paths', action='append',
+        help='search DIRECTORY for headers named by #include directives', metavar='DIRECTORY')
+    parser.add_argument('--include-cache', dest='include_cache',
+        help='store parsed header declarations in FILE between runs', metavar='FILE')
     args = parser.parse_args()
     convert_file(
         args.filename, 
         in_place=args.in_place, 
         verbose=args.verbose, 
+        diagnostics_format=args.diagnostics_format, 
+        diagnostics_limit=args.diagnostics_limit, 
+        index_filename=args.index_filename, 
+        include_paths=args.include_paths, 
+        include_cache=args.include_cache, 
     )
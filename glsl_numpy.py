@@ -0,0 +1,1206 @@
+#!/bin/env python3
+
+"""
+"glsl_numpy.py" evaluates glsl functions on the cpu using numpy,
+so that generated code can be checked numerically without a gpu or a browser.
+
+Each function declaration is translated to the source of a python function
+whose arguments and return values are numpy arrays.
+Every value holds a batch of samples: scalars may be arrays of any shape,
+while vectors and matrices store their components along trailing axes,
+so a `vec3` over N samples has shape (N,3), and a `mat3` has shape (N,3,3),
+indexed by column, then row.
+A single call therefore evaluates a function for every sample at once.
+
+Control flow is vectorized. Both sides of a branch are evaluated for every sample,
+and assignments within a branch are only kept for samples where its condition holds,
+much like divergent threads on a gpu. Loops repeat until no sample remains within them.
+
+Translation to python source does not require numpy, but evaluation does.
+
+By default, the command line interface prints the python source for a file:
+  python3 ./glsl_numpy.py -f file.glsl.c
+
+It can also check derivatives within a file, such as those output by glsl_derivative.py,
+against central differences of the functions they were derived from:
+  python3 ./glsl_derivative.py -f file.glsl.c --input-handling prepend > derived.glsl.c
+  python3 ./glsl_numpy.py -f derived.glsl.c --check-derivatives
+"""
+
+
+import keyword
+import re
+import sys
+
+import pypeg2 as peg
+import pypeg2glsl as glsl
+import glsl_index
+import glsl_include
+
+# attempt to import numpy, which is only needed to evaluate functions
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def assert_type(variable, types):
+    if not any([isinstance(variable, type_) for type_ in types]):
+        raise AssertionError(f'expected {types} but got {variable}')
+
+def throw_not_implemented_error(f, feature='expressions'):
+    f_str = f if isinstance(f, str) else peg.compose(f, type(f))
+    raise NotImplementedError(f'support for evaluating {feature} such as "{f_str}" is not implemented')
+
+def throw_compiler_error(f, description='invalid expression'):
+    f_str = f if isinstance(f, str) else peg.compose(f, type(f))
+    raise ValueError(f'{description}, code cannot compile, cannot continue safely: \n\t{f_str}')
+
+def assert_numpy():
+    if np is None:
+        raise ImportError('numpy is required to evaluate glsl, install it using "pip install numpy"')
+
+class NumpyLibrary:
+    """
+    "NumpyLibrary" contains the functions that are called by translated glsl,
+    where a built in glsl function or operation has no direct equivalent in numpy.
+    Translated code refers to it as `__glsl`, and to numpy as `__numpy`.
+    `rank` is the number of trailing axes that store components:
+    0 for scalars, 1 for vectors, and 2 for matrices.
+    """
+
+    @staticmethod
+    def expand(value, rank):
+        '''
+        "expand" appends `rank` axes of length 1 to a value,
+        so that a batch of scalars can be combined with a batch of vectors or matrices
+        '''
+        return np.reshape(value, np.shape(value) + (1,)*rank)
+
+    @staticmethod
+    def select(condition, value, otherwise, rank=0):
+        '''
+        "select" returns `value` for samples where `condition` holds and `otherwise` elsewhere.
+        `otherwise` may be None where a variable was declared without a value.
+        '''
+        if otherwise is None:
+            return value
+        if np.ndim(condition) == 0:
+            return value if condition else otherwise
+        return np.where(NumpyLibrary.expand(condition, rank), value, otherwise)
+
+    @staticmethod
+    def both(a, b):
+        return np.logical_and(a, b)
+
+    @staticmethod
+    def either(a, b):
+        return np.logical_or(a, b)
+
+    @staticmethod
+    def exclude(mask, *masks):
+        '''
+        "exclude" returns the samples within `mask` that are not within any of `masks`
+        '''
+        for excluded in masks:
+            mask = np.logical_and(mask, np.logical_not(excluded))
+        return mask
+
+    @staticmethod
+    def equal_all(a, b, rank):
+        return np.all(np.equal(a, b), axis=tuple(range(-rank, 0)))
+
+    @staticmethod
+    def divide_int(a, b):
+        return np.trunc(np.true_divide(a, b)).astype('int64')
+
+    @staticmethod
+    def convert(value, dtype):
+        return np.asarray(value).astype(dtype)
+
+    @staticmethod
+    def vector(size, dtype, *arguments):
+        '''
+        "vector" constructs a vector from the components of its arguments, in order.
+        Scalar arguments must already be expanded to a single component.
+        A single component is repeated for every component of the vector.
+        '''
+        arguments = [np.atleast_1d(np.asarray(argument, dtype=dtype)) for argument in arguments]
+        if len(arguments) == 1 and arguments[0].shape[-1] == 1:
+            return np.broadcast_to(arguments[0], arguments[0].shape[:-1] + (size,))
+        batch = np.broadcast_shapes(*[argument.shape[:-1] for argument in arguments])
+        components = np.concatenate(
+            [np.broadcast_to(argument, batch + argument.shape[-1:]) for argument in arguments],
+            axis=-1
+        )
+        return components[..., :size]
+
+    @staticmethod
+    def matrix(columns, rows, dtype, *arguments):
+        '''
+        "matrix" constructs a matrix from the components of its arguments, in column major order
+        '''
+        components = NumpyLibrary.vector(columns*rows, dtype, *arguments)
+        return np.reshape(components, components.shape[:-1] + (columns, rows))
+
+    @staticmethod
+    def diagonal(columns, rows, dtype, value):
+        value = np.asarray(value, dtype=dtype)
+        return NumpyLibrary.expand(value, 2) * np.eye(columns, rows, dtype=dtype)
+
+    @staticmethod
+    def matmul(a, b, rank1, rank2):
+        '''
+        "matmul" performs linear algebraic multiplication,
+        where at least one operand is a matrix and the other is a vector or matrix
+        '''
+        if rank1 == 2 and rank2 == 1:
+            return np.einsum('...cr,...c->...r', a, b)
+        elif rank1 == 1 and rank2 == 2:
+            return np.einsum('...r,...cr->...c', a, b)
+        else:
+            return np.einsum('...kr,...ck->...cr', a, b)
+
+    @staticmethod
+    def index(value, i, rank):
+        '''
+        "index" returns the component or column at `i` within a vector or matrix,
+        where `i` may differ between samples
+        '''
+        value = np.asarray(value)
+        i = np.asarray(i)
+        if i.ndim == 0:
+            return value[(Ellipsis, int(i)) + (slice(None),)*(rank-1)]
+        batch = np.broadcast_shapes(value.shape[:value.ndim-rank], i.shape)
+        value = np.broadcast_to(value, batch + value.shape[value.ndim-rank:])
+        i = np.reshape(np.broadcast_to(i, batch), batch + (1,)*rank)
+        return np.squeeze(np.take_along_axis(value, i, axis=len(batch)), axis=len(batch))
+
+    @staticmethod
+    def assign(target, key, value, condition, rank, value_rank):
+        '''
+        "assign" returns a copy of a vector or matrix whose components at `key`
+        are replaced by `value` for samples where `condition` holds
+        '''
+        target = np.asarray(target)
+        value = np.asarray(value)
+        batch = np.broadcast_shapes(
+            target.shape[:target.ndim-rank],
+            value.shape[:value.ndim-value_rank],
+            np.shape(condition)
+        )
+        result = np.array(np.broadcast_to(target, batch + target.shape[target.ndim-rank:]))
+        result[key] = NumpyLibrary.select(condition, value, result[key], value_rank)
+        return result
+
+    @staticmethod
+    def scalar_index(i):
+        if np.ndim(i) != 0:
+            raise NotImplementedError('support for assigning to components whose indices differ between samples is not implemented')
+        return int(i)
+
+    # built in functions that have no direct equivalent in numpy
+    @staticmethod
+    def atan(y, x=None):
+        return np.arctan(y) if x is None else np.arctan2(y, x)
+
+    @staticmethod
+    def inversesqrt(x):
+        return 1.0 / np.sqrt(x)
+
+    @staticmethod
+    def fract(x):
+        return x - np.floor(x)
+
+    @staticmethod
+    def mod(x, y):
+        return x - y * np.floor(x / y)
+
+    @staticmethod
+    def clamp(x, low, high):
+        return np.minimum(np.maximum(x, low), high)
+
+    @staticmethod
+    def mix(x, y, a):
+        if np.asarray(a).dtype == bool:
+            return np.where(a, y, x)
+        return x * (1.0 - a) + y * a
+
+    @staticmethod
+    def step(edge, x):
+        return np.where(x < edge, 0.0, 1.0)
+
+    @staticmethod
+    def smoothstep(edge0, edge1, x):
+        t = np.clip((x - edge0) / (edge1 - edge0), 0.0, 1.0)
+        return t * t * (3.0 - 2.0 * t)
+
+    @staticmethod
+    def floatBitsToInt(x):
+        return np.asarray(x, dtype='float32').view('int32').astype('int64')
+
+    @staticmethod
+    def floatBitsToUint(x):
+        return np.asarray(x, dtype='float32').view('uint32').astype('int64')
+
+    @staticmethod
+    def intBitsToFloat(x):
+        return np.asarray(x, dtype='int32').view('float32').astype('float64')
+
+    @staticmethod
+    def uintBitsToFloat(x):
+        return np.asarray(x, dtype='uint32').view('float32').astype('float64')
+
+    @staticmethod
+    def cross(a, b):
+        return np.cross(a, b)
+
+    @staticmethod
+    def outerProduct(c, r):
+        return np.expand_dims(r, -1) * np.expand_dims(c, -2)
+
+    @staticmethod
+    def transpose(m):
+        return np.swapaxes(m, -1, -2)
+
+    @staticmethod
+    def determinant(m):
+        return np.linalg.det(m)
+
+    @staticmethod
+    def inverse(m):
+        return np.linalg.inv(m)
+
+    @staticmethod
+    def any(x):
+        return np.any(x, axis=-1)
+
+    @staticmethod
+    def all(x):
+        return np.all(x, axis=-1)
+
+    # built in functions whose behavior depends on whether arguments are scalars or vectors
+    @staticmethod
+    def dot(a, b, rank):
+        return np.sum(a * b, axis=-1) if rank > 0 else a * b
+
+    @staticmethod
+    def length(x, rank):
+        return np.sqrt(NumpyLibrary.dot(x, x, rank))
+
+    @staticmethod
+    def distance(a, b, rank):
+        return NumpyLibrary.length(a - b, rank)
+
+    @staticmethod
+    def normalize(x, rank):
+        return x / NumpyLibrary.expand(NumpyLibrary.length(x, rank), rank)
+
+    @staticmethod
+    def faceforward(n, i, nref, rank):
+        return NumpyLibrary.select(NumpyLibrary.dot(nref, i, rank) < 0.0, n, -n, rank)
+
+    @staticmethod
+    def reflect(i, n, rank):
+        return i - 2.0 * NumpyLibrary.expand(NumpyLibrary.dot(n, i, rank), rank) * n
+
+    @staticmethod
+    def refract(i, n, eta, rank):
+        cosine = NumpyLibrary.dot(n, i, rank)
+        k = 1.0 - eta * eta * (1.0 - cosine * cosine)
+        result = (NumpyLibrary.expand(eta, rank) * i -
+                  NumpyLibrary.expand(eta * cosine + np.sqrt(np.maximum(k, 0.0)), rank) * n)
+        return NumpyLibrary.select(k < 0.0, 0.0 * result, result, rank)
+
+'''
+"numpy_ufuncs" maps built in glsl functions to numpy functions that behave identically
+'''
+numpy_ufuncs = {
+    'radians': 'radians', 'degrees': 'degrees',
+    'sin': 'sin', 'cos': 'cos', 'tan': 'tan',
+    'asin': 'arcsin', 'acos': 'arccos',
+    'sinh': 'sinh', 'cosh': 'cosh', 'tanh': 'tanh',
+    'asinh': 'arcsinh', 'acosh': 'arccosh', 'atanh': 'arctanh',
+    'pow': 'power', 'exp': 'exp', 'log': 'log', 'exp2': 'exp2', 'log2': 'log2', 'sqrt': 'sqrt',
+    'abs': 'absolute', 'sign': 'sign',
+    'floor': 'floor', 'trunc': 'trunc', 'round': 'round', 'roundEven': 'round', 'ceil': 'ceil',
+    'min': 'minimum', 'max': 'maximum',
+    'isnan': 'isnan', 'isinf': 'isinf',
+    'matrixCompMult': 'multiply',
+    'lessThan': 'less', 'lessThanEqual': 'less_equal',
+    'greaterThan': 'greater', 'greaterThanEqual': 'greater_equal',
+    'equal': 'equal', 'notEqual': 'not_equal', 'not': 'logical_not',
+}
+'''
+"numpy_library_functions" lists built in glsl functions that are implemented by NumpyLibrary,
+and whose arguments are broadcast against each other like those of numpy_ufuncs
+'''
+numpy_library_functions = [
+    'atan', 'inversesqrt', 'fract', 'mod', 'clamp', 'mix', 'step', 'smoothstep',
+    'floatBitsToInt', 'floatBitsToUint', 'intBitsToFloat', 'uintBitsToFloat',
+    'cross', 'outerProduct', 'transpose', 'determinant', 'inverse', 'any', 'all',
+]
+'''
+"numpy_rank_library_functions" lists built in glsl functions that are implemented by NumpyLibrary,
+and which must be told whether their arguments are scalars or vectors
+'''
+numpy_rank_library_functions = [
+    'dot', 'length', 'distance', 'normalize', 'faceforward', 'reflect', 'refract',
+]
+
+component_sets = ['xyzw', 'rgba', 'stpq']
+int_types = ['int', 'uint', *glsl.int_vector_types, *glsl.uint_vector_types]
+bool_types = ['bool', *glsl.bool_vector_types, *glsl.bool_matrix_types]
+
+def get_rank(type_, element):
+    '''
+    "get_rank" returns the number of trailing axes that store the components of a type,
+    types that cannot be deduced are assumed to be scalars
+    '''
+    if type_ is None or type_ in glsl.scalar_types or type_ == 'void':
+        return 0
+    elif type_ in glsl.vector_types:
+        return 1
+    elif type_ in glsl.matrix_types:
+        return 2
+    elif isinstance(type_, glsl.AttributeExpression):
+        throw_not_implemented_error(element, 'arrays')
+    else:
+        throw_not_implemented_error(element, 'data structures')
+
+def get_dtype(type_):
+    if type_ in int_types or type_ in glsl.int_matrix_types:
+        return 'int64'
+    elif type_ in bool_types:
+        return 'bool'
+    else:
+        return 'float64'
+
+def get_component_type(type_):
+    '''
+    "get_component_type" returns the type of a single component of a vector type
+    '''
+    return {'i': 'int', 'u': 'uint', 'b': 'bool'}.get(type_[0], 'float')
+
+def get_swizzle_type(type_, size):
+    return get_component_type(type_) if size == 1 else f'{type_[:-4]}vec{size}'
+
+def get_component_indices(swizzle, element):
+    '''
+    "get_component_indices" returns the indices of components named by a swizzle, such as "xy"
+    '''
+    for component_set in component_sets:
+        if all([component in component_set for component in swizzle]):
+            return [component_set.index(component) for component in swizzle]
+    throw_compiler_error(element, f'invalid swizzle "{swizzle}"')
+
+def get_python_name(name):
+    return f'{name}_' if keyword.iskeyword(name) else name
+
+def get_python_literal(literal):
+    '''
+    "get_python_literal" returns the python equivalent of a glsl literal,
+    or None if the text is not a literal
+    '''
+    if glsl.bool_literal.fullmatch(literal):
+        return 'True' if literal == 'true' else 'False'
+    elif glsl.int_literal.fullmatch(literal):
+        digits = literal.rstrip('uU')
+        if len(digits) > 1 and digits[0] == '0' and digits[1] not in 'xX':
+            return str(int(digits, 8))
+        return digits
+    elif glsl.float_literal.fullmatch(literal) and not glsl.token.fullmatch(literal):
+        digits = literal.rstrip('fF')
+        return str(float.fromhex(digits)) if digits[:2].lower() == '0x' else digits
+    return None
+
+def get_parameter_types(declaration):
+    return tuple([
+        parameter.type if isinstance(parameter.type, str) else peg.compose(parameter.type, type(parameter.type))
+        for parameter in declaration.parameters
+    ])
+
+def get_overloads(code):
+    '''
+    "get_overloads" returns a dictionary that maps the name of every function
+    that is declared more than once within glsl code to another dictionary,
+    which maps tuples of parameter types to the name of the python function for that overload
+    '''
+    signatures = {}
+    for element in code:
+        if isinstance(element, glsl.FunctionDeclaration):
+            signatures.setdefault(element.name, {})[get_parameter_types(element)] = None
+    return {
+        name: {
+            parameter_types: f"{get_python_name(name)}__{'_'.join(parameter_types)}"
+            for parameter_types in overloads
+        }
+        for name, overloads in signatures.items()
+        if len(overloads) > 1
+    }
+
+def get_function_key(declaration, overloads):
+    '''
+    "get_function_key" returns the key for a function within the dictionary returned by get_numpy_functions(),
+    which is its name, followed by its parameter types if it is overloaded
+    '''
+    if declaration.name in overloads:
+        return f"{declaration.name}({', '.join(get_parameter_types(declaration))})"
+    return declaration.name
+
+def get_function_python_name(declaration, overloads):
+    if declaration.name in overloads:
+        return overloads[declaration.name][get_parameter_types(declaration)]
+    return get_python_name(declaration.name)
+
+class NumpyTranslation:
+    """
+    A "NumpyTranslation" stores the state needed while translating a function to python:
+    the names of variables declared within each enclosing block,
+    the loops that enclose the current statement,
+    and whether samples may have been masked by a branch, loop, or early return.
+    Variables that shadow those of enclosing blocks are renamed,
+    since python has no block scope, and so are overloaded functions,
+    as returned by get_overloads().
+    """
+    def __init__(self, scope, overloads=None):
+        self.scope = scope
+        self.overloads = overloads or {}
+        self.blocks = [{}]
+        self.loops = []
+        self.depth = 0
+        self.has_returned = False
+        self.count = 0
+
+    def get_id(self):
+        self.count += 1
+        return self.count
+
+    def is_masked(self):
+        return self.depth > 0 or self.has_returned
+
+    def get_name(self, name):
+        for block in reversed(self.blocks):
+            if name in block:
+                return block[name]
+        return get_python_name(name)
+
+    def declare(self, name):
+        python_name = get_python_name(name)
+        if any([name in block for block in self.blocks]):
+            python_name = f'{python_name}_{self.get_id()}'
+        self.blocks[-1][name] = python_name
+        return python_name
+
+    def get_exclusions(self):
+        '''
+        "get_exclusions" returns the masks of samples that must be excluded
+        from the current statement once the branch that contains it has finished
+        '''
+        loop = [f'__break{self.loops[-1]}', f'__continue{self.loops[-1]}'] if self.loops else []
+        return ', '.join(['__returned', *loop])
+
+def get_expanded(text, expression, rank):
+    if rank < 1 or (isinstance(expression, str) and get_python_literal(expression) is not None):
+        return text
+    return f'__glsl.expand({text}, {rank})'
+
+def get_numpy_grouped_expression(expression, translation):
+    '''
+    "get_numpy_grouped_expression" translates a binary expression
+    that has already been grouped by pypeg2glsl.Template.get_left_grouped()
+    '''
+    if not isinstance(expression, glsl.BinaryExpression):
+        return get_numpy_expression(expression, translation)
+    scope = translation.scope
+    operand1 = expression.operand1
+    operand2 = expression.operand2
+    operator = expression.operator
+    a = get_numpy_grouped_expression(operand1, translation)
+    b = get_numpy_grouped_expression(operand2, translation)
+    a = f'({a})' if isinstance(operand1, glsl.BinaryExpression) else a
+    b = f'({b})' if isinstance(operand2, glsl.BinaryExpression) else b
+    type1 = scope.deduce_type(operand1)
+    type2 = scope.deduce_type(operand2)
+    rank1 = get_rank(type1, operand1)
+    rank2 = get_rank(type2, operand2)
+    if isinstance(expression, glsl.LogicalAndExpression):
+        return f'__numpy.logical_and({a}, {b})'
+    elif isinstance(expression, glsl.LogicalOrExpression):
+        return f'__numpy.logical_or({a}, {b})'
+    elif isinstance(expression, glsl.LogicalXorExpression):
+        return f'__numpy.logical_xor({a}, {b})'
+    elif isinstance(expression, glsl.EqualityExpression) and max(rank1, rank2) > 0:
+        equal = f'__glsl.equal_all({a}, {b}, {max(rank1, rank2)})'
+        return equal if operator == '==' else f'__numpy.logical_not({equal})'
+    elif (isinstance(expression, glsl.MultiplicativeExpression) and operator == '*' and
+            min(rank1, rank2) > 0 and max(rank1, rank2) > 1):
+        return f'__glsl.matmul({a}, {b}, {rank1}, {rank2})'
+    a = get_expanded(a, operand1, rank2 - rank1)
+    b = get_expanded(b, operand2, rank1 - rank2)
+    if (isinstance(expression, glsl.MultiplicativeExpression) and operator == '/' and
+            type1 in int_types and type2 in int_types):
+        return f'__glsl.divide_int({a}, {b})'
+    return f'{a} {operator} {b}'
+
+def get_numpy_binary_expression(expression, translation):
+    return get_numpy_grouped_expression(
+        glsl.Template.get_left_grouped(glsl.Template.get_chain(expression)), translation)
+
+def get_numpy_unary_expression(expression, translation):
+    if isinstance(expression.operand1, glsl.BinaryExpression):
+        return get_numpy_binary_expression(expression, translation)
+    operand = get_numpy_expression(expression.operand1, translation)
+    if expression.operator == '-':
+        return f'(-{operand})'
+    elif expression.operator == '+':
+        return operand
+    elif expression.operator == '!':
+        return f'__numpy.logical_not({operand})'
+    else:
+        throw_not_implemented_error(expression, 'increments within expressions')
+
+def get_numpy_ternary_expression(expression, translation):
+    condition = get_numpy_expression(expression.operand1, translation)
+    a = get_numpy_expression(expression.operand2, translation)
+    b = get_numpy_expression(expression.operand3, translation)
+    rank = get_rank(translation.scope.deduce_type(expression.operand2), expression.operand2)
+    return f'__glsl.select({condition}, {a}, {b}, {rank})'
+
+def get_numpy_arguments(arguments, translation, rank=None):
+    '''
+    "get_numpy_arguments" translates the arguments of an invocation,
+    and expands any that are scalars to `rank` if provided,
+    or otherwise to the greatest rank among arguments
+    '''
+    ranks = [get_rank(translation.scope.deduce_type(argument), argument) for argument in arguments]
+    rank = max(ranks or [0]) if rank is None else rank
+    return [
+        get_expanded(get_numpy_expression(argument, translation), argument, rank - argument_rank if argument_rank == 0 else 0)
+        for argument, argument_rank in zip(arguments, ranks)
+    ], ranks
+
+def get_numpy_invocation_expression(expression, translation):
+    scope = translation.scope
+    reference = expression.reference
+    arguments = expression.arguments or []
+    if reference in glsl.scalar_types:
+        argument = get_numpy_expression(arguments[0], translation)
+        return f"__glsl.convert({argument}, '{get_dtype(reference)}')"
+    elif reference in glsl.vector_types:
+        texts, ranks = get_numpy_arguments(arguments, translation, 1)
+        if max(ranks or [0]) > 1:
+            throw_not_implemented_error(expression, 'vectors constructed from matrices')
+        return f"__glsl.vector({reference[-1]}, '{get_dtype(reference)}', {', '.join(texts)})"
+    elif reference in glsl.matrix_types:
+        columns, rows = re.match('\w*mat(\d)x?(\d?)', reference).groups()
+        rows = rows or columns
+        texts, ranks = get_numpy_arguments(arguments, translation, 1)
+        if max(ranks or [0]) > 1:
+            throw_not_implemented_error(expression, 'matrices constructed from matrices')
+        if len(arguments) == 1 and ranks[0] == 0:
+            argument = get_numpy_expression(arguments[0], translation)
+            return f"__glsl.diagonal({columns}, {rows}, '{get_dtype(reference)}', {argument})"
+        return f"__glsl.matrix({columns}, {rows}, '{get_dtype(reference)}', {', '.join(texts)})"
+    elif reference in scope.attributes:
+        throw_not_implemented_error(expression, 'data structures')
+    elif reference in numpy_rank_library_functions:
+        texts, ranks = get_numpy_arguments(arguments, translation, 0)
+        return f"__glsl.{reference}({', '.join(texts)}, rank={max(ranks or [0])})"
+    elif reference in numpy_ufuncs:
+        texts, ranks = get_numpy_arguments(arguments, translation)
+        return f"__numpy.{numpy_ufuncs[reference]}({', '.join(texts)})"
+    elif reference in numpy_library_functions:
+        texts, ranks = get_numpy_arguments(arguments, translation)
+        return f"__glsl.{reference}({', '.join(texts)})"
+    elif reference in glsl.built_in_function_signatures and reference not in scope.functions:
+        throw_not_implemented_error(expression, f'the built in function "{reference}"')
+    texts = [get_numpy_expression(argument, translation) for argument in arguments]
+    if reference in translation.overloads:
+        argument_types = tuple([scope.deduce_type(argument) for argument in arguments])
+        overloads = translation.overloads[reference]
+        candidates = [
+            name for parameter_types, name in overloads.items()
+            if len(parameter_types) == len(argument_types) and
+               all([argument_type == parameter_type or
+                    parameter_type in glsl.implicit_type_conversions.get(argument_type, [])
+                    for argument_type, parameter_type in zip(argument_types, parameter_types)])
+        ]
+        if argument_types in overloads:
+            return f"{overloads[argument_types]}({', '.join(texts)})"
+        elif len(candidates) == 1:
+            return f"{candidates[0]}({', '.join(texts)})"
+        throw_compiler_error(expression, 'no unambiguous overload')
+    return f"{get_python_name(reference)}({', '.join(texts)})"
+
+def get_numpy_attribute_expression(expression, translation):
+    scope = translation.scope
+    text = get_numpy_expression(expression.reference, translation)
+    type_ = scope.deduce_type(expression.reference)
+    for attribute in expression.attributes:
+        rank = get_rank(type_, expression)
+        if isinstance(attribute, str):
+            if rank != 1:
+                throw_not_implemented_error(expression, 'attributes of data structures')
+            indices = get_component_indices(attribute, expression)
+            text = f'{text}[..., {indices[0] if len(indices) == 1 else indices}]'
+            type_ = get_swizzle_type(type_, len(indices))
+        else:
+            if rank < 1:
+                throw_compiler_error(expression, 'index of non vector')
+            index = attribute.content
+            if isinstance(index, str) and glsl.int_literal.fullmatch(index):
+                key = ', '.join([get_python_literal(index), *[':']*(rank-1)])
+                text = f'{text}[..., {key}]'
+            else:
+                text = f'__glsl.index({text}, {get_numpy_expression(index, translation)}, {rank})'
+            type_ = get_component_type(type_) if rank == 1 else re.sub('mat(\d)x?\d?', 'vec\\1', type_)
+    return text
+
+def get_numpy_expression(expression, translation):
+    assert_type(expression, [str, glsl.GlslElement])
+    if isinstance(expression, str):
+        literal = get_python_literal(expression)
+        if literal is not None:
+            return literal
+        elif glsl.token.fullmatch(expression):
+            return translation.get_name(expression)
+        else:
+            throw_not_implemented_error(expression, 'literals')
+    elif isinstance(expression, glsl.ParensExpression):
+        return f'({get_numpy_expression(expression.content, translation)})'
+    elif isinstance(expression, glsl.BinaryExpression):
+        return get_numpy_binary_expression(expression, translation)
+    elif isinstance(expression, glsl.PreIncrementExpression):
+        return get_numpy_unary_expression(expression, translation)
+    elif isinstance(expression, glsl.PostIncrementExpression):
+        throw_not_implemented_error(expression, 'increments within expressions')
+    elif isinstance(expression, glsl.TernaryExpression):
+        return get_numpy_ternary_expression(expression, translation)
+    elif isinstance(expression, glsl.InvocationExpression):
+        return get_numpy_invocation_expression(expression, translation)
+    elif isinstance(expression, glsl.AttributeExpression):
+        return get_numpy_attribute_expression(expression, translation)
+    elif isinstance(expression, glsl.AssignmentExpression):
+        throw_not_implemented_error(expression, 'assignments within expressions')
+    raise ValueError(f'support for {type(expression)} not implemented, cannot safely continue')
+
+def get_numpy_assignment_key(target, translation):
+    '''
+    "get_numpy_assignment_key" returns the python text for the index of components
+    that are assigned by an attribute expression, such as "v.xy" or "m[1][2]"
+    '''
+    type_ = translation.scope.deduce_type(target.reference)
+    rank = get_rank(type_, target)
+    selectors = []
+    for attribute in target.attributes:
+        if isinstance(attribute, str):
+            indices = get_component_indices(attribute, target)
+            selectors.append(str(indices[0] if len(indices) == 1 else indices))
+        else:
+            index = get_numpy_expression(attribute.content, translation)
+            selectors.append(f'__glsl.scalar_index({index})')
+    if len(selectors) > rank:
+        throw_not_implemented_error(target, 'assignments to attributes of data structures')
+    return f"(Ellipsis, {', '.join([*selectors, *['slice(None)']*(rank-len(selectors))])})", rank
+
+def get_numpy_assignment(assignment, translation):
+    '''
+    "get_numpy_assignment" returns lines of python for an assignment,
+    where the assigned value is only kept for samples that are active
+    '''
+    lines = []
+    value = assignment.operand2
+    if isinstance(value, glsl.AssignmentExpression):
+        lines += get_numpy_assignment(value, translation)
+        value = value.operand1
+    target = assignment.operand1
+    if assignment.operator != '=':
+        BinaryExpressionTemp = (glsl.MultiplicativeExpression
+            if assignment.operator[0] in '*/' else glsl.AdditiveExpression)
+        value = BinaryExpressionTemp(target, assignment.operator[0], glsl.ParensExpression(value))
+    value_text = get_numpy_expression(value, translation)
+    value_rank = get_rank(translation.scope.deduce_type(target), target)
+    mask = '__active' if translation.is_masked() else 'True'
+    if isinstance(target, str):
+        name = translation.get_name(target)
+        if translation.is_masked():
+            lines.append(f'{name} = __glsl.select(__active, {value_text}, {name}, {value_rank})')
+        else:
+            lines.append(f'{name} = {value_text}')
+    elif isinstance(target, glsl.AttributeExpression) and isinstance(target.reference, str):
+        name = translation.get_name(target.reference)
+        key, rank = get_numpy_assignment_key(target, translation)
+        lines.append(f'{name} = __glsl.assign({name}, {key}, {value_text}, {mask}, {rank}, {value_rank})')
+    else:
+        throw_not_implemented_error(assignment, 'assignments')
+    return lines
+
+def get_numpy_variable_declaration(declaration, translation):
+    get_rank(declaration.type, declaration)
+    elements = declaration.content if isinstance(declaration.content, list) else [declaration.content]
+    lines = []
+    for element in elements:
+        if isinstance(element, glsl.AssignmentExpression):
+            if isinstance(element.operand2, glsl.AssignmentExpression):
+                throw_not_implemented_error(element, 'assignments within declarations')
+            value = get_numpy_expression(element.operand2, translation)
+            lines.append(f'{translation.declare(element.operand1)} = {value}')
+        else:
+            lines.append(f'{translation.declare(element)} = None')
+    return lines
+
+def get_numpy_return_statement(statement, translation):
+    value = 'None'
+    rank = 0
+    if statement.value is not None:
+        value = get_numpy_expression(statement.value, translation)
+        rank = get_rank(translation.scope.deduce_type(statement.value), statement.value)
+    if not translation.is_masked():
+        return [f'return {value}']
+    if translation.depth > 0:
+        translation.has_returned = True
+    return [
+        f'__result = __glsl.select(__active, {value}, __result, {rank})',
+        '__returned = __glsl.either(__returned, __active)',
+        '__active = False',
+    ]
+
+def get_numpy_block(statements, translation):
+    '''
+    "get_numpy_block" returns lines of python for the statements within a nested block
+    '''
+    translation.blocks.append({})
+    translation.depth += 1
+    lines = get_numpy_statements(statements, translation)
+    translation.depth -= 1
+    translation.blocks.pop()
+    return lines or ['pass']
+
+def get_indented(lines):
+    return [f'    {line}' for line in lines]
+
+def get_numpy_if_statement(statement, translation):
+    i = translation.get_id()
+    condition = get_numpy_expression(statement.condition, translation)
+    lines = [
+        f'__condition{i} = {condition}',
+        f'__outer{i} = __active',
+        f'__active = __glsl.both(__outer{i}, __condition{i})',
+        *get_numpy_block(statement.content, translation),
+    ]
+    if statement.else_:
+        lines += [
+            f'__active = __glsl.exclude(__outer{i}, __condition{i})',
+            *get_numpy_block(statement.else_, translation),
+        ]
+    lines.append(f'__active = __glsl.exclude(__outer{i}, {translation.get_exclusions()})')
+    return lines
+
+def get_numpy_loop_statement(statement, translation):
+    '''
+    "get_numpy_loop_statement" returns lines of python for a while, do while, or for loop.
+    The loop repeats for as long as any sample remains within it.
+    Samples leave the loop when its condition fails, or when they break or return.
+    '''
+    i = translation.get_id()
+    translation.blocks.append({})
+    lines = []
+    if isinstance(statement, glsl.ForStatement):
+        lines += get_numpy_variable_declaration(statement.declaration, translation)
+    condition = get_numpy_expression(statement.condition, translation)
+    remaining = f'__glsl.exclude(__loop{i}, __returned, __break{i})'
+    lines += [
+        f'__outer{i} = __active',
+        f'__loop{i} = __active',
+        f'__break{i} = False',
+        'while True:',
+    ]
+    body = []
+    if isinstance(statement, glsl.DoWhileStatement):
+        body.append(f'__loop{i} = {remaining}')
+    else:
+        body.append(f'__loop{i} = __glsl.both({remaining}, {condition})')
+    body += [
+        f'if not __numpy.any(__loop{i}):',
+        '    break',
+        f'__active = __loop{i}',
+        f'__continue{i} = False',
+    ]
+    translation.loops.append(i)
+    body += get_numpy_block(statement.content, translation)
+    translation.loops.pop()
+    if isinstance(statement, glsl.ForStatement) and statement.operation:
+        operation = statement.operation
+        if isinstance(operation, glsl.UnaryExpression):
+            operation = glsl.AssignmentExpression(operation.operand1, operation.operator[0]+'=', '1')
+        translation.depth += 1
+        body += [f'__active = {remaining}', *get_numpy_assignment(operation, translation)]
+        translation.depth -= 1
+    elif isinstance(statement, glsl.DoWhileStatement):
+        body += [f'__active = {remaining}', f'__loop{i} = __glsl.both(__active, {condition})']
+    lines += get_indented(body)
+    lines.append(f'__active = __glsl.exclude(__outer{i}, __returned)')
+    translation.blocks.pop()
+    return lines
+
+def get_numpy_jump_statement(statement, translation):
+    if statement == 'discard':
+        throw_not_implemented_error(statement, 'discard statements')
+    if not translation.loops:
+        throw_compiler_error(statement, f'"{statement}" outside of a loop')
+    mask = f'__{statement}{translation.loops[-1]}'
+    return [f'{mask} = __glsl.either({mask}, __active)', '__active = False']
+
+def get_numpy_statements(statements, translation):
+    '''
+    "get_numpy_statements" returns lines of python for a list of glsl statements,
+    or a single statement
+    '''
+    if not isinstance(statements, list):
+        statements = [statements]
+    lines = []
+    for statement in statements:
+        if statement in ['break', 'continue', 'discard']:
+            lines += get_numpy_jump_statement(statement, translation)
+        elif isinstance(statement, str):
+            continue # comments and preprocessor directives
+        elif isinstance(statement, glsl.VariableDeclaration):
+            lines += get_numpy_variable_declaration(statement, translation)
+        elif isinstance(statement, glsl.AssignmentExpression):
+            lines += get_numpy_assignment(statement, translation)
+        elif isinstance(statement, glsl.InvocationExpression):
+            lines.append(get_numpy_expression(statement, translation))
+        elif isinstance(statement, glsl.ReturnStatement):
+            lines += get_numpy_return_statement(statement, translation)
+        elif isinstance(statement, glsl.IfStatement):
+            lines += get_numpy_if_statement(statement, translation)
+        elif type(statement) in glsl.code_block_element_types:
+            lines += get_numpy_loop_statement(statement, translation)
+        else:
+            throw_not_implemented_error(statement, 'statements')
+    return lines
+
+def get_numpy_function_source(declaration, scope, overloads=None):
+    '''
+    "get_numpy_function_source" returns the source of a python function
+    that evaluates a glsl function declaration using numpy.
+    It raises NotImplementedError or ValueError if the function cannot be translated.
+    '''
+    assert_type(declaration, [glsl.FunctionDeclaration])
+    overloads = overloads or {}
+    get_rank(declaration.type, declaration)
+    translation = NumpyTranslation(scope.get_subscope(declaration), overloads)
+    parameters = []
+    for parameter in declaration.parameters:
+        if 'out' in parameter.qualifiers or 'inout' in parameter.qualifiers:
+            throw_not_implemented_error(parameter, 'output reference parameters')
+        get_rank(parameter.type, parameter)
+        parameters.append(translation.declare(parameter.name))
+    lines = []
+    is_branching = any([type(statement) in glsl.code_block_element_types
+                        for statement in declaration.content])
+    if is_branching:
+        lines += ['__active = True', '__returned = False', '__result = None']
+    lines += get_numpy_statements(declaration.content, translation)
+    if is_branching and not lines[-1].startswith('return '):
+        lines.append('return __result')
+    return '\n'.join([
+        f"def {get_function_python_name(declaration, overloads)}({', '.join(parameters)}):",
+        *get_indented(lines or ['return None']),
+    ])
+
+def get_numpy_global_source(declaration, scope):
+    '''
+    "get_numpy_global_source" returns python source that assigns global variables,
+    variables that are declared without a value, such as uniforms,
+    must instead be provided by the caller
+    '''
+    translation = NumpyTranslation(scope)
+    lines = get_numpy_variable_declaration(declaration, translation)
+    return '\n'.join([line for line in lines if not line.endswith(' = None')])
+
+def get_unavailable_comment(error_description, name, kind='Function'):
+    return '\n'.join([f'# {line}' for line in f'{kind} "{name}" not available: {error_description}'.splitlines()])
+
+def get_numpy_sources(code, scope):
+    '''
+    "get_numpy_sources" returns a list of (element, source) pairs for every declaration within glsl code,
+    in order, where source is a string of python,
+    or an exception if the declaration could not be translated
+    '''
+    overloads = get_overloads(code)
+    result = []
+    for element in code:
+        if isinstance(element, glsl.FunctionDeclaration):
+            try:
+                result.append((element, get_numpy_function_source(element, scope, overloads)))
+            except (NotImplementedError, ValueError) as error:
+                result.append((element, error))
+        elif isinstance(element, glsl.VariableDeclaration):
+            try:
+                result.append((element, get_numpy_global_source(element, scope)))
+            except (NotImplementedError, ValueError) as error:
+                result.append((element, error))
+        elif isinstance(element, glsl.StructureDeclaration):
+            result.append((element, NotImplementedError('support for evaluating data structures is not implemented')))
+    return result
+
+def get_numpy_source(code, scope):
+    '''
+    "get_numpy_source" returns python source for all declarations within glsl code,
+    declarations that could not be translated are replaced by comments
+    '''
+    overloads = get_overloads(code)
+    texts = []
+    for element, source in get_numpy_sources(code, scope):
+        if isinstance(source, Exception):
+            kind, name = (
+                ('Variable', ', '.join(element.get_names())) if isinstance(element, glsl.VariableDeclaration) else 
+                ('Structure', element.name) if isinstance(element, glsl.StructureDeclaration) else
+                ('Function', get_function_key(element, overloads))
+            )
+            texts.append(get_unavailable_comment(str(source), name, kind))
+        elif source != '':
+            texts.append(source)
+    return '\n\n'.join(texts) + '\n'
+
+def get_error_ignoring_function(function):
+    '''
+    "get_error_ignoring_function" wraps a translated function so that floating point errors are ignored,
+    since both sides of every branch are evaluated for every sample
+    '''
+    def call(*arguments):
+        with np.errstate(all='ignore'):
+            return function(*arguments)
+    return call
+
+def get_numpy_functions(code, scope, namespace=None):
+    '''
+    "get_numpy_functions" returns a dictionary mapping every function within glsl code,
+    as named by get_function_key(), to a python callable that evaluates it over numpy arrays,
+    or to a string describing why it is not available.
+    `namespace` may provide the values of global variables that are declared without a value.
+    '''
+    assert_numpy()
+    overloads = get_overloads(code)
+    namespace = {**(namespace or {}), '__numpy': np, '__glsl': NumpyLibrary}
+    result = {}
+    for element, source in get_numpy_sources(code, scope):
+        is_function = isinstance(element, glsl.FunctionDeclaration)
+        key = get_function_key(element, overloads) if is_function else None
+        if isinstance(source, Exception):
+            if is_function:
+                result[key] = f'Function "{key}" not available: {source}'
+            continue
+        exec(compile(source, f'<glsl {key or "globals"}>', 'exec'), namespace)
+        if is_function:
+            result[key] = get_error_ignoring_function(namespace[get_function_python_name(element, overloads)])
+    return result
+
+def get_samples(type_, count, domain, random):
+    '''
+    "get_samples" returns an array of `count` random values of a glsl type,
+    whose components lie within `domain`
+    '''
+    rank = get_rank(type_, type_)
+    shape = (count,)
+    if rank == 1:
+        shape = (count, int(type_[-1]))
+    elif rank == 2:
+        columns, rows = re.match('\w*mat(\d)x?(\d?)', type_).groups()
+        shape = (count, int(columns), int(rows or columns))
+    dtype = get_dtype(type_)
+    if dtype == 'bool':
+        return random.integers(0, 2, shape).astype(bool)
+    elif dtype == 'int64':
+        return random.integers(int(domain[0]), int(domain[1])+1, shape)
+    return random.uniform(domain[0], domain[1], shape)
+
+def get_finite_difference(function, arguments, i, h=1e-5, component=None, side=0):
+    '''
+    "get_finite_difference" returns the finite difference of a function
+    with respect to the argument at index `i`, whose first axis indexes samples.
+    The difference is central if `side` is 0, otherwise it is forward or backward 
+    depending on whether `side` is positive or negative.
+    By default, every component of a vector or matrix is offset together,
+    otherwise only the component at index `component` is offset.
+    '''
+    offset = h
+    if component is not None:
+        offset = np.zeros_like(arguments[i][0])
+        offset[component] = h
+    above = list(arguments)
+    below = list(arguments)
+    if side >= 0:
+        above[i] = arguments[i] + offset
+    if side <= 0:
+        below[i] = arguments[i] - offset
+    return (np.asarray(function(*above)) - np.asarray(function(*below))) / (h if side else 2*h)
+
+def get_batched(value, count):
+    '''
+    "get_batched" broadcasts a value to `count` samples if it is the same for every sample, 
+    such as a constant returned by a function
+    '''
+    return value if np.shape(value)[:1] == (count,) else np.broadcast_to(value, (count,) + np.shape(value))
+
+def get_derivative_pairs(code):
+    '''
+    "get_derivative_pairs" returns a list of (derivative, function, parameter) triples
+    for every function within glsl code named like a derivative of another with the same parameters, 
+    such as "ddx_f" for "f(x)"
+    '''
+    declarations = {}
+    for element in code:
+        if isinstance(element, glsl.FunctionDeclaration):
+            declarations[(element.name, get_parameter_types(element))] = element
+    result = []
+    for (name, parameter_types), derivative in declarations.items():
+        if not name.startswith('dd'):
+            continue
+        suffix = name[2:]
+        for i, character in enumerate(suffix):
+            x, function = suffix[:i], declarations.get((suffix[i+1:], parameter_types))
+            if (character == '_' and function is not None and 
+                    x in [parameter.name for parameter in function.parameters]):
+                result.append((derivative, function, x))
+                break
+    return result
+
+def get_derivative_checks(code, scope, count=1000, domain=(0.1, 1.0), seed=0, h=1e-5):
+    '''
+    "get_derivative_checks" compares every derivative within glsl code
+    against finite differences of the function it was derived from,
+    or against its gradient, where the derivative of a scalar with respect to a vector is a vector,
+    and returns a list of (name, error, sample count) triples,
+    where error is the greatest error over samples, relative to the magnitude of the derivative where it exceeds 1,
+    or a string describing why the derivative could not be checked.
+    The error of a sample is the least among several differences, both central and one sided,
+    so that samples near discontinuities or singularities are not mistaken for incorrect derivatives.
+    Samples where results are not finite are ignored.
+    '''
+    functions = get_numpy_functions(code, scope)
+    overloads = get_overloads(code)
+    random = np.random.default_rng(seed)
+    result = []
+    for derivative, function, x in get_derivative_pairs(code):
+        name = get_function_key(derivative, overloads)
+        f = functions[get_function_key(function, overloads)]
+        dfdx = functions[name]
+        if isinstance(dfdx, str) or isinstance(f, str):
+            result.append((name, dfdx if isinstance(dfdx, str) else f, 0))
+            continue
+        types = get_parameter_types(function)
+        i = [parameter.name for parameter in function.parameters].index(x)
+        if get_dtype(types[i]) != 'float64':
+            result.append((name, f'parameter "{x}" is not continuous', 0))
+            continue
+        try:
+            arguments = [get_samples(type_, count, domain, random) for type_ in types]
+            actual = np.asarray(dfdx(*arguments))
+            rank = get_rank(derivative.type, derivative)
+            is_gradient = (get_rank(types[i], x) == 1 and 
+                rank == get_rank(function.type, function) + 1)
+            errors = []
+            for step, side in [(h, 0), (h/10, 0), (h, 1), (h, -1)]:
+                expected = (
+                    np.stack([get_finite_difference(f, arguments, i, step, j, side)
+                              for j in range(arguments[i].shape[-1])], axis=-1) 
+                    if is_gradient else get_finite_difference(f, arguments, i, step, None, side))
+                expected, actual_ = np.broadcast_arrays(
+                    get_batched(expected, count), get_batched(actual, count))
+                errors.append(np.abs(actual_ - expected) / np.maximum(1.0, np.abs(expected)))
+        except (NotImplementedError, ValueError, TypeError, IndexError, NameError) as error:
+            result.append((name, f'could not be evaluated: {error}', 0))
+            continue
+        error = np.fmin.reduce(errors)
+        is_finite = np.isfinite(error)
+        if not np.any(is_finite):
+            result.append((name, 'no samples produced finite results', 0))
+            continue
+        is_sample_finite = np.all(np.reshape(is_finite, (count, -1)), axis=1)
+        result.append((name, float(np.max(error[is_finite])), int(np.sum(is_sample_finite))))
+    return result
+
+def convert_file(input_filename=None, check_derivatives=False,
+        count=1000, domain=(0.1, 1.0), seed=0, tolerance=1e-4,
+        diagnostics_format='text', diagnostics_limit=None, index_filename=None,
+        include_paths=None, include_cache=None):
+    input_text = ''
+    if input_filename:
+        with open(input_filename, 'r') as input_file:
+            input_text = input_file.read()
+    else:
+        for line in sys.stdin:
+            input_text += line
+
+    diagnostics = glsl.Diagnostics(diagnostics_limit)
+    glsl_code = peg.parse(input_text, glsl.code)
+    base_scope = glsl_index.ProjectIndex.load(index_filename).get_scope() if index_filename else None
+    include_resolver = glsl_include.IncludeResolver(include_paths, include_cache)
+    base_scope = include_resolver.get_scope(input_text, input_filename, base_scope)
+    include_resolver.save()
+    scope = glsl.LexicalScope(glsl_code, diagnostics, base_scope)
+
+    is_passing = True
+    if check_derivatives:
+        for name, error, sample_count in get_derivative_checks(glsl_code, scope, count, domain, seed):
+            if isinstance(error, str):
+                print(f'{name}: not checked, {error}')
+            elif error > tolerance:
+                is_passing = False
+                print(f'{name}: FAILED, max error {error:.3g} over {sample_count} samples')
+            else:
+                print(f'{name}: max error {error:.3g} over {sample_count} samples')
+    else:
+        print(get_numpy_source(glsl_code, scope))
+    diagnostics.report(diagnostics_format)
+    return is_passing
+
+if __name__ == '__main__':
+    import argparse
+
+    assert sys.version_info[0] >= 3, "Script must be run with Python 3 or higher"
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--filename', dest='filename',
+        help='read input from FILE', metavar='FILE')
+    parser.add_argument('--check-derivatives', dest='check_derivatives', action='store_true',
+        help='check functions named like derivatives, such as "ddx_f", against central differences of the functions they were derived from')
+    parser.add_argument('--samples', dest='samples', type=int, default=1000,
+        help='the number of random samples used to check derivatives', metavar='N')
+    parser.add_argument('--domain', dest='domain', type=float, nargs=2, default=[0.1, 1.0],
+        help='the range of values from which samples are drawn', metavar=('LOW', 'HIGH'))
+    parser.add_argument('--seed', dest='seed', type=int, default=0,
+        help='the seed for random samples', metavar='N')
+    parser.add_argument('--tolerance', dest='tolerance', type=float, default=1e-4,
+        help='the greatest relative error for which a derivative is considered correct', metavar='E')
+    parser.add_argument('--diagnostics', dest='diagnostics_format', choices=['text', 'json', 'none'], default='text',
+        help='specify whether to report diagnostics to stderr as text, as json, or not at all',
+    )
+    parser.add_argument('--diagnostics-limit', dest='diagnostics_limit', type=int, default=100,
+        help='maximum number of diagnostics to record', metavar='N',
+    )
+    parser.add_argument('--index', dest='index_filename',
+        help='seed type information from an index built by glsl_index.py', metavar='FILE')
+    parser.add_argument('-I', '--include-path', dest='include_paths', action='append',
+        help='search DIRECTORY for headers named by #include directives', metavar='DIRECTORY')
+    parser.add_argument('--include-cache', dest='include_cache',
+        help='store parsed header declarations in FILE between runs', metavar='FILE')
+    args = parser.parse_args()
+    if args.check_derivatives and args.samples < 1:
+        parser.error('--samples must be at least 1')
+    is_passing = convert_file(
+        args.filename,
+        check_derivatives=args.check_derivatives,
+        count=args.samples,
+        domain=args.domain,
+        seed=args.seed,
+        tolerance=args.tolerance,
+        diagnostics_format=args.diagnostics_format,
+        diagnostics_limit=args.diagnostics_limit,
+        index_filename=args.index_filename,
+        include_paths=args.include_paths,
+        include_cache=args.include_cache,
+    )
+    sys.exit(0 if is_passing else 1)
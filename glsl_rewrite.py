@@ -0,0 +1,351 @@
+#!/bin/env python3
+
+"""
+"glsl_rewrite.py" is a term rewriting engine for glsl expressions.
+Rules are declared as data: each pairs a pattern with a replacement,
+both written as glsl text in which placeholders such as `$a` stand for subexpressions,
+in the same way as pypeg2glsl.Template.
+Rules are indexed by the type and operator of the root of their pattern,
+so only rules that could possibly match an expression are ever tried.
+Expressions are rewritten from the leaves up,
+and whatever a rule produces is visited again until no rule applies,
+so that the result is a fixed point of the rules.
+
+The grammar in pypeg2glsl nests chains of binary operations to the right,
+so `a - b + c` is parsed as if it were `a - (b + c)`.
+Rules would be unsound if they matched such trees,
+so expressions are regrouped to nest to the left, as they are evaluated,
+before any rule is applied, and regrouped to match the grammar afterward.
+The right hand operand of `+` or `*` may be left unwrapped where a rule produces it,
+since for real numbers `a + (b - c)` and `a * (b / c)` equal `a + b - c` and `a * b / c`.
+
+This script is a library, it is used by glsl_simplify.py.
+"""
+
+
+import copy
+
+import pypeg2glsl as glsl
+
+def assert_type(variable, types):
+    if len(types) == 1 and not isinstance(variable, types[0]):
+        raise AssertionError(f'expected {types[0]} but got {type(variable)} (value: {variable})')
+    if not any([isinstance(variable, type_) for type_ in types]):
+        raise AssertionError(f'expected any of {types} but got {type(variable)} (value: {variable})')
+
+'''
+"associative_operators" lists operators whose right hand operand
+need not be wrapped in parentheses when it has the same precedence
+'''
+associative_operators = ['+', '*']
+
+def get_mapped(element, get_mapped_subelement):
+    '''
+    "get_mapped" returns a shallow copy of an element where every subelement
+    has been passed through `get_mapped_subelement`,
+    or the element itself if no subelement has changed
+    '''
+    if isinstance(element, list):
+        result = [get_mapped_subelement(subelement) for subelement in element]
+        if all([a is b for a, b in zip(result, element)]):
+            return element
+        mapped = copy.copy(element)
+        mapped[:] = result
+        return mapped
+    elif isinstance(element, glsl.GlslElement):
+        mapped = None
+        for attribute in glsl.element_attributes:
+            if hasattr(element, attribute):
+                subelement = getattr(element, attribute)
+                result = get_mapped_subelement(subelement)
+                if result is not subelement:
+                    mapped = mapped or copy.copy(element)
+                    setattr(mapped, attribute, result)
+        return mapped or element
+    else:
+        return element
+
+def get_evaluation_grouped(element):
+    '''
+    "get_evaluation_grouped" returns a copy of an element
+    where chains of binary operations nest to the left, as they are evaluated
+    '''
+    if (isinstance(element, glsl.BinaryExpression) or
+        isinstance(element, glsl.PreIncrementExpression) and
+        isinstance(element.operand1, glsl.BinaryExpression)):
+        chain = glsl.Template.get_chain(element)
+        chain[::2] = [get_mapped(operand, get_evaluation_grouped) for operand in chain[::2]]
+        return glsl.Template.get_left_grouped(chain)
+    return get_mapped(element, get_evaluation_grouped)
+
+def get_text_grouped(element):
+    '''
+    "get_text_grouped" is the inverse of get_evaluation_grouped(),
+    it returns a copy of an element where chains of binary operations
+    nest to the right, as they would be parsed from text, so that they can be composed
+    '''
+    if isinstance(element, glsl.BinaryExpression):
+        chain = glsl.Template.get_chain(element)
+        chain[::2] = [get_mapped(operand, get_text_grouped) for operand in chain[::2]]
+        return glsl.Template.get_regrouped(chain)
+    return get_mapped(element, get_text_grouped)
+
+def is_equivalent(a, b):
+    '''
+    "is_equivalent" returns whether two elements have the same structure,
+    disregarding comments
+    '''
+    if isinstance(a, str) or isinstance(b, str):
+        return isinstance(a, str) and isinstance(b, str) and a == b
+    elif type(a) != type(b):
+        return False
+    elif isinstance(a, list):
+        return len(a) == len(b) and all([is_equivalent(a2, b2) for a2, b2 in zip(a, b)])
+    elif isinstance(a, glsl.GlslElement):
+        return all([
+            is_equivalent(getattr(a, attribute, None), getattr(b, attribute, None))
+            for attribute in glsl.element_attributes
+            if not attribute.startswith('comment')
+        ])
+    else:
+        return a == b
+
+def get_equivalence_key(element):
+    '''
+    "get_equivalence_key" returns a hashable representation of an element
+    that is shared by elements if and only if they are equivalent, as by is_equivalent().
+    Keys can also be compared, so that equivalent elements can be sorted together.
+    '''
+    if isinstance(element, str):
+        return ('', element)
+    elif isinstance(element, list):
+        return ('list', *[get_equivalence_key(subelement) for subelement in element])
+    elif isinstance(element, glsl.GlslElement):
+        return (type(element).__name__, *[
+            get_equivalence_key(getattr(element, attribute, None))
+            for attribute in glsl.element_attributes
+            if not attribute.startswith('comment')
+        ])
+    else:
+        return ('', repr(element))
+
+def get_wrapped(operand, parent, attribute):
+    '''
+    "get_wrapped" returns an operand wrapped in parentheses
+    wherever it would otherwise be ambiguous as the given attribute of `parent`
+    '''
+    precedence = glsl.Template.get_precedence(operand)
+    if isinstance(parent, glsl.BinaryExpression) and attribute in ['operand1', 'operand2']:
+        parent_precedence = glsl.Template.get_precedence(parent)
+        is_ambiguous = (precedence is None or precedence > parent_precedence or
+            (attribute == 'operand2' and precedence == parent_precedence and
+             parent.operator not in associative_operators))
+    elif isinstance(parent, glsl.UnaryExpression) and attribute == 'operand1':
+        is_ambiguous = not (isinstance(operand, str) or type(operand) in glsl.postfix_expression_or_less)
+    elif isinstance(parent, glsl.TernaryExpression) and attribute == 'operand1':
+        is_ambiguous = precedence is None
+    elif isinstance(parent, glsl.AttributeExpression) and attribute == 'reference':
+        # the grammar only accepts a name, an invocation, or parentheses before an attribute
+        is_ambiguous = not isinstance(operand, (str, glsl.InvocationExpression, glsl.ParensExpression))
+    else:
+        is_ambiguous = False
+    return glsl.ParensExpression(operand) if is_ambiguous else operand
+
+def get_rewrapped(element):
+    '''
+    "get_rewrapped" returns an element whose operands are wrapped in parentheses where needed,
+    for an element whose operands may have been replaced
+    '''
+    if not isinstance(element, (glsl.BinaryExpression, glsl.UnaryExpression, glsl.TernaryExpression, 
+                                glsl.AttributeExpression)):
+        return element
+    wrapped = {attribute: get_wrapped(getattr(element, attribute), element, attribute)
+               for attribute in ['operand1', 'operand2', 'operand3', 'reference']
+               if hasattr(element, attribute)}
+    if all([wrapped[attribute] is getattr(element, attribute) for attribute in wrapped]):
+        return element
+    result = copy.copy(element)
+    for attribute in wrapped:
+        setattr(result, attribute, wrapped[attribute])
+    return result
+
+def get_binary_expression(BinaryExpressionTemp, operand1, operator, operand2):
+    '''
+    "get_binary_expression" returns a binary expression
+    whose operands are wrapped in parentheses where needed
+    '''
+    result = BinaryExpressionTemp(operand1, operator, operand2)
+    result.operand1 = get_wrapped(operand1, result, 'operand1')
+    result.operand2 = get_wrapped(operand2, result, 'operand2')
+    return result
+
+def get_index_key(element):
+    '''
+    "get_index_key" returns the key under which rules are indexed for an element,
+    or under which rules are looked up for an element
+    '''
+    if isinstance(element, (glsl.BinaryExpression, glsl.UnaryExpression)):
+        return (type(element), element.operator)
+    elif isinstance(element, glsl.InvocationExpression):
+        return (type(element), element.reference)
+    else:
+        return (type(element), None)
+
+class RewriteRule:
+    """
+    A "RewriteRule" replaces expressions that match a pattern.
+    `pattern` is glsl text in which placeholders such as `$a` match any subexpression,
+    and a placeholder that appears more than once must match equivalent subexpressions.
+    `replacement` is either glsl text in which placeholders are substituted
+    with the subexpressions they matched, wrapped in parentheses where needed,
+    or a function that returns the replacement, or None if the rule does not apply.
+    `condition` is an optional function that returns whether the rule applies.
+    Functions are passed the matched subexpressions as keyword arguments
+    alongside the matched `element` and the `scope` in which it is found.
+    """
+
+    def __init__(self, pattern, replacement, condition=None):
+        self.text = f'{pattern} -> {replacement if isinstance(replacement, str) else replacement.__name__}'
+        self.pattern = get_evaluation_grouped(
+            glsl.Template(pattern, glsl.ternary_expression_or_less).tree)
+        self.replacement = (
+            get_evaluation_grouped(glsl.Template(replacement, glsl.ternary_expression_or_less).tree)
+            if isinstance(replacement, str) else replacement)
+        self.condition = condition
+        self.index_key = (get_index_key(self.pattern)
+            if not RewriteRule.get_placeholder(getattr(self.pattern, 'reference', None))
+            else (type(self.pattern), None))
+
+    @staticmethod
+    def get_placeholder(element):
+        '''
+        "get_placeholder" returns the name of a placeholder, or None if the element is not one
+        '''
+        if isinstance(element, str) and element.startswith(glsl.Template.placeholder_prefix):
+            return element[len(glsl.Template.placeholder_prefix):]
+        return None
+
+    def match(self, pattern, element, bindings):
+        '''
+        "match" returns whether an element matches a pattern,
+        and stores the subexpressions matched by placeholders within `bindings`
+        '''
+        name = RewriteRule.get_placeholder(pattern)
+        if name is not None:
+            if name in bindings:
+                return is_equivalent(bindings[name], element)
+            bindings[name] = element
+            return True
+        elif isinstance(pattern, str):
+            return isinstance(element, str) and pattern == element
+        elif type(pattern) != type(element):
+            return False
+        elif isinstance(pattern, list):
+            return (len(pattern) == len(element) and
+                all([self.match(pattern2, element2, bindings)
+                     for pattern2, element2 in zip(pattern, element)]))
+        elif isinstance(pattern, glsl.GlslElement):
+            return all([
+                self.match(getattr(pattern, attribute), getattr(element, attribute, None), bindings)
+                for attribute in glsl.element_attributes
+                if hasattr(pattern, attribute) and not attribute.startswith('comment')
+            ])
+        else:
+            return pattern == element
+
+    def substitute(self, element, bindings):
+        name = RewriteRule.get_placeholder(element)
+        if name is not None:
+            return bindings[name]
+        elif isinstance(element, list):
+            return [self.substitute(subelement, bindings) for subelement in element]
+        elif isinstance(element, glsl.GlslElement):
+            result = copy.copy(element)
+            for attribute in glsl.element_attributes:
+                if hasattr(element, attribute):
+                    setattr(result, attribute, get_wrapped(
+                        self.substitute(getattr(element, attribute), bindings), result, attribute))
+            return result
+        else:
+            return element
+
+    def apply(self, element, scope):
+        '''
+        "apply" returns the replacement for an element,
+        or None if the element does not match or the rule does not otherwise apply
+        '''
+        bindings = {}
+        if not self.match(self.pattern, element, bindings):
+            return None
+        if self.condition is not None and not self.condition(element=element, scope=scope, **bindings):
+            return None
+        if callable(self.replacement):
+            return self.replacement(element=element, scope=scope, **bindings)
+        return self.substitute(self.replacement, bindings)
+
+class RewriteSystem:
+    """
+    A "RewriteSystem" stores a list of RewriteRules, indexed by the root of their patterns.
+    Where several rules could apply to an expression, the one listed first is applied.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.index = {}
+        for rule in rules:
+            self.index.setdefault(rule.index_key, []).append(rule)
+        self.lookups = {}
+
+    def get_rules(self, element):
+        '''
+        "get_rules" returns the rules that could apply to an element, in the order they are listed
+        '''
+        key = get_index_key(element)
+        if key not in self.lookups:
+            candidates = {id(rule) for rule in
+                [*self.index.get(key, []), *self.index.get((key[0], None), [])]}
+            self.lookups[key] = [rule for rule in self.rules if id(rule) in candidates]
+        return self.lookups[key]
+
+    def get_normal_form(self, element, scope, budget=None):
+        '''
+        "get_normal_form" returns an element where rules have been applied
+        until none apply, for an element that has been grouped by get_evaluation_grouped().
+        Elements that are known to be in normal form are not visited again,
+        so subexpressions that a rule carries over to its replacement are not revisited.
+        Every rule that is applied is counted against `budget`, if provided, 
+        see pypeg2glsl.Budget. Once it is exhausted, elements are returned as they are,
+        which is still equivalent to the input, though not necessarily in normal form.
+        '''
+        normal = {}
+        def visit(element):
+            while id(element) not in normal:
+                if budget is not None and budget.is_exhausted():
+                    return element
+                mapped = get_mapped(element, visit)
+                # a subexpression may have been replaced with one of lower precedence
+                element = get_rewrapped(mapped) if mapped is not element else element
+                # the budget may have been exhausted while visiting subexpressions
+                if budget is not None and budget.is_exhausted():
+                    return element
+                for rule in self.get_rules(element):
+                    replacement = rule.apply(element, scope)
+                    if replacement is not None:
+                        assert_type(replacement, [str, glsl.GlslElement])
+                        element = replacement
+                        if budget is not None:
+                            budget.spend()
+                        break
+                else:
+                    # the element is stored to keep its id from being reused
+                    normal[id(element)] = element
+            return element
+        return visit(element)
+
+    def get_rewritten(self, element, scope, budget=None):
+        '''
+        "get_rewritten" is a pure function that returns an element
+        where rules have been applied until none apply, 
+        or until `budget` is exhausted, if provided
+        '''
+        return get_text_grouped(self.get_normal_form(get_evaluation_grouped(element), scope, budget))
@@ -23,13 +23,24 @@ If you want to replace all files in a directory, call like so:
 """
 
 
+import collections
 import copy
+import decimal
 import difflib
+import math
 import re
+import struct
 import sys
 
 import pypeg2 as peg
 import pypeg2glsl as glsl
+import glsl_cost
+import glsl_cse
+import glsl_dce
+import glsl_egraph
+import glsl_index
+import glsl_include
+import glsl_rewrite
 
 # attempt to import colorama, for colored diff output
 try:
@@ -46,86 +57,780 @@ def assert_type(variable, types):
     if not any([isinstance(variable, type_) for type_ in types]):
         raise AssertionError(f'expected any of {types} but got {type(variable)} (value: {variable})')
 
-def compose_many(*expressions):
-    return [peg.compose(expression, type(expression)) 
-            for expression in expressions]
-
-def get_simplified_multiplicative_expression(element, scope):
-    a, b = (
-        get_simplified(element.operand1, scope),
-        get_simplified(element.operand2, scope)
-    )
-    if (isinstance(a, glsl.ParensExpression) and 
-        isinstance(a.content, glsl.MultiplicativeExpression)):
-        a2 = a.content.operand1
-        b2 = glsl.MultiplicativeExpression(a.content.operand2, a.content.operator, b)
-        # a, b = a2, b2
-    if (isinstance(b, glsl.ParensExpression) and 
-        isinstance(b.content, glsl.MultiplicativeExpression)):
-        b = b.content
-    # if (isinstance(b, str) and glsl.float_literal.match(b)):
-        # a2 = b
-        # b2 = a
-        # a, b = a2, b2
-    a_str, b_str = compose_many(a, b)
-    zero = re.compile('(vec[234])? \(? 0+\.?0*f? \)? $', re.VERBOSE)
-    one  = re.compile('(vec[234])? \(? 0*1\.?0*f? \)? $', re.VERBOSE)
-    if zero.match(a_str) or zero.match(b_str):
+def get_0_for_element(element, scope):
+    '''
+    "get_0_for_element" returns the additive identity for the type of an expression,
+    or None if the type cannot be deduced or has no known identity
+    '''
+    try:
         return glsl.get_0_for_type(scope.deduce_type(element))
-    elif one.match(a_str):
-        return b
-    elif one.match(b_str):
-        return a
-    else:
-        return glsl.MultiplicativeExpression(a, element.operator, b)
+    except NotImplementedError:
+        return None
 
-def get_simplified_additive_expression(element, scope):
-    a, b = (
-        get_simplified(element.operand1, scope),
-        get_simplified(element.operand2, scope)
-    )
-    if (isinstance(a, glsl.ParensExpression) and 
-        isinstance(a.content, glsl.MultiplicativeExpression)):
-        a = a.content
-    if (isinstance(a, glsl.ParensExpression) and 
-        isinstance(a.content, glsl.AdditiveExpression)):
-        a2 = a.content.operand1
-        b2 = glsl.AdditiveExpression(a.content.operand2, a.content.operator, b)
-        a, b = a2, b2
-    if (isinstance(b, glsl.ParensExpression) and 
-        (isinstance(a.content, glsl.MultiplicativeExpression) or 
-         isinstance(a.content, glsl.AdditiveExpression))):
-        b = b.content
-    a_str, b_str = compose_many(a, b)
-    zero = re.compile('(vec[234])? \(? 0+\.?0*f? \)? $', re.VERBOSE)
-    if a_str == b_str:
-        return glsl.MultiplicativeExpression('2.0f', '*', b_str)
-    elif zero.match(a_str):
-        return b
-    elif zero.match(b_str):
+def is_literal_of(element, value):
+    '''
+    "is_literal_of" returns whether an element is a literal, a negated literal,
+    or a vector of literals, such as `vec3(0.0f)`, whose components all equal a value
+    '''
+    literal = get_literal_value(element)
+    return literal is not None and all([x == value for x in literal[1]])
+
+def is_0(element):
+    return is_literal_of(element, 0)
+
+def is_1(element):
+    return is_literal_of(element, 1)
+
+def get_0(element, scope, **bindings):
+    return get_0_for_element(element, scope)
+
+'''
+"real_types" and "integer_types" list the types of numbers that are deduced
+to decide whether a rewrite preserves the type and value of an expression
+'''
+real_types = ['float', *glsl.float_vector_types, *glsl.float_matrix_types]
+integer_types = ['int', 'uint', *glsl.int_vector_types, *glsl.uint_vector_types]
+
+def get_type(element, scope):
+    '''
+    "get_type" returns the type of an expression, or None if it cannot be deduced,
+    without recording diagnostics
+    '''
+    return scope.get_quiet_scope().deduce_type(element)
+
+def get_identity_operand(element, operand, identity, scope):
+    '''
+    "get_identity_operand" returns the operand that replaces a binary expression
+    whose other operand is an identity, such as `t` for `1.0f * t`,
+    converted to the type of the expression where they differ, such as `vec3(t)` for `vec3(1.0f) * t`,
+    or None if the types cannot be deduced, or the operand cannot be converted without changing its value
+    '''
+    element_type = get_type(element, scope)
+    operand_type = get_type(operand, scope)
+    if element_type == operand_type:
+        return operand
+    elif operand_type is None:
+        # a scalar identity does not change the type of an operand, whatever it may be
+        return operand if isinstance(identity, str) else None
+    elif element_type in ['float', 'int', 'uint', *glsl.float_vector_types, *glsl.int_vector_types, *glsl.uint_vector_types]:
+        return glsl.InvocationExpression(element_type, [operand])
+    return None
+
+def get_identity_a(element, scope, a, b, **bindings):
+    return get_identity_operand(element, a, b, scope)
+
+def get_identity_b(element, scope, a, b, **bindings):
+    return get_identity_operand(element, b, a, scope)
+
+def get_negated_identity_b(element, scope, a, b, **bindings):
+    operand = get_identity_operand(element, b, a, scope)
+    return None if operand is None else glsl.PreIncrementExpression(
+        glsl_rewrite.get_wrapped(operand, glsl.PreIncrementExpression(), 'operand1'), '-')
+
+def get_doubled(element, scope, a, **bindings):
+    '''
+    "get_doubled" returns `2.0f * a` for a sum of equivalent operands, `a + a`,
+    or `2 * a` if they are integers, or None if their type cannot be deduced
+    '''
+    type_ = get_type(a, scope)
+    if type_ in real_types:
+        return glsl_rewrite.get_binary_expression(glsl.MultiplicativeExpression, '2.0f', '*', a)
+    elif type_ in integer_types:
+        return glsl_rewrite.get_binary_expression(glsl.MultiplicativeExpression, '2', '*', a)
+    return None
+
+def is_regroupable_product(element, scope):
+    '''
+    "is_regroupable_product" returns whether a product can be multiplied without parentheses,
+    such as `b * c` in `a * (b * c)`, which is not the case if it divides integers,
+    since integer division is truncated
+    '''
+    return (isinstance(element, glsl.MultiplicativeExpression) and
+        (all([operator == '*' for _, operator in glsl.Template.get_chain(element)[1::2]]) or
+         get_type(element, scope) in real_types))
+
+'''
+"float_literal_regex" and "int_literal_regex" match the literals that can be folded,
+hexadecimal, octal, and unsigned literals are left as they are
+'''
+float_literal_regex = re.compile('(\d+\.\d*|\.\d+)(e-?\d+)?f?|\d+e-?\d+f?', re.IGNORECASE)
+int_literal_regex = re.compile('[1-9]\d*|0')
+
+def get_float32(value):
+    '''
+    "get_float32" rounds a number to the nearest single precision float, as used by glsl,
+    or returns None if it cannot be represented
+    '''
+    try:
+        result = struct.unpack('f', struct.pack('f', value))[0]
+    except (OverflowError, struct.error):
+        return None
+    return result if math.isfinite(result) else None
+
+def get_int32(value):
+    '''
+    "get_int32" wraps an integer to the range of a signed 32 bit int, as used by glsl
+    '''
+    return (value + 2**31) % 2**32 - 2**31
+
+def get_float_literal_text(value):
+    '''
+    "get_float_literal_text" returns the shortest text for a nonnegative float literal
+    that is read back as the same single precision float
+    '''
+    for precision in range(1, 10):
+        text = f'{value:.{precision}g}'
+        if get_float32(float(text)) == value:
+            break
+    if 'e' in text and 1e-4 <= value < 1e16:
+        text = format(decimal.Decimal(text), 'f')
+    mantissa, *exponent = text.replace('e+', 'e').split('e')
+    if '.' not in mantissa:
+        mantissa += '.0'
+    return 'e'.join([mantissa, *exponent]) + 'f'
+
+def get_literal_value(element):
+    '''
+    "get_literal_value" returns the type and components of an element 
+    if it is a float or int literal, a negated literal, 
+    or a vector constructed from literals, or None otherwise
+    '''
+    if isinstance(element, str):
+        if float_literal_regex.fullmatch(element):
+            value = get_float32(float(element.rstrip('fF')))
+            return ('float', [value]) if value is not None else None
+        elif int_literal_regex.fullmatch(element):
+            return ('int', [get_int32(int(element))])
+    elif isinstance(element, glsl.ParensExpression):
+        return get_literal_value(element.content)
+    elif isinstance(element, glsl.PreIncrementExpression) and element.operator in '+-':
+        literal = get_literal_value(element.operand1)
+        if literal is not None and element.operator == '-':
+            type_, components = literal
+            return (type_, [get_int32(-x) if type_ == 'int' else -x for x in components])
+        return literal
+    elif (isinstance(element, glsl.InvocationExpression) and 
+          element.reference in ['float', *glsl.float_vector_types]):
+        literals = [get_literal_value(argument) for argument in element.arguments]
+        if len(literals) < 1 or None in literals or any([type_ not in ['float', 'int', *glsl.float_vector_types] for type_, components in literals]):
+            return None
+        components = [float(x) for type_, components in literals for x in components]
+        size = 1 if element.reference == 'float' else int(element.reference[-1])
+        if len(components) == 1:
+            return (element.reference, components * size)
+        elif len(components) == size or len(components) > size and len(literals[-1][1]) > len(components) - size:
+            return (element.reference, components[:size])
+    return None
+
+def get_literal(type_, components):
+    '''
+    "get_literal" is the inverse of get_literal_value(),
+    it returns a literal of the given type and components
+    '''
+    def get_scalar(value):
+        text = str(abs(value)) if type_ in ['int'] else get_float_literal_text(abs(value))
+        return glsl.PreIncrementExpression(text, '-') if value < 0 else text
+    if type_ in glsl.float_vector_types:
+        if all([x == components[0] for x in components]):
+            components = components[:1]
+        return glsl.InvocationExpression(type_, [get_scalar(x) for x in components])
+    return get_scalar(components[0])
+
+def is_literal_form(element):
+    '''
+    "is_literal_form" returns whether a literal is written as get_literal() would write it,
+    aside from its number formatting, so that folding it would accomplish nothing
+    '''
+    if isinstance(element, glsl.InvocationExpression):
+        return element.reference != 'float' and all([
+            isinstance(argument, str) or 
+            isinstance(argument, glsl.PreIncrementExpression) and argument.operator == '-' and isinstance(argument.operand1, str)
+            for argument in element.arguments
+        ]) and len(element.arguments) in [1, int(element.reference[-1])]
+    elif isinstance(element, glsl.PreIncrementExpression):
+        return element.operator == '-' and isinstance(element.operand1, str)
+    return isinstance(element, str)
+
+def get_broadcasted(literals):
+    '''
+    "get_broadcasted" returns the type of the result of a componentwise operation 
+    on literals, along with the components of each literal repeated to match,
+    or None if the literals cannot be combined
+    '''
+    types = set([type_ for type_, components in literals])
+    sizes = set([len(components) for type_, components in literals]) - {1}
+    if len(sizes) > 1 or not types <= {'float', 'int', *glsl.float_vector_types}:
+        return None
+    size = sizes.pop() if sizes else 1
+    type_ = ('int' if types == {'int'} else 
+             'float' if size == 1 else 
+             f'vec{size}')
+    return type_, [components * size if len(components) == 1 else components 
+                   for type_2, components in literals]
+
+def get_folded_components(type_, components):
+    '''
+    "get_folded_components" returns the literal for components that were computed
+    by a folding operation, rounded as glsl would round them, 
+    or None if any component is undefined or cannot be represented
+    '''
+    if None in components:
+        return None
+    if type_ == 'int':
+        return get_literal(type_, [get_int32(x) for x in components])
+    components = [get_float32(x) for x in components]
+    return None if None in components else get_literal(type_, components)
+
+def get_int_quotient(a, b):
+    '''
+    "get_int_quotient" divides ints, truncating toward zero as glsl does
+    '''
+    return abs(a) // abs(b) * (1 if (a < 0) == (b < 0) else -1) if b != 0 else None
+
+def get_folded_binary_expression(element, scope, a, b):
+    '''
+    "get_folded_binary_expression" evaluates arithmetic on literals
+    '''
+    literals = [get_literal_value(a), get_literal_value(b)]
+    broadcasted = get_broadcasted(literals) if None not in literals else None
+    if broadcasted is None:
+        return None
+    type_, (x, y) = broadcasted
+    operations = {
+        '+': lambda x, y: x + y,
+        '-': lambda x, y: x - y,
+        '*': lambda x, y: x * y,
+        '/': (get_int_quotient if type_ == 'int' else 
+              lambda x, y: x / y if y != 0 else None),
+    }
+    return get_folded_components(type_, [operations[element.operator](x2, y2) for x2, y2 in zip(x, y)])
+
+def get_folded_negation(element, scope, a):
+    '''
+    "get_folded_negation" rewrites negated literals to literals, such as `-vec2(1.0f)` to `vec2(-1.0f)`
+    '''
+    literal = get_literal_value(element)
+    if literal is None or is_literal_form(element):
+        return None
+    return get_literal(*literal)
+
+def get_folded_constructor(element, scope, **bindings):
+    '''
+    "get_folded_constructor" rewrites constructors of literals as literals,
+    such as `vec3(vec2(1.0f, 2.0f), 3)` to `vec3(1.0f, 2.0f, 3.0f)`
+    '''
+    literal = get_literal_value(element)
+    if literal is None or is_literal_form(element):
+        return None
+    return get_literal(*literal)
+
+def get_bool_value(element):
+    '''
+    "get_bool_value" returns the value of a bool literal,
+    possibly wrapped in parentheses, or None if the element is not one
+    '''
+    if isinstance(element, glsl.ParensExpression):
+        return get_bool_value(element.content)
+    return {'true': True, 'false': False}.get(element) if isinstance(element, str) else None
+
+def get_bool_literal(value):
+    return 'true' if value else 'false'
+
+'''
+"comparisons" maps the operators of relational and equality expressions to their implementations
+'''
+comparisons = {
+    '<':  lambda x, y: x < y,
+    '<=': lambda x, y: x <= y,
+    '>':  lambda x, y: x > y,
+    '>=': lambda x, y: x >= y,
+    '==': lambda x, y: x == y,
+    '!=': lambda x, y: x != y,
+}
+
+def get_folded_comparison(element, scope, a, b):
+    '''
+    "get_folded_comparison" evaluates comparisons of scalar literals,
+    and tests for equality between bool literals
+    '''
+    literals = [get_literal_value(a), get_literal_value(b)]
+    if None not in literals and all([len(components) == 1 for type_, components in literals]):
+        return get_bool_literal(comparisons[element.operator](literals[0][1][0], literals[1][1][0]))
+    values = [get_bool_value(a), get_bool_value(b)]
+    if None not in values and element.operator in ['==', '!=']:
+        return get_bool_literal(comparisons[element.operator](*values))
+    return None
+
+def get_folded_logical_expression(element, scope, a, b):
+    '''
+    "get_folded_logical_expression" evaluates logical operations where the value of an operand is known,
+    such as `true && $b` to `$b`.
+    The left operand is only dropped if evaluating it has no side effects.
+    '''
+    x, y = get_bool_value(a), get_bool_value(b)
+    # the value of an operand that decides the result on its own
+    deciding = {'&&': False, '||': True}[element.operator]
+    if x is not None and y is not None:
+        return get_bool_literal({'&&': x and y, '||': x or y}[element.operator])
+    elif x is not None:
+        return get_bool_literal(x) if x == deciding else b
+    elif y is not None and y != deciding:
         return a
-    else:
-        return glsl.AdditiveExpression(a, element.operator, b)
+    elif y is not None and glsl_cse.is_pure(a, scope):
+        return get_bool_literal(y)
+    return None
 
-def get_simplified_parens_expression(element, scope):
-    if isinstance(element.content, glsl.ParensExpression):
-        return get_simplified(element.content, scope)
-    else:
-        return glsl.ParensExpression(get_simplified(element.content, scope))
+def get_folded_not(element, scope, a):
+    value = get_bool_value(a)
+    return get_bool_literal(not value) if value is not None else None
+
+def get_folded_ternary_expression(element, scope, a, b, c):
+    '''
+    "get_folded_ternary_expression" selects the operand of a ternary expression whose condition is a literal
+    '''
+    value = get_bool_value(a)
+    return None if value is None else b if value else c
+
+def get_undefined_unless(condition, value):
+    return value() if condition else None
+
+'''
+"foldable_functions" maps built in functions that can be evaluated during conversion 
+to implementations that operate on a single component of each argument.
+Implementations return None wherever glsl leaves the result undefined.
+'''
+foldable_functions = [
+    ('radians',     lambda x: math.radians(x)),
+    ('degrees',     lambda x: math.degrees(x)),
+    ('sin',         lambda x: math.sin(x)),
+    ('cos',         lambda x: math.cos(x)),
+    ('tan',         lambda x: math.tan(x)),
+    ('asin',        lambda x: get_undefined_unless(abs(x) <= 1, lambda: math.asin(x))),
+    ('acos',        lambda x: get_undefined_unless(abs(x) <= 1, lambda: math.acos(x))),
+    ('atan',        lambda x: math.atan(x)),
+    ('atan',        lambda y, x: get_undefined_unless(x != 0 or y != 0, lambda: math.atan2(y, x))),
+    ('pow',         lambda x, y: get_undefined_unless(x > 0 or x == 0 and y > 0, lambda: math.pow(x, y))),
+    ('exp',         lambda x: math.exp(x)),
+    ('log',         lambda x: get_undefined_unless(x > 0, lambda: math.log(x))),
+    ('exp2',        lambda x: math.pow(2.0, x)),
+    ('log2',        lambda x: get_undefined_unless(x > 0, lambda: math.log2(x))),
+    ('sqrt',        lambda x: get_undefined_unless(x >= 0, lambda: math.sqrt(x))),
+    ('inversesqrt', lambda x: get_undefined_unless(x > 0, lambda: 1.0 / math.sqrt(x))),
+    ('abs',         lambda x: abs(x)),
+    ('sign',        lambda x: float((x > 0) - (x < 0))),
+    ('floor',       lambda x: float(math.floor(x))),
+    ('ceil',        lambda x: float(math.ceil(x))),
+    ('fract',       lambda x: x - math.floor(x)),
+    ('mod',         lambda x, y: get_undefined_unless(y != 0, lambda: x - y * math.floor(x / y))),
+    ('min',         lambda x, y: min(x, y)),
+    ('max',         lambda x, y: max(x, y)),
+    ('clamp',       lambda x, low, high: get_undefined_unless(low <= high, lambda: min(max(x, low), high))),
+    ('mix',         lambda x, y, a: x * (1.0 - a) + y * a),
+    ('step',        lambda edge, x: 0.0 if x < edge else 1.0),
+    ('smoothstep',  lambda edge0, edge1, x: get_undefined_unless(edge0 < edge1, lambda: 
+                        (lambda t: t * t * (3.0 - 2.0 * t))(min(max((x - edge0) / (edge1 - edge0), 0.0), 1.0)))),
+]
+
+def get_folded_invocation(function):
+    '''
+    "get_folded_invocation" returns a replacement for rewrite rules 
+    that evaluates a call to a built in function on float literals
+    '''
+    def get_folded(element, scope, **bindings):
+        literals = [get_literal_value(argument) for argument in element.arguments]
+        if None in literals or any([type_ not in ['float', *glsl.float_vector_types] for type_, components in literals]):
+            return None
+        broadcasted = get_broadcasted(literals)
+        if broadcasted is None:
+            return None
+        type_, arguments = broadcasted
+        try:
+            return get_folded_components(type_, [function(*components) for components in zip(*arguments)])
+        except (ArithmeticError, ValueError):
+            return None
+    return get_folded
+
+def get_propagated(element, constants):
+    '''
+    "get_propagated" returns a copy of an element grouped by glsl_rewrite.get_evaluation_grouped()
+    where references to the variables within `constants` are replaced with their values.
+    Declared names, assigned variables, invoked functions, and accessed attributes are left as they are.
+    '''
+    if isinstance(element, str):
+        return constants.get(element, element)
+    elif isinstance(element, list):
+        return [get_propagated(subelement, constants) for subelement in element]
+    elif isinstance(element, glsl.InvocationExpression):
+        return glsl.InvocationExpression(element.reference, get_propagated(element.arguments, constants))
+    elif isinstance(element, glsl.AttributeExpression):
+        return glsl.AttributeExpression(
+            get_propagated(element.reference, constants), 
+            [get_propagated(attribute, constants) if isinstance(attribute, glsl.BracketedExpression) else attribute
+             for attribute in element.attributes])
+    elif isinstance(element, glsl.AssignmentExpression):
+        result = copy.copy(element)
+        result.operand1 = (get_propagated(element.operand1, {}) 
+            if isinstance(element.operand1, glsl.AttributeExpression) else element.operand1)
+        result.operand2 = get_propagated(element.operand2, constants)
+        return result
+    elif isinstance(element, glsl.VariableDeclaration):
+        result = copy.copy(element)
+        result.content = get_propagated(element.content, constants)
+        return result
+    elif isinstance(element, glsl.GlslElement):
+        result = copy.copy(element)
+        for attribute in ['condition', 'declaration', 'operation', 'value', 'content', 'else_', 
+                          'operand1', 'operand2', 'operand3']:
+            if hasattr(element, attribute):
+                setattr(result, attribute, glsl_rewrite.get_wrapped(
+                    get_propagated(getattr(element, attribute), constants), result, attribute))
+        return result
+    return element
+
+def get_constant_values(scope, base_scope=None, base_values=None):
+    '''
+    "get_constant_values" returns a dictionary that maps the names of `const` variables 
+    within a scope to literals, for those whose values can be folded to literals.
+    Constants that `scope` inherits from `base_scope` are folded within `base_scope`,
+    since their values may refer to variables that are shadowed within `scope`.
+    If they were already folded, their values can be provided as `base_values`,
+    so that they are not folded again for every function within `base_scope`.
+    '''
+    if base_values is None:
+        base_values = get_constant_values(base_scope) if base_scope is not None else {}
+    result = {}
+    for name, value in scope.constants.items():
+        if base_scope is not None and base_scope.constants.get(name) is value:
+            if name in base_values:
+                result[name] = base_values[name]
+            continue
+        folded = get_simplified_content(value, scope, result)
+        if get_literal_value(folded) is not None or get_bool_value(folded) is not None:
+            result[name] = folded
+    return result
+
+'''
+"simplification_rules" lists the identities used by get_simplified(),
+see glsl_rewrite.py for how rules are declared and applied.
+Rules are tried in the order they are listed.
+'''
+simplification_rules = glsl_rewrite.RewriteSystem([
+    # parentheses that are not needed
+    glsl_rewrite.RewriteRule('(($a))', '($a)'),
+    glsl_rewrite.RewriteRule('($a)', '$a', 
+        lambda a, **context: isinstance(a, str) or type(a) in glsl.postfix_expression_or_less),
+    glsl_rewrite.RewriteRule('$a * ($b)', '$a * $b', 
+        lambda a, b, scope, **context: is_regroupable_product(b, scope)),
+    glsl_rewrite.RewriteRule('($a) * $b', '$a * $b', 
+        lambda a, b, **context: isinstance(a, glsl.MultiplicativeExpression)),
+    glsl_rewrite.RewriteRule('($a) / $b', '$a / $b', 
+        lambda a, b, **context: isinstance(a, glsl.MultiplicativeExpression)),
+    glsl_rewrite.RewriteRule('($a) + $b', '$a + $b', 
+        lambda a, b, **context: isinstance(a, (glsl.AdditiveExpression, glsl.MultiplicativeExpression))),
+    glsl_rewrite.RewriteRule('($a) - $b', '$a - $b', 
+        lambda a, b, **context: isinstance(a, (glsl.AdditiveExpression, glsl.MultiplicativeExpression))),
+    glsl_rewrite.RewriteRule('$a + ($b)', '$a + $b', 
+        lambda a, b, **context: isinstance(b, (glsl.AdditiveExpression, glsl.MultiplicativeExpression))),
+    glsl_rewrite.RewriteRule('$a - ($b)', '$a - $b', 
+        lambda a, b, **context: isinstance(b, glsl.MultiplicativeExpression)),
+    # constant folding
+    glsl_rewrite.RewriteRule('$a * $b', get_folded_binary_expression),
+    glsl_rewrite.RewriteRule('$a / $b', get_folded_binary_expression),
+    glsl_rewrite.RewriteRule('$a + $b', get_folded_binary_expression),
+    glsl_rewrite.RewriteRule('$a - $b', get_folded_binary_expression),
+    glsl_rewrite.RewriteRule('-$a', get_folded_negation),
+    glsl_rewrite.RewriteRule('+$a', '$a', lambda a, **context: get_literal_value(a) is not None),
+    *[glsl_rewrite.RewriteRule(f'{type_}($a)', get_folded_constructor) 
+      for type_ in ['float', *glsl.float_vector_types]],
+    *[glsl_rewrite.RewriteRule(f'{type_}($a, $b)', get_folded_constructor) 
+      for type_ in glsl.float_vector_types],
+    *[glsl_rewrite.RewriteRule(f'{type_}($a, $b, $c)', get_folded_constructor) 
+      for type_ in glsl.float_vector_types[1:]],
+    glsl_rewrite.RewriteRule('vec4($a, $b, $c, $d)', get_folded_constructor),
+    *[glsl_rewrite.RewriteRule(
+        f'{name}({", ".join(["$"+chr(ord("a")+i) for i in range(function.__code__.co_argcount)])})', 
+        get_folded_invocation(function))
+      for name, function in foldable_functions],
+    *[glsl_rewrite.RewriteRule(f'$a {operator} $b', get_folded_comparison) for operator in comparisons],
+    *[glsl_rewrite.RewriteRule(f'$a {operator} $b', get_folded_logical_expression) for operator in ['&&', '||']],
+    glsl_rewrite.RewriteRule('!$a', get_folded_not),
+    glsl_rewrite.RewriteRule('$a ? $b : $c', get_folded_ternary_expression),
+    # multiplicative identities
+    glsl_rewrite.RewriteRule('$a * $b', get_0, lambda a, b, **context: is_0(a) or is_0(b)),
+    glsl_rewrite.RewriteRule('$a / $b', get_0, lambda a, b, **context: is_0(a)),
+    glsl_rewrite.RewriteRule('dot($a, $b)', get_0, lambda a, b, **context: is_0(a) or is_0(b)),
+    glsl_rewrite.RewriteRule('$a * $b', get_identity_b, lambda a, b, **context: is_1(a)),
+    glsl_rewrite.RewriteRule('$a * $b', get_identity_a, lambda a, b, **context: is_1(b)),
+    glsl_rewrite.RewriteRule('$a / $b', get_identity_a, lambda a, b, **context: is_1(b)),
+    # additive identities
+    glsl_rewrite.RewriteRule('$a + $b', get_identity_a, lambda a, b, **context: is_0(b)),
+    glsl_rewrite.RewriteRule('$a - $b', get_identity_a, lambda a, b, **context: is_0(b)),
+    glsl_rewrite.RewriteRule('$a - $b', get_negated_identity_b, lambda a, b, **context: is_0(a)),
+    glsl_rewrite.RewriteRule('$a + $b', get_identity_b, lambda a, b, **context: is_0(a)),
+    glsl_rewrite.RewriteRule('$a + $a', get_doubled),
+    glsl_rewrite.RewriteRule('$a - $a', get_0),
+])
 
-def get_simplified_function_declaration(in_element, scope):
-    out_element = copy.deepcopy(in_element)
-    out_element.content = get_simplified(in_element.content, scope.get_subscope(in_element))
-    return out_element
+'''
+"canonical_types" lists the types of sums and products that get_canonical() rearranges,
+since their operations are commutative and associative, at least for real numbers
+'''
+canonical_types = ['float', *glsl.float_vector_types]
 
-def get_simplified_default_element(in_element, scope):
-    out_element = copy.deepcopy(in_element)
-    for attribute in glsl.element_attributes:
-        if hasattr(in_element, attribute):
-            setattr(out_element, attribute, get_simplified(in_element.__dict__[attribute], scope))
-    return out_element
+def get_product(coefficient, powers):
+    '''
+    "get_product" returns an expression for a coefficient multiplied by powers of factors,
+    where `powers` maps the equivalence key of each factor to a list containing the factor, 
+    its exponent, and whether it was raised to that power using pow().
+    Factors are sorted by their keys, and integer powers that were not written with pow() 
+    are written as repeated multiplication or division, since pow() is undefined for negative bases.
+    Factors with negative exponents are gathered into a single division.
+    '''
+    numerator = []
+    denominator = []
+    for key in sorted(powers):
+        factor, exponent, is_pow = powers[key]
+        if exponent == 0:
+            continue
+        elif is_pow:
+            (numerator if exponent > 0 else denominator).append(factor if abs(exponent) == 1 else 
+                glsl.InvocationExpression('pow', [factor, get_literal('float', [abs(exponent)])]))
+        else:
+            (numerator if exponent > 0 else denominator).extend([factor] * abs(int(exponent)))
+    if coefficient == -1 and len(numerator) > 0:
+        numerator[0] = glsl.PreIncrementExpression(
+            glsl_rewrite.get_wrapped(numerator[0], glsl.PreIncrementExpression(), 'operand1'), '-')
+    elif coefficient != 1 or len(numerator) < 1:
+        numerator.insert(0, get_literal('float', [coefficient]))
+    result = numerator[0]
+    for factor in numerator[1:]:
+        result = glsl_rewrite.get_binary_expression(glsl.MultiplicativeExpression, result, '*', factor)
+    if len(denominator) > 0:
+        divisor = denominator[0]
+        for factor in denominator[1:]:
+            divisor = glsl_rewrite.get_binary_expression(glsl.MultiplicativeExpression, divisor, '*', factor)
+        result = glsl_rewrite.get_binary_expression(glsl.MultiplicativeExpression, result, '/', divisor)
+    return result
+
+def get_canonical(element, scope, budget=None):
+    '''
+    "get_canonical" returns a copy of an element grouped by glsl_rewrite.get_evaluation_grouped(),
+    where chains of sums and products are flattened, their operands are sorted,
+    like terms are collected, such as `x + 2.0f * x` to `3.0f * x`, 
+    and like factors are collected, such as `a * b * a` to `a * a * b`,
+    or `pow(x, 2.0f) * x` to `pow(x, 3.0f)`.
+    Only sums and products of floats and float vectors are rearranged, 
+    and only if they are free of side effects and matrices,
+    and only if glsl_cost.py does not estimate the result to be more expensive.
+    Every factor or term that is combined with a like one is counted against `budget`, if provided,
+    and nothing more is rearranged once it is exhausted.
+    Like floating point arithmetic that is relaxed by a glsl compiler,
+    results may be rounded differently.
+    '''
+    quiet_scope = scope.get_quiet_scope()
+    costs = {}
+
+    def get_cost(element):
+        # costs are stored by id, so the element is stored to keep its id from being reused
+        if id(element) not in costs:
+            costs[id(element)] = (glsl_cost.get_cost(element, quiet_scope), element)
+        return costs[id(element)][0]
+
+    def get_monomial(element):
+        '''
+        "get_monomial" returns the coefficient and powers of a product, 
+        as described by get_product(), or None if it cannot be rearranged
+        '''
+        coefficient = 1.0
+        powers = {}
+        def add(factor, exponent, is_pow):
+            key = glsl_rewrite.get_equivalence_key(factor)
+            if key in powers:
+                if budget is not None and not budget.spend():
+                    return False
+                powers[key][1] += exponent
+                powers[key][2] = powers[key][2] or is_pow
+            else:
+                powers[key] = [factor, exponent, is_pow]
+            return True
+        def visit_factor(element, exponent):
+            nonlocal coefficient
+            literal = get_literal_value(element)
+            if isinstance(element, glsl.MultiplicativeExpression):
+                return (visit_factor(element.operand1, exponent) and 
+                        visit_factor(element.operand2, exponent if element.operator == '*' else -exponent))
+            elif (isinstance(element, glsl.ParensExpression) and 
+                  isinstance(element.content, (glsl.MultiplicativeExpression, glsl.PreIncrementExpression))):
+                return visit_factor(element.content, exponent)
+            elif literal is not None and literal[0] in ['float', 'int']:
+                value = literal[1][0]
+                if value == 0 and exponent < 0:
+                    return False
+                coefficient *= value ** exponent
+                return True
+            elif isinstance(element, glsl.PreIncrementExpression) and element.operator in '+-':
+                coefficient *= -1 if element.operator == '-' else 1
+                return visit_factor(element.operand1, exponent)
+            elif (isinstance(element, glsl.InvocationExpression) and element.reference == 'pow' and 
+                  len(element.arguments) == 2 and get_literal_value(element.arguments[1]) is not None and
+                  get_literal_value(element.arguments[1])[0] == 'float'):
+                factor = visit(element.arguments[0])
+                if quiet_scope.deduce_type(factor) not in canonical_types:
+                    return False
+                return add(factor, exponent * get_literal_value(element.arguments[1])[1][0], True)
+            else:
+                if quiet_scope.deduce_type(element) not in canonical_types:
+                    return False
+                factor = visit(element)
+                # a factor may have been simplified to a product, such as `(x + x)` to `2.0f * x`
+                if (isinstance(factor, glsl.ParensExpression) and 
+                    isinstance(factor.content, (glsl.MultiplicativeExpression, glsl.PreIncrementExpression)) or 
+                    get_literal_value(factor) is not None and get_literal_value(factor)[0] in ['float', 'int']):
+                    return visit_factor(factor, exponent)
+                return add(factor, exponent, False)
+        if not visit_factor(element, 1):
+            return None
+        return coefficient, powers
+
+    def get_canonical_product(element):
+        monomial = get_monomial(element)
+        if monomial is None:
+            return None
+        coefficient, powers = monomial
+        if get_float32(coefficient) is None:
+            return None
+        return get_product(get_float32(coefficient), powers)
+
+    def get_canonical_sum(element):
+        terms = []
+        def visit_term(element, sign):
+            if isinstance(element, glsl.AdditiveExpression):
+                visit_term(element.operand1, sign)
+                visit_term(element.operand2, sign if element.operator == '+' else -sign)
+            elif (isinstance(element, glsl.ParensExpression) and 
+                  isinstance(element.content, glsl.AdditiveExpression)):
+                visit_term(element.content, sign)
+            else:
+                terms.append((sign, element))
+        visit_term(element, 1)
+        collected = {}
+        for sign, term in terms:
+            monomial = get_monomial(term)
+            if monomial is None:
+                factor = visit(term)
+                monomial = (1.0, {glsl_rewrite.get_equivalence_key(factor): [factor, 1, False]})
+            coefficient, powers = monomial
+            key = tuple(sorted([(key, exponent, is_pow) 
+                for key, (factor, exponent, is_pow) in powers.items() if exponent != 0]))
+            if key in collected:
+                if budget is not None and not budget.spend():
+                    return None
+                collected[key][0] += sign * coefficient
+            else:
+                collected[key] = [sign * coefficient, powers]
+        monomials = []
+        for key, (coefficient, powers) in collected.items():
+            coefficient = get_float32(coefficient)
+            if coefficient is None:
+                return None
+            if coefficient != 0:
+                monomials.append((coefficient < 0, len(key) < 1, key, coefficient, powers))
+        if len(monomials) < 1:
+            return get_0_for_element(element, scope)
+        monomials.sort(key=lambda monomial: monomial[:3])
+        result = get_product(monomials[0][3], monomials[0][4])
+        for is_negative, is_constant, key, coefficient, powers in monomials[1:]:
+            result = glsl_rewrite.get_binary_expression(glsl.AdditiveExpression, 
+                result, '-' if is_negative else '+', get_product(abs(coefficient), powers))
+        return result
+
+    def visit(element):
+        if budget is not None and budget.is_exhausted():
+            return element
+        if (isinstance(element, (glsl.AdditiveExpression, glsl.MultiplicativeExpression)) and 
+            quiet_scope.deduce_type(element) in canonical_types and 
+            glsl_cse.is_pure(element, quiet_scope)):
+            result = (get_canonical_sum(element) if isinstance(element, glsl.AdditiveExpression) else 
+                      get_canonical_product(element))
+            # the canonical form is skipped where it is more expensive, 
+            # such as where sorting would divide a vector where a scalar was divided before
+            if result is not None and get_cost(result) <= get_cost(element):
+                return result
+        return glsl_rewrite.get_mapped(element, visit)
 
-def get_simplified(element, scope):
+    return visit(element)
+
+def get_simplified_content(element, scope, constants, egraph=False, budget=None):
+    '''
+    "get_simplified_content" simplifies an element that is found within `scope`,
+    after replacing references to `constants` with their values.
+    If `egraph` is set, small expressions are then optimized by glsl_egraph.py.
+    If `budget` is provided, see pypeg2glsl.Budget, elements that are too large
+    are returned as they are, and the best result so far is returned once it is exhausted.
+    '''
+    budget = budget.get_started() if budget is not None else None
+    if budget is not None and not budget.fits(glsl_cse.get_size(element)):
+        return element
+    element = get_propagated(glsl_rewrite.get_evaluation_grouped(element), constants)
+    element = simplification_rules.get_normal_form(element, scope, budget)
+    if budget is None or not budget.is_exhausted():
+        element = simplification_rules.get_normal_form(get_canonical(element, scope, budget), scope, budget)
+    if egraph and (budget is None or not budget.is_exhausted()):
+        element = simplification_rules.get_normal_form(glsl_egraph.get_optimized(element, scope), scope, budget)
+    return glsl_rewrite.get_text_grouped(element)
+
+def get_pruned_statement(statement, counts):
+    '''
+    "get_pruned_statement" returns a list of statements that replace `statement`,
+    where if statements whose conditions are bool literals are replaced with the branch that is taken.
+    The statements of a branch are only moved out of it if the variables it declares 
+    are declared nowhere else within the function, as counted by `counts`, 
+    otherwise the branch is kept within an `if (true)` statement.
+    '''
+    if type(statement) not in glsl.code_block_element_types:
+        return [statement]
+    out_statement = copy.copy(statement)
+    for attribute in ['content', 'else_']:
+        content = getattr(statement, attribute, None)
+        if isinstance(content, list):
+            setattr(out_statement, attribute, get_pruned_code_block(content, counts))
+        elif isinstance(content, glsl.GlslElement):
+            pruned = get_pruned_statement(content, counts)
+            setattr(out_statement, attribute, pruned[0] if len(pruned) == 1 else pruned)
+    value = get_bool_value(out_statement.condition) if isinstance(statement, glsl.IfStatement) else None
+    if value is None:
+        return [out_statement]
+    branch = out_statement.content if value else out_statement.else_
+    branch = branch if isinstance(branch, list) else [branch]
+    if all([counts[name] == 1 for name in glsl_cse.get_declared_variables(branch)]):
+        return branch
+    return [glsl.IfStatement('true', branch)]
+
+def get_pruned_code_block(statements, counts):
+    '''
+    "get_pruned_code_block" behaves like get_pruned_statement() for a list of statements
+    '''
+    return [pruned for statement in statements for pruned in get_pruned_statement(statement, counts)]
+
+def get_simplified_function_declaration(in_element, scope, egraph=False, budget=None, dce=False, constants=None):
+    budget = budget.get_started() if budget is not None else None
+    subscope = scope.get_subscope(in_element)
+    out_element = copy.copy(in_element)
+    out_element.content = get_simplified_content(
+        in_element.content, subscope, get_constant_values(subscope, scope, constants), egraph, budget)
+    if budget is not None:
+        budget.report(scope.diagnostics, in_element)
+    # branches are pruned twice, since variables that are declared within many branches
+    # may only be declared once after the first, so that their branches can be moved out of `if (true)`
+    for i in range(2):
+        counts = collections.Counter([
+            *[parameter.name for parameter in in_element.parameters],
+            *glsl_cse.get_declared_variables(out_element.content)])
+        out_element.content = get_pruned_code_block(out_element.content, counts)
+    # simplification often leaves variables that are no longer read
+    return glsl_dce.get_eliminated_function_declaration(out_element, scope) if dce else out_element
+
+def get_simplified(element, scope, egraph=False, budget=None, dce=False, constants=None):
     assert_type(element, [str, list, glsl.GlslElement])
     ''' 
     "get_simplified" is a pure function that 
@@ -135,35 +840,47 @@ def get_simplified(element, scope):
     We simplify code in a separate step as it allows us to vastly simplify 
     logic elsewhere in code that would otherwise need to express this 
     simplification logic themselves. 
+    Identities are applied by glsl_rewrite.py, as listed in simplification_rules.
+    Arithmetic on literals is evaluated, and `const` variables whose values are literals 
+    are replaced with their values.
+    Comparisons and logical operations on literals are evaluated as well,
+    and if statements whose conditions are literals are replaced with the branch that is taken.
+    Sums and products are then put in the canonical form described by get_canonical().
+    If `egraph` is set, small expressions are then replaced with the cheapest
+    equivalent expressions that can be found by glsl_egraph.py.
+    If a pypeg2glsl.Budget is provided as `budget`, its limits apply to each function separately.
+    A function that exhausts it is simplified only as far as the budget allows, 
+    and this is reported in the diagnostics of `scope`.
+    If `dce` is set, variables that are no longer read once functions are simplified 
+    are then removed by glsl_dce.py.
+    The values of `const` variables within `scope` are found once by get_constant_values(),
+    unless they are provided as `constants`, and shared between all elements of a list.
     '''
-    simplification_map = {
-        (str,  lambda element, scope: element),
-        (list, lambda element, scope: [get_simplified(element, scope) for element in element]),
-        (glsl.MultiplicativeExpression,  get_simplified_multiplicative_expression),
-        (glsl.AdditiveExpression,        get_simplified_additive_expression),
-        (glsl.ParensExpression,          get_simplified_parens_expression),
-        (glsl.FunctionDeclaration,       get_simplified_function_declaration),
-    }
-    for Rule, get_simplification_rule in simplification_map:
-        if isinstance(element, Rule):
-            simplified = get_simplification_rule(element, scope)
-            assert_type(simplified, [str, list, glsl.GlslElement])
-            return simplified
-    # if no rule is found, run the default simplifier
-    return get_simplified_default_element(element, scope)
+    constants = constants if constants is not None else get_constant_values(scope)
+    if isinstance(element, list):
+        return [get_simplified(subelement, scope, egraph, budget, dce, constants) for subelement in element]
+    elif isinstance(element, glsl.FunctionDeclaration):
+        return get_simplified_function_declaration(element, scope, egraph, budget, dce, constants)
+    else:
+        return get_simplified_content(element, scope, constants, egraph, budget)
 
 
-def convert_glsl(input_glsl):
+def convert_glsl(input_glsl, diagnostics=None, base_scope=None, egraph=False, budget=None, dce=False):
     ''' 
     "convert_glsl" is a pure function that performs 
     a transformation on a parse tree of glsl as represented by pypeg2glsl,
     then returns a transformed parse tree as output. 
+    Problems found along the way are recorded in `diagnostics`, if provided.
+    Declarations outside input_glsl can be provided using `base_scope`.
+    If `egraph` is set, expressions are also optimized by glsl_egraph.py.
+    If a pypeg2glsl.Budget is provided as `budget`, it limits the work done on each function.
+    If `dce` is set, dead code is then removed by glsl_dce.py.
     '''
-    output_glsl = get_simplified(input_glsl, glsl.LexicalScope(input_glsl))
+    output_glsl = get_simplified(input_glsl, glsl.LexicalScope(input_glsl, diagnostics, base_scope), egraph, budget, dce)
     glsl.warn_of_invalid_grammar_elements(output_glsl)
     return output_glsl
 
-def convert_text(input_text):
+def convert_text(input_text, diagnostics=None, base_scope=None, egraph=False, budget=None, dce=False):
     ''' 
     "convert_text" is a pure function that performs 
     a transformation on a string containing glsl code,
@@ -174,11 +891,13 @@ def convert_text(input_text):
     or performing simple string substitutions 
     '''
     input_glsl = peg.parse(input_text, glsl.code)
-    output_glsl = convert_glsl(input_glsl)
+    output_glsl = convert_glsl(input_glsl, diagnostics, base_scope, egraph, budget, dce)
     output_text = peg.compose(output_glsl, glsl.code, autoblank = False) 
     return output_text
 
-def convert_file(input_filename=False, in_place=False, verbose=False):
+def convert_file(input_filename=False, in_place=False, verbose=False, 
+        diagnostics_format='text', diagnostics_limit=None, index_filename=None,
+        include_paths=None, include_cache=None, egraph=False, budget=None, dce=False):
     ''' 
     "convert_file" performs a transformation on a file containing glsl code
     It may either print out transformed contents or replace the file, 
@@ -210,7 +929,13 @@ def convert_file(input_filename=False, in_place=False, verbose=False):
         for line in sys.stdin:
             input_text += line
 
-    output_text = convert_text(input_text)
+    diagnostics = glsl.Diagnostics(diagnostics_limit)
+    base_scope = glsl_index.ProjectIndex.load(index_filename).get_scope() if index_filename else None
+    include_resolver = glsl_include.IncludeResolver(include_paths, include_cache)
+    base_scope = include_resolver.get_scope(input_text, input_filename, base_scope)
+    include_resolver.save()
+    output_text = convert_text(input_text, diagnostics, base_scope, egraph, budget, dce)
+    diagnostics.report(diagnostics_format)
 
     if verbose:
         diff = difflib.ndiff(
@@ -239,9 +964,39 @@ if __name__ == '__main__':
         help='edit the file in-place', action='store_true')
     parser.add_argument('-v', '--verbose', dest='verbose', 
         help='show debug information', action='store_true')
+    parser.add_argument('--egraph', dest='egraph', 
+        help='also search for the cheapest equivalent form of small expressions using an e-graph', action='store_true')
+    parser.add_argument('--dce', dest='dce', 
+        help='also remove variables that are no longer read once simplified, see glsl_dce.py', action='store_true')
+    parser.add_argument('--iteration-limit', dest='iteration_limit', type=int, default=200000,
+        help='stop simplifying a function after N rewrites', metavar='N')
+    parser.add_argument('--node-limit', dest='node_limit', type=int, default=20000,
+        help='leave functions with more than N elements in their parse tree as they are', metavar='N')
+    parser.add_argument('--time-limit', dest='time_limit', type=float, default=30.0,
+        help='stop simplifying a function after SECONDS', metavar='SECONDS')
+    parser.add_argument('--diagnostics', dest='diagnostics_format', choices=['text', 'json', 'none'], default='text',
+        help='specify whether to report diagnostics to stderr as text, as json, or not at all', 
+    )
+    parser.add_argument('--diagnostics-limit', dest='diagnostics_limit', type=int, default=100,
+        help='maximum number of diagnostics to record', metavar='N',
+    )
+    parser.add_argument('--index', dest='index_filename', 
+        help='seed type information from an index built by glsl_index.py', metavar='FILE')
+    parser.add_argument('-I', '--include-path', dest='include_paths', action='append',
+        help='search DIRECTORY for headers named by #include directives', metavar='DIRECTORY')
+    parser.add_argument('--include-cache', dest='include_cache',
+        help='store parsed header declarations in FILE between runs', metavar='FILE')
     args = parser.parse_args()
     convert_file(
         args.filename, 
         in_place=args.in_place, 
         verbose=args.verbose, 
+        diagnostics_format=args.diagnostics_format, 
+        diagnostics_limit=args.diagnostics_limit, 
+        index_filename=args.index_filename, 
+        include_paths=args.include_paths, 
+        include_cache=args.include_cache, 
+        egraph=args.egraph, 
+        dce=args.dce, 
+        budget=glsl.Budget(args.iteration_limit, args.node_limit, args.time_limit),
     )
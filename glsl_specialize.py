@@ -0,0 +1,353 @@
+#!/bin/env python3
+
+"""
+"glsl_specialize.py" creates variants of glsl code where the values
+of some `uniform` or `const` variables are known ahead of time,
+such as a shader that is built once for every level of quality.
+Values are bound to variables by name, such as `QUALITY=2` or `FOG_COLOR=vec3(0.5)`.
+The declarations of bound variables are replaced with `const` declarations of their values,
+then the code is simplified by glsl_simplify.py, which replaces references to them with their values,
+folds the expressions that use them, replaces `if` statements whose conditions become literals
+with the branch that is taken, and removes variables that are no longer used, see glsl_dce.py.
+
+Only variables that are declared outside of functions with a `uniform` or `const` qualifier can be bound.
+Values whose types do not match the declaration are converted explicitly, such as `float(2)`.
+Many variants can be created from a single file, in which case it is parsed only once,
+and declarations found by `--index` or `#include` directives are only gathered once.
+
+The command line interface for this script is meant to resemble sed.
+You can select a file using the `-f` argument.
+By default, the script will print out the results of a "dry run".
+You can modify the file in-place using the `-i` flag.
+You can print a diff between input and output using the `-v` flag.
+
+For basic usage on a single file, call like so:
+  python3 ./glsl_specialize.py -f file.glsl.c -D QUALITY=2 -D USE_FOG=true
+
+To create many variants at once, call like so:
+  python3 ./glsl_specialize.py -f file.glsl.c -D USE_FOG=true \
+      --variant QUALITY=1 --variant QUALITY=2 --output file.{index}.glsl.c
+"""
+
+
+import copy
+import difflib
+import string
+import sys
+
+import pypeg2 as peg
+import pypeg2glsl as glsl
+import glsl_index
+import glsl_include
+import glsl_inline
+import glsl_simplify
+
+# attempt to import colorama, for colored diff output
+try:
+    from colorama import Fore, Back, Style, init
+    init()
+except ImportError:  # fallback so that the imported classes always exist
+    class ColorFallback():
+        __getattr__ = lambda self, name: ''
+    Fore = Back = Style = ColorFallback()
+
+def assert_type(variable, types):
+    if len(types) == 1 and not isinstance(variable, types[0]):
+        raise AssertionError(f'expected {types[0]} but got {type(variable)} (value: {variable})')
+    if not any([isinstance(variable, type_) for type_ in types]):
+        raise AssertionError(f'expected any of {types} but got {type(variable)} (value: {variable})')
+
+'''
+"bindable_qualifiers" lists the qualifiers of variables whose values can be bound
+'''
+bindable_qualifiers = ['uniform', 'const']
+
+def get_value(value):
+    '''
+    "get_value" returns the parse tree for a value that is bound to a variable,
+    which may be given either as glsl text or as a parse tree
+    '''
+    try:
+        return peg.parse(value, glsl.ternary_expression_or_less) if isinstance(value, str) else value
+    except SyntaxError as error:
+        raise ValueError(f'"{value}" is not a valid glsl expression, cannot specialize code') from error
+
+def get_binding(text):
+    '''
+    "get_binding" returns the name and value of a binding written as `name=value`
+    '''
+    name, separator, value = text.partition('=')
+    name = name.strip()
+    if not separator or not glsl.token.fullmatch(name):
+        raise ValueError(f'"{text}" is not a binding of the form name=value')
+    return name, get_value(value.strip())
+
+def get_output_pattern(pattern, variant_count=1):
+    '''
+    "get_output_pattern" returns a pattern for the names of output files if it is valid,
+    that is, if `{index}` is its only replacement field, and it is present whenever there are many variants.
+    A ValueError is raised otherwise, rather than failing once the variants have been created.
+    '''
+    try:
+        fields = [field for _, field, _, _ in string.Formatter().parse(pattern) if field is not None]
+    except ValueError as error:
+        raise ValueError(f'"{pattern}" is not a valid output pattern: {error}') from error
+    for field in fields:
+        if field != 'index':
+            raise ValueError(f'"{pattern}" is not a valid output pattern: '
+                             f'unknown field "{{{field}}}", only {{index}} can be used')
+    if variant_count > 1 and not fields:
+        raise ValueError(f'"{pattern}" is not a valid output pattern: '
+                         f'{{index}} is required to write {variant_count} variants to different files')
+    return pattern
+
+def get_bound_declaration(declaration, values, scope):
+    '''
+    "get_bound_declaration" returns a list of declarations that replace a global VariableDeclaration,
+    where the variables within `values` are declared `const` with their values,
+    and any other variables are declared as they were.
+    '''
+    initializers = glsl.LexicalScope.get_initializers(declaration)
+    bound = [name for name in initializers if name in values]
+    if not bound or not any([qualifier in bindable_qualifiers for qualifier in declaration.qualifiers]):
+        return [declaration]
+    # precision qualifiers are kept, but a constant cannot also be a uniform, attribute, or varying
+    qualifiers = ['const', *[qualifier for qualifier in declaration.qualifiers
+                             if qualifier in ['highp', 'mediump', 'lowp']]]
+    result = []
+    content = declaration.content if isinstance(declaration.content, list) else [declaration.content]
+    unbound = [element for element in content
+               if (element.operand1 if isinstance(element, glsl.AssignmentExpression) else element) not in bound]
+    if unbound:
+        remainder = copy.copy(declaration)
+        remainder.content = unbound
+        result.append(remainder)
+    for name in bound:
+        result.append(glsl.VariableDeclaration(declaration.type,
+            [glsl.AssignmentExpression(name, '=', glsl_inline.get_converted(values[name], declaration.type, scope))],
+            qualifiers))
+    return result
+
+def get_bound(code, scope, bindings):
+    '''
+    "get_bound" is a pure function that returns a copy of a list of glsl declarations
+    where the variables within `bindings` are declared `const` with the values they are bound to,
+    as glsl text or parse trees.
+    A ValueError is raised if any of them are not declared as `uniform` or `const` variables.
+    '''
+    values = {name: get_value(value) for name, value in bindings.items()}
+    bindable = {
+        name
+        for element in code
+        if isinstance(element, glsl.VariableDeclaration) and
+           any([qualifier in bindable_qualifiers for qualifier in element.qualifiers])
+        for name in element.get_names()
+    }
+    for name in values:
+        if name not in bindable:
+            raise ValueError(f'"{name}" is not declared as a uniform or const variable, cannot specialize code')
+    return [
+        bound
+        for element in code
+        for bound in (get_bound_declaration(element, values, scope)
+                      if isinstance(element, glsl.VariableDeclaration) else [element])
+    ]
+
+def get_specialized_scope(scope, code):
+    '''
+    "get_specialized_scope" returns a copy of a scope where `const` variables
+    are those declared within `code`, as returned by get_bound(),
+    so that the scope does not need to be gathered again for every variant of the code
+    '''
+    result = copy.copy(scope)
+    result.constants = {**scope.constants, **glsl.LexicalScope.get_global_constant_lookups(code)}
+    return result
+
+def get_specialized(code, scope, bindings, budget=None):
+    '''
+    "get_specialized" is a pure function that returns a copy of a list of glsl declarations
+    where the variables within `bindings` are replaced with the values they are bound to,
+    then simplified as described at the top of this file.
+    `scope` is the LexicalScope of `code` before it is specialized,
+    which is reused so that it can be shared between variants.
+    If a pypeg2glsl.Budget is provided as `budget`, it limits the work done to simplify each function.
+    '''
+    assert_type(code, [list])
+    bound = get_bound(code, scope, bindings)
+    return glsl_simplify.get_simplified(bound, get_specialized_scope(scope, bound), budget=budget, dce=True)
+
+def get_variants(code, scope, variants, budget=None):
+    '''
+    "get_variants" returns a list containing the result of get_specialized()
+    for every dictionary of bindings within `variants`,
+    reusing the same parse tree and scope for every variant
+    '''
+    return [get_specialized(code, scope, bindings, budget) for bindings in variants]
+
+def convert_glsl(input_glsl, bindings, diagnostics=None, base_scope=None, budget=None):
+    '''
+    "convert_glsl" is a pure function that performs
+    a transformation on a parse tree of glsl as represented by pypeg2glsl,
+    then returns a transformed parse tree as output.
+    Problems found along the way are recorded in `diagnostics`, if provided.
+    Declarations outside input_glsl can be provided using `base_scope`.
+    `bindings` maps the names of variables to the values they are bound to.
+    '''
+    output_glsl = get_specialized(input_glsl, glsl.LexicalScope(input_glsl, diagnostics, base_scope), bindings, budget)
+    glsl.warn_of_invalid_grammar_elements(output_glsl)
+    return output_glsl
+
+def convert_text(input_text, variants, diagnostics=None, base_scope=None, budget=None):
+    '''
+    "convert_text" is a pure function that performs
+    a transformation on a string containing glsl code,
+    then returns a list of transformed output, one for every dictionary of bindings within `variants`.
+    The input is parsed once for all variants.
+    '''
+    input_glsl = peg.parse(input_text, glsl.code)
+    scope = glsl.LexicalScope(input_glsl, diagnostics, base_scope)
+    output_texts = []
+    for output_glsl in get_variants(input_glsl, scope, variants, budget):
+        glsl.warn_of_invalid_grammar_elements(output_glsl)
+        output_texts.append(peg.compose(output_glsl, glsl.code, autoblank = False))
+    return output_texts
+
+def convert_file(input_filename=False, in_place=False, verbose=False,
+        diagnostics_format='text', diagnostics_limit=None, index_filename=None,
+        include_paths=None, include_cache=None, variants=None, output_pattern=None, budget=None):
+    '''
+    "convert_file" performs a transformation on a file containing glsl code
+    It may either print out transformed contents or replace the file,
+    depending on the value of `in_place`.
+    If many variants are given, they are either printed one after another,
+    or written to files named by `output_pattern`, where `{index}` is replaced with
+    the index of the variant.
+    '''
+
+    def colorize_diff(diff):
+        '''
+        "colorize_diff" colorizes text output from the difflib library
+        for display in the command line
+        All credit goes to:
+        https://chezsoi.org/lucas/blog/colored-diff-output-with-python.html
+        '''
+        for line in diff:
+            if line.startswith('+'):
+                yield Fore.GREEN + line + Fore.RESET
+            elif line.startswith('-'):
+                yield Fore.RED + line + Fore.RESET
+            elif line.startswith('^'):
+                yield Fore.BLUE + line + Fore.RESET
+            else:
+                yield line
+
+    variants = variants if variants is not None else [{}]
+    if output_pattern:
+        get_output_pattern(output_pattern, len(variants))
+    input_text = ''
+    if input_filename:
+        with open(input_filename, 'r+') as input_file:
+            input_text = input_file.read()
+    else:
+        for line in sys.stdin:
+            input_text += line
+
+    diagnostics = glsl.Diagnostics(diagnostics_limit)
+    base_scope = glsl_index.ProjectIndex.load(index_filename).get_scope() if index_filename else None
+    include_resolver = glsl_include.IncludeResolver(include_paths, include_cache)
+    base_scope = include_resolver.get_scope(input_text, input_filename, base_scope)
+    include_resolver.save()
+    output_texts = convert_text(input_text, variants, diagnostics, base_scope, budget)
+    diagnostics.report(diagnostics_format)
+
+    for index, (bindings, output_text) in enumerate(zip(variants, output_texts)):
+        if verbose:
+            diff = difflib.ndiff(
+                input_text.splitlines(keepends=True),
+                output_text.splitlines(keepends=True)
+            )
+            for line in colorize_diff(diff):
+                print(line)
+
+        if output_pattern:
+            with open(output_pattern.format(index=index), 'w') as output_file:
+                output_file.write(output_text)
+        elif in_place:
+            with open(input_filename, 'w') as output_file:
+                output_file.write(output_text)
+                output_file.truncate()
+        elif len(variants) > 1:
+            print(f'// variant {index}: ' + ', '.join([
+                f'{name}={value if isinstance(value, str) else peg.compose(value, type(value))}'
+                for name, value in bindings.items()]))
+            print(output_text)
+        else:
+            print(output_text)
+
+if __name__ == '__main__':
+    import argparse
+
+    assert sys.version_info[0] >= 3, "Script must be run with Python 3 or higher"
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--filename', dest='filename',
+        help='read input from FILE', metavar='FILE')
+    parser.add_argument('-i', '--in-place', dest='in_place',
+        help='edit the file in-place', action='store_true')
+    parser.add_argument('-v', '--verbose', dest='verbose',
+        help='show debug information', action='store_true')
+    parser.add_argument('-D', '--define', dest='definitions', type=get_binding, action='append', default=[],
+        help='bind the uniform or const variable NAME to VALUE within every variant', metavar='NAME=VALUE')
+    parser.add_argument('--variant', dest='variants', type=get_binding, action='append', nargs='+',
+        help='output a variant where each uniform or const variable NAME is bound to VALUE, '
+             'in addition to those bound by --define', metavar='NAME=VALUE')
+    parser.add_argument('-o', '--output', dest='output_pattern',
+        help='write each variant to a file named by PATTERN, where {index} is replaced by the index of the variant',
+        metavar='PATTERN')
+    parser.add_argument('--iteration-limit', dest='iteration_limit', type=int, default=200000,
+        help='stop simplifying a function after N rewrites', metavar='N')
+    parser.add_argument('--node-limit', dest='node_limit', type=int, default=20000,
+        help='leave functions with more than N elements in their parse tree as they are', metavar='N')
+    parser.add_argument('--time-limit', dest='time_limit', type=float, default=30.0,
+        help='stop simplifying a function after SECONDS', metavar='SECONDS')
+    parser.add_argument('--diagnostics', dest='diagnostics_format', choices=['text', 'json', 'none'], default='text',
+        help='specify whether to report diagnostics to stderr as text, as json, or not at all',
+    )
+    parser.add_argument('--diagnostics-limit', dest='diagnostics_limit', type=int, default=100,
+        help='maximum number of diagnostics to record', metavar='N',
+    )
+    parser.add_argument('--index', dest='index_filename',
+        help='seed type information from an index built by glsl_index.py', metavar='FILE')
+    parser.add_argument('-I', '--include-path', dest='include_paths', action='append',
+        help='search DIRECTORY for headers named by #include directives', metavar='DIRECTORY')
+    parser.add_argument('--include-cache', dest='include_cache',
+        help='store parsed header declarations in FILE between runs', metavar='FILE')
+    args = parser.parse_args()
+    variants = [
+        {**dict(args.definitions), **dict(variant)}
+        for variant in (args.variants or [[]])
+    ]
+    if args.in_place and len(variants) > 1:
+        parser.error('--in-place can only be used with a single variant, use --output instead')
+    if args.output_pattern:
+        try:
+            get_output_pattern(args.output_pattern, len(variants))
+        except ValueError as error:
+            parser.error(str(error))
+    try:
+        convert_file(
+            args.filename,
+            in_place=args.in_place,
+            verbose=args.verbose,
+            diagnostics_format=args.diagnostics_format,
+            diagnostics_limit=args.diagnostics_limit,
+            index_filename=args.index_filename,
+            include_paths=args.include_paths,
+            include_cache=args.include_cache,
+            variants=variants,
+            output_pattern=args.output_pattern,
+            budget=glsl.Budget(args.iteration_limit, args.node_limit, args.time_limit),
+        )
+    except ValueError as error:
+        # such as a binding of a variable that is not declared, see get_bound()
+        parser.error(str(error))
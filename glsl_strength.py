@@ -0,0 +1,345 @@
+#!/bin/env python3
+
+"""
+"glsl_strength.py" performs strength reduction on glsl code.
+Expressions are replaced with equivalent expressions that are cheaper to evaluate
+on a gpu, such as `pow(x, 2.0f)` with `x * x`, division by a literal with
+multiplication by its reciprocal, `1.0f / sqrt(x)` with `inversesqrt(x)`,
+or `a + (b - a) * t` with `mix(a, b, t)`.
+Many of these patterns are generated by glsl_derivative.py,
+such as `pow(cos(u), 2.0f)` within the derivative of `tan(u)`,
+so it is best run on the output of glsl_derivative.py and glsl_simplify.py.
+
+Costs are estimated by glsl_cost.py.
+A rule is only applied if it lowers the estimated cost of the expression it matches.
+Like floating point arithmetic that is relaxed by a glsl compiler,
+results may be rounded differently.
+
+The command line interface for this script is meant to resemble sed.
+You can select a file using the `-f` argument.
+By default, the script will print out the results of a "dry run".
+You can modify the file in-place using the `-i` flag.
+You can print a diff between input and output using the `-v` flag.
+You can print the estimated cost of every function before and after reduction
+using the `--report` flag.
+
+For basic usage on a single file, call like so:
+  python3 ./glsl_strength.py -f file.glsl.c
+
+If you want to replace all files in a directory, call like so:
+ find . -name *.glsl.c \
+     -exec echo {} \; -exec python3 ./glsl_strength.py -if {} \;
+"""
+
+
+import copy
+import difflib
+import sys
+
+import pypeg2 as peg
+import pypeg2glsl as glsl
+import glsl_cost
+import glsl_cse
+import glsl_index
+import glsl_include
+import glsl_rewrite
+import glsl_simplify
+
+# attempt to import colorama, for colored diff output
+try:
+    from colorama import Fore, Back, Style, init
+    init()
+except ImportError:  # fallback so that the imported classes always exist
+    class ColorFallback():
+        __getattr__ = lambda self, name: ''
+    Fore = Back = Style = ColorFallback()
+
+def assert_type(variable, types):
+    if len(types) == 1 and not isinstance(variable, types[0]):
+        raise AssertionError(f'expected {types[0]} but got {type(variable)} (value: {variable})')
+    if not any([isinstance(variable, type_) for type_ in types]):
+        raise AssertionError(f'expected any of {types} but got {type(variable)} (value: {variable})')
+
+class StrengthReductionRule(glsl_rewrite.RewriteRule):
+    """
+    A "StrengthReductionRule" is a glsl_rewrite.RewriteRule
+    that only applies if its replacement is cheaper than the expression it matches,
+    as estimated by glsl_cost.get_cost().
+    Replacements may evaluate subexpressions a different number of times,
+    so expressions with side effects are left as they are.
+    """
+
+    def apply(self, element, scope):
+        if not glsl_cse.is_pure(element, scope):
+            return None
+        replacement = super().apply(element, scope)
+        if replacement is None:
+            return None
+        # placeholders that appear more than once would otherwise share a subtree
+        replacement = copy.deepcopy(replacement)
+        quiet_scope = scope.get_quiet_scope()
+        return (replacement if glsl_cost.get_cost(replacement, quiet_scope) < glsl_cost.get_cost(element, quiet_scope)
+                else None)
+
+def get_exponent(element):
+    '''
+    "get_exponent" returns the value of a float literal that is used as an exponent,
+    including vectors whose components are all the same, or None if it is not a literal
+    '''
+    literal = glsl_simplify.get_literal_value(element)
+    if literal is None or literal[0] not in glsl_simplify.canonical_types:
+        return None
+    type_, components = literal
+    return components[0] if all([x == components[0] for x in components]) else None
+
+def has_exponent(exponent):
+    return lambda a, b, **context: get_exponent(b) == exponent
+
+def is_scalar_1(element):
+    return isinstance(element, str) and glsl_simplify.is_1(element)
+
+def get_reciprocal_product(element, scope, a, b):
+    '''
+    "get_reciprocal_product" returns a product with the reciprocal of a float literal,
+    for a division by that literal, or None if the literal has no reciprocal
+    '''
+    literal = glsl_simplify.get_literal_value(b)
+    if literal is None or literal[0] not in glsl_simplify.canonical_types or 0.0 in literal[1]:
+        return None
+    type_, components = literal
+    reciprocal = glsl_simplify.get_folded_components(type_, [1.0 / x for x in components])
+    if reciprocal is None:
+        return None
+    return glsl_rewrite.get_binary_expression(glsl.MultiplicativeExpression, a, '*', reciprocal)
+
+def is_mix(a, b, t, scope, **context):
+    '''
+    "is_mix" returns whether `mix(a, b, t)` has the same type as the expression it replaces
+    '''
+    quiet_scope = scope.get_quiet_scope()
+    a_type, b_type, t_type = [quiet_scope.deduce_type(x) for x in [a, b, t]]
+    return a_type in glsl_simplify.canonical_types and a_type == b_type and t_type in [a_type, 'float']
+
+def is_float_vector(v, scope, **context):
+    return scope.get_quiet_scope().deduce_type(v) in glsl.float_vector_types
+
+'''
+"reduction_rules" lists rules that are applied by get_reduced(),
+in the form used by glsl_rewrite.py.
+Rules are applied to expressions that are grouped as they are evaluated,
+and rules that occur first take precedence.
+'''
+reduction_rules = glsl_rewrite.RewriteSystem([
+    # powers with literal exponents
+    StrengthReductionRule('pow($a, $b)', '$a', has_exponent(1.0)),
+    StrengthReductionRule('pow($a, $b)', '$a * $a', has_exponent(2.0)),
+    StrengthReductionRule('pow($a, $b)', '$a * $a * $a', has_exponent(3.0)),
+    StrengthReductionRule('pow($a, $b)', '$a * $a * ($a * $a)', has_exponent(4.0)),
+    StrengthReductionRule('pow($a, $b)', '1.0f / $a', has_exponent(-1.0)),
+    StrengthReductionRule('pow($a, $b)', '1.0f / ($a * $a)', has_exponent(-2.0)),
+    StrengthReductionRule('pow($a, $b)', 'sqrt($a)', has_exponent(0.5)),
+    StrengthReductionRule('pow($a, $b)', 'inversesqrt($a)', has_exponent(-0.5)),
+    StrengthReductionRule('pow($a, $b)', 'exp2($b)',
+        lambda a, b, **context: isinstance(a, str) and get_exponent(a) == 2.0),
+    # reciprocals
+    StrengthReductionRule('$b / sqrt($a)', 'inversesqrt($a)', lambda a, b, **context: is_scalar_1(b)),
+    StrengthReductionRule('$b / sqrt($a)', '$b * inversesqrt($a)'),
+    StrengthReductionRule('$b / length($v)', 'inversesqrt(dot($v, $v))', lambda b, v, **context: is_scalar_1(b)),
+    StrengthReductionRule('$v / length($v)', 'normalize($v)', is_float_vector),
+    StrengthReductionRule('$a / $b', get_reciprocal_product),
+    # inverse functions
+    StrengthReductionRule('exp(log($a))', '$a'),
+    StrengthReductionRule('log(exp($a))', '$a'),
+    StrengthReductionRule('exp2(log2($a))', '$a'),
+    StrengthReductionRule('log2(exp2($a))', '$a'),
+    StrengthReductionRule('sqrt($a * $a)', 'abs($a)'),
+    StrengthReductionRule('exp($a) * exp($b)', 'exp($a + $b)'),
+    StrengthReductionRule('exp2($a) * exp2($b)', 'exp2($a + $b)'),
+    # linear interpolation
+    StrengthReductionRule('$a + ($b - $a) * $t', 'mix($a, $b, $t)', is_mix),
+    StrengthReductionRule('$a + $t * ($b - $a)', 'mix($a, $b, $t)', is_mix),
+    StrengthReductionRule('$a * (1.0f - $t) + $b * $t', 'mix($a, $b, $t)', is_mix),
+    StrengthReductionRule('(1.0f - $t) * $a + $t * $b', 'mix($a, $b, $t)', is_mix),
+])
+
+def get_reduced_function_declaration(in_element, scope):
+    subscope = scope.get_subscope(in_element)
+    out_element = copy.copy(in_element)
+    out_element.content = reduction_rules.get_rewritten(in_element.content, subscope)
+    return out_element
+
+def get_reduced(element, scope):
+    assert_type(element, [str, list, glsl.GlslElement])
+    '''
+    "get_reduced" is a pure function that
+    transforms a glsl grammar element matching pypeg2glsl.ternary_expression_or_less
+    to an equivalent element where expressions are replaced with cheaper expressions,
+    as listed in reduction_rules
+    '''
+    if isinstance(element, list):
+        return [get_reduced(subelement, scope) for subelement in element]
+    elif isinstance(element, glsl.FunctionDeclaration):
+        return get_reduced_function_declaration(element, scope)
+    else:
+        return element
+
+def get_function_costs(input_glsl, output_glsl, scope):
+    '''
+    "get_function_costs" returns a list containing the signature of every function
+    within `input_glsl`, along with its estimated cost before and after it was reduced
+    to the corresponding function of `output_glsl`
+    '''
+    return [
+        (glsl_cost.get_function_signature(before),
+         glsl_cost.get_function_cost(before, scope)['weighted'],
+         glsl_cost.get_function_cost(after, scope)['weighted'])
+        for before, after in zip(input_glsl, output_glsl)
+        if isinstance(before, glsl.FunctionDeclaration)
+    ]
+
+def get_report(function_costs):
+    '''
+    "get_report" returns text that lists the costs returned by get_function_costs()
+    '''
+    width = max([len('function'), *[len(signature) for signature, before, after in function_costs]])
+    lines = [f'{"function":<{width}}  {"before":>8}  {"after":>8}']
+    for signature, before, after in function_costs:
+        lines.append(f'{signature:<{width}}  {before:>8}  {after:>8}')
+    total_before = sum([before for signature, before, after in function_costs])
+    total_after  = sum([after  for signature, before, after in function_costs])
+    lines.append(f'{"total":<{width}}  {total_before:>8}  {total_after:>8}')
+    return '\n'.join(lines)
+
+def convert_glsl(input_glsl, diagnostics=None, base_scope=None):
+    '''
+    "convert_glsl" is a pure function that performs
+    a transformation on a parse tree of glsl as represented by pypeg2glsl,
+    then returns a transformed parse tree as output.
+    Problems found along the way are recorded in `diagnostics`, if provided.
+    Declarations outside input_glsl can be provided using `base_scope`.
+    '''
+    output_glsl = get_reduced(input_glsl, glsl.LexicalScope(input_glsl, diagnostics, base_scope))
+    glsl.warn_of_invalid_grammar_elements(output_glsl)
+    return output_glsl
+
+def convert_text(input_text, diagnostics=None, base_scope=None, report=False):
+    '''
+    "convert_text" is a pure function that performs
+    a transformation on a string containing glsl code,
+    then returns transformed output.
+    It may run convert_glsl behind the scenes,
+    and may also perform additional string based transformations,
+    such as appending utility functions
+    or performing simple string substitutions.
+    If `report` is set, a report of estimated costs is returned instead,
+    as described by get_report()
+    '''
+    input_glsl = peg.parse(input_text, glsl.code)
+    output_glsl = convert_glsl(input_glsl, diagnostics, base_scope)
+    if report:
+        scope = glsl.LexicalScope(input_glsl, glsl.Diagnostics(0), base_scope)
+        return get_report(get_function_costs(input_glsl, output_glsl, scope))
+    output_text = peg.compose(output_glsl, glsl.code, autoblank = False)
+    return output_text
+
+def convert_file(input_filename=False, in_place=False, verbose=False,
+        diagnostics_format='text', diagnostics_limit=None, index_filename=None,
+        include_paths=None, include_cache=None, report=False):
+    '''
+    "convert_file" performs a transformation on a file containing glsl code
+    It may either print out transformed contents or replace the file,
+    depending on the value of `in_place`,
+    or print a report of estimated costs, if `report` is set
+    '''
+
+    def colorize_diff(diff):
+        '''
+        "colorize_diff" colorizes text output from the difflib library
+        for display in the command line
+        All credit goes to:
+        https://chezsoi.org/lucas/blog/colored-diff-output-with-python.html
+        '''
+        for line in diff:
+            if line.startswith('+'):
+                yield Fore.GREEN + line + Fore.RESET
+            elif line.startswith('-'):
+                yield Fore.RED + line + Fore.RESET
+            elif line.startswith('^'):
+                yield Fore.BLUE + line + Fore.RESET
+            else:
+                yield line
+
+    input_text = ''
+    if input_filename:
+        with open(input_filename, 'r+') as input_file:
+            input_text = input_file.read()
+    else:
+        for line in sys.stdin:
+            input_text += line
+
+    diagnostics = glsl.Diagnostics(diagnostics_limit)
+    base_scope = glsl_index.ProjectIndex.load(index_filename).get_scope() if index_filename else None
+    include_resolver = glsl_include.IncludeResolver(include_paths, include_cache)
+    base_scope = include_resolver.get_scope(input_text, input_filename, base_scope)
+    include_resolver.save()
+    if report:
+        print(convert_text(input_text, diagnostics, base_scope, report=True))
+        diagnostics.report(diagnostics_format)
+        return
+    output_text = convert_text(input_text, diagnostics, base_scope)
+    diagnostics.report(diagnostics_format)
+
+    if verbose:
+        diff = difflib.ndiff(
+            input_text.splitlines(keepends=True),
+            output_text.splitlines(keepends=True)
+        )
+        for line in colorize_diff(diff):
+            print(line)
+
+    if in_place:
+        with open(input_filename, 'w') as output_file:
+            output_file.write(output_text)
+            output_file.truncate()
+    else:
+        print(output_text)
+
+if __name__ == '__main__':
+    import argparse
+
+    assert sys.version_info[0] >= 3, "Script must be run with Python 3 or higher"
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--filename', dest='filename',
+        help='read input from FILE', metavar='FILE')
+    parser.add_argument('-i', '--in-place', dest='in_place',
+        help='edit the file in-place', action='store_true')
+    parser.add_argument('-v', '--verbose', dest='verbose',
+        help='show debug information', action='store_true')
+    parser.add_argument('--report', dest='report',
+        help='print the estimated cost of every function before and after reduction, instead of the converted code',
+        action='store_true')
+    parser.add_argument('--diagnostics', dest='diagnostics_format', choices=['text', 'json', 'none'], default='text',
+        help='specify whether to report diagnostics to stderr as text, as json, or not at all',
+    )
+    parser.add_argument('--diagnostics-limit', dest='diagnostics_limit', type=int, default=100,
+        help='maximum number of diagnostics to record', metavar='N',
+    )
+    parser.add_argument('--index', dest='index_filename',
+        help='seed type information from an index built by glsl_index.py', metavar='FILE')
+    parser.add_argument('-I', '--include-path', dest='include_paths', action='append',
+        help='search DIRECTORY for headers named by #include directives', metavar='DIRECTORY')
+    parser.add_argument('--include-cache', dest='include_cache',
+        help='store parsed header declarations in FILE between runs', metavar='FILE')
+    args = parser.parse_args()
+    convert_file(
+        args.filename,
+        in_place=args.in_place,
+        verbose=args.verbose,
+        diagnostics_format=args.diagnostics_format,
+        diagnostics_limit=args.diagnostics_limit,
+        index_filename=args.index_filename,
+        include_paths=args.include_paths,
+        include_cache=args.include_cache,
+        report=args.report,
+    )
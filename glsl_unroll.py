@@ -0,0 +1,403 @@
+#!/bin/env python3
+
+"""
+"glsl_unroll.py" unrolls `for` loops whose number of iterations is known
+before the loop runs, such as `for (int i = 0; i < MAX_LIGHT_COUNT; i++)`.
+The body of the loop is repeated once for every iteration,
+and references to the loop variable are replaced with its value in that iteration,
+so that glsl_simplify.py can fold expressions that depend on it.
+It is also run by glsl_derivative.py, which cannot differentiate loops otherwise.
+
+A loop is only unrolled if:
+* it declares a single `int` variable whose initial value folds to a literal,
+* its condition compares the variable against an expression that folds to a literal,
+  where `const` variables are replaced with their values,
+* it increments or decrements the variable by a literal amount,
+  and nothing within its body assigns to the variable,
+* nothing within its body breaks out of it or continues it,
+* nothing within its body references a variable that it declares before it is declared,
+  such as a variable of the same name outside the loop, since such references are not renamed,
+* and it runs at most `trip_limit` times.
+Variables that are declared within the body are renamed in every iteration,
+such as `t` to `t_0`, `t_1`, and so on, since glsl does not allow them to be redeclared.
+Loops within loops are unrolled first, and again once the variable of the loop 
+that contains them is replaced, in case their bounds depend on it.
+
+The command line interface for this script is meant to resemble sed.
+You can select a file using the `-f` argument.
+By default, the script will print out the results of a "dry run".
+You can modify the file in-place using the `-i` flag.
+You can print a diff between input and output using the `-v` flag.
+
+For basic usage on a single file, call like so:
+  python3 ./glsl_unroll.py -f file.glsl.c
+
+If you want to replace all files in a directory, call like so:
+ find . -name *.glsl.c \
+     -exec echo {} \; -exec python3 ./glsl_unroll.py -if {} \;
+"""
+
+
+import copy
+import difflib
+import itertools
+import sys
+
+import pypeg2 as peg
+import pypeg2glsl as glsl
+import glsl_cse
+import glsl_dce
+import glsl_index
+import glsl_include
+import glsl_simplify
+
+# attempt to import colorama, for colored diff output
+try:
+    from colorama import Fore, Back, Style, init
+    init()
+except ImportError:  # fallback so that the imported classes always exist
+    class ColorFallback():
+        __getattr__ = lambda self, name: ''
+    Fore = Back = Style = ColorFallback()
+
+def assert_type(variable, types):
+    if len(types) == 1 and not isinstance(variable, types[0]):
+        raise AssertionError(f'expected {types[0]} but got {type(variable)} (value: {variable})')
+    if not any([isinstance(variable, type_) for type_ in types]):
+        raise AssertionError(f'expected any of {types} but got {type(variable)} (value: {variable})')
+
+'''
+"default_trip_limit" is the largest number of iterations of a loop that is unrolled by default
+'''
+default_trip_limit = 32
+
+'''
+"comparisons" maps the operators of loop conditions to functions that evaluate them,
+and "reversed_comparisons" maps them to the operator that is used
+if the loop variable is found on the right
+'''
+comparisons = {
+    '<':  lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>':  lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '!=': lambda a, b: a != b,
+}
+reversed_comparisons = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '!=': '!='}
+
+def get_int_value(element, scope, constants):
+    '''
+    "get_int_value" returns the value of an int expression
+    if it folds to a literal once `constants` are replaced with their values,
+    or None otherwise
+    '''
+    literal = glsl_simplify.get_literal_value(
+        glsl_simplify.get_simplified_content(element, scope, constants))
+    if literal is None or literal[0] != 'int':
+        return None
+    return literal[1][0]
+
+def get_step(operation, name, scope, constants):
+    '''
+    "get_step" returns the amount by which the operation of a loop
+    changes the loop variable `name`, or None if it is not a constant amount
+    '''
+    if (isinstance(operation, (glsl.PostIncrementExpression, glsl.PreIncrementExpression)) and
+        operation.operand1 == name and operation.operator in ['++', '--']):
+        return 1 if operation.operator == '++' else -1
+    elif (isinstance(operation, glsl.AssignmentExpression) and
+          operation.operand1 == name and operation.operator in ['+=', '-=']):
+        step = get_int_value(operation.operand2, scope, constants)
+        if step is None:
+            return None
+        return step if operation.operator == '+=' else -step
+    return None
+
+def has_jump(element):
+    '''
+    "has_jump" returns whether a loop body contains a `break` or `continue`
+    that applies to the loop, rather than to a loop within it
+    '''
+    if isinstance(element, str):
+        return element in ['break', 'continue']
+    elif isinstance(element, list):
+        return any([has_jump(subelement) for subelement in element])
+    elif isinstance(element, glsl.IfStatement):
+        return has_jump(element.content) or has_jump(element.else_)
+    return False
+
+def is_referenced_before_declared(content, names, declared=frozenset()):
+    '''
+    "is_referenced_before_declared" returns whether any variable within `names`
+    is referenced by a list of statements where it is not declared within them,
+    or within a block that contains them, whose names are given by `declared`.
+    Such references are to a variable of the same name outside the statements.
+    '''
+    declared = set(declared)
+    def is_referenced(element):
+        return len(glsl.get_variable_references(element, names) - declared) > 0
+    for statement in (content if isinstance(content, list) else [content]):
+        if isinstance(statement, str):
+            continue
+        elif isinstance(statement, glsl.VariableDeclaration):
+            # a variable can only be referenced once its initial value has been evaluated
+            for name, value in glsl.LexicalScope.get_initializers(statement).items():
+                if value is not None and is_referenced(value):
+                    return True
+                declared.add(name)
+        elif type(statement) in glsl.code_block_element_types:
+            if isinstance(statement, glsl.ForStatement):
+                if is_referenced_before_declared([statement.declaration], names, declared):
+                    return True
+                inner = {*declared, *statement.declaration.get_names()}
+            else:
+                inner = declared
+            if any([is_referenced_before_declared([getattr(statement, attribute)], names, inner)
+                    for attribute in ['condition', 'operation'] if getattr(statement, attribute, None) is not None]):
+                return True
+            if any([is_referenced_before_declared(getattr(statement, attribute), names, inner)
+                    for attribute in ['content', 'else_'] if getattr(statement, attribute, None) is not None]):
+                return True
+        elif is_referenced(statement):
+            return True
+    return False
+
+def get_trip_values(statement, scope, constants, trip_limit=default_trip_limit):
+    '''
+    "get_trip_values" returns a list containing the value of the loop variable
+    in every iteration of a ForStatement,
+    or None if the loop cannot be unrolled, as described at the top of this file
+    '''
+    assert_type(statement, [glsl.ForStatement])
+    declaration = statement.declaration
+    content = declaration.content if isinstance(declaration.content, list) else [declaration.content]
+    if (declaration.type != 'int' or len(content) != 1 or
+        not isinstance(content[0], glsl.AssignmentExpression)):
+        return None
+    name = content[0].operand1
+    value = get_int_value(content[0].operand2, scope, constants)
+    condition = statement.condition
+    if (value is None or
+        not isinstance(condition, (glsl.RelationalExpression, glsl.EqualityExpression)) or
+        condition.operator not in comparisons):
+        return None
+    if condition.operand1 == name:
+        operator, bound = condition.operator, condition.operand2
+    elif condition.operand2 == name:
+        operator, bound = reversed_comparisons[condition.operator], condition.operand1
+    else:
+        return None
+    bound = get_int_value(bound, scope, constants)
+    step = get_step(statement.operation, name, scope, constants)
+    body = statement.content
+    if (bound is None or step is None or has_jump(body) or
+        name in glsl_cse.get_assigned_variables(body, scope) or
+        name in glsl_dce.get_declared_variables(body) or
+        is_referenced_before_declared(body, glsl_dce.get_declared_variables(body))):
+        return None
+    result = []
+    while comparisons[operator](value, bound):
+        if len(result) >= trip_limit:
+            return None
+        result.append(value)
+        value = glsl_simplify.get_int32(value + step)
+    return result
+
+def get_unrolled_statement(statement, scope, constants, trip_limit, names):
+    '''
+    "get_unrolled_statement" returns a list of statements that are equivalent to `statement`,
+    where loops within it are unrolled where possible.
+    `names` is the set of names that are already in use within the function,
+    to which the names of renamed variables are added.
+    '''
+    if type(statement) not in glsl.code_block_element_types:
+        return [statement]
+    out_statement = copy.copy(statement)
+    for attribute in ['content', 'else_']:
+        content = getattr(statement, attribute, None)
+        if isinstance(content, list):
+            setattr(out_statement, attribute, get_unrolled_code_block(content, scope, constants, trip_limit, names))
+        elif isinstance(content, glsl.GlslElement):
+            unrolled = get_unrolled_statement(content, scope, constants, trip_limit, names)
+            setattr(out_statement, attribute, unrolled[0] if len(unrolled) == 1 else unrolled)
+    if not isinstance(statement, glsl.ForStatement):
+        return [out_statement]
+    values = get_trip_values(out_statement, scope, constants, trip_limit)
+    if values is None:
+        return [out_statement]
+    name, = statement.declaration.get_names()
+    body = out_statement.content if isinstance(out_statement.content, list) else [out_statement.content]
+    declared = sorted(glsl_dce.get_declared_variables(body))
+    result = []
+    for i, value in enumerate(values):
+        literal = glsl_simplify.get_literal('int', [value])
+        renamed = {name: literal if value >= 0 else glsl.ParensExpression(literal)}
+        for variable in declared:
+            renamed[variable] = next(
+                candidate for candidate in
+                    (f'{variable}_{i}' if j < 1 else f'{variable}_{i}_{j}' for j in itertools.count())
+                if candidate not in names)
+            names.add(renamed[variable])
+        result.extend(glsl_cse.get_renamed(copy.deepcopy(body), renamed))
+    # loops within the body may only have constant bounds once the loop variable is replaced
+    return get_unrolled_code_block(result, scope, constants, trip_limit, names)
+
+def get_unrolled_code_block(statements, scope, constants, trip_limit, names):
+    '''
+    "get_unrolled_code_block" behaves like get_unrolled_statement() for a list of statements
+    '''
+    return [
+        unrolled
+        for statement in statements
+        for unrolled in get_unrolled_statement(statement, scope, constants, trip_limit, names)
+    ]
+
+def get_unrolled_function_declaration(in_element, scope, trip_limit=default_trip_limit, constants=None):
+    out_element = copy.copy(in_element)
+    local_scope = scope.get_subscope(in_element).get_quiet_scope()
+    constants = glsl_simplify.get_constant_values(local_scope, scope, constants)
+    names = {
+        *local_scope.variables, *local_scope.functions,
+        *glsl_dce.get_declared_variables(in_element.content)
+    }
+    out_element.content = get_unrolled_code_block(in_element.content, local_scope, constants, trip_limit, names)
+    return out_element
+
+def get_unrolled(element, scope, trip_limit=default_trip_limit, constants=None):
+    '''
+    "get_unrolled" is a pure function that returns a copy of a glsl parse tree
+    where `for` loops within functions that run at most `trip_limit` times are unrolled,
+    as described at the top of this file
+    '''
+    assert_type(element, [str, list, glsl.GlslElement])
+    if isinstance(element, glsl.FunctionDeclaration):
+        return get_unrolled_function_declaration(element, scope, trip_limit, constants)
+    elif isinstance(element, list):
+        # the values of global constants are only found once for all functions
+        constants = constants if constants is not None else glsl_simplify.get_constant_values(scope)
+        return [get_unrolled(subelement, scope, trip_limit, constants) for subelement in element]
+    return element
+
+def convert_glsl(input_glsl, diagnostics=None, base_scope=None, trip_limit=default_trip_limit):
+    '''
+    "convert_glsl" is a pure function that performs
+    a transformation on a parse tree of glsl as represented by pypeg2glsl,
+    then returns a transformed parse tree as output.
+    Problems found along the way are recorded in `diagnostics`, if provided.
+    Declarations outside input_glsl can be provided using `base_scope`.
+    Loops are unrolled if they run at most `trip_limit` times.
+    '''
+    output_glsl = get_unrolled(input_glsl, glsl.LexicalScope(input_glsl, diagnostics, base_scope), trip_limit)
+    glsl.warn_of_invalid_grammar_elements(output_glsl)
+    return output_glsl
+
+def convert_text(input_text, diagnostics=None, base_scope=None, trip_limit=default_trip_limit):
+    '''
+    "convert_text" is a pure function that performs
+    a transformation on a string containing glsl code,
+    then returns transformed output.
+    It may run convert_glsl behind the scenes,
+    and may also perform additional string based transformations,
+    such as appending utility functions
+    or performing simple string substitutions
+    '''
+    input_glsl = peg.parse(input_text, glsl.code)
+    output_glsl = convert_glsl(input_glsl, diagnostics, base_scope, trip_limit)
+    output_text = peg.compose(output_glsl, glsl.code, autoblank = False)
+    return output_text
+
+def convert_file(input_filename=False, in_place=False, verbose=False,
+        diagnostics_format='text', diagnostics_limit=None, index_filename=None,
+        include_paths=None, include_cache=None, trip_limit=default_trip_limit):
+    '''
+    "convert_file" performs a transformation on a file containing glsl code
+    It may either print out transformed contents or replace the file,
+    depending on the value of `in_place`
+    '''
+
+    def colorize_diff(diff):
+        '''
+        "colorize_diff" colorizes text output from the difflib library
+        for display in the command line
+        All credit goes to:
+        https://chezsoi.org/lucas/blog/colored-diff-output-with-python.html
+        '''
+        for line in diff:
+            if line.startswith('+'):
+                yield Fore.GREEN + line + Fore.RESET
+            elif line.startswith('-'):
+                yield Fore.RED + line + Fore.RESET
+            elif line.startswith('^'):
+                yield Fore.BLUE + line + Fore.RESET
+            else:
+                yield line
+
+    input_text = ''
+    if input_filename:
+        with open(input_filename, 'r+') as input_file:
+            input_text = input_file.read()
+    else:
+        for line in sys.stdin:
+            input_text += line
+
+    diagnostics = glsl.Diagnostics(diagnostics_limit)
+    base_scope = glsl_index.ProjectIndex.load(index_filename).get_scope() if index_filename else None
+    include_resolver = glsl_include.IncludeResolver(include_paths, include_cache)
+    base_scope = include_resolver.get_scope(input_text, input_filename, base_scope)
+    include_resolver.save()
+    output_text = convert_text(input_text, diagnostics, base_scope, trip_limit)
+    diagnostics.report(diagnostics_format)
+
+    if verbose:
+        diff = difflib.ndiff(
+            input_text.splitlines(keepends=True),
+            output_text.splitlines(keepends=True)
+        )
+        for line in colorize_diff(diff):
+            print(line)
+
+    if in_place:
+        with open(input_filename, 'w') as output_file:
+            output_file.write(output_text)
+            output_file.truncate()
+    else:
+        print(output_text)
+
+if __name__ == '__main__':
+    import argparse
+
+    assert sys.version_info[0] >= 3, "Script must be run with Python 3 or higher"
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--filename', dest='filename',
+        help='read input from FILE', metavar='FILE')
+    parser.add_argument('-i', '--in-place', dest='in_place',
+        help='edit the file in-place', action='store_true')
+    parser.add_argument('-v', '--verbose', dest='verbose',
+        help='show debug information', action='store_true')
+    parser.add_argument('--trip-limit', dest='trip_limit', type=int, default=default_trip_limit,
+        help='only unroll loops that run at most N times', metavar='N')
+    parser.add_argument('--diagnostics', dest='diagnostics_format', choices=['text', 'json', 'none'], default='text',
+        help='specify whether to report diagnostics to stderr as text, as json, or not at all',
+    )
+    parser.add_argument('--diagnostics-limit', dest='diagnostics_limit', type=int, default=100,
+        help='maximum number of diagnostics to record', metavar='N',
+    )
+    parser.add_argument('--index', dest='index_filename',
+        help='seed type information from an index built by glsl_index.py', metavar='FILE')
+    parser.add_argument('-I', '--include-path', dest='include_paths', action='append',
+        help='search DIRECTORY for headers named by #include directives', metavar='DIRECTORY')
+    parser.add_argument('--include-cache', dest='include_cache',
+        help='store parsed header declarations in FILE between runs', metavar='FILE')
+    args = parser.parse_args()
+    convert_file(
+        args.filename,
+        in_place=args.in_place,
+        verbose=args.verbose,
+        diagnostics_format=args.diagnostics_format,
+        diagnostics_limit=args.diagnostics_limit,
+        index_filename=args.index_filename,
+        include_paths=args.include_paths,
+        include_cache=args.include_cache,
+        trip_limit=args.trip_limit,
+    )
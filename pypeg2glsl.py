@@ -7,15 +7,24 @@ It has the following features:
 * pypeg2 grammar rule classes for parsing glsl.
 * a "LexicalScope" class for storing, querying, and deducing type information 
   within glsl lexical scopes
+* a "Diagnostics" class for collecting problems found during type deduction,
+  which are only rendered to text once they are reported
 * various variables storing information about built in glsl types
   (vector_types, matrix_types, built_in_types)
+* a table of built in glsl function signatures, used for overload resolution
+  (built_in_function_signatures, get_built_in_function_type)
 
 See pypeg2 documentation for more information on usage.
 '''
 
 import re
+import sys
 import copy
+import collections
+import json
+import functools
 import warnings
+import time
 
 import pypeg2
 from pypeg2 import attr, optional, maybe_some, blank, endl
@@ -99,6 +108,9 @@ If an error occurs, it issues a warning
 stating which subelements are causing problems. 
 This makes it very useful for debugging errors where pypeg2.compose()
 returns an empty string without explaining why.
+Subelements are only checked if their parent is invalid, 
+since pypeg2.compose() has already composed them otherwise, 
+and checking every subelement takes quadratic time for deeply nested expressions.
 '''
 def warn_of_invalid_grammar_elements(element):
     if isinstance(element, list):
@@ -107,6 +119,7 @@ def warn_of_invalid_grammar_elements(element):
     elif isinstance(element, GlslElement):
         try:
             pypeg2.compose(element, type(element))
+            return
         except ValueError as error:
             warnings.warn(f'element of type "{type(element)}" is invalid: \n{debug(element, "  ")}')
         for attribute in element_attributes:
@@ -145,6 +158,81 @@ def debug(element, indent=''):
     else:
         return indent + repr(element)
 
+'''
+"get_structure_key" returns a hashable representation of a glsl element.
+Two elements share a key if and only if they have the same structure, 
+regardless of whether they are the same object or where they were parsed,
+so the key can be used to look up results for equivalent subexpressions.
+'''
+def get_structure_key(element):
+    if isinstance(element, list):
+        return (list, *[get_structure_key(subelement) for subelement in element])
+    elif isinstance(element, GlslElement):
+        return (type(element), *[
+                (attribute, get_structure_key(subelement))
+                for attribute, subelement in sorted(vars(element).items())
+                if attribute != 'position_in_text'
+            ])
+    else:
+        return element
+
+'''
+"get_structure_id" returns an integer that identifies the structure of a glsl element:
+two elements share an identifier if and only if they share a structure key.
+Identifiers are found bottom-up from the identifiers of subelements, 
+so only a shallow tuple is built and hashed for each element, 
+and keying every subexpression of a tree takes linear rather than quadratic time.
+"structure_ids" maps shallow tuples to identifiers, 
+and "element_ids" memoizes the identifier of each element by its id().
+Both must be shared between calls, 
+and elements must not be modified in place once they have been identified.
+'''
+def get_structure_id(element, structure_ids, element_ids):
+    if isinstance(element, (list, GlslElement)):
+        memoized = element_ids.get(id(element))
+        if memoized is not None and memoized[0] is element:
+            return memoized[1]
+    if isinstance(element, list):
+        shallow = (list, *[get_structure_id(subelement, structure_ids, element_ids) for subelement in element])
+    elif isinstance(element, GlslElement):
+        shallow = (type(element), *[
+                (attribute, get_structure_id(subelement, structure_ids, element_ids))
+                for attribute, subelement in sorted(vars(element).items())
+                if attribute != 'position_in_text'
+            ])
+    else:
+        shallow = (type(element), element)
+    structure_id = structure_ids.setdefault(shallow, len(structure_ids))
+    if isinstance(element, (list, GlslElement)):
+        element_ids[id(element)] = (element, structure_id)
+    return structure_id
+
+'''
+"get_variable_references" returns the set of variables within `names` 
+that are referenced by a glsl element.
+Names of invoked functions and accessed attributes are not considered references.
+'''
+def get_variable_references(element, names):
+    if isinstance(element, str):
+        return {element} if element in names else set()
+    elif isinstance(element, list):
+        return set().union(*[get_variable_references(subelement, names) for subelement in element])
+    elif isinstance(element, InvocationExpression):
+        return get_variable_references(element.arguments, names)
+    elif isinstance(element, AttributeExpression):
+        return get_variable_references([
+                element.reference, 
+                *[attribute for attribute in element.attributes 
+                  if isinstance(attribute, BracketedExpression)]
+            ], names)
+    elif isinstance(element, GlslElement):
+        return get_variable_references([
+                getattr(element, attribute) 
+                for attribute in element_attributes 
+                if hasattr(element, attribute)
+            ], names)
+    return set()
+
 '''
 "GlslElement" is the parent class of all grammar rule classes within pypeg2glsl
 '''
@@ -330,7 +418,7 @@ AssignmentExpression.grammar = (
 )
 
 VariableDeclaration.grammar = (
-    attr('qualifiers', maybe_some(re.compile('const|highp|mediump|lowp|attribute|uniform|varying'))),
+    attr('qualifiers', maybe_some(re.compile(r'(const|highp|mediump|lowp|attribute|uniform|varying)\b'), blank)),
     attr('type', [ AttributeExpression, token ]), blank,
     attr('content', pypeg2.csl([AssignmentExpression, token])),
 )
@@ -378,7 +466,7 @@ ForStatement.grammar = (
 )
 
 ParameterDeclaration.grammar = (
-    attr('qualifiers', maybe_some(re.compile('in|out|inout'), blank)),
+    attr('qualifiers', maybe_some(re.compile(r'(inout|in|out)\b'), blank)),
     attr('type', [ AttributeExpression, token ]), blank,
     attr('name', token)
 )
@@ -403,22 +491,25 @@ StructureDeclaration.grammar = (
 
 code = pypeg2.some(
     [
-        # start with include directives, which can be determined quickly and ignored
-        pypeg2.ignore(include_directive),
+        # start with preprocessor directives, which can be determined quickly,
+        # they are kept as text so they survive conversion, see glsl_include.py
+        include_directive,
         # next try declarations: they're harder to parse, but we need 
         # to parse them before comments since they have their own comment docs
         StructureDeclaration, 
         FunctionDeclaration, 
-        # last try variable declaration
-        (VariableDeclaration, ';', endl),
         # next try standalone comments since they're quick to parse
         inline_comment, 
         endline_comment,
+        # last try variable declaration, 
+        # this must follow comments since pypeg2 consumes elements 
+        # that do not match a concatenation while composing
+        (VariableDeclaration, ';', endl),
     ]
 )
 
 scalar_types = [
-    'float', 'int', 'bool'
+    'float', 'int', 'uint', 'bool'
 ]
 float_vector_types = [
     'vec2', 'vec3', 'vec4', 
@@ -426,12 +517,16 @@ float_vector_types = [
 int_vector_types = [
     'ivec2', 'ivec3', 'ivec4', 
 ]
+uint_vector_types = [
+    'uvec2', 'uvec3', 'uvec4', 
+]
 bool_vector_types = [
     'bvec2', 'bvec3', 'bvec4', 
 ]
 vector_types = [
     *float_vector_types,
     *int_vector_types,
+    *uint_vector_types,
     *bool_vector_types,
 ]
 float_matrix_types = [
@@ -459,27 +554,398 @@ code_block_element_types = [
     WhileStatement,
     ForStatement,
 ]
-built_in_overloaded_functions = [
-    'radians', 'degrees',
-    'sin', 'cos', 'tan', 
-    'asin', 'acos', 'atan', 'atan2', 
-    'sqrt', 'cbrt', 'pow', 'exp', 'exp2', 'log', 'log2', 'inversesqrt',
-    'trunc', 'floor', 'ceil', 'round','mod'
-    'sqrt', 'fract', 
-    'min', 'max', 'clamp',  'step', 'smoothstep',
-    'abs', 'sign', 
-    'length', 'distance', 'normalize', 
-    'faceforward', 'reflect', 'refract',
-    'equal', 'notEqual', 'lessThan', 'lessThanEqual', 'greaterThan', 'greaterThanEqual', 
-    'any', 'all', 'not',
-    'frexp', 'ldexp',
-]
+
+'''
+"built_in_function_declarations" lists the signatures of built in glsl 3.3 functions
+as they are written within the glsl 3.3 specification. 
+Generic types are expanded into concrete types by get_built_in_function_signatures():
+* "genType", "genIType", "genUType", and "genBType" expand to scalars and vectors 
+  of float, int, uint, and bool, respectively, with matching component counts
+* "vec", "ivec", "uvec", and "bvec" expand to vectors only, with matching component counts
+* "mat" expands to any floating point matrix
+Texture lookup and noise functions are not listed since 
+pypeg2glsl has no concept of sampler types.
+'''
+built_in_function_declarations = '''
+    genType radians(genType)
+    genType degrees(genType)
+    genType sin(genType)
+    genType cos(genType)
+    genType tan(genType)
+    genType asin(genType)
+    genType acos(genType)
+    genType atan(genType, genType)
+    genType atan(genType)
+    genType sinh(genType)
+    genType cosh(genType)
+    genType tanh(genType)
+    genType asinh(genType)
+    genType acosh(genType)
+    genType atanh(genType)
+
+    genType pow(genType, genType)
+    genType exp(genType)
+    genType log(genType)
+    genType exp2(genType)
+    genType log2(genType)
+    genType sqrt(genType)
+    genType inversesqrt(genType)
+
+    genType abs(genType)
+    genIType abs(genIType)
+    genType sign(genType)
+    genIType sign(genIType)
+    genType floor(genType)
+    genType trunc(genType)
+    genType round(genType)
+    genType roundEven(genType)
+    genType ceil(genType)
+    genType fract(genType)
+    genType mod(genType, float)
+    genType mod(genType, genType)
+    genType modf(genType, genType)
+    genType min(genType, genType)
+    genType min(genType, float)
+    genIType min(genIType, genIType)
+    genIType min(genIType, int)
+    genUType min(genUType, genUType)
+    genUType min(genUType, uint)
+    genType max(genType, genType)
+    genType max(genType, float)
+    genIType max(genIType, genIType)
+    genIType max(genIType, int)
+    genUType max(genUType, genUType)
+    genUType max(genUType, uint)
+    genType clamp(genType, genType, genType)
+    genType clamp(genType, float, float)
+    genIType clamp(genIType, genIType, genIType)
+    genIType clamp(genIType, int, int)
+    genUType clamp(genUType, genUType, genUType)
+    genUType clamp(genUType, uint, uint)
+    genType mix(genType, genType, genType)
+    genType mix(genType, genType, float)
+    genType mix(genType, genType, genBType)
+    genType step(genType, genType)
+    genType step(float, genType)
+    genType smoothstep(genType, genType, genType)
+    genType smoothstep(float, float, genType)
+    genBType isnan(genType)
+    genBType isinf(genType)
+    genIType floatBitsToInt(genType)
+    genUType floatBitsToUint(genType)
+    genType intBitsToFloat(genIType)
+    genType uintBitsToFloat(genUType)
+
+    float length(genType)
+    float distance(genType, genType)
+    float dot(genType, genType)
+    vec3 cross(vec3, vec3)
+    genType normalize(genType)
+    genType faceforward(genType, genType, genType)
+    genType reflect(genType, genType)
+    genType refract(genType, genType, float)
+
+    mat matrixCompMult(mat, mat)
+    mat2 outerProduct(vec2, vec2)
+    mat3 outerProduct(vec3, vec3)
+    mat4 outerProduct(vec4, vec4)
+    mat2x3 outerProduct(vec3, vec2)
+    mat3x2 outerProduct(vec2, vec3)
+    mat2x4 outerProduct(vec4, vec2)
+    mat4x2 outerProduct(vec2, vec4)
+    mat3x4 outerProduct(vec4, vec3)
+    mat4x3 outerProduct(vec3, vec4)
+    mat2 transpose(mat2)
+    mat3 transpose(mat3)
+    mat4 transpose(mat4)
+    mat2x3 transpose(mat3x2)
+    mat3x2 transpose(mat2x3)
+    mat2x4 transpose(mat4x2)
+    mat4x2 transpose(mat2x4)
+    mat3x4 transpose(mat4x3)
+    mat4x3 transpose(mat3x4)
+    float determinant(mat2)
+    float determinant(mat3)
+    float determinant(mat4)
+    mat2 inverse(mat2)
+    mat3 inverse(mat3)
+    mat4 inverse(mat4)
+
+    bvec lessThan(vec, vec)
+    bvec lessThan(ivec, ivec)
+    bvec lessThan(uvec, uvec)
+    bvec lessThanEqual(vec, vec)
+    bvec lessThanEqual(ivec, ivec)
+    bvec lessThanEqual(uvec, uvec)
+    bvec greaterThan(vec, vec)
+    bvec greaterThan(ivec, ivec)
+    bvec greaterThan(uvec, uvec)
+    bvec greaterThanEqual(vec, vec)
+    bvec greaterThanEqual(ivec, ivec)
+    bvec greaterThanEqual(uvec, uvec)
+    bvec equal(vec, vec)
+    bvec equal(ivec, ivec)
+    bvec equal(uvec, uvec)
+    bvec equal(bvec, bvec)
+    bvec notEqual(vec, vec)
+    bvec notEqual(ivec, ivec)
+    bvec notEqual(uvec, uvec)
+    bvec notEqual(bvec, bvec)
+    bool any(bvec)
+    bool all(bvec)
+    bvec not(bvec)
+'''
+
+'''
+"generic_type_expansions" maps generic types found in built_in_function_declarations 
+to the concrete types they represent, indexed by component count
+'''
+generic_type_expansions = {
+    'genType':  ['float', *float_vector_types],
+    'genIType': ['int',   *int_vector_types],
+    'genUType': ['uint',  *uint_vector_types],
+    'genBType': ['bool',  *bool_vector_types],
+    'vec':  float_vector_types,
+    'ivec': int_vector_types,
+    'uvec': uint_vector_types,
+    'bvec': bool_vector_types,
+    'mat':  float_matrix_types,
+}
+
+'''
+"implicit_type_conversions" maps types to the types they may be 
+implicitly converted to when passed to a function, as specified by glsl 3.3
+'''
+implicit_type_conversions = {
+    'int':   ['float'],
+    'uint':  ['float'],
+    'ivec2': ['vec2'],
+    'ivec3': ['vec3'],
+    'ivec4': ['vec4'],
+    'uvec2': ['vec2'],
+    'uvec3': ['vec3'],
+    'uvec4': ['vec4'],
+}
+
+def get_built_in_function_signatures(declarations):
+    '''
+    "get_built_in_function_signatures" returns a dictionary that maps 
+    the name of each built in function to another dictionary,
+    which maps tuples of parameter types to return types.
+    '''
+    declaration_regex = re.compile('(\w+) \s+ (\w+) \s* \( ([^)]*) \)', re.VERBOSE)
+    result = {}
+    for return_type, name, parameters in declaration_regex.findall(declarations):
+        types = [return_type, *[parameter.strip() for parameter in parameters.split(',')]]
+        generic_types = [type_ for type_ in types if type_ in generic_type_expansions]
+        expansion_count = min([len(generic_type_expansions[type_]) for type_ in generic_types] or [1])
+        signatures = result.setdefault(name, {})
+        for i in range(expansion_count):
+            concrete_return_type, *concrete_parameter_types = [
+                generic_type_expansions[type_][i] if type_ in generic_type_expansions else type_
+                for type_ in types
+            ]
+            signatures.setdefault(tuple(concrete_parameter_types), concrete_return_type)
+    return result
+
+built_in_function_signatures = get_built_in_function_signatures(built_in_function_declarations)
+
+'''
+"built_in_function_type_map" maps built in functions to their return types,
+for functions whose return types do not depend on their parameters.
+Their return types can be deduced without inspecting arguments.
+'''
 built_in_function_type_map = {
-    'cross': 'vec3',
-    'dot': 'float',
-    'length': 'float',
-    'distance': 'float',
+    name: next(iter(signatures.values()))
+    for name, signatures in built_in_function_signatures.items()
+    if len(set(signatures.values())) == 1
 }
+'''
+"built_in_overloaded_functions" lists built in functions 
+whose return types depend on the types of their arguments.
+'''
+built_in_overloaded_functions = [
+    name for name in built_in_function_signatures 
+    if name not in built_in_function_type_map
+]
+
+@functools.lru_cache(maxsize=None)
+def get_built_in_function_type(name, argument_types):
+    '''
+    "get_built_in_function_type" returns the return type for a call to 
+    a built in function given a tuple of argument types, 
+    or None if no overload can be found. 
+    An exact match is preferred, otherwise implicit conversions are considered,
+    so long as they do not make the return type ambiguous.
+    Results are cached, since most shaders only use a handful of distinct overloads.
+    '''
+    signatures = built_in_function_signatures.get(name, {})
+    if argument_types in signatures:
+        return signatures[argument_types]
+    candidates = set(
+        return_type
+        for parameter_types, return_type in signatures.items()
+        if len(parameter_types) == len(argument_types) and 
+           all([argument_type == parameter_type or 
+                parameter_type in implicit_type_conversions.get(argument_type, [])
+                for argument_type, parameter_type in zip(argument_types, parameter_types)])
+    )
+    return candidates.pop() if len(candidates) == 1 else None
+
+class Template:
+    """
+    A "Template" is a glsl expression containing placeholders such as `$u`,
+    which is parsed once and can then be instantiated many times 
+    by substituting parse trees for its placeholders.
+    This avoids the cost of composing parse trees to text 
+    and parsing them back again whenever an expression is built from smaller parts.
+    Substituted parse trees are not copied, 
+    so they may be shared with other parse trees and must not be modified in place.
+    Like text, substituted expressions should be wrapped in parentheses
+    by the caller wherever they could be ambiguous.
+    Where they are not, chains of binary operators are regrouped
+    to match the tree that would have been parsed from text,
+    and any other ambiguous substitution falls back to composing and parsing text.
+    """
+    placeholder = re.compile('\$(\w+)')
+    placeholder_prefix = '__template_placeholder_'
+
+    def __init__(self, text, Rule):
+        self.text = text
+        self.Rule = Rule
+        self.names = set(Template.placeholder.findall(text))
+        self.tree = pypeg2.parse(
+            Template.placeholder.sub(Template.placeholder_prefix+'\\1', text), 
+            Rule
+        )
+
+    @staticmethod
+    def get_precedence(expression):
+        '''
+        "get_precedence" returns the index within order_of_operations 
+        for a binary expression or its type, -1 for anything that binds tighter, 
+        or None for expressions that cannot appear unwrapped within a binary expression
+        '''
+        for i, (BinaryExpressionTemp, binary_regex) in enumerate(order_of_operations):
+            if type(expression) is BinaryExpressionTemp or expression is BinaryExpressionTemp:
+                return i
+        if isinstance(expression, str) or type(expression) in unary_expression_or_less:
+            return -1
+        return None
+
+    @staticmethod
+    def get_chain(expression):
+        '''
+        "get_chain" returns the operands and operators of an unwrapped chain of binary operations,
+        alternating as they would appear in text, with each operator paired with its expression type
+        '''
+        if isinstance(expression, BinaryExpression):
+            return [
+                *Template.get_chain(expression.operand1), 
+                (type(expression), expression.operator), 
+                *Template.get_chain(expression.operand2)
+            ]
+        elif (isinstance(expression, PreIncrementExpression) 
+                and isinstance(expression.operand1, BinaryExpression)):
+            chain = Template.get_chain(expression.operand1)
+            chain[0] = PreIncrementExpression(chain[0], expression.operator)
+            return chain
+        else:
+            return [expression]
+
+    @staticmethod
+    def get_regrouped(chain):
+        '''
+        "get_regrouped" returns the parse tree for a chain as returned by get_chain().
+        Like the grammar, the chain is split at the first operator of lowest precedence, 
+        so that operations of equal precedence nest to the right.
+        '''
+        if len(chain) < 2:
+            return chain[0]
+        precedences = [Template.get_precedence(BinaryExpressionTemp) 
+                       for BinaryExpressionTemp, operator in chain[1::2]]
+        i = 1 + 2*precedences.index(max(precedences))
+        BinaryExpressionTemp, operator = chain[i]
+        return BinaryExpressionTemp(
+            Template.get_regrouped(chain[:i]), 
+            operator, 
+            Template.get_regrouped(chain[i+1:])
+        )
+
+    @staticmethod
+    def get_left_grouped(chain):
+        '''
+        "get_left_grouped" returns the parse tree for a chain as returned by get_chain(),
+        where operations of equal precedence nest to the left, as they are evaluated.
+        Unlike trees returned by get_regrouped(), these trees cannot be composed to text,
+        but their structure reflects the order of evaluation.
+        '''
+        if len(chain) < 2:
+            return chain[0]
+        precedences = [Template.get_precedence(BinaryExpressionTemp) 
+                       for BinaryExpressionTemp, operator in chain[1::2]]
+        i = len(chain) - 2 - 2*precedences[::-1].index(max(precedences))
+        BinaryExpressionTemp, operator = chain[i]
+        return BinaryExpressionTemp(
+            Template.get_left_grouped(chain[:i]), 
+            operator, 
+            Template.get_left_grouped(chain[i+1:])
+        )
+
+    @staticmethod
+    def is_grouped(expression):
+        '''
+        "is_grouped" returns whether a parse tree could have been parsed from its own text
+        '''
+        if isinstance(expression, BinaryExpression):
+            precedence = Template.get_precedence(expression)
+            precedence1 = Template.get_precedence(expression.operand1)
+            precedence2 = Template.get_precedence(expression.operand2)
+            return (precedence1 is not None and precedence2 is not None 
+                    and precedence1 < precedence and precedence2 <= precedence)
+        elif isinstance(expression, PreIncrementExpression):
+            return Template.get_precedence(expression.operand1) == -1
+        elif isinstance(expression, TernaryExpression):
+            return Template.get_precedence(expression.operand1) is not None
+        return True
+
+    def instantiate(self, **substitutions):
+        assert set(substitutions) == self.names, \
+            f'template "{self.text}" expects substitutions for {sorted(self.names)}'
+        is_ambiguous = False
+        def substitute(element):
+            nonlocal is_ambiguous
+            if isinstance(element, str):
+                if element.startswith(Template.placeholder_prefix):
+                    return substitutions[element[len(Template.placeholder_prefix):]]
+                return element
+            elif isinstance(element, list):
+                result = copy.copy(element)
+                result[:] = [substitute(subelement) for subelement in element]
+                return result
+            elif isinstance(element, GlslElement):
+                result = copy.copy(element)
+                for attribute in element_attributes:
+                    if hasattr(element, attribute):
+                        setattr(result, attribute, substitute(getattr(element, attribute)))
+                if Template.is_grouped(result):
+                    return result
+                chain = Template.get_chain(result)
+                if any([Template.get_precedence(operand) != -1 for operand in chain[::2]]):
+                    is_ambiguous = True
+                    return result
+                return Template.get_regrouped(chain)
+            else:
+                return element
+        result = substitute(self.tree)
+        if is_ambiguous:
+            def compose(match):
+                substitution = substitutions[match.group(1)]
+                return (substitution if isinstance(substitution, str) 
+                        else pypeg2.compose(substitution, type(substitution)))
+            text = Template.placeholder.sub(compose, self.text)
+            return pypeg2.parse(text, self.Rule)
+        return result
 
 def get_1_for_type(type_):
     identity_map ={
@@ -493,7 +959,7 @@ def get_1_for_type(type_):
     if type_ in identity_map:
         return identity_map[type_]
     else:
-        throw_not_implemented_error(type_element, 'additives identities for types')
+        raise NotImplementedError(f'support for multiplicative identities of type "{type_}" is not implemented')
     
 def get_0_for_type(type_):
     identity_map ={
@@ -507,7 +973,171 @@ def get_0_for_type(type_):
     if type_ in identity_map:
         return identity_map[type_]
     else:
-        throw_not_implemented_error(type_element, 'multiplicative identities for types')
+        raise NotImplementedError(f'support for additive identities of type "{type_}" is not implemented')
+
+class Diagnostic:
+    """
+    A "Diagnostic" is a structured record of a problem found within glsl code, 
+    such as a failure to deduce type.
+    It stores a reference to the offending element rather than its text, 
+    since pypeg2.compose() is expensive and most diagnostics are never read.
+    """
+    def __init__(self, kind, element, description='', types=None, operand=None):
+        self.kind = kind
+        self.element = element
+        self.description = description
+        self.types = types or []
+        self.operand = operand
+
+    def get_text(self):
+        if self.kind == 'budget-exhausted':
+            # the element is the function declaration that was being transformed
+            name = self.element.name if isinstance(self.element, FunctionDeclaration) else self.element
+            return f'budget exhausted while transforming "{name}" ({self.description}), the best result found so far was kept'
+        element_str = pypeg2.compose(self.element, type(self.element))
+        if self.kind == 'unknown-operand-type':
+            operand_str = pypeg2.compose(self.operand, type(self.operand))
+            return f'could not deduce type for variable "{operand_str}" \n\t{element_str}'
+        elif self.kind == 'type-mismatch':
+            return f'type mismatch, {self.description} \n\t{element_str}'
+        else:
+            return f'could not deduce type for {self.description} in "{element_str}"'
+
+    def get_json(self):
+        return {
+            'kind': self.kind,
+            'element_type': type(self.element).__name__,
+            'element': pypeg2.compose(self.element, type(self.element)),
+            'operand': (pypeg2.compose(self.operand, type(self.operand)) 
+                        if self.operand is not None else None),
+            'description': self.description,
+            'types': [type_ if isinstance(type_, str) or type_ is None 
+                      else pypeg2.compose(type_, type(type_)) 
+                      for type_ in self.types],
+            'message': self.get_text(),
+        }
+
+class Diagnostics:
+    """
+    A "Diagnostics" object collects Diagnostic records 
+    over the course of a conversion so they can be reported together at the end,
+    either as text or as json.
+    At most `limit` records are kept, any further records are only counted.
+    Records that are identical to one that was already added are ignored,
+    such as those found again when a function is converted once per parameter.
+    If `warn` is set, each record is also issued as a warning when it is added,
+    so that problems are not silently dropped when no collector is provided.
+    """
+    def __init__(self, limit=None, warn=False):
+        self.limit = limit
+        self.warn = warn
+        self.records = []
+        self.dropped_count = 0
+        self.keys = set()
+
+    def add(self, kind, element, description='', types=None, operand=None):
+        key = (kind, get_structure_key(element), description, 
+               get_structure_key(list(types or [])), get_structure_key(operand))
+        if key in self.keys:
+            return
+        self.keys.add(key)
+        if self.limit is not None and len(self.records) >= self.limit:
+            self.dropped_count += 1
+            return
+        record = Diagnostic(kind, element, description, types, operand)
+        self.records.append(record)
+        if self.warn:
+            warnings.warn(record.get_text())
+
+    def extend(self, other):
+        '''
+        "extend" adds the records of another Diagnostics object in order, 
+        such as one that was filled in by another process
+        '''
+        for record in other.records:
+            self.add(record.kind, record.element, record.description, record.types, record.operand)
+        self.dropped_count += other.dropped_count
+
+    def report(self, format='text', file=None):
+        file = file or sys.stderr
+        if format == 'json':
+            json.dump({
+                    'diagnostics': [record.get_json() for record in self.records],
+                    'dropped_count': self.dropped_count,
+                }, file, indent=2)
+            file.write('\n')
+        elif format == 'text':
+            for record in self.records:
+                file.write(f'warning: {record.get_text()}\n')
+            if self.dropped_count > 0:
+                file.write(f'warning: {self.dropped_count} further diagnostics were omitted\n')
+
+class Budget:
+    """
+    A "Budget" limits the work that transformations may do on a single function,
+    as a number of rewrites, a number of elements in its parse tree, and a number of seconds. 
+    Transformations that run out of budget return the best result they have found so far,
+    so that a pathological function cannot stall the conversion of a file.
+    Limits of None are never reached.
+    A budget only starts to count once get_started() is called for a function.
+    """
+    def __init__(self, iteration_limit=None, node_limit=None, time_limit=None):
+        self.iteration_limit = iteration_limit
+        self.node_limit = node_limit
+        self.time_limit = time_limit
+        self.is_started = False
+        self.iterations = 0
+        self.deadline = None
+        self.exhaustion = None
+        self.is_reported = False
+
+    def get_started(self):
+        '''
+        "get_started" returns a copy of the budget whose counts start now,
+        or the budget itself if it has already been started by a caller
+        '''
+        if self.is_started:
+            return self
+        result = Budget(self.iteration_limit, self.node_limit, self.time_limit)
+        result.is_started = True
+        if self.time_limit is not None:
+            result.deadline = time.monotonic() + self.time_limit
+        return result
+
+    def is_exhausted(self):
+        if self.exhaustion is None:
+            if self.iteration_limit is not None and self.iterations > self.iteration_limit:
+                self.exhaustion = f'more than {self.iteration_limit} rewrites'
+            elif self.deadline is not None and time.monotonic() > self.deadline:
+                self.exhaustion = f'more than {self.time_limit} seconds'
+        return self.exhaustion is not None
+
+    def spend(self, iterations=1):
+        '''
+        "spend" counts rewrites against the budget, 
+        and returns whether any budget remains
+        '''
+        self.iterations += iterations
+        return not self.is_exhausted()
+
+    def fits(self, size):
+        '''
+        "fits" returns whether a parse tree with `size` elements may be transformed,
+        and exhausts the budget if it may not
+        '''
+        if self.node_limit is not None and size > self.node_limit:
+            self.exhaustion = self.exhaustion or f'more than {self.node_limit} elements'
+        return not self.is_exhausted()
+
+    def report(self, diagnostics, declaration):
+        '''
+        "report" adds a diagnostic to `diagnostics` if the budget was exhausted,
+        at most once for each function, where `declaration` is the FunctionDeclaration
+        that was being transformed
+        '''
+        if self.exhaustion is not None and not self.is_reported:
+            diagnostics.add('budget-exhausted', declaration, self.exhaustion)
+            self.is_reported = True
 
 class LexicalScope:
     """ 
@@ -544,6 +1174,60 @@ class LexicalScope:
                     result[name] = element.type
         return result
 
+    @staticmethod
+    def get_initializers(declaration):
+        '''
+        "get_initializers" returns a dictionary that maps the names declared by a 
+        VariableDeclaration to their initial values, or None where no value is given
+        '''
+        content = declaration.content if isinstance(declaration.content, list) else [declaration.content]
+        return {
+            element.operand1 if isinstance(element, AssignmentExpression) else element:
+            element.operand2 if isinstance(element, AssignmentExpression) else None
+            for element in content
+        }
+
+    @staticmethod
+    def get_global_constant_lookups(code):
+        result = {}
+        for element in code:
+            if isinstance(element, VariableDeclaration) and 'const' in element.qualifiers:
+                for name, value in LexicalScope.get_initializers(element).items():
+                    if value is not None:
+                        result[name] = value
+        return result
+
+    @staticmethod
+    def get_local_constant_lookups(function_content):
+        '''
+        "get_local_constant_lookups" returns a dictionary that maps the names of 
+        `const` variables declared within a function to their values.
+        Names that are declared more than once are left out, 
+        since local variables are not otherwise distinguished by block.
+        '''
+        declarations = []
+        def visit(content):
+            for element in (content if isinstance(content, list) else [content]):
+                if isinstance(element, ForStatement):
+                    declarations.append(element.declaration)
+                    visit(element.content)
+                elif isinstance(element, VariableDeclaration):
+                    declarations.append(element)
+                elif type(element) in code_block_element_types:
+                    visit(element.content)
+                    if isinstance(element, IfStatement):
+                        visit(element.else_)
+        visit(function_content)
+        counts = collections.Counter([
+            name for declaration in declarations for name in declaration.get_names()])
+        result = {}
+        for declaration in declarations:
+            if 'const' in declaration.qualifiers:
+                for name, value in LexicalScope.get_initializers(declaration).items():
+                    if value is not None and counts[name] == 1:
+                        result[name] = value
+        return result
+
     @staticmethod
     def get_attribute_type_lookups(code):
         result = {}
@@ -565,35 +1249,66 @@ class LexicalScope:
                 result[element.name] = element.type
         return result
 
-    def __init__(self, code = []):
+    def __init__(self, code = [], diagnostics = None, base_scope = None):
+        '''
+        Type information is gathered from declarations within `code`.
+        If `base_scope` is provided, its type information is used 
+        for anything that is not declared within `code`,
+        such as declarations found in other files.
+        Problems found while deducing types are recorded in `diagnostics`,
+        or issued as warnings if it is not provided, see Diagnostics.
+        The type information of `base_scope` is layered beneath that of `code` 
+        rather than copied, so that constructing a scope does not depend on its size.
+        '''
         self.variables  = LexicalScope.get_global_variable_type_lookups(code)
         self.functions  = LexicalScope.get_function_type_lookups(code)
         self.attributes = LexicalScope.get_attribute_type_lookups(code)
+        self.constants  = LexicalScope.get_global_constant_lookups(code)
+        if base_scope is not None:
+            self.variables  = collections.ChainMap(self.variables,  base_scope.variables)
+            self.functions  = collections.ChainMap(self.functions,  base_scope.functions)
+            self.attributes = collections.ChainMap(self.attributes, base_scope.attributes)
         self.callstack  = []
         self.returntype = None
+        self.diagnostics = diagnostics if diagnostics is not None else Diagnostics(warn=True)
         
     def get_subscope(self, function):
         """
         returns a new LexicalScope object whose state reflects the type 
-        information of variables defined within a local subscope
+        information of variables defined within a local subscope.
+        Local declarations are layered above those of this scope, 
+        so only the declarations within `function` are gathered.
         """
         assert_type(function, [FunctionDeclaration])
-        result = LexicalScope()
-        result.attributes = copy.deepcopy(self.attributes)
-        result.functions = copy.deepcopy(self.functions)
-        result.variables = {
-            **self.variables,
-            **LexicalScope.get_local_variable_type_lookups(function.parameters),
-            **LexicalScope.get_local_variable_type_lookups(function.content)
-        }
+        result = LexicalScope(diagnostics = self.diagnostics)
+        result.attributes = collections.ChainMap({}, self.attributes)
+        result.functions = collections.ChainMap({}, self.functions)
+        local_variables = LexicalScope.get_local_variable_type_lookups([*function.parameters, *function.content])
+        result.variables = collections.ChainMap(local_variables, self.variables)
+        # constants that are shadowed by local variables are left out, 
+        # which requires a copy only if there are any
+        constants = self.constants
+        if any([name in constants for name in local_variables]):
+            constants = {name: value for name, value in constants.items() if name not in local_variables}
+        result.constants = collections.ChainMap(
+            LexicalScope.get_local_constant_lookups(function.content), constants)
         result.callstack = [*self.callstack, function.name]
         result.returntype = function.type
         return result
+
+    def get_quiet_scope(self):
+        """
+        returns a copy of this scope that does not record diagnostics,
+        for deducing types where problems are reported elsewhere, or not at all,
+        such as when deciding whether a rewrite is safe
+        """
+        result = copy.copy(self)
+        result.diagnostics = Diagnostics(0)
+        return result
         
     def deduce_type(self, expression):
-        def warn_of_type_deduction_failure(expression, description):
-            expression_str = pypeg2.compose(expression, type(expression))
-            warnings.warn(f'could not deduce type for {description} in "{expression_str}"')
+        def warn_of_type_deduction_failure(expression, description, types=None):
+            self.diagnostics.add('type-deduction-failure', expression, description, types)
 
         assert_type(expression, [str, GlslElement])
 
@@ -621,9 +1336,12 @@ class LexicalScope:
                 type_ = built_in_function_type_map[expression.reference]
             # function invocation (built-in, overloaded)
             elif expression.reference in built_in_overloaded_functions:
-                param_types = [self.deduce_type(param) for param in expression.arguments]
-                vector_param_types = [param_type for param_type in param_types if param_type in vector_types]
-                type_ = vector_param_types[0] if len(vector_param_types) > 0 else param_types[0]
+                argument_types = tuple([self.deduce_type(argument) for argument in expression.arguments])
+                if all([isinstance(argument_type, str) for argument_type in argument_types]):
+                    type_ = get_built_in_function_type(expression.reference, argument_types)
+                if type_ is None:
+                    argument_types_str = ', '.join([str(argument_type) for argument_type in argument_types])
+                    warn_of_type_deduction_failure( expression, f'call to "{expression.reference}" with no overload for arguments of type ({argument_types_str})', list(argument_types) )
             # function invocation (user-defined)
             elif expression.reference in self.functions:
                 type_ = self.functions[expression.reference]
@@ -677,30 +1395,26 @@ class LexicalScope:
             elif matrix_type:
                 type_ = matrix_type
             else:
-                expression_str = pypeg2.compose(expression, type(expression))
-                operand1_str = pypeg2.compose(expression.operand1, type(expression.operand1))
-                operand2_str = pypeg2.compose(expression.operand2, type(expression.operand2))
                 if type1 == None:
-                    warnings.warn(f'could not deduce type for variable "{operand1_str}" \n\t{expression_str}')
+                    self.diagnostics.add('unknown-operand-type', expression, types=[type1, type2], operand=expression.operand1)
                 elif type2 == None:
-                    warnings.warn(f'could not deduce type for variable "{operand2_str}" \n\t{expression_str}')
+                    self.diagnostics.add('unknown-operand-type', expression, types=[type1, type2], operand=expression.operand2)
                 elif type1 != type2:
-                    warnings.warn(f'type mismatch, operation "{expression.operator}" was fed left operand of type "{type1}" and right hand operand of type "{type2}" \n\t{expression_str} ')
+                    self.diagnostics.add('type-mismatch', expression, 
+                        f'operation "{expression.operator}" was fed left operand of type "{type1}" and right hand operand of type "{type2}"', 
+                        [type1, type2])
                 type_ = type1
         elif isinstance(expression, TernaryExpression):
             type1 = self.deduce_type(expression.operand2)
             type2 = self.deduce_type(expression.operand3)
-            expression_str = pypeg2.compose(expression, type(expression))
-            operand1_str = pypeg2.compose(expression.operand2, type(expression.operand2))
-            operand2_str = pypeg2.compose(expression.operand3, type(expression.operand3))
             if type1 == None:
-                warnings.warn(f'could not deduce type for variable "{operand1_str}" \n\t{expression_str}')
+                self.diagnostics.add('unknown-operand-type', expression, types=[type1, type2], operand=expression.operand2)
             elif type2 == None:
-                warnings.warn(f'could not deduce type for variable "{operand2_str}" \n\t{expression_str}')
+                self.diagnostics.add('unknown-operand-type', expression, types=[type1, type2], operand=expression.operand3)
             elif type1 != type2:
-                expression_str = pypeg2.compose(expression, TernaryExpression)
-                warnings.warn(f'type mismatch, ternary operation takes a left hand operand of type "{type1}" and right hand operand of type "{type2} \n\t{expression_str}"')
-                warnings.warn(seariables)
+                self.diagnostics.add('type-mismatch', expression, 
+                    f'ternary operation takes a left hand operand of type "{type1}" and right hand operand of type "{type2}"', 
+                    [type1, type2])
             type_ = type1
         elif isinstance(expression, AssignmentExpression):
             type_ = self.deduce_type(expression.operand2)
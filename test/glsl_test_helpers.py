@@ -0,0 +1,15 @@
+def get_function_body(output, name=None):
+    '''
+    "get_function_body" returns the lines within a function of glsl code,
+    or within the first function if `name` is not given,
+    without their indentation or blank lines, or None if the function is not declared.
+    The body ends at the first closing brace that is not indented,
+    so braces of nested blocks are kept.
+    '''
+    lines = output.splitlines()
+    for i, line in enumerate(lines):
+        if line.strip().endswith('(') and (name is None or line.strip().endswith(f' {name}(')):
+            start = [line.strip() for line in lines].index('){', i) + 1
+            end = lines.index('}', start)
+            return [line.strip() for line in lines[start:end] if line.strip()]
+    return None
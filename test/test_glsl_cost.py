@@ -0,0 +1,47 @@
+import json
+
+import glsl_cost
+
+def get_costs(text):
+    '''
+    "get_costs" returns a dictionary mapping the signature of every function
+    within glsl code to its estimated cost
+    '''
+    return {entry.pop('function'): entry for entry in json.loads(glsl_cost.convert_text(text, format='json'))}
+
+def test_operations_are_counted_per_component():
+    costs = get_costs('float f(float x){ return x * x + 1.0; } vec3 g(vec3 v){ return v * v + 1.0; }')
+    assert costs['f(float)']['alu'] == 2
+    assert costs['g(vec3)']['alu'] == 6
+    assert costs['g(vec3)']['transcendental'] == 0
+
+def test_transcendental_operations_are_weighted():
+    cost, = get_costs('float f(float x){ return sin(x) + sqrt(x); }').values()
+    assert cost['alu'] == 2
+    assert cost['transcendental'] == 2
+    assert cost['weighted'] == 2 + 2 * glsl_cost.transcendental_weight
+
+def test_fixed_costs_and_matrix_products():
+    costs = get_costs('float f(vec3 v){ return length(v); } vec3 g(mat3 m, vec3 v){ return m * v; }')
+    assert costs['f(vec3)']['alu'] == 6
+    assert costs['f(vec3)']['transcendental'] == 1
+    # a dot product of three components for each of three components
+    assert costs['g(mat3, vec3)']['alu'] == 9
+
+def test_branches_and_registers():
+    text = '''
+    float f(float x, vec4 c){
+        vec3 a = c.xyz * x;
+        float b = a.x + a.y;
+        if (b > 0.0) { b += 1.0; }
+        return b * c.w;
+    }'''
+    cost, = get_costs(text).values()
+    assert cost['branches'] == 1
+    # "a" and "c" are live at once, "x" is not read after "a" is assigned
+    assert cost['registers'] == 3 + 4
+
+def test_text_report():
+    header, row = glsl_cost.convert_text('float f(float x){ return x; }').splitlines()
+    assert header.split() == ['function', 'alu', 'transcendental', 'branches', 'registers', 'weighted']
+    assert row.split() == ['f(float)', '0', '0', '0', '1', '0']
@@ -0,0 +1,46 @@
+import glsl_cse
+
+from glsl_test_helpers import get_function_body
+
+def test_repeated_expressions_are_stored():
+    output = glsl_cse.convert_text('float f(float x, float y){ float a = sin(x*y) + cos(x*y); return a * sin(x*y); }')
+    assert get_function_body(output, 'f') == [
+        'float cse0 = x * y;',
+        'float cse1 = sin(cse0);',
+        'float a = cse1 + cos(cse0);',
+        'return a * cse1;',
+    ]
+
+def test_expressions_are_not_reused_after_assignment():
+    output = glsl_cse.convert_text('float f(float x){ float a = x*x+1.0; x = x + 1.0; return a + (x*x+1.0); }')
+    assert 'cse' not in output
+
+def test_impure_expressions_are_not_stored():
+    output = glsl_cse.convert_text('float g(inout float x){ x += 1.0; return x; } float f(float x){ return g(x) * g(x) + (x + x) * (x + x); }')
+    assert get_function_body(output, 'f') == [
+        'float cse0 = x + x;',
+        'return g(x) * g(x) + cse0 * cse0;',
+    ]
+
+def test_expressions_are_not_moved_out_of_control_flow():
+    output = glsl_cse.convert_text('float f(float x){ float a = x*x+1.0; if (x > 0.0) { return (x*x+1.0) * (x*x+1.0); } return a; }')
+    assert get_function_body(output, 'f') == [
+        'float a = x * x + 1.0;',
+        'if (x > 0.0)',
+        '{',
+        'float cse0 = x * x + 1.0;',
+        'return cse0 * cse0;',
+        '}',
+        'return a;',
+    ]
+
+def test_names_do_not_collide():
+    output = glsl_cse.convert_text('float f(float cse0){ return sin(cse0*2.0) + sin(cse0*2.0); }')
+    assert get_function_body(output, 'f') == [
+        'float cse1 = sin(cse0 * 2.0);',
+        'return cse1 + cse1;',
+    ]
+
+def test_trivial_expressions_are_not_stored():
+    output = glsl_cse.convert_text('float f(vec3 v){ return v.x + v.x * -v.y + vec2(1.0).x * vec2(1.0).x - -v.y; }')
+    assert 'cse' not in output
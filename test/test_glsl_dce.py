@@ -0,0 +1,70 @@
+import glsl_dce
+
+from glsl_test_helpers import get_function_body
+
+def test_dead_stores_are_removed():
+    assert get_function_body(glsl_dce.convert_text('''
+        float f(float x){
+            float a = x * x;
+            float b = x + 1.0;
+            a = b;
+            return a;
+        }
+    ''')) == ['float a;', 'float b = x + 1.0;', 'a = b;', 'return a;']
+
+def test_unused_declarations_are_removed():
+    assert get_function_body(glsl_dce.convert_text('''
+        float f(float x){
+            float a;
+            float b = x;
+            return x;
+        }
+    ''')) == ['return x;']
+
+def test_out_parameters_and_side_effects_are_kept():
+    assert get_function_body(glsl_dce.convert_text('''
+        float f(float x, out float y){
+            float a = g(x);
+            y = x;
+            return x;
+        }
+    ''')) == ['float a = g(x);', 'y = x;', 'return x;']
+
+def test_loops_keep_values_read_by_later_iterations():
+    assert get_function_body(glsl_dce.convert_text('''
+        float f(float x){
+            float s = 0.0;
+            float t = 1.0;
+            for (int i = 0; i < 3; i++) {
+                s += t;
+                t = t * x;
+            }
+            return s;
+        }
+    ''')) == [
+        'float s = 0.0;',
+        'float t = 1.0;',
+        'for (int i = 0; i < 3; i++)',
+        '{',
+        's += t;',
+        't = t * x;',
+        '}',
+        'return s;',
+    ]
+
+def test_variable_named_after_called_function_is_kept():
+    assert get_function_body(glsl_dce.convert_text('''
+        float f(float a, float b){
+            float max = max(a, b);
+            return max(a, b);
+        }
+    ''')) == ['float max = max(a, b);', 'return max(a, b);']
+
+def test_variable_declared_twice_is_kept():
+    assert get_function_body(glsl_dce.convert_text('''
+        vec3 f(mat3 A){
+            vec3 B = A[1];
+            vec3 B = A[0];
+            return B;
+        }
+    ''')) == ['vec3 B = A[1];', 'vec3 B = A[0];', 'return B;']
@@ -0,0 +1,331 @@
+import io
+import os
+
+import pypeg2 as peg
+import pypeg2glsl as glsl
+import glsl_derivative
+
+from glsl_test_helpers import get_function_body
+
+def test_structure_keys_ignore_identity():
+    expressions = [peg.parse(text, glsl.ternary_expression_or_less) for text in ['x*x + sin(x*x)', 'x*x + sin(x*x)', 'x+x', 'x*x']]
+    keys = [glsl.get_structure_key(expression) for expression in expressions]
+    assert keys[0] == keys[1] and keys[2] != keys[3]
+    assert glsl.get_structure_key(expressions[0].operand1) == keys[3]
+
+def test_repeated_subexpressions_are_differentiated_once():
+    glsl_derivative.derivative_cache_statistics.clear()
+    output = glsl_derivative.convert_text('float f(float x){ return sin(x*x) + cos(x*x); }')
+    assert get_function_body(output, 'ddx_f') == [
+        'float cse0 = x * x;',
+        'return 2.0f * x * cos(cse0) - 2.0f * x * sin(cse0);',
+    ]
+    assert glsl_derivative.derivative_cache_statistics['hits'] == 2
+
+def test_reused_derivatives_are_copied():
+    f = peg.parse('float f(float x){ return sin(x*x) + cos(x*x); }', glsl.FunctionDeclaration)
+    ddx_f = glsl_derivative.get_ddx_function(f, 'x', glsl.LexicalScope([f]))
+    ids = []
+    def visit(element):
+        if isinstance(element, (list, glsl.GlslElement)):
+            ids.append(id(element))
+            for subelement in (element if isinstance(element, list) else vars(element).values()):
+                visit(subelement)
+    visit(ddx_f)
+    assert len(ids) == len(set(ids))
+
+def test_inactive_variables_are_not_differentiated():
+    text = 'float f(float x, float y){ float a = y*y; float b = x*a; return b + a; }'
+    output = glsl_derivative.convert_text(text)
+    assert get_function_body(output, 'ddx_f') == [
+        'float a = y * y;',
+        'float ddx_b = a;',
+        'return ddx_b;',
+    ]
+    assert get_function_body(output, 'ddy_f') == [
+        'float ddy_a = 2.0f * y;',
+        'float ddy_b = ddy_a * x;',
+        'return ddy_a + ddy_b;',
+    ]
+
+def test_unavailable_derivative_does_not_truncate_output():
+    output = glsl_derivative.convert_text('float f(float x){ return x; }\nvec2 g(vec2 x){ return abs(x); }\nfloat h(float x){ return x*x; }')
+    assert 'Derivative "ddx_g" not available' in output
+    assert get_function_body(output, 'ddx_h') == ['return 2.0f * x;']
+
+def test_gradient_accumulates_adjoints_in_reverse():
+    text = 'float f(float x, float y){ float a = x*y; float b = sin(a) + x; return a*b; }'
+    output = glsl_derivative.convert_text(text, mode='gradient')
+    assert 'float gradient_f(' in output
+    assert 'out float ddx_f,' in output and 'out float ddy_f' in output
+    assert get_function_body(output, 'gradient_f') == [
+        'float a = x * y;',
+        'float b = x + sin(a);',
+        'float adjoint_x = 0.0f;',
+        'float adjoint_y = 0.0f;',
+        'float adjoint_a = 0.0f;',
+        'float adjoint_b = 0.0f;',
+        'adjoint_a += b;',
+        'adjoint_b += a;',
+        'adjoint_a += adjoint_b * cos(a);',
+        'adjoint_x += adjoint_b;',
+        'adjoint_x += adjoint_a * y;',
+        'adjoint_y += adjoint_a * x;',
+        'ddx_f = adjoint_x;',
+        'ddy_f = adjoint_y;',
+        'return a * b;',
+    ]
+
+def test_gradient_of_accumulated_variable():
+    output = glsl_derivative.convert_text('float f(float x){ float a = x; a += x * x; return a; }', mode='gradient')
+    assert get_function_body(output, 'gradient_f')[-5:] == [
+        'adjoint_a += 1.0f;',
+        'adjoint_x += 2.0f * adjoint_a * x;',
+        'adjoint_x += adjoint_a;',
+        'ddx_f = adjoint_x;',
+        'return a;',
+    ]
+
+def test_gradient_reports_unsupported_code():
+    for text, description in [
+        ('float f(float x){ if (x > 0.0) { return x; } return -x; }', 'control flow within gradients'),
+        ('float f(float x){ float a = x; a = a * x; return a; }', 'reassignment of variables after they are read'),
+        ('vec2 f(float x){ return vec2(x); }', 'gradients of functions that do not return a float'),
+    ]:
+        output = glsl_derivative.convert_text(text, mode='gradient')
+        assert 'Gradient "gradient_f" not available' in output
+        assert description in output
+
+def test_dual_packs_scalars_into_vec2():
+    output = glsl_derivative.convert_text('float f(float x, float y){ float a = x*y; return sin(a) + a; }', mode='dual')
+    assert 'vec2 dual_ddx_f(' in output
+    assert get_function_body(output, 'dual_ddx_f') == [
+        'float a = x * y;',
+        'float ddx_a = y;',
+        'return vec2(a + sin(a), ddx_a + ddx_a * cos(a));',
+    ]
+    assert get_function_body(output, 'dual_ddy_f')[-1] == 'return vec2(a + sin(a), ddy_a + ddy_a * cos(a));'
+
+def test_dual_declares_each_structure_once():
+    text = 'vec3 f(vec3 a, float t){ return a*t; } vec3 g(vec3 a, float t){ return a/t; }'
+    output = glsl_derivative.convert_text(text, mode='dual')
+    assert output.count('struct dual_vec3_vec3') == 1
+    assert output.index('struct dual_vec3_vec3') < output.index('dual_vec3_vec3 dual_dda_f(')
+    assert 'vec3 derivative;' in output
+
+constant_text = '''
+const float K = 2.0;
+const int N = 3;
+const float K2 = K * K;
+float f(float x){ return K * K * x; }
+float g(float x){ float s = 0.0; for (int i = 0; i < N; i++) { s += x * float(i); } return s; }
+float h(float x){ return K2 * x * x; }
+'''
+
+def get_json_diagnostics(diagnostics):
+    output = io.StringIO()
+    diagnostics.report('json', output)
+    return output.getvalue()
+
+def test_jobs_keep_order_and_diagnostics():
+    text = constant_text + 'float u(float x){ return x * y; }\nvec2 w(float x){ return vec2(x) * 2; }\n'
+    for input_handling in ['omit', 'embed', 'prepend']:
+        diagnostics = glsl.Diagnostics()
+        output = glsl_derivative.convert_text(text, input_handling=input_handling, diagnostics=diagnostics, jobs=1)
+        pooled_diagnostics = glsl.Diagnostics()
+        assert glsl_derivative.convert_text(text, input_handling=input_handling, diagnostics=pooled_diagnostics, jobs=3) == output
+        assert diagnostics.records
+        assert get_json_diagnostics(pooled_diagnostics) == get_json_diagnostics(diagnostics)
+
+def test_jobs_receive_base_scope():
+    base_scope = glsl.LexicalScope(peg.parse('struct S { vec3 p; float r; }; uniform S s; float k(float x){ return x; }', glsl.code))
+    text = 'float f(float x){ return s.r * x * k(x); }\nfloat g(float x){ return s.r * x; }\n'
+    output = glsl_derivative.convert_text(text, base_scope=base_scope, jobs=1)
+    assert glsl_derivative.convert_text(text, base_scope=base_scope, jobs=2) == output
+    assert get_function_body(output, 'ddx_g') == ['return s.r;']
+
+def test_cache_persists_output_and_diagnostics(tmp_path):
+    cache_filename = str(tmp_path / 'cache.json')
+    text = 'float f(float x){ return x * x; }\nfloat u(float x){ return x * y; }\n'
+    cache = glsl_derivative.PersistentDerivativeCache(cache_filename)
+    diagnostics = glsl.Diagnostics()
+    output = glsl_derivative.convert_text(text, diagnostics=diagnostics, cache=cache)
+    cache.save()
+    assert cache.hits == 0 and cache.misses == 2
+    cache = glsl_derivative.PersistentDerivativeCache(cache_filename)
+    cached_diagnostics = glsl.Diagnostics()
+    assert glsl_derivative.convert_text(text, diagnostics=cached_diagnostics, cache=cache) == output
+    assert cache.hits == 2 and cache.misses == 0
+    assert get_json_diagnostics(cached_diagnostics) == get_json_diagnostics(diagnostics)
+
+def test_cache_depends_on_referenced_types():
+    cache = glsl_derivative.PersistentDerivativeCache()
+    text = 'float k(float x){ return x; }\nfloat f(float x){ return k(x) * x; }\nfloat g(float x){ return x * x; }\n'
+    glsl_derivative.convert_text(text, cache=cache)
+    misses = cache.misses
+    glsl_derivative.convert_text(text.replace('float k(', 'vec2 k('), cache=cache)
+    # "k" and "f" are converted again, "g" does not refer to "k"
+    assert cache.misses - misses == 2
+    assert cache.hits == 1
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache_filename = str(tmp_path / 'cache.json')
+    cache = glsl_derivative.PersistentDerivativeCache(cache_filename, limit=2)
+    glsl_derivative.convert_text('float f(float x){ return x * x; }', cache=cache)
+    cache.save()
+    cache = glsl_derivative.PersistentDerivativeCache(cache_filename, limit=2)
+    glsl_derivative.convert_text('float g(float x){ return x + x; }\nfloat h(float x){ return x - x; }', cache=cache)
+    cache.save()
+    cache = glsl_derivative.PersistentDerivativeCache(cache_filename, limit=2)
+    assert len(cache.entries) == 2
+    glsl_derivative.convert_text('float f(float x){ return x * x; }', cache=cache)
+    assert cache.hits == 0
+
+def get_function_names(output):
+    return [line.split()[1][:-1] for line in output.splitlines() if line.endswith('(') and not line.startswith(' ')]
+
+def test_second_order_derivatives_are_symmetric():
+    output = glsl_derivative.convert_text('float f(float x, float y){ return x*x*y; }', orders=(2,))
+    # mixed partial derivatives are only output once
+    assert get_function_names(output) == ['ddx_ddx_f', 'ddy_ddx_f', 'ddy_ddy_f']
+    assert get_function_body(output, 'ddx_ddx_f') == ['return 2.0f * y;']
+    assert get_function_body(output, 'ddy_ddx_f') == ['return 2.0f * x;']
+    assert get_function_body(output, 'ddy_ddy_f') == ['return 0.0f;']
+
+def test_third_order_derivative():
+    output = glsl_derivative.convert_text('float f(float x){ return sin(x); }', orders=(3,))
+    assert get_function_names(output) == ['ddx_ddx_ddx_f']
+    assert get_function_body(output, 'ddx_ddx_ddx_f') == ['return -cos(x);']
+
+def test_hessian_outputs_first_and_second_order():
+    output = glsl_derivative.convert_text('float f(float x, float y){ return x*y; }', orders=(1, 2))
+    assert get_function_names(output) == ['ddx_f', 'ddy_f', 'ddx_ddx_f', 'ddy_ddx_f', 'ddy_ddy_f']
+    assert get_function_body(output, 'ddy_ddx_f') == ['return 1.0f;']
+
+def test_derivatives_of_sqrt_and_tan():
+    output = glsl_derivative.convert_text('float f(float x){ return sqrt(x*x + 1.0); }')
+    assert get_function_body(output, 'ddx_f') == ['return x / sqrt(x * x + 1.0f);']
+    output = glsl_derivative.convert_text('float f(float x){ return tan(2.0*x); }')
+    assert get_function_body(output, 'ddx_f') == ['return 2.0f / pow(cos(2.0f * x), 2.0f);']
+
+def test_vector_derivative():
+    output = glsl_derivative.convert_text('vec3 vv(vec3 a, float t){return a*t;}')
+    assert get_function_body(output, 'dda_vv') == ['return vec3(t);']
+    assert get_function_body(output, 'ddt_vv') == ['return a;']
+
+def test_dual_structures_allow_underscores_in_types():
+    declaration = glsl_derivative.get_dual_structure_declaration('sdf_vec3', 'float')
+    assert declaration.name == 'dual_sdf_vec3_float'
+    assert peg.compose(declaration, glsl.StructureDeclaration).split() == [
+        'struct', 'dual_sdf_vec3_float', '{', 'sdf_vec3', 'value;', 'float', 'derivative;', '};']
+
+def test_vector_dual():
+    output = glsl_derivative.convert_text('vec3 vv(vec3 a, float t){return a*t;}', mode='dual')
+    assert get_function_body(output, 'dual_dda_vv') == ['return dual_vec3_vec3(a * t, vec3(t));']
+    assert get_function_body(output, 'dual_ddt_vv') == ['return dual_vec3_vec3(a * t, a);']
+
+def test_inactive_vector_variable():
+    text = 'vec3 vw(vec3 a, float t){vec3 b = a * 2.0; float s = t * t; return b * s + a;}'
+    output = glsl_derivative.convert_text(text)
+    assert get_function_body(output, 'ddt_vw') == [
+        'vec3 b = 2.0f * a;',
+        'float ddt_s = 2.0f * t;',
+        'return b * ddt_s;',
+    ]
+    output = glsl_derivative.convert_text(text, mode='dual')
+    assert get_function_body(output, 'dual_dda_vw')[-1] == 'return dual_vec3_vec3(a + b * s, dda_b * s + vec3(1.f));'
+
+def test_undeclared_variable_is_reported():
+    text = 'float test_constructor(in float X){ vec2 U = vec2(x); return sqrt(U.x); }'
+    for mode in ['derivative', 'dual']:
+        output = glsl_derivative.convert_text(text, mode=mode)
+        assert 'not available' in output
+        assert 'vec2(x)' in output
+
+def test_jobs_do_not_change_output():
+    for mode in ['derivative', 'dual', 'gradient']:
+        output = glsl_derivative.convert_text(constant_text, mode=mode, jobs=1)
+        assert glsl_derivative.convert_text(constant_text, mode=mode, jobs=2) == output
+    output = glsl_derivative.convert_text(constant_text, jobs=2)
+    assert get_function_body(output, 'ddx_f') == ['return 4.0f;']
+    assert 'not available' not in output
+
+def test_worker_intermediates_are_bounded():
+    glsl_derivative.set_worker_declarations({'functions': {}, 'attributes': {}, 'variables': {}}, {}, None)
+    count = glsl_derivative.worker_intermediates_limit + 4
+    for i in range(count):
+        output, diagnostics, _, _ = glsl_derivative.get_converted_function_in_worker(
+            f'float f{i}(float x){{ return x * x * float({i}); }}', ('x', 'x'), 'derivative')
+        assert peg.compose(output, glsl.FunctionDeclaration).split()[:2] == ['float', f'ddx_ddx_f{i}(']
+    assert list(glsl_derivative.worker_intermediates) == [
+        f'float f{i}(float x){{ return x * x * float({i}); }}' 
+        for i in range(count - glsl_derivative.worker_intermediates_limit, count)]
+    glsl_derivative.set_worker_declarations({'functions': {}, 'attributes': {}, 'variables': {}}, {}, None)
+    assert len(glsl_derivative.worker_intermediates) == 0
+
+def test_jobs_unroll_loops_bounded_by_global_const():
+    output = glsl_derivative.convert_text(constant_text, jobs=2)
+    assert get_function_body(output, 'ddx_g') == [
+        'float ddx_s = 0.0f;',
+        'ddx_s += 0.0f;',
+        'ddx_s += 1.0f;',
+        'ddx_s += 2.0f;',
+        'return ddx_s;',
+    ]
+
+def test_cache_depends_on_constant_values():
+    cache = glsl_derivative.PersistentDerivativeCache()
+    output = glsl_derivative.convert_text(constant_text, cache=cache)
+    assert get_function_body(output, 'ddx_f') == ['return 4.0f;']
+    assert get_function_body(output, 'ddx_h') == ['return 8.0f * x;']
+    assert cache.hits == 0
+    output = glsl_derivative.convert_text(constant_text.replace('K = 2.0', 'K = 5.0'), cache=cache)
+    assert get_function_body(output, 'ddx_f') == ['return 25.0f;']
+    assert get_function_body(output, 'ddx_h') == ['return 50.0f * x;']
+    # only "g" does not refer to K
+    assert cache.hits == 1
+    output = glsl_derivative.convert_text(constant_text, cache=cache)
+    assert get_function_body(output, 'ddx_f') == ['return 4.0f;']
+    assert cache.hits == 4
+
+
+def get_tool_basenames():
+    return [os.path.basename(filename) for filename in glsl_derivative.get_tool_filenames()]
+
+def test_tool_version_covers_imported_modules():
+    basenames = get_tool_basenames()
+    for basename in ['pypeg2glsl.py', 'glsl_derivative.py', 'glsl_simplify.py', 'glsl_cse.py', 'glsl_dce.py',
+                     'glsl_rewrite.py', 'glsl_cost.py', 'glsl_egraph.py']:
+        assert basename in basenames
+    assert 'glsl_numpy.py' not in basenames
+
+def test_tool_version_covers_unrolling():
+    assert 'glsl_unroll.py' in get_tool_basenames()
+
+def test_tool_version_covers_inlining():
+    assert 'glsl_inline.py' in get_tool_basenames()
+
+def test_structure_ids_match_structure_keys():
+    expressions = [peg.parse(text, glsl.ternary_expression_or_less) for text in ['x*x + sin(x*x)', 'x*x + sin(x*x)', 'x+x', 'x*x']]
+    structure_ids, element_ids = {}, {}
+    ids = [glsl.get_structure_id(expression, structure_ids, element_ids) for expression in expressions]
+    keys = [glsl.get_structure_key(expression) for expression in expressions]
+    for i in range(len(expressions)):
+        for j in range(len(expressions)):
+            assert (ids[i] == ids[j]) == (keys[i] == keys[j])
+    assert ids[0] == ids[1] and ids[2] != ids[3]
+    product = expressions[0].operand1
+    assert glsl.get_structure_id(product, structure_ids, element_ids) == ids[3]
+
+def test_nested_expression_is_keyed_once_per_node():
+    depth = 12
+    text = 'sin(' * depth + 'x' + ')' * depth
+    output = glsl_derivative.convert_text(f'float f(float x){{ return {text}; }}')
+    assert get_function_body(output, 'ddx_f')[-1].startswith('return cos(')
+    structure_ids, element_ids = {}, {}
+    expression = peg.parse(text, glsl.ternary_expression_or_less)
+    glsl.get_structure_id(expression, structure_ids, element_ids)
+    identified = dict(element_ids)
+    for element, _ in identified.values():
+        glsl.get_structure_id(element, structure_ids, element_ids)
+    assert element_ids == identified
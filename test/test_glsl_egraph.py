@@ -0,0 +1,45 @@
+import time
+
+import pypeg2 as peg
+import pypeg2glsl as glsl
+import glsl_egraph
+import glsl_rewrite
+import glsl_simplify
+
+from glsl_test_helpers import get_function_body
+
+def get_expression(text):
+    return glsl_rewrite.get_evaluation_grouped(peg.parse(text, glsl.ternary_expression_or_less))
+
+def get_scope(text):
+    return glsl.LexicalScope(peg.parse(text, glsl.code), glsl.Diagnostics(0))
+
+def test_rules_that_cost_more_at_first_are_found():
+    text = 'float f(float a, float b, float c){ return a*b + a*c + a*b*c; }'
+    assert get_function_body(glsl_simplify.convert_text(text, egraph=False)) == ['return a * b + a * b * c + a * c;']
+    assert get_function_body(glsl_simplify.convert_text(text, egraph=True)) == ['return a * (b + b * c + c);']
+    text = 'float f(float a, float b){ return exp(a)*exp(b) * pow(a, 2.0); }'
+    assert get_function_body(glsl_simplify.convert_text(text, egraph=True)) == ['return a * a * exp(a + b);']
+
+def test_integers_are_not_rearranged():
+    assert get_function_body(glsl_simplify.convert_text('int f(int a, int b, int c){ return a*b + a*c; }', egraph=True)) == ['return a * b + a * c;']
+
+def test_equal_expressions_share_e_classes():
+    egraph = glsl_egraph.EGraph(get_scope('uniform float x; uniform float y;'))
+    a = egraph.add(get_expression('x * y + sin(x)'))
+    assert egraph.add(get_expression('x * y + sin(x)')) == a
+    b = egraph.add(get_expression('sin(x) + x * y'))
+    assert a != b
+    glsl_egraph.get_saturated(egraph, glsl_egraph.egraph_rules, time.monotonic() + 10.0)
+    assert egraph.find(a) == egraph.find(b)
+
+def test_limits_leave_equivalent_expressions():
+    scope = get_scope('uniform float a; uniform float b; uniform float c; uniform float d;')
+    expression = get_expression('a * b + a * c + a * d + b * c + b * d + c * d')
+    egraph = glsl_egraph.EGraph(scope)
+    id_ = egraph.add(expression)
+    assert not glsl_egraph.get_saturated(egraph, glsl_egraph.egraph_rules, time.monotonic() + 10.0, node_limit=50)
+    result = egraph.extract(id_)
+    assert isinstance(result, glsl.AdditiveExpression)
+    # expressions larger than max_size are left as they are
+    assert glsl_egraph.get_optimized(expression, scope, max_size=3) is expression
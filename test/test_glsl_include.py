@@ -0,0 +1,99 @@
+import os
+
+import pytest
+
+import pypeg2 as peg
+import pypeg2glsl as glsl
+import pypeg2js as js
+import glsl_include
+import glsl_js
+
+def write(filename, text):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'w') as file:
+        file.write(text)
+
+def get_basenames(headers):
+    return [os.path.basename(header.path) for header in headers]
+
+def test_include_names_and_guards():
+    assert glsl_include.get_include_names('#include "a.glsl"\n  # include <b/c.glsl>\n// #include "d"') == ['a.glsl', 'b/c.glsl']
+    assert glsl_include.get_include_guard('// header\n#ifndef A_H\n#define A_H\n#endif\n') == 'A_H'
+    assert glsl_include.get_include_guard('#pragma once\nfloat f();') == ''
+    assert glsl_include.get_include_guard('float f(float x){ return x; }') is None
+
+def test_headers_are_visited_once_in_dependency_order(tmp_path):
+    root = str(tmp_path)
+    write(os.path.join(root, 'include', 'common.glsl'), '#pragma once\nstruct Ray { vec3 o; vec3 d; };\n')
+    write(os.path.join(root, 'include', 'shape.glsl'), '#include "common.glsl"\nfloat hit(Ray r){ return r.o.x; }\n')
+    write(os.path.join(root, 'include', 'light.glsl'), '#include "common.glsl"\nvec3 shine(Ray r){ return r.d; }\n')
+    text = '#include "shape.glsl"\n#include "light.glsl"\nfloat f(Ray r){ return hit(r); }\n'
+    resolver = glsl_include.IncludeResolver([os.path.join(root, 'include')])
+    headers = resolver.get_headers(text, os.path.join(root, 'main.glsl'))
+    assert get_basenames(headers) == ['common.glsl', 'shape.glsl', 'light.glsl']
+    scope = resolver.get_scope(text, os.path.join(root, 'main.glsl'))
+    assert scope.functions['hit'] == 'float'
+    assert scope.functions['shine'] == 'vec3'
+    assert scope.attributes['Ray']['d'] == 'vec3'
+    # headers are shared by reference between translation units
+    assert resolver.get_headers(text)[0] is headers[0]
+
+def test_headers_sharing_a_guard_are_included_once(tmp_path):
+    root = str(tmp_path)
+    write(os.path.join(root, 'a', 'util.glsl'), '#ifndef UTIL_H\n#define UTIL_H\nfloat u(float x){ return x; }\n#endif\n')
+    write(os.path.join(root, 'b', 'util.glsl'), '#ifndef UTIL_H\n#define UTIL_H\nfloat u(float x){ return x; }\n#endif\n')
+    text = '#include "a/util.glsl"\n#include "b/util.glsl"\n'
+    resolver = glsl_include.IncludeResolver()
+    assert len(resolver.get_headers(text, os.path.join(root, 'main.glsl'))) == 1
+
+def test_include_cycles(tmp_path):
+    root = str(tmp_path)
+    write(os.path.join(root, 'a.glsl'), '#include "b.glsl"\nfloat a(float x){ return x; }\n')
+    write(os.path.join(root, 'b.glsl'), '#include "a.glsl"\nfloat b(float x){ return x; }\n')
+    resolver = glsl_include.IncludeResolver()
+    with pytest.raises(ValueError, match='include cycle'):
+        resolver.get_headers('#include "a.glsl"\n', os.path.join(root, 'main.glsl'))
+    write(os.path.join(root, 'a.glsl'), '#pragma once\n#include "b.glsl"\nfloat a(float x){ return x; }\n')
+    resolver = glsl_include.IncludeResolver()
+    headers = resolver.get_headers('#include "a.glsl"\n', os.path.join(root, 'main.glsl'))
+    assert get_basenames(headers) == ['b.glsl', 'a.glsl']
+
+def test_missing_headers_are_reported(tmp_path):
+    resolver = glsl_include.IncludeResolver()
+    with pytest.warns(UserWarning, match='could not find header "missing.glsl"'):
+        assert resolver.get_headers('#include "missing.glsl"\n', str(tmp_path / 'main.glsl')) == []
+    assert resolver.get_scope('float f(float x){ return x; }', None, 'base') == 'base'
+
+def test_cached_headers_are_not_parsed_again(tmp_path):
+    root = str(tmp_path)
+    cache_filename = os.path.join(root, 'cache.json')
+    write(os.path.join(root, 'a.glsl'), 'float a(float x){ return x; }\n')
+    text = '#include "a.glsl"\n'
+    resolver = glsl_include.IncludeResolver(cache_filename=cache_filename)
+    assert resolver.get_headers(text, os.path.join(root, 'main.glsl'))[0].code is not None
+    resolver.save()
+    resolver = glsl_include.IncludeResolver(cache_filename=cache_filename)
+    header, = resolver.get_headers(text, os.path.join(root, 'main.glsl'))
+    assert header.code is None
+    assert header.scope.functions['a'] == 'float'
+    write(os.path.join(root, 'a.glsl'), 'vec2 a(float x){ return vec2(x); }\n')
+    resolver = glsl_include.IncludeResolver(cache_filename=cache_filename)
+    header, = resolver.get_headers(text, os.path.join(root, 'main.glsl'))
+    assert header.code is not None
+    assert header.scope.functions['a'] == 'vec2'
+
+def test_only_include_directives_are_commented_out_in_js():
+    code = peg.parse('#version 300 es\n#include "a.glsl"\n#define K 2.0\nfloat f(float x){ return x; }\n', glsl.code)
+    lines = peg.compose(glsl_js.get_js(code, glsl.LexicalScope(code)), js.code, autoblank=False).splitlines()
+    assert lines[:3] == ['#version 300 es', '//#include "a.glsl"', '#define K 2.0']
+
+def test_header_scopes_are_shared_by_reference(tmp_path):
+    root = str(tmp_path)
+    write(os.path.join(root, 'a.glsl'), 'float a(float x){ return x; }\n')
+    text = '#include "a.glsl"\nfloat f(float x){ return a(x); }\n'
+    resolver = glsl_include.IncludeResolver()
+    header, = resolver.get_headers(text, os.path.join(root, 'main.glsl'))
+    code = peg.parse(text, glsl.code)
+    scope = glsl.LexicalScope(code, base_scope=resolver.get_scope(text, os.path.join(root, 'main.glsl')))
+    assert any([functions is header.scope.functions for functions in scope.functions.maps[1].maps])
+    assert scope.get_subscope(code[1]).deduce_type(code[1].content[0].value) == 'float'
@@ -0,0 +1,61 @@
+import json
+import os
+
+import pytest
+
+import pypeg2 as peg
+import pypeg2glsl as glsl
+import glsl_index
+
+def write(filename, text):
+    with open(filename, 'w') as file:
+        file.write(text)
+
+def test_index_is_updated_incrementally(tmp_path):
+    root = str(tmp_path)
+    write(os.path.join(root, 'a.glsl'), 'uniform vec3 V; float f(float x){ return x; }')
+    write(os.path.join(root, 'b.frag'), 'struct S { vec2 p; float r; }; S g(vec2 p){ return S(p, 1.0); }')
+    write(os.path.join(root, 'c.txt'), 'not glsl')
+    index = glsl_index.ProjectIndex()
+    assert [os.path.basename(filename) for filename in index.update(root)] == ['a.glsl', 'b.frag']
+    assert index.update(root) == []
+    # touching a file without changing it does not parse it again
+    os.utime(os.path.join(root, 'a.glsl'), (0, 0))
+    assert index.update(root) == []
+    write(os.path.join(root, 'a.glsl'), 'uniform vec3 V; vec3 f(float x){ return V * x; }')
+    os.utime(os.path.join(root, 'a.glsl'), (1, 1))
+    assert [os.path.basename(filename) for filename in index.update(root)] == ['a.glsl']
+    assert index.functions['f'] == 'vec3'
+    os.remove(os.path.join(root, 'b.frag'))
+    index.update(root)
+    assert 'g' not in index.functions
+
+def test_index_is_saved_and_seeds_scopes(tmp_path):
+    root = str(tmp_path)
+    write(os.path.join(root, 'a.glsl'), 'struct S { vec2 p; float r; }; S g(vec2 p){ return S(p, 1.0); }')
+    index_filename = os.path.join(root, 'index.json')
+    index = glsl_index.ProjectIndex()
+    index.update(root)
+    index.save(index_filename)
+    loaded = glsl_index.ProjectIndex.load(index_filename)
+    assert loaded.functions == index.functions
+    assert loaded.attributes == {'S': {'p': 'vec2', 'r': 'float'}}
+    scope = glsl.LexicalScope(peg.parse('float h(){ return g(vec2(0.0)).r; }', glsl.code), base_scope=loaded.get_scope())
+    expression = peg.parse('g(vec2(0.0)).p', glsl.ternary_expression_or_less)
+    assert scope.deduce_type(expression) == 'vec2'
+
+def test_index_of_another_version_is_rebuilt(tmp_path):
+    index_filename = str(tmp_path / 'index.json')
+    assert glsl_index.ProjectIndex.load(index_filename).files == {}
+    write(index_filename, json.dumps({'version': glsl_index.index_version + 1, 'files': {'a.glsl': {}}}))
+    assert glsl_index.ProjectIndex.load(index_filename).files == {}
+
+def test_unparsable_files_are_skipped(tmp_path):
+    root = str(tmp_path)
+    write(os.path.join(root, 'a.glsl'), 'float f(float x){ return x; }')
+    write(os.path.join(root, 'b.glsl'), 'float g(float x){ return x +; }')
+    index = glsl_index.ProjectIndex()
+    with pytest.warns(UserWarning, match='could not index'):
+        updated = index.update(root)
+    assert [os.path.basename(filename) for filename in updated] == ['a.glsl']
+    assert 'g' not in index.functions
@@ -0,0 +1,67 @@
+import glsl_derivative
+import glsl_inline
+
+from glsl_test_helpers import get_function_body
+
+library_text = '''
+float sq(float x) { return x * x; }
+float smooth1(float x) { float t = clamp(x, 0.0, 1.0); return t * t * (3.0 - 2.0 * t); }
+float fact(float x) { return x < 1.0 ? 1.0 : x * fact(x - 1.0); }
+void bump(inout float x) { x += 1.0; }
+'''
+
+def test_expression_is_inlined():
+    output = glsl_inline.convert_text(library_text + 
+        'float f(float a, vec2 b) { return sq(a) - sq(-b.x) + smooth1(a + b.y); }')
+    assert get_function_body(output, 'f')[-1] == 'return a * a - -b.x * -b.x + smooth1_t * smooth1_t * (3.0 - 2.0 * smooth1_t);'
+    # functions that are inlined are kept
+    assert get_function_body(output, 'sq') == ['return x * x;']
+
+def test_arguments_are_evaluated_once():
+    output = glsl_inline.convert_text(library_text + 
+        'float f(float a) { return sq(sq(sin(a) * cos(a))); }')
+    assert get_function_body(output, 'f') == [
+        'float sq_x = sin(a) * cos(a);',
+        'float sq_x_1 = sq_x * sq_x;',
+        'return sq_x_1 * sq_x_1;',
+    ]
+    # the argument could only be declared before the whole condition
+    output = glsl_inline.convert_text(library_text + 
+        'float f(float a) { return a > 0.0 ? sq(sin(a)) : sq(a); }')
+    assert get_function_body(output, 'f') == ['return a > 0.0? sq(sin(a)) : a * a;']
+
+def test_attributes_of_inlined_calls_are_kept():
+    text = library_text + 'vec2 w(vec2 v) { return v.yx; }\n'
+    output = glsl_inline.convert_text(text + 'float f(float a) { return w(vec2(a, 1.0)).x; }')
+    assert get_function_body(output, 'f') == ['return (vec2(a, 1.0).yx).x;']
+    output = glsl_inline.convert_text(text + 'float f(float a) { float z = w(vec2(a, 1.0)).x; return z; }')
+    assert get_function_body(output, 'f') == ['float z = (vec2(a, 1.0).yx).x;', 'return z;']
+
+def test_statements_are_inlined_with_renamed_variables():
+    output = glsl_inline.convert_text(library_text + 
+        'float g(float a) { float y = smooth1(a * 2.0); return y; }')
+    assert get_function_body(output, 'g') == [
+        'float smooth1_x = a * 2.0;',
+        'float smooth1_t = clamp(smooth1_x, 0.0, 1.0);',
+        'float y = smooth1_t * smooth1_t * (3.0 - 2.0 * smooth1_t);',
+        'return y;',
+    ]
+
+def test_recursive_and_inout_functions_are_not_inlined():
+    output = glsl_inline.convert_text(library_text + '''
+        float h(float a) { return fact(a); }
+        float k(float a) { float b = a; bump(b); return b; }
+    ''')
+    assert get_function_body(output, 'h') == ['return fact(a);']
+    assert get_function_body(output, 'k') == ['float b = a;', 'bump(b);', 'return b;']
+
+def test_size_limit():
+    text = library_text + 'float f(float a) { return sq(a); }'
+    assert get_function_body(glsl_inline.convert_text(text), 'f') == ['return a * a;']
+    assert get_function_body(glsl_inline.convert_text(text, size_limit=2), 'f') == ['return sq(a);']
+
+def test_inlining_allows_derivatives_of_calls_with_many_parameters():
+    text = 'float mul(float a, float b) { return a * b; } float f(float x) { return mul(x, x + 1.0); }'
+    assert get_function_body(glsl_derivative.convert_text(text), 'ddx_f') is None
+    output = glsl_derivative.convert_text(text, inline=True)
+    assert get_function_body(output, 'ddx_f') == ['return 2.0f * x + 1.0f;']
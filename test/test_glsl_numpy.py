@@ -0,0 +1,73 @@
+import pytest
+
+import pypeg2 as peg
+import pypeg2glsl as glsl
+import glsl_derivative
+import glsl_numpy
+
+# numpy is an optional dependency, only needed to evaluate functions
+np = pytest.importorskip('numpy')
+
+def get_functions(text):
+    code = peg.parse(text, glsl.code)
+    return glsl_numpy.get_numpy_functions(code, glsl.LexicalScope(code))
+
+def get_checks(text):
+    code = peg.parse(text, glsl.code)
+    return {name: (error, count) for name, error, count in glsl_numpy.get_derivative_checks(code, glsl.LexicalScope(code), count=200)}
+
+def test_scalar_functions_are_batched():
+    f, = get_functions('float f(float x, float y){ return sin(x) * y + 1.0; }').values()
+    x = np.linspace(0.0, 1.0, 5)
+    np.testing.assert_allclose(f(x, 2.0 * x), np.sin(x) * 2.0 * x + 1.0)
+
+def test_vectors_and_swizzles():
+    f, = get_functions('vec3 f(vec3 v, float t){ vec3 u = v.zyx * t; u.x += dot(v, v); return u; }').values()
+    v = np.array([[1.0, 2.0, 3.0], [0.0, -1.0, 0.5]])
+    t = np.array([2.0, 3.0])
+    expected = v[:, ::-1] * t[:, None]
+    expected[:, 0] += np.sum(v * v, axis=-1)
+    np.testing.assert_allclose(f(v, t), expected)
+
+def test_control_flow_is_vectorized():
+    f, = get_functions('''
+    float f(float x){
+        float s = 0.0;
+        for (int i = 0; i < 4; i++) {
+            if (float(i) > x) { break; }
+            s += x;
+        }
+        if (x < 0.0) { return -1.0; }
+        return s;
+    }''').values()
+    x = np.array([-0.5, 0.5, 1.5, 10.0])
+    np.testing.assert_allclose(f(x), [-1.0, 0.5, 3.0, 40.0])
+
+def test_generated_derivatives_pass_checks():
+    text = 'float f(float x, float y){ float a = x * y; return sin(a) + pow(x, 2.0) / y; }'
+    checks = get_checks(glsl_derivative.convert_text(text, input_handling='prepend'))
+    assert set(checks) == {'ddx_f', 'ddy_f'}
+    for error, count in checks.values():
+        assert error < 1e-4 and count == 200
+
+def test_incorrect_derivatives_fail_checks():
+    checks = get_checks('float f(float x){ return x * x; }\nfloat ddx_f(float x){ return x; }\n')
+    error, count = checks['ddx_f']
+    assert error > 0.1 and count == 200
+
+def test_gradients_are_checked_per_component():
+    checks = get_checks('float f(vec2 v){ return v.x * v.y; }\nvec2 ddv_f(vec2 v){ return v.yx; }\n')
+    error, _ = checks['ddv_f']
+    assert error < 1e-4
+
+def test_unavailable_functions_are_described():
+    functions = get_functions('float f(float x){ return x; }\nfloat g(float x){ return x++ * 2.0; }\n')
+    assert callable(functions['f'])
+    assert isinstance(functions['g'], str)
+    assert 'increments within expressions' in functions['g']
+
+def test_reassignment_that_reads_itself_passes_checks():
+    text = 'float f(float x){ float y = x * x; y = sin(y); return y; }'
+    checks = get_checks(glsl_derivative.convert_text(text, input_handling='prepend'))
+    error, _ = checks['ddx_f']
+    assert error < 1e-4
@@ -0,0 +1,70 @@
+import pypeg2 as peg
+import pypeg2glsl as glsl
+import glsl_rewrite
+
+def get_rewritten_text(system, text, scope=None, budget=None):
+    '''
+    "get_rewritten_text" returns the text of a glsl expression rewritten by a RewriteSystem
+    '''
+    expression = peg.parse(text, glsl.ternary_expression_or_less)
+    result = system.get_rewritten(expression, scope or glsl.LexicalScope(), budget)
+    return result if isinstance(result, str) else peg.compose(result, type(result))
+
+def test_rules_are_applied_until_none_apply():
+    system = glsl_rewrite.RewriteSystem([
+        glsl_rewrite.RewriteRule('$a * 1.0', '$a'),
+        glsl_rewrite.RewriteRule('$a + 0.0', '$a'),
+        glsl_rewrite.RewriteRule('$a * ($b + $c)', '$a * $b + $a * $c'),
+    ])
+    assert get_rewritten_text(system, 'x * 1.0 + 0.0') == 'x'
+    assert get_rewritten_text(system, '(x + 0.0) * 1.0') == '(x)'
+    assert get_rewritten_text(system, 'x * (y + z * 1.0)') == 'x * y + x * z'
+
+def test_chains_are_matched_as_they_are_evaluated():
+    system = glsl_rewrite.RewriteSystem([glsl_rewrite.RewriteRule('$a - $a', '0.0')])
+    # parsed as if it were "x - (x + y)", but evaluated as "(x - x) + y"
+    assert get_rewritten_text(system, 'x - x + y') == '0.0 + y'
+    assert get_rewritten_text(system, 'y + x - x') == 'y + x - x'
+
+def test_repeated_placeholders_match_equivalent_subexpressions():
+    system = glsl_rewrite.RewriteSystem([glsl_rewrite.RewriteRule('$a / $a', '1.0')])
+    assert get_rewritten_text(system, 'sin(x * y) / sin(x * y)') == '1.0'
+    assert get_rewritten_text(system, 'sin(x * y) / sin(y * x)') == 'sin(x * y) / sin(y * x)'
+
+def test_replacements_are_wrapped_where_needed():
+    system = glsl_rewrite.RewriteSystem([glsl_rewrite.RewriteRule('$a * $b', '$b * $a', lambda a, b, **_: a != 'y')])
+    assert get_rewritten_text(system, '(x + 1.0) * y') == 'y * (x + 1.0)'
+    system = glsl_rewrite.RewriteSystem([glsl_rewrite.RewriteRule('-$a', '0.0 - $a')])
+    assert get_rewritten_text(system, 'y * -(x - z)') == 'y * (0.0 - (x - z))'
+
+def test_conditions_and_functions():
+    def get_folded(element, scope, a, b):
+        if not all([isinstance(operand, str) and glsl.float_literal.fullmatch(operand) for operand in [a, b]]):
+            return None
+        return f'{float(a) + float(b)}'
+    system = glsl_rewrite.RewriteSystem([
+        glsl_rewrite.RewriteRule('$a + $b', get_folded),
+        glsl_rewrite.RewriteRule('($a)', '$a', lambda a, **_: isinstance(a, str)),
+        glsl_rewrite.RewriteRule('$a * 2.0', '$a + $a', lambda a, scope, **_: scope.deduce_type(a) == 'float'),
+    ])
+    scope = glsl.LexicalScope(peg.parse('uniform float x; uniform vec2 v;', glsl.code))
+    assert get_rewritten_text(system, '1.0 + 2.5', scope) == '3.5'
+    assert get_rewritten_text(system, '(1.0 + 2.0) * 2.0', scope) == '6.0'
+    assert get_rewritten_text(system, 'x * 2.0', scope) == 'x + x'
+    assert get_rewritten_text(system, 'v * 2.0', scope) == 'v * 2.0'
+
+def test_rules_are_indexed_by_root():
+    multiply = glsl_rewrite.RewriteRule('$a * 1.0', '$a')
+    add = glsl_rewrite.RewriteRule('$a + 0.0', '$a')
+    call = glsl_rewrite.RewriteRule('sin(-$a)', '-sin($a)')
+    system = glsl_rewrite.RewriteSystem([multiply, add, call])
+    assert system.get_rules(peg.parse('x * y', glsl.ternary_expression_or_less)) == [multiply]
+    assert system.get_rules(peg.parse('sin(x)', glsl.ternary_expression_or_less)) == [call]
+    assert system.get_rules(peg.parse('cos(x)', glsl.ternary_expression_or_less)) == []
+
+def test_budget_stops_rewriting():
+    system = glsl_rewrite.RewriteSystem([glsl_rewrite.RewriteRule('$a + 0.0', '$a')])
+    assert get_rewritten_text(system, 'x + 0.0 + 0.0 + 0.0') == 'x'
+    budget = glsl.Budget(iteration_limit=0).get_started()
+    assert get_rewritten_text(system, 'x + 0.0 + 0.0 + 0.0', budget=budget) == 'x + 0.0 + 0.0'
+    assert budget.iterations == 1
@@ -0,0 +1,110 @@
+import pypeg2 as peg
+import pypeg2glsl as glsl
+import glsl_simplify
+
+from glsl_test_helpers import get_function_body
+
+def test_identities_depend_on_operator():
+    assert get_function_body(glsl_simplify.convert_text('float f(float u){ return 1.0/u; }')) == ['return 1.0f / u;']
+    assert get_function_body(glsl_simplify.convert_text('float f(float u){ return u/1.0; }')) == ['return u;']
+    assert get_function_body(glsl_simplify.convert_text('float f(float u){ return 0.0/u; }')) == ['return 0.0f;']
+    assert get_function_body(glsl_simplify.convert_text('float f(float b){ return 0.0 - b; }')) == ['return -b;']
+    assert get_function_body(glsl_simplify.convert_text('float f(float a){ return a - a; }')) == ['return 0.0f;']
+
+def test_identities_compare_literal_values():
+    assert get_function_body(glsl_simplify.convert_text('int f(int x){ return x * 10 + 100 * x; }')) == ['return x * 10 + 100 * x;']
+    assert get_function_body(glsl_simplify.convert_text('float f(float x){ return x / 10.0 + x * 10.0; }')) == ['return 10.1f * x;']
+    assert get_function_body(glsl_simplify.convert_text('float f(float x){ return x * 1.00f + (-0.0) * x; }')) == ['return x;']
+
+def test_parentheses_are_kept_where_needed():
+    assert get_function_body(glsl_simplify.convert_text('float f(float a, float b, float c){ return a/(b*c); }')) == ['return a / (b * c);']
+
+def test_parentheses_are_kept_before_attributes():
+    assert get_function_body(glsl_simplify.convert_text('float f(vec2 v, mat2 m){ float a = (v.yx).x; float b = (m[1]).y; return a + b; }')) == [
+        'float a = (v.yx).x;', 'float b = (m[1]).y;', 'return a + b;']
+    assert get_function_body(glsl_simplify.convert_text('float f(vec2 v){ return (v).x + (v.x); }')) == ['return 2.0f * v.x;']
+
+def test_constants_are_folded_and_propagated():
+    text = 'const float K = 2.0; const int N = 3; const float K2 = K * K + float(N); float f(float x){ return K2 * x + sin(0.0) + float(N / 2); }'
+    output = glsl_simplify.convert_text(text)
+    assert 'const float K2 = 7.0f;' in output
+    assert get_function_body(glsl_simplify.convert_text(text)) == ['return 7.0f * x + 1.0f;']
+
+def test_constants_of_the_base_scope_are_only_folded_once():
+    code = peg.parse('const float K = 2.0; float f(float x){ const float L = K * 3.0; return L * x; }', glsl.code)
+    scope = glsl.LexicalScope(code)
+    subscope = scope.get_subscope(code[1])
+    assert glsl_simplify.get_constant_values(subscope, scope) == {'K': '2.0', 'L': '6.0f'}
+    assert glsl_simplify.get_constant_values(subscope, scope, {'K': '5.0f'}) == {'K': '5.0f', 'L': '15.0f'}
+
+def test_undefined_operations_are_not_folded():
+    assert get_function_body(glsl_simplify.convert_text('float f(float x){ return 1.0 / 0.0 + x; }')) == ['return x + 1.0 / 0.0;']
+
+def test_chains_are_propagated_in_evaluation_order():
+    assert get_function_body(glsl_simplify.convert_text('float f(float a, float b){ return a - b + b; }')) == ['return a;']
+    assert get_function_body(glsl_simplify.convert_text('const float K = 2.0; float f(float a){ return a - K + K; }')) == ['return a;']
+
+def test_like_terms_are_collected():
+    assert get_function_body(glsl_simplify.convert_text('float f(float x, float y){ return x*y + 2.0*x*y - y*x; }')) == ['return 2.0f * x * y;']
+    assert get_function_body(glsl_simplify.convert_text('float f(float x, float y){ return x + y - x + 3.0 + y*2.0 - 1.0; }')) == ['return 3.0f * y + 2.0f;']
+    assert get_function_body(glsl_simplify.convert_text('float f(float x, float y){ return x - (y - x); }')) == ['return 2.0f * x - y;']
+    assert get_function_body(glsl_simplify.convert_text('vec3 f(vec3 a, vec3 b){ return a*b + b*a; }')) == ['return 2.0f * a * b;']
+
+def test_like_factors_are_collected():
+    assert get_function_body(glsl_simplify.convert_text('float f(float x){ return x*x*x / x; }')) == ['return x * x;']
+    assert get_function_body(glsl_simplify.convert_text('float f(float x, float y){ return x / y / (x * 2.0); }')) == ['return 0.5f / y;']
+
+def test_integer_and_matrix_chains_keep_their_order():
+    assert get_function_body(glsl_simplify.convert_text('int f(int a, int b){ return a - b + a; }')) == ['return a - b + a;']
+    assert get_function_body(glsl_simplify.convert_text('mat2 f(mat2 a, mat2 b){ return a*b - b*a; }')) == ['return a * b - b * a;']
+
+def test_budget_applies_to_each_function():
+    text = 'float f(float x){ return x*1.0 + 0.0 + x*1.0 + 0.0; } float g(float x){ return x*1.0; }'
+    diagnostics = glsl.Diagnostics()
+    output = glsl_simplify.convert_text(text, diagnostics=diagnostics, budget=glsl.Budget(node_limit=5))
+    assert 'return x * 1.0 + 0.0 + x * 1.0 + 0.0;' in output
+    assert 'return x;' in output
+    record, = diagnostics.records
+    assert record.kind == 'budget-exhausted' and record.element.name == 'f'
+    diagnostics = glsl.Diagnostics()
+    output = glsl_simplify.convert_text(text, diagnostics=diagnostics, budget=glsl.Budget(iteration_limit=1))
+    assert 'return 2.0f * x;' not in output
+    assert [record.element.name for record in diagnostics.records] == ['f']
+
+def test_budget_applies_to_like_terms():
+    chain = ' * '.join([f'pow(x, {i}.0)' for i in range(1, 151)])
+    text = f'float f(float x){{ return {chain}; }}'
+    diagnostics = glsl.Diagnostics()
+    output = glsl_simplify.convert_text(text, diagnostics=diagnostics, budget=glsl.Budget(iteration_limit=0))
+    assert 'pow(x, 150.0)' in output
+    assert [record.description for record in diagnostics.records] == ['more than 0 rewrites']
+    assert get_function_body(glsl_simplify.convert_text(text)) == ['return pow(x, 11325.0f);']
+
+def test_branches_with_constant_conditions_are_taken():
+    assert get_function_body(glsl_simplify.convert_text('float f(float x){ if (1 > 2) { return x; } return 2.0 * x; }')) == ['return 2.0f * x;']
+
+def test_identity_keeps_vector_type():
+    assert get_function_body(glsl_simplify.convert_text('vec3 f(float t){ return vec3(1.0)*t; }')) == ['return vec3(t);']
+    assert get_function_body(glsl_simplify.convert_text('vec3 f(float t){ return t*vec3(1.0); }')) == ['return vec3(t);']
+    assert get_function_body(glsl_simplify.convert_text('vec3 f(float t){ return vec3(0.0) + t; }')) == ['return vec3(t);']
+    assert get_function_body(glsl_simplify.convert_text('vec3 f(float t){ return vec3(0.0) - t; }')) == ['return -vec3(t);']
+
+def test_identity_keeps_scalar_type():
+    assert get_function_body(glsl_simplify.convert_text('float f(float t){ return 1.0*t; }')) == ['return t;']
+    assert get_function_body(glsl_simplify.convert_text('int f(int i){ return 1*i; }')) == ['return i;']
+    assert get_function_body(glsl_simplify.convert_text('float f(int i){ return 1.0*i; }')) == ['return float(i);']
+
+def test_doubling_uses_literal_of_operand_type():
+    assert get_function_body(glsl_simplify.convert_text('float f(float x){ return x + x; }')) == ['return 2.0f * x;']
+    assert get_function_body(glsl_simplify.convert_text('int f(int i){ return i + i; }')) == ['return 2 * i;']
+
+def test_integer_division_is_not_regrouped():
+    assert get_function_body(glsl_simplify.convert_text('int f(int a, int b){ return a * (b / 2); }')) == ['return a * (b / 2);']
+    assert get_function_body(glsl_simplify.convert_text('int f(int a, int b){ return a * (b * 2); }')) == ['return a * b * 2;']
+
+def test_dead_code_is_only_removed_if_requested():
+    text = 'float f(float x){ float u = x; float v = 2.0 * x; return v; }'
+    assert get_function_body(glsl_simplify.convert_text(text)) == ['float u = x;', 'float v = 2.0f * x;', 'return v;']
+    output = glsl_simplify.convert_text(text, dce=True)
+    assert 'float u' not in output
+    assert 'return v;' in output
@@ -0,0 +1,63 @@
+import pytest
+
+import glsl_specialize
+
+from glsl_test_helpers import get_function_body
+
+specialize_text = '''
+uniform int QUALITY;
+uniform vec3 FOG_COLOR;
+const bool USE_FOG = false;
+vec3 shade(vec3 color, float depth){
+    float samples = float(QUALITY) * 2.0;
+    if (USE_FOG) { return mix(color, FOG_COLOR, depth) * samples; }
+    return color * samples;
+}
+'''
+
+def test_binding_folds_values():
+    output, = glsl_specialize.convert_text(specialize_text, [{'QUALITY': '2'}])
+    assert 'const int QUALITY = 2;' in output
+    assert get_function_body(output, 'shade') == ['float samples = 4.0f;', 'return color * samples;']
+
+def test_binding_takes_branch_and_converts_type():
+    output, = glsl_specialize.convert_text(specialize_text, [{'USE_FOG': 'true', 'FOG_COLOR': '0.5'}])
+    assert 'const vec3 FOG_COLOR = vec3(0.5);' in output
+    assert 'if' not in '\n'.join(get_function_body(output, 'shade'))
+
+def test_variants_share_one_parse():
+    outputs = glsl_specialize.convert_text(specialize_text, [{'QUALITY': '1'}, {'QUALITY': '3'}])
+    assert [get_function_body(output, 'shade') for output in outputs] == [
+        ['float samples = 2.0f;', 'return color * samples;'],
+        ['float samples = 6.0f;', 'return color * samples;'],
+    ]
+
+def test_binding_syntax():
+    name, value = glsl_specialize.get_binding('QUALITY = 2')
+    assert name == 'QUALITY' and value == '2'
+    for text in ['QUALITY', '2=QUALITY', 'QUALITY=)']:
+        with pytest.raises(ValueError):
+            glsl_specialize.get_binding(text)
+
+def test_unknown_name_is_rejected():
+    with pytest.raises(ValueError, match='not declared as a uniform or const'):
+        glsl_specialize.convert_text(specialize_text, [{'samples': '2'}])
+
+def test_output_pattern_is_validated():
+    assert glsl_specialize.get_output_pattern('out.{index:02d}.c', 2) == 'out.{index:02d}.c'
+    assert glsl_specialize.get_output_pattern('out.c') == 'out.c'
+    for pattern in ['out_{U}.c', 'out_{}.c', 'out_{index.c', 'out_{index[0]}.c']:
+        with pytest.raises(ValueError, match='not a valid output pattern'):
+            glsl_specialize.get_output_pattern(pattern, 2)
+    with pytest.raises(ValueError, match='is required'):
+        glsl_specialize.get_output_pattern('out.c', 2)
+
+def test_output_pattern_names_files(tmp_path):
+    input_filename = tmp_path / 'shade.glsl.c'
+    input_filename.write_text(specialize_text)
+    variants = [{'QUALITY': '1'}, {'QUALITY': '3'}]
+    with pytest.raises(ValueError):
+        glsl_specialize.convert_file(str(input_filename), variants=variants, output_pattern=str(tmp_path / 'out_{U}.c'))
+    assert not list(tmp_path.glob('out_*'))
+    glsl_specialize.convert_file(str(input_filename), variants=variants, output_pattern=str(tmp_path / 'out_{index}.c'))
+    assert 'const int QUALITY = 3;' in (tmp_path / 'out_1.c').read_text()
@@ -0,0 +1,26 @@
+import glsl_strength
+
+from glsl_test_helpers import get_function_body
+
+def test_powers_with_literal_exponents():
+    assert get_function_body(glsl_strength.convert_text('float f(float x){ return pow(x, 2.0f) + pow(x + 1.0, 3.0); }')) == [
+        'return x * x + (x + 1.0) * (x + 1.0) * (x + 1.0);']
+    assert get_function_body(glsl_strength.convert_text('float f(float x){ return pow(x, -0.5); }')) == ['return inversesqrt(x);']
+    assert get_function_body(glsl_strength.convert_text('float f(float x){ return pow(x, 2.5); }')) == ['return pow(x, 2.5);']
+
+def test_reciprocals():
+    assert get_function_body(glsl_strength.convert_text('float f(float x){ return 1.0f / sqrt(x) + x / 4.0 + x / 0.0; }')) == [
+        'return inversesqrt(x) + x * 0.25f + x / 0.0;']
+    assert get_function_body(glsl_strength.convert_text('vec3 f(vec3 v){ return v / length(v); }')) == ['return normalize(v);']
+
+def test_linear_interpolation_keeps_types():
+    assert get_function_body(glsl_strength.convert_text('vec3 f(vec3 a, vec3 b, float t){ return a + (b - a) * t; }')) == ['return mix(a, b, t);']
+    assert get_function_body(glsl_strength.convert_text('int f(int a, int b, int t){ return a + (b - a) * t; }')) == ['return a + (b - a) * t;']
+
+def test_cost_report():
+    report = glsl_strength.convert_text('float f(float x){ return pow(x, 2.0f); } float g(float x){ return x; }', report=True)
+    header, f, g, total = [line.split() for line in report.splitlines()]
+    assert header == ['function', 'before', 'after']
+    assert f[0] == 'f(float)' and int(f[1]) > int(f[2])
+    assert g[1:] == ['0', '0']
+    assert total[1:] == f[1:]
@@ -0,0 +1,50 @@
+import glsl_unroll
+
+from glsl_test_helpers import get_function_body
+
+def test_loop_bounded_by_global_const_is_unrolled():
+    assert get_function_body(glsl_unroll.convert_text('''
+        const int N = 3;
+        float f(float x){ float s = 0.0; for (int i = 0; i < N; i++) { float t = x * float(i); s += t; } return s; }
+    ''')) == [
+        'float s = 0.0;',
+        'float t_0 = x * float(0);',
+        's += t_0;',
+        'float t_1 = x * float(1);',
+        's += t_1;',
+        'float t_2 = x * float(2);',
+        's += t_2;',
+        'return s;',
+    ]
+
+def test_loop_that_counts_down_is_unrolled():
+    assert get_function_body(glsl_unroll.convert_text('''
+        float f(float x){ float s = 0.0; for (int i = 6; i > 0; i -= 2) { s += x * float(i); } return s; }
+    ''')) == [
+        'float s = 0.0;',
+        's += x * float(6);',
+        's += x * float(4);',
+        's += x * float(2);',
+        'return s;',
+    ]
+
+def test_loop_over_trip_limit_is_kept():
+    text = 'float f(float x){ float s = 0.0; for (int i = 0; i < 40; i++) { s += x; } return s; }'
+    assert 'for (int i = 0; i < 40; i++)' in get_function_body(glsl_unroll.convert_text(text))
+    assert get_function_body(glsl_unroll.convert_text(text, trip_limit=40)).count('s += x;') == 40
+
+def test_loop_with_break_is_kept():
+    text = 'float f(float x){ float s = 0.0; for (int i = 0; i < 4; i++) { if (s > 1.0) { break; } s += x; } return s; }'
+    assert 'for (int i = 0; i < 4; i++)' in get_function_body(glsl_unroll.convert_text(text))
+
+def test_loop_that_references_shadowed_variables_is_kept():
+    text = '''
+        const int N = 2;
+        float f(float x, vec3 v){
+            float s = 0.0; float t = 5.0;
+            for (int i = 0; i < N; i++) { s += t; float t = x * float(i); vec3 x = v; s += t * x.x; }
+            return s;
+        }
+    '''
+    assert 'for (int i = 0; i < N; i++)' in get_function_body(glsl_unroll.convert_text(text))
+    assert 's += t_0;' not in get_function_body(glsl_unroll.convert_text(text))
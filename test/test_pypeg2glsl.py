@@ -0,0 +1,213 @@
+import copy
+import io
+import json
+
+import pytest
+
+import pypeg2 as peg
+import pypeg2glsl as glsl
+
+def get_expression_type(text, code_text=''):
+    '''
+    "get_expression_type" returns the type deduced for a glsl expression,
+    along with the diagnostics that were recorded while deducing it
+    '''
+    diagnostics = glsl.Diagnostics()
+    scope = glsl.LexicalScope(peg.parse(code_text, glsl.code) if code_text else [], diagnostics)
+    return scope.deduce_type(peg.parse(text, glsl.ternary_expression_or_less)), diagnostics
+
+def test_generic_signatures_are_expanded():
+    assert glsl.get_built_in_function_type('sin', ('vec3',)) == 'vec3'
+    assert glsl.get_built_in_function_type('abs', ('ivec2',)) == 'ivec2'
+    assert glsl.get_built_in_function_type('mix', ('vec4', 'vec4', 'float')) == 'vec4'
+    assert glsl.get_built_in_function_type('clamp', ('vec2', 'float', 'float')) == 'vec2'
+    assert glsl.get_built_in_function_type('sin', ('vec3', 'vec3')) is None
+
+def test_implicit_conversions():
+    assert glsl.get_built_in_function_type('pow', ('int', 'float')) == 'float'
+    assert glsl.get_built_in_function_type('sqrt', ('uint',)) == 'float'
+    # min(int, int) matches exactly, so it is not converted to float
+    assert glsl.get_built_in_function_type('min', ('int', 'int')) == 'int'
+
+def test_mod_and_sqrt_are_distinct():
+    assert 'mod' in glsl.built_in_overloaded_functions
+    assert 'sqrt' in glsl.built_in_overloaded_functions
+    assert 'modsqrt' not in glsl.built_in_function_signatures
+
+def test_functions_with_fixed_return_types():
+    assert glsl.built_in_function_type_map['length'] == 'float'
+    assert glsl.built_in_function_type_map['dot'] == 'float'
+    assert 'any' in glsl.built_in_function_type_map
+
+def test_deduce_built_in_types():
+    code_text = 'uniform vec3 V; uniform ivec2 I; uniform uint U; uniform mat3 M;'
+    for text, type_ in [('sin(V)', 'vec3'), ('abs(I)', 'ivec2'), ('max(V, 0.5)', 'vec3'),
+                        ('length(V)', 'float'), ('sqrt(U)', 'float'), ('cross(V, V)', 'vec3'),
+                        ('M * V', 'vec3'), ('M[1]', 'vec3'), ('V.xy', 'vec2')]:
+        assert get_expression_type(text, code_text)[0] == type_, text
+
+def test_deduce_reports_missing_overload():
+    type_, diagnostics = get_expression_type('sin(V, V)', 'uniform vec3 V;')
+    assert type_ is None
+    assert [record.kind for record in diagnostics.records] == ['type-deduction-failure']
+    assert 'no overload' in diagnostics.records[0].description
+
+def test_scopes_are_layered_over_their_base_scope():
+    base_scope = glsl.LexicalScope(peg.parse('uniform float k; float g(float x){ return x; }', glsl.code))
+    code = peg.parse('uniform vec2 k; const float K = 1.0; float f(float x){ int K = 2; return g(x); }', glsl.code)
+    scope = glsl.LexicalScope(code, base_scope=base_scope)
+    subscope = scope.get_subscope(code[2])
+    assert scope.variables['k'] == 'vec2' and base_scope.variables['k'] == 'float'
+    assert subscope.functions['g'] == 'float' and subscope.variables['x'] == 'float'
+    assert scope.constants['K'] == '1.0' and subscope.variables['K'] == 'int' and 'K' not in subscope.constants
+    subscope.variables['y'] = 'float'
+    assert 'y' not in scope.variables
+
+def test_diagnostics_are_limited():
+    diagnostics = glsl.Diagnostics(limit=2)
+    for name in ['a', 'b', 'c']:
+        diagnostics.add('type-deduction-failure', name, f'reference to unknown variable "{name}"')
+    assert [record.element for record in diagnostics.records] == ['a', 'b']
+    assert diagnostics.dropped_count == 1
+    combined = glsl.Diagnostics()
+    combined.extend(diagnostics)
+    combined.extend(diagnostics)
+    assert [record.element for record in combined.records] == ['a', 'b']
+    assert combined.dropped_count == 2
+
+def test_identical_diagnostics_are_recorded_once():
+    code = peg.parse('float f(float x, float y){ return x * k; }', glsl.code)
+    diagnostics = glsl.Diagnostics()
+    scope = glsl.LexicalScope(code, diagnostics)
+    for x in ['x', 'y']:
+        scope.get_subscope(code[0]).deduce_type(copy.deepcopy(code[0].content[0].value))
+    assert [record.kind for record in diagnostics.records] == ['type-deduction-failure', 'unknown-operand-type']
+
+def test_diagnostics_are_warned_without_a_collector():
+    with pytest.warns(UserWarning, match='reference to unknown variable "k"'):
+        glsl.LexicalScope().deduce_type('k')
+
+def test_quiet_scopes_do_not_record_diagnostics():
+    diagnostics = glsl.Diagnostics()
+    scope = glsl.LexicalScope(peg.parse('uniform float k;', glsl.code), diagnostics)
+    quiet_scope = scope.get_quiet_scope()
+    assert quiet_scope.deduce_type('k') == 'float' and quiet_scope.deduce_type('j') is None
+    assert diagnostics.records == [] and scope.diagnostics is diagnostics
+
+def test_diagnostics_report_text():
+    _, diagnostics = get_expression_type('x * 2.0')
+    output = io.StringIO()
+    diagnostics.report('text', output)
+    lines = output.getvalue().splitlines()
+    assert lines[0] == 'warning: could not deduce type for reference to unknown variable "x" in "x"'
+    assert lines[1].startswith('warning: could not deduce type for variable "x"')
+
+def test_diagnostics_report_json():
+    _, diagnostics = get_expression_type('1 + 2.0')
+    output = io.StringIO()
+    diagnostics.report('json', output)
+    report = json.loads(output.getvalue())
+    assert report['dropped_count'] == 0
+    record, = report['diagnostics']
+    assert record['kind'] == 'type-mismatch'
+    assert record['element_type'] == 'AdditiveExpression'
+    assert record['types'] == ['int', 'float']
+    output = io.StringIO()
+    diagnostics.report('none', output)
+    assert output.getvalue() == ''
+
+def parse_expression(text):
+    return peg.parse(text, glsl.ternary_expression_or_less)
+
+def test_template_matches_parsed_text():
+    template = glsl.Template('$u * $v - $u', glsl.ternary_expression_or_less)
+    for u, v in [('x', 'y'), ('a * b', 'c'), ('a + b', 'c / d'), ('-a', 'f(b, c)'), ('x > y? x : y', 'z')]:
+        wrapped_u = u if glsl.Template.get_precedence(parse_expression(u)) == -1 else f'({u})'
+        wrapped_v = v if glsl.Template.get_precedence(parse_expression(v)) == -1 else f'({v})'
+        instance = template.instantiate(u=parse_expression(wrapped_u), v=parse_expression(wrapped_v))
+        expected = parse_expression(f'{wrapped_u} * {wrapped_v} - {wrapped_u}')
+        assert glsl.get_structure_key(instance) == glsl.get_structure_key(expected), (u, v)
+
+def test_template_regroups_unwrapped_chains():
+    template = glsl.Template('$u * $v', glsl.ternary_expression_or_less)
+    instance = template.instantiate(u=parse_expression('a * b'), v=parse_expression('c * d'))
+    assert peg.compose(instance, type(instance)) == 'a * b * c * d'
+    assert glsl.Template.is_grouped(instance)
+    parsed = parse_expression('a * b * c * d')
+    assert instance.operand1 == parsed.operand1 == 'a'
+    assert peg.compose(instance.operand2, type(instance.operand2)) == peg.compose(parsed.operand2, type(parsed.operand2))
+
+def test_template_shares_substitutions():
+    template = glsl.Template('sin($u) + $u', glsl.ternary_expression_or_less)
+    u = parse_expression('f(x)')
+    instance = template.instantiate(u=u)
+    assert instance.operand1.arguments[0] is u
+    assert instance.operand2 is u
+    # the template itself is left as it was
+    assert template.instantiate(u='y') is not instance
+    assert peg.compose(template.instantiate(u='y'), glsl.AdditiveExpression) == 'sin(y) + y'
+
+def test_template_requires_every_placeholder():
+    template = glsl.Template('$u + $v', glsl.ternary_expression_or_less)
+    with pytest.raises(AssertionError):
+        template.instantiate(u='x')
+
+def test_regrouped_chains():
+    chain = glsl.Template.get_chain(parse_expression('a - b - c * d'))
+    assert [operand for operand in chain[::2]] == ['a', 'b', 'c', 'd']
+    tree = glsl.Template.get_regrouped(chain)
+    assert tree.operand1 == 'a'
+    assert isinstance(tree.operand2, glsl.AdditiveExpression)
+    assert isinstance(tree.operand2.operand2, glsl.MultiplicativeExpression)
+
+def test_left_grouped_chains():
+    chain = glsl.Template.get_chain(parse_expression('a - b - c * d'))
+    tree = glsl.Template.get_left_grouped(chain)
+    assert isinstance(tree.operand1, glsl.AdditiveExpression)
+    assert tree.operand1.operand1 == 'a'
+    assert isinstance(tree.operand2, glsl.MultiplicativeExpression)
+
+def test_comments_between_declarations_are_composed():
+    text = 'float a;\n/* note */\nfloat b;\nfloat f(float x){ return x; }\n'
+    output = peg.compose(peg.parse(text, glsl.code), glsl.code)
+    assert '/* note */' in output
+    assert 'float b;' in output
+    assert 'float f(' in output
+
+def test_parameter_qualifiers_are_whole_words():
+    function = peg.parse('float f(int n, inout float y, in float z, out float w){ return y; }', glsl.code)[0]
+    assert [(parameter.qualifiers, parameter.type, parameter.name) for parameter in function.parameters] == [
+        ([], 'int', 'n'), (['inout'], 'float', 'y'), (['in'], 'float', 'z'), (['out'], 'float', 'w')]
+
+def test_budget_counts_from_when_it_is_started():
+    budget = glsl.Budget(iteration_limit=2)
+    started = budget.get_started()
+    assert started is not budget and started.get_started() is started
+    assert started.spend() and started.spend()
+    assert not started.spend()
+    assert started.exhaustion == 'more than 2 rewrites'
+    # the budget that was passed in is shared between functions, so it is never spent
+    assert budget.iterations == 0 and not budget.is_exhausted()
+
+def test_budget_limits_size_and_time():
+    budget = glsl.Budget(node_limit=10).get_started()
+    assert budget.fits(10)
+    assert not budget.fits(11)
+    assert budget.exhaustion == 'more than 10 elements'
+    budget = glsl.Budget(time_limit=0.0).get_started()
+    budget.deadline -= 1.0
+    assert budget.is_exhausted()
+    assert glsl.Budget().get_started().spend(10**9)
+
+def test_budget_is_reported_once():
+    declaration = peg.parse('float f(float x){ return x; }', glsl.FunctionDeclaration)
+    diagnostics = glsl.Diagnostics()
+    budget = glsl.Budget(iteration_limit=0).get_started()
+    budget.report(diagnostics, declaration)
+    assert diagnostics.records == []
+    budget.spend()
+    budget.report(diagnostics, declaration)
+    budget.report(diagnostics, declaration)
+    record, = diagnostics.records
+    assert record.kind == 'budget-exhausted' and record.element is declaration
+    assert record.get_text() == 'budget exhausted while transforming "f" (more than 0 rewrites), the best result found so far was kept'